@@ -0,0 +1,115 @@
+import datetime
+from typing import Any, Dict, List, Optional
+
+from storage import read_json_blob, update_json_blob
+
+# Formato de fecha usado por GitHub y por los manifiestos generados en backup.sh
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+# Mismo límite que CATALOG_MAX_ENTRIES en scripts/catalog.sh
+CATALOG_MAX_ENTRIES = 500
+
+
+def manifest_name(backup_name: str) -> str:
+    """Devuelve el nombre del manifiesto que acompaña a un backup."""
+    base = backup_name[:-len(".dump")] if backup_name.endswith(".dump") else backup_name
+    return f"{base}.manifest.json"
+
+
+def parse_timestamp(value: Optional[str]) -> Optional[datetime.datetime]:
+    """Convierte un timestamp ISO-8601 en UTC (con sufijo Z) a datetime."""
+    if not value:
+        return None
+    try:
+        return datetime.datetime.strptime(value, TIMESTAMP_FORMAT)
+    except ValueError:
+        return None
+
+
+def load_catalog(storage_account: str, container: str, catalog_blob: str) -> Dict[str, Any]:
+    """
+    Lee el índice de catálogo de un contenedor. Un contenedor sin catálogo se trata
+    como un catálogo vacío para que las consultas no fallen antes del primer backup.
+    """
+    catalog = read_json_blob(storage_account, container, catalog_blob)
+    if not catalog:
+        return {"version": 1, "updated_at": None, "backups": []}
+    catalog.setdefault("backups", [])
+    return catalog
+
+
+def filter_backups(
+    backups: List[Dict[str, Any]],
+    pg_database: Optional[str] = None,
+    pg_host: Optional[str] = None,
+    status: Optional[str] = "valid",
+    max_age: Optional[datetime.timedelta] = None,
+    now: Optional[datetime.datetime] = None
+) -> List[Dict[str, Any]]:
+    """
+    Filtra las entradas del catálogo y las devuelve ordenadas de la más reciente
+    a la más antigua.
+    """
+    now = now or datetime.datetime.utcnow()
+    selected = []
+    for entry in backups:
+        if pg_database and entry.get("database") != pg_database:
+            continue
+        if pg_host and entry.get("source_host") != pg_host:
+            continue
+        if status and entry.get("status") != status:
+            continue
+        created_at = parse_timestamp(entry.get("created_at"))
+        if max_age is not None and (created_at is None or now - created_at > max_age):
+            continue
+        selected.append(entry)
+
+    return sorted(selected, key=lambda entry: entry.get("created_at") or "", reverse=True)
+
+
+def latest_backup(backups: List[Dict[str, Any]], **filters) -> Optional[Dict[str, Any]]:
+    """Devuelve el backup más reciente que cumple los filtros, o None."""
+    matches = filter_backups(backups, **filters)
+    return matches[0] if matches else None
+
+
+def catalog_entry(manifest: Dict[str, Any]) -> Dict[str, Any]:
+    """Construye la entrada de catálogo de un backup a partir de su manifiesto (como backup.sh)."""
+    entry = {key: manifest.get(key) for key in (
+        "name", "database", "source_host", "pg_version", "codec", "size_bytes", "sha256",
+        "database_size_bytes", "created_at", "run_id"
+    )}
+    entry.update({
+        "manifest": manifest_name(manifest["name"]),
+        "storage": manifest.get("storage", "blob"),
+        "dump_seconds": manifest.get("timings", {}).get("dump_seconds"),
+        "table_count": len(manifest.get("tables", [])),
+        "status": "valid"
+    })
+    return entry
+
+
+def _touch(catalog: Dict[str, Any]) -> Dict[str, Any]:
+    catalog["updated_at"] = datetime.datetime.utcnow().strftime(TIMESTAMP_FORMAT)
+    catalog["backups"] = catalog["backups"][:CATALOG_MAX_ENTRIES]
+    return catalog
+
+
+def add_catalog_entry(storage_account: str, container: str, catalog_blob: str, entry: Dict[str, Any]) -> None:
+    """Añade (o reemplaza) la entrada de un backup al principio del catálogo."""
+    def update(catalog: Dict[str, Any]) -> Dict[str, Any]:
+        catalog["backups"] = [entry] + [b for b in catalog.get("backups", []) if b.get("name") != entry["name"]]
+        return _touch(catalog)
+
+    update_json_blob(storage_account, container, catalog_blob, update, {"version": 1, "backups": []})
+
+
+def set_backup_status(storage_account: str, container: str, catalog_blob: str, backup_name: str, status: str) -> None:
+    """Cambia el estado de un backup del catálogo (por ejemplo a 'invalid' si su checksum no coincide)."""
+    def update(catalog: Dict[str, Any]) -> Dict[str, Any]:
+        for backup in catalog.get("backups", []):
+            if backup.get("name") == backup_name:
+                backup["status"] = status
+        return _touch(catalog)
+
+    update_json_blob(storage_account, container, catalog_blob, update, {"version": 1, "backups": []})
@@ -0,0 +1,307 @@
+"""
+Almacén de chunks deduplicado para los backups.
+
+Los dumps diarios de una misma base de datos son casi idénticos, así que en lugar de
+subir cada dump como un blob completo se trocea con chunking definido por contenido
+(gear hash con normalización, como FastCDC): los cortes dependen solo de los bytes
+cercanos, de modo que una inserción desplaza únicamente los chunks afectados y el
+resto coincide con los de backups anteriores. Cada chunk se direcciona por su SHA-256
+(`chunks/<sha[:2]>/<sha>`, comprimido con zlib) y solo se sube si no existe.
+
+Junto al backup se escribe `<backup>.chunks.json` con la lista ordenada de chunks,
+que `get` usa para reconstruir el dump byte a byte. Para que la deduplicación sea
+efectiva el dump debe generarse sin compresión (`pg_dump -Z 0`): con compresión un
+cambio pequeño altera todo el flujo a partir de ese punto.
+
+El troceado del fichero se reparte en segmentos de tamaño fijo que se procesan en
+paralelo; cada segmento termina en un corte forzado, lo que cuesta como mucho un par
+de chunks no deduplicados por segmento a cambio de escalar con los núcleos.
+
+Solo depende de los SDK de Azure Storage (vía storage.py) para poder ejecutarse desde
+backup.sh y restore.sh:
+
+    python3 chunkstore.py put --account acct --container backups --file /tmp/db.dump --name db_20260301.dump
+    python3 chunkstore.py get --account acct --container backups --name db_20260301.dump --file /tmp/db.dump
+
+`get` termina con código 4 si el backup no tiene manifiesto de chunks (backup clásico).
+"""
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import threading
+import time
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
+
+from azure.core.exceptions import ResourceExistsError
+
+from storage import download_file_blob, get_container_client, list_blob_names, read_json_blob, write_json_blob
+
+CHUNKS_PREFIX = "chunks"
+MIN_CHUNK_SIZE = 256 * 1024
+AVG_CHUNK_SIZE = 1024 * 1024
+MAX_CHUNK_SIZE = 4 * 1024 * 1024
+SEGMENT_SIZE = 64 * 1024 * 1024
+COMPRESSION_LEVEL = 3
+EXIT_NO_CHUNK_MANIFEST = 4
+
+_MASK64 = (1 << 64) - 1
+# Tabla fija (derivada de SHA-256) para que los cortes sean estables entre versiones y máquinas
+GEAR = tuple(int.from_bytes(hashlib.sha256(bytes([i])).digest()[:8], "big") for i in range(256))
+
+
+def chunk_manifest_name(backup_name: str) -> str:
+    """Devuelve el nombre del manifiesto de chunks que acompaña a un backup."""
+    base = backup_name[:-len(".dump")] if backup_name.endswith(".dump") else backup_name
+    return f"{base}.chunks.json"
+
+
+def chunk_blob_name(digest: str) -> str:
+    return f"{CHUNKS_PREFIX}/{digest[:2]}/{digest}"
+
+
+def _high_bits_mask(bits: int) -> int:
+    # El gear hash desplaza a la izquierda: los bits altos son los que mezclan más bytes
+    return ((1 << bits) - 1) << (64 - bits)
+
+
+def cut_point(data, start: int, end: int, min_size: int = MIN_CHUNK_SIZE,
+              avg_size: int = AVG_CHUNK_SIZE, max_size: int = MAX_CHUNK_SIZE) -> int:
+    """
+    Devuelve la posición (exclusiva) donde termina el chunk que empieza en `start`.
+    Antes del tamaño medio se exige una máscara más estricta y después una más laxa,
+    lo que concentra los tamaños alrededor de `avg_size`.
+    """
+    if end - start <= min_size:
+        return end
+    end = min(end, start + max_size)
+    normal = min(end, start + avg_size)
+    bits = avg_size.bit_length() - 1
+    mask_strict, mask_loose = _high_bits_mask(bits + 2), _high_bits_mask(bits - 2)
+    gear = GEAR
+    view = memoryview(data)
+    position = start + min_size
+    digest = 0
+    for byte in view[position:normal]:
+        digest = ((digest << 1) + gear[byte]) & _MASK64
+        position += 1
+        if not digest & mask_strict:
+            return position
+    for byte in view[position:end]:
+        digest = ((digest << 1) + gear[byte]) & _MASK64
+        position += 1
+        if not digest & mask_loose:
+            return position
+    return end
+
+
+def chunk_boundaries(data, min_size: int = MIN_CHUNK_SIZE, avg_size: int = AVG_CHUNK_SIZE,
+                     max_size: int = MAX_CHUNK_SIZE) -> List[Tuple[int, int]]:
+    """Trocea un buffer completo y devuelve la lista de (offset, longitud)."""
+    boundaries = []
+    start, end = 0, len(data)
+    while start < end:
+        cut = cut_point(data, start, end, min_size, avg_size, max_size)
+        boundaries.append((start, cut - start))
+        start = cut
+    return boundaries
+
+
+def _segment_boundaries(path: str, offset: int, length: int, sizes: Tuple[int, int, int]) -> List[Tuple[int, int]]:
+    with open(path, "rb") as file:
+        file.seek(offset)
+        data = file.read(length)
+    return [(offset + start, size) for start, size in chunk_boundaries(data, *sizes)]
+
+
+def chunk_file(path: str, workers: int = 0, segment_size: int = SEGMENT_SIZE, min_size: int = MIN_CHUNK_SIZE,
+               avg_size: int = AVG_CHUNK_SIZE, max_size: int = MAX_CHUNK_SIZE) -> List[Tuple[int, int]]:
+    """
+    Trocea un fichero en segmentos de `segment_size` procesados en paralelo (procesos,
+    porque el bucle del hash es CPU puro). `workers` 0 usa un proceso por núcleo.
+    """
+    size = os.path.getsize(path)
+    sizes = (min_size, avg_size, max_size)
+    segments = [(offset, min(segment_size, size - offset)) for offset in range(0, size, segment_size)]
+    workers = min(workers or os.cpu_count() or 1, len(segments))
+    if workers <= 1:
+        return [chunk for offset, length in segments for chunk in _segment_boundaries(path, offset, length, sizes)]
+    # spawn: el proceso llamante puede tener hilos y conexiones abiertas (executors.py)
+    context = multiprocessing.get_context("spawn")
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        results = pool.map(_segment_boundaries, [path] * len(segments),
+                           [offset for offset, _ in segments], [length for _, length in segments],
+                           [sizes] * len(segments))
+        return [chunk for segment in results for chunk in segment]
+
+
+def existing_chunks(storage_account: str, container: str) -> set:
+    """Devuelve los digests de los chunks ya almacenados en el contenedor."""
+    return {name.rsplit("/", 1)[-1] for name in list_blob_names(storage_account, container, f"{CHUNKS_PREFIX}/")}
+
+
+def put_file(storage_account: str, container: str, backup_name: str, path: str, jobs: int = 8,
+             workers: int = 0, segment_size: int = SEGMENT_SIZE, min_size: int = MIN_CHUNK_SIZE,
+             avg_size: int = AVG_CHUNK_SIZE, max_size: int = MAX_CHUNK_SIZE) -> Dict[str, Any]:
+    """
+    Sube un dump al almacén de chunks: solo se transfieren los chunks que no existen.
+    El manifiesto de chunks se escribe al final, de modo que nunca referencia chunks
+    ausentes. Devuelve las estadísticas de deduplicación.
+    """
+    started = time.monotonic()
+    boundaries = chunk_file(path, workers, segment_size, min_size, avg_size, max_size)
+    chunking_seconds = round(time.monotonic() - started, 3)
+
+    known = existing_chunks(storage_account, container)
+    container_client = get_container_client(storage_account, container)
+    lock = threading.Lock()
+    stats = {"new_chunks": 0, "bytes_new": 0, "bytes_uploaded": 0}
+
+    def store(data: bytes) -> str:
+        digest = hashlib.sha256(data).hexdigest()
+        with lock:
+            if digest in known:
+                return digest
+            # Se reserva antes de subir para no subir dos veces un chunk repetido en el mismo dump
+            known.add(digest)
+        compressed = zlib.compress(data, COMPRESSION_LEVEL)
+        try:
+            container_client.upload_blob(chunk_blob_name(digest), compressed, overwrite=False)
+        except ResourceExistsError:
+            # Subido por otra ejecución concurrente: el contenido es el mismo
+            return digest
+        except Exception:
+            with lock:
+                known.discard(digest)
+            raise
+        with lock:
+            stats["new_chunks"] += 1
+            stats["bytes_new"] += len(data)
+            stats["bytes_uploaded"] += len(compressed)
+        return digest
+
+    file_hash = hashlib.sha256()
+    # Limita los chunks leídos en memoria a la espera de subirse
+    in_flight = threading.BoundedSemaphore(jobs * 2)
+    futures = []
+    with open(path, "rb") as file, concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as pool:
+        for _, length in boundaries:
+            data = file.read(length)
+            file_hash.update(data)
+            in_flight.acquire()
+            future = pool.submit(store, data)
+            future.add_done_callback(lambda _: in_flight.release())
+            futures.append(future)
+        digests = [future.result() for future in futures]
+
+    size = sum(length for _, length in boundaries)
+    manifest = {
+        "version": 1,
+        "name": backup_name,
+        "algorithm": "gear-cdc",
+        "min_size": min_size,
+        "avg_size": avg_size,
+        "max_size": max_size,
+        "segment_size": segment_size,
+        "compression": "zlib",
+        "size_bytes": size,
+        "sha256": file_hash.hexdigest(),
+        "chunks": [[digest, length] for digest, (_, length) in zip(digests, boundaries)]
+    }
+    write_json_blob(storage_account, container, chunk_manifest_name(backup_name), manifest)
+
+    result = {
+        "chunk_manifest": chunk_manifest_name(backup_name),
+        "chunks": len(boundaries),
+        "new_chunks": stats["new_chunks"],
+        "bytes_total": size,
+        "bytes_new": stats["bytes_new"],
+        "bytes_uploaded": stats["bytes_uploaded"],
+        "dedup_ratio": round(size / stats["bytes_new"], 2) if stats["bytes_new"] else None,
+        "chunking_seconds": chunking_seconds,
+        "seconds": round(time.monotonic() - started, 3)
+    }
+    logging.info(f"Chunked upload of {backup_name}: {result['new_chunks']}/{result['chunks']} new chunks, "
+                 f"{result['bytes_uploaded']} of {size} bytes transferred")
+    return result
+
+
+def get_file(storage_account: str, container: str, backup_name: str, path: str, jobs: int = 8) -> bool:
+    """
+    Reconstruye un dump a partir de su manifiesto de chunks, verificando cada chunk y el
+    SHA-256 del fichero completo. Devuelve False si el backup no tiene manifiesto de chunks.
+    """
+    manifest = read_json_blob(storage_account, container, chunk_manifest_name(backup_name))
+    if manifest is None:
+        return False
+    container_client = get_container_client(storage_account, container)
+
+    def fetch(digest: str) -> bytes:
+        data = zlib.decompress(container_client.download_blob(chunk_blob_name(digest)).readall())
+        if hashlib.sha256(data).hexdigest() != digest:
+            raise RuntimeError(f"Chunk {digest} of {backup_name} is corrupted")
+        return data
+
+    file_hash = hashlib.sha256()
+    window = jobs * 4
+    chunks = manifest["chunks"]
+    with open(path, "wb") as file, concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as pool:
+        # Por ventanas para acotar la memoria; map conserva el orden de escritura
+        for index in range(0, len(chunks), window):
+            for data in pool.map(fetch, [digest for digest, _ in chunks[index:index + window]]):
+                file.write(data)
+                file_hash.update(data)
+    if file_hash.hexdigest() != manifest["sha256"]:
+        raise RuntimeError(f"Reassembled {backup_name} does not match its chunk manifest checksum")
+    return True
+
+
+def download_backup(storage_account: str, container: str, backup_name: str, path: str) -> bool:
+    """Descarga un backup, troceado o clásico. Devuelve False si no existe."""
+    if get_file(storage_account, container, backup_name, path):
+        return True
+    return download_file_blob(storage_account, container, backup_name, path)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Almacén de chunks deduplicado para backups")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    put_parser = subparsers.add_parser("put", help="Trocea y sube un dump")
+    put_parser.add_argument("--file", required=True)
+    put_parser.add_argument("--output", help="Fichero donde escribir las estadísticas de deduplicación")
+    put_parser.add_argument("--workers", type=int, default=0, help="Procesos de troceado (0: uno por núcleo)")
+
+    get_parser = subparsers.add_parser("get", help="Reconstruye un dump a partir de sus chunks")
+    get_parser.add_argument("--file", required=True)
+
+    for subparser in (put_parser, get_parser):
+        subparser.add_argument("--account", required=True)
+        subparser.add_argument("--container", required=True)
+        subparser.add_argument("--name", required=True, help="Nombre del backup")
+        subparser.add_argument("--jobs", type=int, default=8, help="Transferencias concurrentes")
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    if args.command == "put":
+        stats = put_file(args.account, args.container, args.name, args.file, args.jobs, args.workers)
+        if args.output:
+            with open(args.output, "w") as file:
+                json.dump(stats, file)
+        print(json.dumps(stats))
+        return 0
+
+    if not get_file(args.account, args.container, args.name, args.file, args.jobs):
+        print(f"No chunk manifest for {args.name}", file=sys.stderr)
+        return EXIT_NO_CHUNK_MANIFEST
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,7 @@
 import json
 import os
 import logging
+import tempfile
 from pathlib import Path
 
 def load_secrets():
@@ -53,3 +54,111 @@ def get_github_config():
         "repo": repo,
         "workflow_id": workflow_id
     }
+
+def get_storage_config():
+    """
+    Obtiene la configuración de Azure Storage usada para leer manifiestos, catálogos
+    e informes de ejecución. La cuenta y el contenedor pueden sobrescribirse por petición.
+    """
+    return {
+        "account": os.environ.get("AZURE_STORAGE_ACCOUNT"),
+        "container": os.environ.get("AZURE_STORAGE_CONTAINER"),
+        "connection_string": os.environ.get("AZURE_STORAGE_CONNECTION_STRING"),
+        "catalog_blob": os.environ.get("CATALOG_BLOB", "catalog/index.json")
+    }
+
+def get_executor_config():
+    """
+    Obtiene la configuración del ejecutor local, que ejecuta los refrescos dentro de la
+    propia API en lugar de en GitHub Actions. Requiere pg_dump/pg_restore en el PATH
+    (o en PG_BIN_DIR).
+    """
+    return {
+        "default": os.environ.get("REFRESH_EXECUTOR", "github"),
+        "local_workers": int(os.environ.get("LOCAL_EXECUTOR_WORKERS", "2")),
+        "local_work_dir": os.environ.get("LOCAL_EXECUTOR_WORK_DIR"),
+        "pg_bin_dir": os.environ.get("PG_BIN_DIR"),
+        "postgres_domain": os.environ.get("PG_HOST_DOMAIN", "postgres.database.azure.com")
+    }
+
+def get_state_config():
+    """
+    Obtiene la ruta de la base de datos SQLite con el estado persistente de la API
+    (programaciones de refrescos). En Azure Functions /home se conserva entre reinicios.
+    """
+    default_dir = "/home/data" if os.environ.get("WEBSITE_SITE_NAME") else tempfile.gettempdir()
+    return {
+        "db_path": os.environ.get("STATE_DB_PATH") or os.path.join(default_dir, "pssqlday2ops", "state.db")
+    }
+
+def get_scheduler_config():
+    """
+    Obtiene la configuración del planificador de refrescos recurrentes.
+    """
+    return {
+        "enabled": os.environ.get("SCHEDULER_ENABLED", "true").lower() == "true",
+        # Margen para lanzar una ejecución planificada que se ha pasado (reinicio, retraso del timer)
+        "grace_minutes": int(os.environ.get("SCHEDULER_GRACE_MINUTES", "15")),
+        "horizon_hours": int(os.environ.get("SCHEDULER_HORIZON_HOURS", "168"))
+    }
+
+def get_arm_config():
+    """
+    Obtiene la configuración de las llamadas a Azure Resource Manager (actualizaciones de
+    versión de los servidores). El endpoint se puede sustituir por un ARM local en pruebas.
+    """
+    return {
+        "endpoint": os.environ.get("ARM_ENDPOINT", "https://management.azure.com").rstrip("/"),
+        "api_version": os.environ.get("ARM_POSTGRES_API_VERSION", "2024-11-01-preview"),
+        "upgrade_concurrency": int(os.environ.get("UPGRADE_MAX_CONCURRENCY", "4")),
+        # Sondeo de las operaciones de larga duración: intervalo inicial y máximo (segundos)
+        "poll_initial_seconds": float(os.environ.get("ARM_POLL_INITIAL_SECONDS", "10")),
+        "poll_max_seconds": float(os.environ.get("ARM_POLL_MAX_SECONDS", "120")),
+        "operation_timeout_minutes": int(os.environ.get("ARM_OPERATION_TIMEOUT_MINUTES", "240")),
+        # Operaciones consultadas por pasada del seguimiento y peticiones en paralelo
+        "poll_batch_size": int(os.environ.get("ARM_POLL_BATCH_SIZE", "50")),
+        "poll_workers": int(os.environ.get("ARM_POLL_WORKERS", "8"))
+    }
+
+def get_inventory_config():
+    """
+    Obtiene la configuración del inventario de Flexible Servers. Sin INVENTORY_SUBSCRIPTIONS
+    se recorren todas las suscripciones visibles para la identidad de la Function App.
+    """
+    subscriptions = os.environ.get("INVENTORY_SUBSCRIPTIONS", "")
+    return {
+        "subscriptions": [sub.strip() for sub in subscriptions.split(",") if sub.strip()],
+        "ttl_seconds": int(os.environ.get("INVENTORY_TTL_SECONDS", "900")),
+        # Suscripciones consultadas a la vez
+        "concurrency": int(os.environ.get("INVENTORY_CONCURRENCY", "8"))
+    }
+
+def get_status_config():
+    """
+    Obtiene la configuración de la espera de cambios (long-poll) de /api/workflow/status:
+    espera máxima por petición e intervalo con el que el vigilante compartido consulta GitHub.
+    """
+    return {
+        "max_wait_seconds": int(os.environ.get("STATUS_MAX_WAIT_SECONDS", "30")),
+        "watch_interval_seconds": float(os.environ.get("STATUS_WATCH_INTERVAL_SECONDS", "5")),
+        # Las ejecuciones locales están en memoria: se pueden consultar con más frecuencia
+        "local_watch_interval_seconds": float(os.environ.get("STATUS_LOCAL_WATCH_INTERVAL_SECONDS", "1"))
+    }
+
+def get_resilience_config(upstream):
+    """
+    Obtiene la configuración de las llamadas a un servicio externo ("github" o "arm"): plazo de
+    cada petición, circuit breaker y hedging de los GET. Las variables llevan el prefijo del
+    servicio, p. ej. GITHUB_TIMEOUT_SECONDS o ARM_BREAKER_FAILURES.
+    """
+    prefix = upstream.upper()
+    default_timeout = "30" if upstream == "arm" else "10"
+    return {
+        "timeout_seconds": float(os.environ.get(f"{prefix}_TIMEOUT_SECONDS", default_timeout)),
+        # Fallos seguidos que abren el circuito y segundos que permanece abierto
+        "failure_threshold": int(os.environ.get(f"{prefix}_BREAKER_FAILURES", "5")),
+        "open_seconds": float(os.environ.get(f"{prefix}_BREAKER_OPEN_SECONDS", "30")),
+        # Segunda petición para los GET que tardan más que el p95 (nunca antes de este mínimo)
+        "hedge_enabled": os.environ.get(f"{prefix}_HEDGE_ENABLED", "true").lower() == "true",
+        "hedge_min_seconds": float(os.environ.get(f"{prefix}_HEDGE_MIN_SECONDS", "0.5"))
+    }
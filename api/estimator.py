@@ -0,0 +1,248 @@
+"""
+Estimación de duración y tamaño de un refresco antes de lanzarlo.
+
+Combina el tamaño actual de cada base de datos en producción (pg_database_size y el tamaño
+de cada tabla) con el rendimiento por fase de los refrescos anteriores:
+
+- dump: bytes de base de datos por segundo de pg_dump (catálogo: dump_seconds)
+- transferencia: bytes de backup por segundo y sentido (manifiesto: upload_seconds; informe
+  'restore': fase download)
+- restauración: bytes de base de datos por segundo y flujo de pg_restore (informe 'restore').
+  Con el perfil fast, pg_restore -j reparte tablas completas, así que el paralelismo efectivo
+  lo limita la tabla más grande.
+
+Las muestras se toman de la misma base de datos si hay suficientes, si no del mismo servidor
+de producción y, en último caso, de todo el catálogo. Los límites de confianza son los
+percentiles 10 y 90 del rendimiento observado; sin historial se usan valores por defecto con
+un margen amplio.
+"""
+import logging
+import statistics
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from catalog import load_catalog, manifest_name
+from reports import run_report_blob
+from storage import read_json_blob
+
+MB = 1024 * 1024
+# Rendimiento supuesto sin historial (bytes/s) y margen aplicado a la estimación
+DEFAULT_THROUGHPUT = {"dump": 40 * MB, "transfer": 60 * MB, "restore": 25 * MB}
+DEFAULT_COMPRESSION_RATIO = 0.3
+DEFAULT_SPREAD = (0.5, 2.0)
+# Backups del catálogo que se consideran y muestras mínimas para usar un grupo
+HISTORY_SIZE = 40
+MIN_SAMPLES = 3
+
+# Los manifiestos y los informes publicados no cambian: se cachean entre estimaciones
+_CACHE_SIZE = 500
+_cache_lock = threading.Lock()
+_blob_cache: "OrderedDict[Tuple[str, str, str], Any]" = OrderedDict()
+
+
+def quantile(values: List[float], q: float) -> float:
+    """Percentil con interpolación lineal."""
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def effective_parallelism(table_sizes: List[int], jobs: int) -> float:
+    """Flujos de pg_restore -j que trabajan a la vez: la tabla más grande no se reparte."""
+    total = sum(table_sizes)
+    if jobs <= 1 or not total:
+        return 1.0
+    return max(1.0, min(float(jobs), total / max(table_sizes)))
+
+
+def build_sample(entry: Dict[str, Any], manifest: Optional[Dict[str, Any]],
+                 restore: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Rendimiento por fase de un refresco anterior (las fases sin datos quedan a None)."""
+    database_size = entry.get("database_size_bytes") or 0
+    backup_size = entry.get("size_bytes") or 0
+    sample = {
+        "database": entry.get("database"),
+        "source_host": entry.get("source_host"),
+        "dump": None,
+        "compression": backup_size / database_size if database_size and backup_size else None,
+        "transfer": None,
+        "restore": None
+    }
+    if database_size and entry.get("dump_seconds") is not None:
+        # Los tiempos se publican en segundos enteros
+        sample["dump"] = database_size / max(entry["dump_seconds"], 1)
+
+    upload_seconds = ((manifest or {}).get("timings") or {}).get("upload_seconds")
+    phases = (restore or {}).get("phases") or {}
+    download_seconds = phases.get("download")
+    directions = [seconds for seconds in (upload_seconds, download_seconds) if seconds is not None]
+    if backup_size and directions:
+        sample["transfer"] = backup_size * len(directions) / max(sum(directions), 1)
+
+    if restore and database_size and restore.get("total_seconds") is not None:
+        restore_seconds = max(restore["total_seconds"] - (download_seconds or 0), 1)
+        parallel = 1.0
+        if restore.get("profile") == "fast":
+            sizes = [int(t.get("size_bytes") or 0) for t in (manifest or {}).get("tables", [])]
+            parallel = effective_parallelism(sizes, int(restore.get("jobs") or 1))
+        sample["restore"] = database_size / restore_seconds / parallel
+    return sample
+
+
+def _read_cached(storage_account: str, container: str, blob_name: str) -> Optional[Any]:
+    key = (storage_account, container, blob_name)
+    with _cache_lock:
+        if key in _blob_cache:
+            _blob_cache.move_to_end(key)
+            return _blob_cache[key]
+    document = read_json_blob(storage_account, container, blob_name)
+    if document is not None:
+        # Un informe ausente puede publicarse más tarde (ejecución en curso): solo se cachean los existentes
+        with _cache_lock:
+            _blob_cache[key] = document
+            while len(_blob_cache) > _CACHE_SIZE:
+                _blob_cache.popitem(last=False)
+    return document
+
+
+def load_history(storage_account: str, container: str, catalog_blob: str,
+                 limit: int = HISTORY_SIZE) -> List[Dict[str, Any]]:
+    """Muestras de rendimiento de los últimos backups válidos del catálogo."""
+    catalog = load_catalog(storage_account, container, catalog_blob)
+    entries = [entry for entry in catalog.get("backups", [])
+               if entry.get("status") == "valid" and entry.get("database_size_bytes")][:limit]
+
+    def load(entry: Dict[str, Any]) -> Dict[str, Any]:
+        manifest = _read_cached(storage_account, container, entry.get("manifest") or manifest_name(entry["name"]))
+        restore = None
+        if entry.get("run_id"):
+            restore = _read_cached(storage_account, container, run_report_blob(entry["run_id"], "restore", entry["database"]))
+        return build_sample(entry, manifest, restore)
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        return list(pool.map(load, entries))
+
+
+def select_samples(samples: List[Dict[str, Any]], key: str, database: str, source_host: str) -> Tuple[List[float], str]:
+    """Valores de una fase del grupo más específico con suficientes muestras."""
+    groups = (
+        ("database", lambda s: s["database"] == database and s["source_host"] == source_host),
+        ("server", lambda s: s["source_host"] == source_host),
+        ("all", lambda s: True)
+    )
+    for basis, matches in groups:
+        values = [s[key] for s in samples if s[key] and matches(s)]
+        if len(values) >= MIN_SAMPLES:
+            return values, basis
+    values = [s[key] for s in samples if s[key]]
+    return values, "all" if values else "default"
+
+
+def predict_phase(size_bytes: float, throughputs: List[float], basis: str, default: float) -> Dict[str, Any]:
+    """Duración esperada (mediana) y límites p10/p90 a partir de rendimientos observados."""
+    if len(throughputs) >= MIN_SAMPLES:
+        median, fast, slow = statistics.median(throughputs), quantile(throughputs, 0.9), quantile(throughputs, 0.1)
+    else:
+        median = statistics.median(throughputs) if throughputs else default
+        fast, slow = median / DEFAULT_SPREAD[0], median / DEFAULT_SPREAD[1]
+    return {
+        "seconds": round(size_bytes / median),
+        "low_seconds": round(size_bytes / fast),
+        "high_seconds": round(size_bytes / slow),
+        "samples": len(throughputs),
+        "basis": basis
+    }
+
+
+def _combine(phases: List[Optional[Dict[str, Any]]], overlap: bool = False) -> Dict[str, int]:
+    """Suma las fases (o, con overlap, suma la primera al máximo de las demás)."""
+    result = {}
+    for field in ("seconds", "low_seconds", "high_seconds"):
+        values = [phase[field] if phase else 0 for phase in phases]
+        result[field] = values[0] + max(values[1:]) if overlap else sum(values)
+    return result
+
+
+def estimate_database(database: str, source_host: str, database_size: int, table_sizes: List[int],
+                      samples: List[Dict[str, Any]], options: Dict[str, Any],
+                      reused_backup: Optional[Dict[str, Any]] = None, local: bool = False) -> Dict[str, Any]:
+    """
+    Estima las fases de una base de datos. Con un backup reutilizado no hay dump y solo se
+    descarga; en el ejecutor local no se descarga y la subida se solapa con la restauración.
+    """
+    compression, _ = select_samples(samples, "compression", database, source_host)
+    if reused_backup is not None:
+        backup_size = reused_backup.get("size_bytes") or database_size * DEFAULT_COMPRESSION_RATIO
+    else:
+        backup_size = database_size * (statistics.median(compression) if compression else DEFAULT_COMPRESSION_RATIO)
+
+    dump = None
+    if reused_backup is None:
+        dump = predict_phase(database_size, *select_samples(samples, "dump", database, source_host), DEFAULT_THROUGHPUT["dump"])
+    # En GitHub Actions un backup nuevo se sube y después se descarga para restaurarlo
+    directions = 2 if reused_backup is None and not local else 1
+    transfer = predict_phase(backup_size * directions, *select_samples(samples, "transfer", database, source_host),
+                             DEFAULT_THROUGHPUT["transfer"])
+
+    jobs = int(options.get("restore_jobs", 4)) if options.get("restore_profile") == "fast" else 1
+    parallel = effective_parallelism(table_sizes, jobs)
+    restore = predict_phase(database_size / parallel, *select_samples(samples, "restore", database, source_host),
+                            DEFAULT_THROUGHPUT["restore"])
+
+    # Ejecutor local con backup nuevo: la restauración usa el fichero local mientras se sube
+    total = _combine([dump, transfer, restore], overlap=local and reused_backup is None)
+    return {
+        "database_size_bytes": database_size,
+        "backup_size_bytes": int(backup_size),
+        "backup_reused": reused_backup is not None,
+        "tables": len(table_sizes),
+        "largest_table_bytes": max(table_sizes) if table_sizes else 0,
+        "restore_parallelism": round(parallel, 1),
+        "dump": dump,
+        "transfer": transfer,
+        "restore": restore,
+        "total": total
+    }
+
+
+def schedule_total(totals: List[Dict[str, int]], max_parallel: int) -> Dict[str, int]:
+    """
+    Duración total con hasta `max_parallel` bases de datos a la vez, arrancando en orden
+    cada una en cuanto queda un hueco libre (como refresh.sh).
+    """
+    result = {}
+    for field in ("seconds", "low_seconds", "high_seconds"):
+        slots = [0] * max(1, max_parallel)
+        for total in totals:
+            slot = slots.index(min(slots))
+            slots[slot] += total[field]
+        result[field] = max(slots)
+    return result
+
+
+def collect_source(conninfos: Dict[str, str], tables_query: str) -> Dict[str, Dict[str, Any]]:
+    """Tamaño de cada base de datos y de sus tablas en producción, consultadas en paralelo."""
+    import psycopg
+
+    def measure(conninfo: str) -> Dict[str, Any]:
+        with psycopg.connect(conninfo) as conn:
+            size = conn.execute("SELECT pg_database_size(current_database())").fetchone()[0]
+            tables = conn.execute(tables_query).fetchone()[0]
+        return {"size_bytes": size, "table_sizes": [int(t.get("size_bytes") or 0) for t in tables]}
+
+    with ThreadPoolExecutor(max_workers=min(4, len(conninfos)) or 1) as pool:
+        results = pool.map(measure, conninfos.values())
+        return dict(zip(conninfos, results))
+
+
+def try_load_history(storage_account: str, container: str, catalog_blob: str) -> List[Dict[str, Any]]:
+    """Igual que load_history, pero sin historial disponible se estima con los valores por defecto."""
+    try:
+        return load_history(storage_account, container, catalog_blob)
+    except Exception as e:
+        logging.warning(f"Could not load refresh history from {container}: {str(e)}")
+        return []
@@ -0,0 +1,1081 @@
+"""
+Ejecutores del refresco dump-restore.
+
+Un refresco puede ejecutarse de dos formas:
+
+- GitHubExecutor: lanza el workflow pg-backup-restore.yml de GitHub Actions. Cada ejecución
+  paga la cola de GitHub, el arranque del runner y la instalación del cliente de PostgreSQL
+  y de Azure CLI antes de mover un solo byte.
+- LocalExecutor: ejecuta las mismas etapas (roles, pg_dump, subida al contenedor y catálogo,
+  pg_restore, verificación por tabla) dentro de la API con un pool de workers, de modo que
+  los refrescos pequeños y medianos empiezan en segundos. Necesita pg_dump, pg_restore,
+  pg_dumpall, psql y vacuumdb en el PATH (o en PG_BIN_DIR). Cuando el backup se crea en la
+  misma ejecución se restaura desde el fichero local mientras se sube al contenedor.
+
+Ambos devuelven el estado con el mismo modelo (id, status, conclusion, jobs con sus steps y
+duración) que expone /api/workflow/status. Las ejecuciones locales se identifican con el
+prefijo "local-" y su estado vive en memoria de la instancia que las lanzó.
+"""
+import collections
+import datetime
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import psycopg
+import requests
+from fastapi import HTTPException
+from psycopg import sql
+
+from catalog import add_catalog_entry, catalog_entry, manifest_name, set_backup_status
+from chunkstore import download_backup, put_file
+from config import get_executor_config, get_github_config, get_storage_config
+from progress import ProgressTracker
+from resilience import get_upstream, is_stale
+from templates import clone_from_template, seal_template, template_name
+from selective import record_target, run_selective, stats_blob
+from subset import run_subset
+from storage import read_json_blob, upload_file_blob, write_json_blob
+from verification import build_conninfo, take_snapshot, verify_restore
+
+GITHUB_API_URL = "https://api.github.com"
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+LOCAL_RUN_PREFIX = "local-"
+# Ejecuciones locales terminadas que se conservan en memoria para consultar su estado
+MAX_LOCAL_RUNS = 50
+# Ejecuciones que se consultan como historial y tamaño de página de la API de GitHub
+MAX_RUN_HISTORY = 200
+GITHUB_PAGE_SIZE = 100
+# Título de cada ejecución (run-name del workflow): permite filtrar sin abrir cada ejecución
+RUN_TITLE_PATTERN = re.compile(r"^Refresh (?P<databases>\S+) from (?P<source>\S+) to (?P<target>\S+)$")
+# pg_dump -F c comprime con zlib al nivel por defecto, igual que backup.sh
+BACKUP_CODEC = "custom/gzip"
+# Los backups troceados se vuelcan sin compresión para que los chunks se repitan entre días
+CHUNKED_BACKUP_CODEC = "custom/none"
+
+# Mismas consultas que backup.sh y refresh.sh
+TABLES_QUERY = """
+    SELECT coalesce(json_agg(json_build_object(
+               'schema', n.nspname,
+               'table', c.relname,
+               'row_estimate', greatest(c.reltuples, 0)::bigint,
+               'size_bytes', pg_total_relation_size(c.oid)
+           ) ORDER BY n.nspname, c.relname), '[]')
+    FROM pg_class c
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE c.relkind IN ('r', 'p')
+      AND n.nspname NOT IN ('pg_catalog', 'information_schema')
+      AND n.nspname NOT LIKE 'pg_toast%'
+"""
+DATABASES_QUERY = """
+    SELECT datname FROM pg_database
+    WHERE NOT datistemplate AND datallowconn
+      AND datname NOT IN ('postgres', 'azure_maintenance', 'azure_sys')
+    ORDER BY pg_database_size(oid) DESC
+"""
+
+
+def utc_now() -> str:
+    return datetime.datetime.utcnow().strftime(TIMESTAMP_FORMAT)
+
+
+def format_duration(seconds: float) -> str:
+    """
+    Formatea una duración en segundos a un formato legible.
+    Por ejemplo: "2h 5m 30s" o "45s"
+    """
+    if seconds is None:
+        return None
+
+    seconds = int(seconds)
+    hours, remainder = divmod(seconds, 3600)
+    minutes, seconds = divmod(remainder, 60)
+
+    parts = []
+    if hours > 0:
+        parts.append(f"{hours}h")
+    if minutes > 0 or hours > 0:
+        parts.append(f"{minutes}m")
+    parts.append(f"{seconds}s")
+
+    return " ".join(parts)
+
+
+def elapsed_seconds(started_at: Optional[str], completed_at: Optional[str] = None) -> Optional[float]:
+    """Segundos entre dos timestamps de GitHub; sin fin se mide hasta ahora."""
+    if not started_at:
+        return None
+    started = datetime.datetime.strptime(started_at, TIMESTAMP_FORMAT)
+    completed = datetime.datetime.strptime(completed_at, TIMESTAMP_FORMAT) if completed_at else datetime.datetime.utcnow()
+    return (completed - started).total_seconds()
+
+
+def format_step(step: Dict[str, Any]) -> Dict[str, Any]:
+    """Paso de un job en el modelo de estado común."""
+    step_duration = elapsed_seconds(step.get("started_at"), step.get("completed_at")) if step.get("completed_at") else None
+    return {
+        "name": step.get("name", "Unknown step"),
+        "status": step.get("status", "unknown"),
+        "conclusion": step.get("conclusion", None),
+        "started_at": step.get("started_at"),
+        "completed_at": step.get("completed_at"),
+        "duration": format_duration(step_duration) if step_duration else None
+    }
+
+
+def format_job(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Job en el modelo de estado común."""
+    job_duration = elapsed_seconds(job.get("started_at"), job.get("completed_at")) if job.get("completed_at") else None
+    return {
+        "id": job.get("id"),
+        "name": job.get("name", "Unknown job"),
+        "status": job.get("status", "unknown"),
+        "conclusion": job.get("conclusion", None),
+        "started_at": job.get("started_at"),
+        "completed_at": job.get("completed_at"),
+        "duration": format_duration(job_duration) if job_duration else None,
+        "steps": [format_step(step) for step in job.get("steps", [])]
+    }
+
+
+def summarize_jobs(jobs: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Recuento de jobs y pasos para la vista resumida del estado. Recorre los jobs tal como
+    llegan (de GitHub o del ejecutor local) sin construir la lista de pasos formateados.
+    """
+    summary = {"total": 0, "queued": 0, "in_progress": 0, "completed": 0, "failed": 0,
+               "steps_total": 0, "steps_completed": 0, "current_job": None, "current_step": None}
+    for job in jobs:
+        summary["total"] += 1
+        status = job.get("status")
+        if status == "completed":
+            summary["completed"] += 1
+            if job.get("conclusion") in ("failure", "cancelled", "timed_out"):
+                summary["failed"] += 1
+        elif status == "in_progress":
+            summary["in_progress"] += 1
+            summary["current_job"] = summary["current_job"] or job.get("name")
+        else:
+            summary["queued"] += 1
+        for step in job.get("steps") or ():
+            summary["steps_total"] += 1
+            if step.get("status") == "completed":
+                summary["steps_completed"] += 1
+            elif step.get("status") == "in_progress" and summary["current_step"] is None:
+                summary["current_step"] = step.get("name")
+    return summary
+
+
+def run_title(databases: Optional[List[str]], source_host: str, target_host: str) -> str:
+    """Título de una ejecución; coincide con el run-name de pg-backup-restore.yml."""
+    return f"Refresh {','.join(databases) if databases is not None else '*'} from {source_host} to {target_host}"
+
+
+def parse_run_title(title: Optional[str]) -> Dict[str, Any]:
+    """Bases de datos y servidores de un título de ejecución (vacío si no tiene el formato)."""
+    match = RUN_TITLE_PATTERN.match(title or "")
+    if not match:
+        return {"databases": None, "all_databases": False, "source_host": None, "target_host": None}
+    databases = match.group("databases")
+    return {
+        # "*": todas las bases de datos del servidor
+        "databases": None if databases == "*" else databases.split(","),
+        "all_databases": databases == "*",
+        "source_host": match.group("source"),
+        "target_host": match.group("target")
+    }
+
+
+def summarize_run(run_id: Any, executor: str, name: str, title: Optional[str], status: str,
+                  conclusion: Optional[str], created_at: Optional[str], updated_at: Optional[str],
+                  html_url: Optional[str]) -> Dict[str, Any]:
+    """Fila del listado de ejecuciones (/api/workflow/runs), sin jobs ni informes."""
+    duration_seconds = elapsed_seconds(created_at, updated_at if status == "completed" else None) if created_at else None
+    return dict({
+        "id": run_id,
+        "executor": executor,
+        "name": name,
+        "title": title,
+        "status": status,
+        "conclusion": conclusion,
+        "created_at": created_at,
+        "updated_at": updated_at,
+        "duration_seconds": round(duration_seconds) if duration_seconds is not None else None,
+        "html_url": html_url
+    }, **parse_run_title(title))
+
+
+def filter_runs(runs: List[Dict[str, Any]], database: Optional[str] = None, host: Optional[str] = None,
+                state: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Filtra el listado de ejecuciones. `database` incluye las ejecuciones de todas las bases de
+    datos; `host` coincide con el servidor de origen o de destino; `state` es active o completed.
+    """
+    result = []
+    for run in runs:
+        if database and not (run["all_databases"] or database in (run["databases"] or [])):
+            continue
+        if host and host not in (run["source_host"], run["target_host"]):
+            continue
+        if state == "active" and run["status"] == "completed":
+            continue
+        if state == "completed" and run["status"] != "completed":
+            continue
+        result.append(run)
+    return result
+
+
+def resolve_host(server: str, domain: Optional[str] = None) -> Tuple[str, int]:
+    """
+    Convierte el nombre de servidor de la petición en host y puerto. Como en el workflow, un
+    nombre corto es un Flexible Server (<nombre>.postgres.database.azure.com); un nombre con
+    dominio, una IP o localhost se usan tal cual. Admite el sufijo :puerto.
+    """
+    domain = domain or get_executor_config()["postgres_domain"]
+    host, _, port = server.partition(":")
+    if "." not in host and host != "localhost":
+        host = f"{host}.{domain}"
+    return host, int(port) if port else 5432
+
+
+class GitHubExecutor:
+    """Lanza el refresco como workflow de GitHub Actions y consulta sus ejecuciones."""
+
+    name = "github"
+
+    def __init__(self, github_config: Optional[Dict[str, Any]] = None):
+        self.config = github_config or get_github_config()
+        if not all([self.config["token"], self.config["owner"], self.config["repo"]]):
+            raise HTTPException(
+                status_code=500,
+                detail="Missing GitHub configuration in function app settings."
+            )
+        self.repo_url = f"{GITHUB_API_URL}/repos/{self.config['owner']}/{self.config['repo']}"
+
+    def _headers(self) -> Dict[str, str]:
+        return {
+            "Accept": "application/vnd.github+json",
+            "Authorization": f"Bearer {self.config['token']}",
+            "Content-Type": "application/json",
+            "X-GitHub-Api-Version": "2022-11-28"
+        }
+
+    def dispatch(self, workflow_data: Any, databases: Optional[List[str]], options: Dict[str, Any]) -> Dict[str, Any]:
+        """Lanza el workflow con los inputs de la petición (WorkflowRequest)."""
+        inputs = {
+            'pg_host_prod': workflow_data.pg_host_prod,
+            'pg_host_dev': workflow_data.pg_host_dev,
+            'pg_database': ",".join(databases) if databases is not None else "*",  # "*": all databases
+            'pg_user': workflow_data.pg_user,
+            'pg_password': workflow_data.pg_password,
+            'resource_group': workflow_data.resource_group,
+            'storage_account': workflow_data.storage_account,
+            'storage_container': workflow_data.storage_container,
+            'options': json.dumps(options)
+        }
+
+        # No registrar la contraseña en los logs
+        logged_inputs = {k: v for k, v in inputs.items() if k != 'pg_password'}
+        logging.info(f"Received parameters: {logged_inputs}")
+
+        workflow_id = self.config["workflow_id"]
+        url = f"{self.repo_url}/actions/workflows/{workflow_id}/dispatches"
+        payload = {
+            "ref": "main",  # or your default branch
+            "inputs": inputs
+        }
+        response = get_upstream("github").call("POST", url, requests.post, headers=self._headers(), json=payload)
+
+        if response.status_code == 204:  # GitHub returns 204 No Content on success
+            return {
+                "message": "PostgreSQL dump-restore workflow initiated successfully",
+                "executor": self.name,
+                "workflowUrl": f"https://github.com/{self.config['owner']}/{self.config['repo']}/actions/workflows/{workflow_id}"
+            }
+        logging.error(f"GitHub API returned: {response.status_code} - {response.text}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to trigger GitHub workflow: {response.text}"
+        )
+
+    def list_runs(self, limit: int = MAX_RUN_HISTORY) -> List[Dict[str, Any]]:
+        """
+        Últimas `limit` ejecuciones del workflow, de más reciente a más antigua. La primera
+        página indica el total; el resto de páginas se piden en paralelo.
+        """
+        url = f"{self.repo_url}/actions/workflows/{self.config['workflow_id']}/runs"
+        per_page = min(GITHUB_PAGE_SIZE, limit)
+
+        def fetch(page: int) -> Dict[str, Any]:
+            response = get_upstream("github").call("GET", url, requests.get, headers=self._headers(),
+                                                   params={"per_page": per_page, "page": page})
+            if response.status_code != 200:
+                raise HTTPException(
+                    status_code=response.status_code,
+                    detail=f"Failed to retrieve workflow runs: {response.text}"
+                )
+            return response.json()
+
+        first = fetch(1)
+        pages = min(-(-limit // per_page), -(-first.get("total_count", 0) // per_page))
+        runs = list(first.get("workflow_runs", []))
+        if pages > 1:
+            with ThreadPoolExecutor(max_workers=min(4, pages - 1)) as pool:
+                for data in pool.map(fetch, range(2, pages + 1)):
+                    runs.extend(data.get("workflow_runs", []))
+        return [
+            summarize_run(run.get("id"), self.name, run.get("name", "Unknown workflow"), run.get("display_title"),
+                          run.get("status", "unknown"), run.get("conclusion"), run.get("created_at"),
+                          run.get("updated_at"), run.get("html_url"))
+            for run in runs[:limit]
+        ]
+
+    def get_status(self, run_id: Optional[str] = None, view: str = "full", include_jobs: bool = True) -> Dict[str, Any]:
+        """
+        Estado de una ejecución con sus jobs y steps. Sin run_id se devuelve la más reciente.
+        Con view="summary" los jobs se resumen en "job_summary" (sin pasos ni raw_data_urls);
+        sin include_jobs no se consultan los jobs.
+        """
+        headers = self._headers()
+        github = get_upstream("github")
+        stale = False
+        if run_id is None:
+            # Get latest workflow run
+            runs_url = f"{self.repo_url}/actions/runs"
+            response = github.call("GET", runs_url, requests.get, headers=headers)
+
+            if response.status_code != 200:
+                raise HTTPException(
+                    status_code=response.status_code,
+                    detail=f"Failed to retrieve workflow runs: {response.text}"
+                )
+
+            runs_data = response.json()
+            stale = is_stale(response)
+            if not runs_data["workflow_runs"]:
+                return {
+                    "message": "No workflow runs found",
+                    "runs_count": 0
+                }
+
+            # Get the most recent run
+            run_id = runs_data["workflow_runs"][0]["id"]
+
+        # Get detailed information about the run
+        run_url = f"{self.repo_url}/actions/runs/{run_id}"
+        run_response = github.call("GET", run_url, requests.get, headers=headers)
+
+        if run_response.status_code != 200:
+            raise HTTPException(
+                status_code=run_response.status_code,
+                detail=f"Failed to retrieve run details: {run_response.text}"
+            )
+
+        run_data = run_response.json()
+        stale = stale or is_stale(run_response)
+
+        # Get jobs for this run
+        jobs_url = f"{self.repo_url}/actions/runs/{run_id}/jobs"
+        jobs_data = {}
+        if include_jobs:
+            jobs_response = github.call("GET", jobs_url, requests.get, headers=headers)
+
+            if jobs_response.status_code != 200:
+                raise HTTPException(
+                    status_code=jobs_response.status_code,
+                    detail=f"Failed to retrieve job details: {jobs_response.text}"
+                )
+
+            jobs_data = jobs_response.json()
+            stale = stale or is_stale(jobs_response)
+
+        duration = None
+        if run_data.get("created_at"):
+            duration_seconds = elapsed_seconds(run_data["created_at"], run_data.get("updated_at"))
+            duration = {
+                "seconds": round(duration_seconds),
+                "formatted": format_duration(duration_seconds)
+            }
+
+        status = {
+            "id": run_data.get("id"),
+            "name": run_data.get("name", "Unknown workflow"),
+            "executor": self.name,
+            "status": run_data.get("status", "unknown"),
+            "conclusion": run_data.get("conclusion", None),
+            "html_url": run_data.get("html_url"),
+            "created_at": run_data.get("created_at"),
+            "updated_at": run_data.get("updated_at"),
+            "duration": duration
+        }
+        if stale:
+            # GitHub no responde (circuito abierto): datos de la última respuesta correcta
+            status["stale"] = True
+        if view == "summary":
+            if include_jobs:
+                status["job_summary"] = summarize_jobs(jobs_data.get("jobs", []))
+            return status
+        if include_jobs:
+            status["jobs"] = [format_job(job) for job in jobs_data.get("jobs", [])]
+        status["raw_data_urls"] = {
+            "run_url": run_url,
+            "jobs_url": jobs_url
+        }
+        return status
+
+
+class LocalRun:
+    """Estado en memoria de una ejecución local, con el mismo modelo que una ejecución de GitHub."""
+
+    def __init__(self, run_id: str, name: str, title: Optional[str] = None):
+        self.id = run_id
+        self.name = name
+        self.title = title
+        self.status = "queued"
+        self.conclusion: Optional[str] = None
+        self.created_at = utc_now()
+        self.updated_at = self.created_at
+        self.reports: Dict[str, Dict[str, Any]] = {}
+        self.trackers: Dict[str, ProgressTracker] = {}
+        self._jobs: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def _touch(self) -> None:
+        self.updated_at = utc_now()
+
+    def set_status(self, status: str, conclusion: Optional[str] = None) -> None:
+        with self._lock:
+            self.status = status
+            self.conclusion = conclusion
+            self._touch()
+
+    def add_job(self, name: str) -> Dict[str, Any]:
+        with self._lock:
+            job = {"id": len(self._jobs) + 1, "name": name, "status": "queued", "conclusion": None,
+                   "started_at": None, "completed_at": None, "steps": []}
+            self._jobs.append(job)
+            self._touch()
+            return job
+
+    def finish_job(self, job: Dict[str, Any], conclusion: str) -> None:
+        with self._lock:
+            job["status"] = "completed"
+            job["conclusion"] = conclusion
+            job["started_at"] = job["started_at"] or utc_now()
+            job["completed_at"] = utc_now()
+            self._touch()
+
+    def start_step(self, job: Dict[str, Any], name: str) -> Dict[str, Any]:
+        with self._lock:
+            now = utc_now()
+            step = {"name": name, "status": "in_progress", "conclusion": None, "started_at": now, "completed_at": None}
+            job["steps"].append(step)
+            job["status"] = "in_progress"
+            job["started_at"] = job["started_at"] or now
+            self._touch()
+            return step
+
+    def end_step(self, step: Dict[str, Any], conclusion: str) -> None:
+        with self._lock:
+            step["status"] = "completed"
+            step["conclusion"] = conclusion
+            step["completed_at"] = utc_now()
+            self._touch()
+
+    @contextmanager
+    def step(self, job: Dict[str, Any], name: str) -> Iterator[Dict[str, Any]]:
+        step = self.start_step(job, name)
+        try:
+            yield step
+        except Exception:
+            self.end_step(step, "failure")
+            raise
+        self.end_step(step, "success")
+
+    def add_report(self, kind: str, database: str, report: Dict[str, Any]) -> None:
+        with self._lock:
+            self.reports.setdefault(kind, {})[database] = report
+            self._touch()
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            return summarize_run(self.id, LocalExecutor.name, self.name, self.title, self.status, self.conclusion,
+                                 self.created_at, self.updated_at, None)
+
+    def snapshot(self, view: str = "full") -> Dict[str, Any]:
+        """
+        Estado de la ejecución en el modelo de /api/workflow/status, con sus informes. Con
+        view="summary" los jobs se resumen en "job_summary" sin copiar sus pasos.
+        """
+        with self._lock:
+            duration_seconds = elapsed_seconds(self.created_at, self.updated_at if self.status == "completed" else None)
+            reports = {kind: dict(by_database) for kind, by_database in self.reports.items()}
+            trackers = dict(self.trackers)
+            jobs = summarize_jobs(self._jobs) if view == "summary" else [format_job(job) for job in self._jobs]
+            status = {
+                "id": self.id,
+                "name": self.name,
+                "executor": LocalExecutor.name,
+                "status": self.status,
+                "conclusion": self.conclusion,
+                "html_url": None,
+                "created_at": self.created_at,
+                "updated_at": self.updated_at,
+                "duration": {"seconds": round(duration_seconds), "formatted": format_duration(duration_seconds)},
+                "job_summary" if view == "summary" else "jobs": jobs
+            }
+        if trackers:
+            reports["progress"] = {database: tracker.snapshot() for database, tracker in trackers.items()}
+        status["reports"] = reports
+        return status
+
+
+class LocalPipeline:
+    """Backup y restauración de una base de datos, equivalente a backup.sh + restore.sh."""
+
+    def __init__(self, executor: "LocalExecutor", run: LocalRun, job: Dict[str, Any],
+                 workflow_data: Any, database: str, options: Dict[str, Any], work_dir: str):
+        self.executor = executor
+        self.run = run
+        self.job = job
+        self.request = workflow_data
+        self.database = database
+        self.options = options
+        self.work_dir = work_dir
+        self.source_host, self.source_port = resolve_host(workflow_data.pg_host_prod)
+        self.target_host, self.target_port = resolve_host(workflow_data.pg_host_dev)
+        self.storage = (workflow_data.storage_account, workflow_data.storage_container)
+        self.catalog_blob = get_storage_config()["catalog_blob"]
+        self.jobs = options.get("restore_jobs", 4)
+        self.verify = options.get("verify", True)
+        self.phases: Dict[str, int] = {}
+        self._upload: Optional[Future] = None
+
+    def _conninfo(self, host: str, port: int, dbname: str) -> str:
+        return build_conninfo(host, dbname, self.request.pg_user, port, self.request.pg_password)
+
+    @contextmanager
+    def _phase(self, name: str) -> Iterator[None]:
+        started = time.monotonic()
+        yield
+        self.phases[name] = int(time.monotonic() - started)
+
+    def execute(self) -> bool:
+        """Ejecuta el pipeline y publica el informe 'pipeline'. Devuelve True si terminó bien."""
+        started_at = utc_now()
+        started = time.monotonic()
+        backup_file = self.options.get("backups", {}).get(self.database)
+        backup_created = False
+        status, failed_stage, error = "succeeded", None, None
+        stage = "backup"
+        try:
+            os.makedirs(self.work_dir, exist_ok=True)
+            local_path, manifest, source_snapshot = None, None, None
+            selective_done, stats = False, None
+            if self.options.get("selective"):
+                stage = "selective"
+                selective_done, stats = self.selective()
+            if self.options.get("subset"):
+                stage = "subset"
+                self.copy_subset()
+            elif not selective_done:
+                if not backup_file:
+                    stage = "backup"
+                    backup_file, local_path, manifest, source_snapshot = self.backup()
+                    backup_created = True
+                stage = "restore"
+                self.restore(backup_file, local_path, manifest, source_snapshot, backup_created)
+            stage = "upload"
+            self._wait_upload()
+            if stats is not None:
+                self._save_stats(stats, refreshed=not selective_done)
+        except Exception as e:
+            logging.exception(f"Local refresh of {self.database} failed during {stage}")
+            status, failed_stage, error = "failed", stage, str(e)
+            if self._upload is not None and stage != "upload":
+                # No dejar la subida del backup huérfana aunque la restauración haya fallado
+                try:
+                    self._wait_upload()
+                except Exception:
+                    pass
+        finally:
+            shutil.rmtree(self.work_dir, ignore_errors=True)
+
+        self.run.add_report("pipeline", self.database, {
+            "database": self.database,
+            "status": status,
+            "failed_stage": failed_stage,
+            "error": error,
+            "backup": backup_file,
+            "backup_created": backup_created,
+            "started_at": started_at,
+            "completed_at": utc_now(),
+            "total_seconds": int(time.monotonic() - started)
+        })
+        self.run.finish_job(self.job, "success" if status == "succeeded" else "failure")
+        return status == "succeeded"
+
+    def selective(self) -> Tuple[bool, Dict[str, Any]]:
+        """
+        Refresco selectivo: solo se copian las tablas que han cambiado desde el último refresco.
+        Devuelve si se aplicó y el registro de estadísticas; si no, hace falta el refresco completo.
+        """
+        with self.run.step(self.job, "Selective refresh"):
+            previous = None
+            try:
+                previous = read_json_blob(*self.storage, stats_blob(self.request.pg_host_prod, self.database))
+            except Exception as e:
+                logging.warning(f"Could not read table statistics of {self.database}: {str(e)}")
+            # Si la copia falla a medias, el siguiente refresco encuentra las estadísticas
+            # invalidadas y hace el refresco completo
+            report, stats = run_selective(
+                (self.source_host, self.source_port), (self.target_host, self.target_port), self.database,
+                self.request.pg_user, self.request.pg_password, previous, self.request.pg_host_prod,
+                self.request.pg_host_dev, self.options["selective"].get("threshold", 0.01), self.jobs,
+                invalidate=lambda record: write_json_blob(
+                    *self.storage, stats_blob(self.request.pg_host_prod, self.database), record)
+            )
+        self.run.add_report("selective", self.database, report)
+        if report["mode"] == "full":
+            logging.info(f"Full refresh of {self.database} required: {report['reason']}")
+        return report["mode"] == "selective", stats
+
+    def _save_stats(self, stats: Dict[str, Any], refreshed: bool) -> None:
+        """Guarda las estadísticas para el siguiente refresco selectivo."""
+        try:
+            if refreshed:
+                # Tras un refresco completo, los contadores de desarrollo se toman al terminar la restauración
+                record_target(stats, self._conninfo(self.target_host, self.target_port, self.database))
+            write_json_blob(*self.storage, stats_blob(self.request.pg_host_prod, self.database), stats)
+        except Exception as e:
+            logging.warning(f"Failed to save table statistics of {self.database}; the next selective refresh will be a full refresh: {str(e)}")
+
+    def copy_subset(self) -> None:
+        """Subconjunto referencialmente consistente copiado de producción a desarrollo, sin backup."""
+        with self.run.step(self.job, "Copy subset"):
+            report = run_subset(
+                (self.source_host, self.source_port), (self.target_host, self.target_port), self.database,
+                self.request.pg_user, self.request.pg_password, self.options["subset"], self.jobs,
+                self.work_dir, self.executor.pg_bin_dir
+            )
+        self.run.add_report("subset", self.database, report)
+
+    def backup(self) -> Tuple[str, str, Dict[str, Any], Optional[Dict[str, Any]]]:
+        """pg_dump de producción; la subida al contenedor continúa en segundo plano."""
+        backup_file = f"{self.database}_{datetime.datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.dump"
+        dump_path = os.path.join(self.work_dir, backup_file)
+        conninfo = self._conninfo(self.source_host, self.source_port, self.database)
+        chunked = bool(self.options.get("chunked_backup"))
+
+        with self.run.step(self.job, "Collect source metadata"):
+            with psycopg.connect(conninfo) as conn:
+                source_version = conn.execute("SHOW server_version").fetchone()[0]
+                database_size = conn.execute("SELECT pg_database_size(current_database())").fetchone()[0]
+                tables = conn.execute(TABLES_QUERY).fetchone()[0]
+
+        with self.run.step(self.job, "Create backup"):
+            dump_started_at = utc_now()
+            dump_start = time.monotonic()
+            exporter = None
+            snapshot_future = None
+            snapshot_args = []
+            snapshot_pool = ThreadPoolExecutor(max_workers=1)
+            try:
+                if self.verify:
+                    # Misma técnica que backup.sh: la instantánea de verificación y pg_dump
+                    # comparten un snapshot exportado que se mantiene abierto durante el dump
+                    exporter = psycopg.connect(conninfo, autocommit=True)
+                    exporter.execute("BEGIN ISOLATION LEVEL REPEATABLE READ READ ONLY")
+                    snapshot_id = exporter.execute("SELECT pg_export_snapshot()").fetchone()[0]
+                    snapshot_args = [f"--snapshot={snapshot_id}"]
+                    snapshot_future = snapshot_pool.submit(
+                        take_snapshot, conninfo, self.jobs,
+                        self.options.get("verify_exact_threshold_mb", 512) * 1024 * 1024,
+                        self.options.get("verify_checksum_rows", 0), snapshot_id
+                    )
+
+                tracker = ProgressTracker(
+                    "dump", self.database,
+                    {f"{t['schema']}.{t['table']}": int(t.get("size_bytes") or 0) for t in tables},
+                    database_size, dump_path, 1, 2
+                )
+                self.run.trackers[self.database] = tracker
+                code, tail = self.executor.run_tool(
+                    ["pg_dump", "-h", self.source_host, "-p", str(self.source_port), "-U", self.request.pg_user,
+                     "-d", self.database, "-F", "c", "-b", "-v", *(["-Z", "0"] if chunked else []),
+                     *snapshot_args, "-f", dump_path],
+                    self.request.pg_password, tracker
+                )
+                tracker.finish(code)
+                if code != 0:
+                    raise RuntimeError(f"pg_dump failed with exit code {code}: {' '.join(tail[-3:])}")
+
+                source_snapshot = None
+                if snapshot_future is not None:
+                    try:
+                        source_snapshot = snapshot_future.result()
+                    except Exception as e:
+                        logging.warning(f"Verification snapshot of {self.database} failed: {str(e)}")
+            finally:
+                if exporter is not None:
+                    exporter.close()
+                snapshot_pool.shutdown(wait=False)
+
+            dump_seconds = int(time.monotonic() - dump_start)
+            sha256 = hashlib.sha256()
+            with open(dump_path, "rb") as file:
+                for chunk in iter(lambda: file.read(1024 * 1024), b""):
+                    sha256.update(chunk)
+
+        verification_file = f"{backup_file[:-len('.dump')]}.verification.json" if source_snapshot else None
+        manifest = {
+            "version": 1,
+            "name": backup_file,
+            "database": self.database,
+            "source_host": self.request.pg_host_prod,
+            "pg_version": source_version,
+            "codec": CHUNKED_BACKUP_CODEC if chunked else BACKUP_CODEC,
+            "format": "custom",
+            "size_bytes": os.path.getsize(dump_path),
+            "sha256": sha256.hexdigest(),
+            "database_size_bytes": database_size,
+            "created_at": dump_started_at,
+            "completed_at": utc_now(),
+            "run_id": self.run.id,
+            "verification_snapshot": verification_file,
+            "timings": {"dump_seconds": dump_seconds, "upload_seconds": None},
+            "tables": tables
+        }
+        if chunked:
+            manifest["storage"] = "chunks"
+
+        # La restauración usa el fichero local mientras el backup se sube al contenedor
+        upload_step = self.run.start_step(self.job, "Upload backup")
+        self._upload = self.executor.background(self._upload_backup, upload_step, dump_path, manifest, source_snapshot)
+        return backup_file, dump_path, manifest, source_snapshot
+
+    def _upload_backup(self, step: Dict[str, Any], dump_path: str, manifest: Dict[str, Any],
+                       source_snapshot: Optional[Dict[str, Any]]) -> None:
+        try:
+            upload_start = time.monotonic()
+            if manifest.get("storage") == "chunks":
+                # Solo se transfieren los chunks que no están ya en el almacén
+                dedup = put_file(*self.storage, manifest["name"], dump_path, jobs=self.jobs * 2, workers=self.jobs)
+                manifest["chunk_manifest"] = dedup.pop("chunk_manifest")
+                manifest["dedup"] = dedup
+                self.run.add_report("chunks", self.database, {"backup": manifest["name"], **dedup})
+            else:
+                upload_file_blob(*self.storage, manifest["name"], dump_path)
+            manifest["timings"]["upload_seconds"] = int(time.monotonic() - upload_start)
+            if source_snapshot:
+                write_json_blob(*self.storage, manifest["verification_snapshot"], source_snapshot)
+            write_json_blob(*self.storage, manifest_name(manifest["name"]), manifest)
+            try:
+                add_catalog_entry(*self.storage, self.catalog_blob, catalog_entry(manifest))
+            except Exception as e:
+                # El backup y su manifiesto ya están subidos; el catálogo se puede reconstruir a partir de ellos
+                logging.warning(f"Failed to update catalog {self.catalog_blob}: {str(e)}")
+        except Exception:
+            self.run.end_step(step, "failure")
+            raise
+        self.run.end_step(step, "success")
+
+    def _wait_upload(self) -> None:
+        if self._upload is not None:
+            upload, self._upload = self._upload, None
+            upload.result()
+
+    def restore(self, backup_file: str, local_path: Optional[str], manifest: Optional[Dict[str, Any]],
+                source_snapshot: Optional[Dict[str, Any]], backup_created: bool) -> None:
+        """pg_restore en desarrollo y verificación por tabla, como restore.sh."""
+        restore_started_at = utc_now()
+        restore_start = time.monotonic()
+        profile = self.options.get("restore_profile", "standard")
+        restore_target = self.options.get("restore_target", "database")
+        # En modo plantilla se restaura en <base_de_datos>__tpl y la base de datos de trabajo se clona al final
+        target_database = template_name(self.database) if restore_target == "template" else self.database
+
+        if local_path is None:
+            local_path = os.path.join(self.work_dir, backup_file)
+            with self.run.step(self.job, "Download backup"), self._phase("download"):
+                if not download_backup(*self.storage, backup_file, local_path):
+                    raise RuntimeError(f"Backup {backup_file} not found in {self.storage[1]}")
+
+            with self.run.step(self.job, "Verify checksum"), self._phase("checksum"):
+                manifest = read_json_blob(*self.storage, manifest_name(backup_file))
+                if manifest:
+                    sha256 = hashlib.sha256()
+                    with open(local_path, "rb") as file:
+                        for chunk in iter(lambda: file.read(1024 * 1024), b""):
+                            sha256.update(chunk)
+                    if sha256.hexdigest() != manifest.get("sha256"):
+                        try:
+                            set_backup_status(*self.storage, self.catalog_blob, backup_file, "invalid")
+                        except Exception as e:
+                            logging.warning(f"Failed to mark {backup_file} as invalid in the catalog: {str(e)}")
+                        raise RuntimeError(f"Checksum mismatch for {backup_file}")
+            if self.verify and manifest and manifest.get("verification_snapshot"):
+                source_snapshot = read_json_blob(*self.storage, manifest["verification_snapshot"])
+
+        with self.run.step(self.job, "Restore backup"):
+            with self._phase("recreate"):
+                admin = self._conninfo(self.target_host, self.target_port, "postgres")
+                with psycopg.connect(admin, autocommit=True) as conn:
+                    conn.execute(sql.SQL("DROP DATABASE IF EXISTS {} WITH (FORCE)").format(sql.Identifier(target_database)))
+                    conn.execute(sql.SQL("CREATE DATABASE {}").format(sql.Identifier(target_database)))
+
+            tracker = ProgressTracker(
+                "restore", self.database,
+                {f"{t['schema']}.{t['table']}": int(t.get("size_bytes") or 0) for t in (manifest or {}).get("tables", [])},
+                stage_index=2 if backup_created else 1, stage_count=2 if backup_created else 1,
+                parallel=profile == "fast"
+            )
+            self.run.trackers[self.database] = tracker
+            target = ["-h", self.target_host, "-p", str(self.target_port), "-U", self.request.pg_user, "-d", target_database]
+            password = self.request.pg_password
+
+            if profile == "fast":
+                # Ajustes de sesión para carga masiva en todas las conexiones de pg_restore/vacuumdb
+                env = {"PGOPTIONS": (f"-c maintenance_work_mem={os.environ.get('RESTORE_MAINTENANCE_WORK_MEM', '1GB')} "
+                                     f"-c work_mem={os.environ.get('RESTORE_WORK_MEM', '64MB')} -c synchronous_commit=off")}
+                for section, phase, parallel in (("pre-data", "pre_data", False), ("data", "data", True), ("post-data", "post_data", True)):
+                    with self._phase(phase):
+                        jobs = ["-j", str(self.jobs)] if parallel else []
+                        code, _ = self.executor.run_tool(
+                            ["pg_restore", *target, f"--section={section}", *jobs, "-v", local_path], password, tracker, env
+                        )
+                        if code != 0:
+                            logging.warning(f"pg_restore {section} of {self.database} completed with warnings or errors")
+                with self._phase("analyze"):
+                    code, _ = self.executor.run_tool(
+                        ["vacuumdb", *target, "--analyze-only", "--jobs", str(self.jobs)], password, extra_env=env
+                    )
+                    if code != 0:
+                        logging.warning(f"ANALYZE failed on {self.database}. Planner statistics may be missing.")
+            else:
+                with self._phase("restore"):
+                    code, _ = self.executor.run_tool(["pg_restore", *target, "-v", local_path], password, tracker)
+                    if code != 0:
+                        # pg_restore puede terminar con código distinto de 0 y dejar la base de datos restaurada con advertencias
+                        logging.warning(f"pg_restore of {self.database} completed with warnings or errors")
+            tracker.finish(0)
+
+        verification_status = "skipped"
+        with self.run.step(self.job, "Verify restore"):
+            conninfo = self._conninfo(self.target_host, self.target_port, target_database)
+            with self._phase("verify"), psycopg.connect(conninfo) as conn:
+                tables_count = conn.execute(
+                    "SELECT count(*) FROM information_schema.tables WHERE table_schema NOT IN ('pg_catalog', 'information_schema')"
+                ).fetchone()[0]
+            if not tables_count:
+                logging.warning(f"The restored database {self.database} appears to be empty")
+
+            if self.verify and source_snapshot:
+                with self._phase("verify_tables"):
+                    try:
+                        report = verify_restore(source_snapshot, conninfo, self.jobs)
+                        self.run.add_report("verification", self.database, report)
+                        verification_status = report["status"]
+                    except Exception as e:
+                        logging.warning(f"Table verification of {self.database} could not be completed: {str(e)}")
+                        verification_status = "error"
+
+        if restore_target == "template" and verification_status != "failed":
+            # Una plantilla que no pasa la verificación no se sella y nunca se clona
+            with self.run.step(self.job, "Clone from template"), self._phase("template_clone"):
+                admin = self._conninfo(self.target_host, self.target_port, "postgres")
+                with psycopg.connect(admin, autocommit=True) as conn:
+                    seal_template(conn, self.database, {
+                        "database": self.database,
+                        "backup": backup_file,
+                        "source_host": (manifest or {}).get("source_host"),
+                        "backup_created_at": (manifest or {}).get("created_at"),
+                        "restored_at": utc_now(),
+                        "run_id": self.run.id
+                    })
+                    clone_from_template(conn, self.database)
+
+        self.run.add_report("restore", self.database, {
+            "database": self.database,
+            "target_host": self.request.pg_host_dev,
+            "backup": backup_file,
+            "profile": profile,
+            "restore_target": restore_target,
+            "jobs": self.jobs if profile == "fast" else 1,
+            "tables": tables_count,
+            "verification": verification_status,
+            "started_at": restore_started_at,
+            "completed_at": utc_now(),
+            "total_seconds": int(time.monotonic() - restore_start),
+            "phases": dict(self.phases)
+        })
+        if verification_status == "failed":
+            raise RuntimeError(f"Restored database {self.database} does not match the source")
+
+
+class LocalExecutor:
+    """Ejecuta refrescos dentro de la API con un pool acotado de workers."""
+
+    name = "local"
+
+    def __init__(self, max_workers: int = 2, work_dir: Optional[str] = None, pg_bin_dir: Optional[str] = None):
+        self.work_dir = work_dir or tempfile.gettempdir()
+        self.pg_bin_dir = pg_bin_dir
+        # Un worker por ejecución; cada ejecución abre su propio pool por base de datos
+        self._runs_pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="local-refresh")
+        # Tareas en segundo plano de los pipelines (subida de backups)
+        self._background_pool = ThreadPoolExecutor(max_workers=max(2, max_workers * 2), thread_name_prefix="local-upload")
+        self._runs: "collections.OrderedDict[str, LocalRun]" = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def background(self, fn, *args) -> Future:
+        return self._background_pool.submit(fn, *args)
+
+    def run_tool(self, args: List[str], password: str, tracker: Optional[ProgressTracker] = None,
+                 extra_env: Optional[Dict[str, str]] = None) -> Tuple[int, List[str]]:
+        """
+        Ejecuta una herramienta cliente de PostgreSQL. La salida de error (verbose) alimenta
+        el seguimiento de progreso; se devuelven el código de salida y las últimas líneas.
+        """
+        env = dict(os.environ, PGPASSWORD=password)
+        env.update(extra_env or {})
+        command = [os.path.join(self.pg_bin_dir, args[0]) if self.pg_bin_dir else args[0], *args[1:]]
+        tail: "collections.deque[str]" = collections.deque(maxlen=20)
+        process = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                   text=True, errors="replace")
+        for line in process.stderr:
+            tail.append(line.rstrip())
+            if tracker is not None:
+                tracker.feed(line)
+        code = process.wait()
+        if code != 0:
+            logging.warning(f"{args[0]} exited with code {code}: {' | '.join(tail)}")
+        return code, list(tail)
+
+    def dispatch(self, workflow_data: Any, databases: Optional[List[str]], options: Dict[str, Any]) -> Dict[str, Any]:
+        """Encola el refresco y devuelve inmediatamente el identificador de la ejecución local."""
+        if resolve_host(workflow_data.pg_host_prod) == resolve_host(workflow_data.pg_host_dev):
+            raise HTTPException(
+                status_code=422,
+                detail="pg_host_prod and pg_host_dev are the same server; the restore would drop the source database"
+            )
+
+        run = LocalRun(f"{LOCAL_RUN_PREFIX}{uuid.uuid4().hex[:12]}", "PostgreSQL Backup and Restore (local)",
+                       run_title(databases, workflow_data.pg_host_prod, workflow_data.pg_host_dev))
+        with self._lock:
+            self._runs[run.id] = run
+            # Olvidar las ejecuciones terminadas más antiguas
+            finished = [run_id for run_id, r in self._runs.items() if r.status == "completed"]
+            for run_id in finished[:max(0, len(self._runs) - MAX_LOCAL_RUNS)]:
+                del self._runs[run_id]
+
+        self._runs_pool.submit(self._execute, run, workflow_data, databases, options)
+        logging.info(f"Local refresh {run.id} queued for {databases if databases is not None else 'all databases'}")
+        return {
+            "message": "PostgreSQL dump-restore started on the local executor",
+            "executor": self.name,
+            "run_id": run.id,
+            "workflowUrl": None
+        }
+
+    def get_status(self, run_id: str, view: str = "full") -> Optional[Dict[str, Any]]:
+        """Estado de una ejecución local, o None si esta instancia no la conoce."""
+        with self._lock:
+            run = self._runs.get(run_id)
+        return run.snapshot(view) if run else None
+
+    def list_runs(self) -> List[Dict[str, Any]]:
+        """Ejecuciones que conoce esta instancia, de más reciente a más antigua."""
+        with self._lock:
+            runs = list(self._runs.values())
+        return [run.summary() for run in reversed(runs)]
+
+    def _execute(self, run: LocalRun, workflow_data: Any, databases: Optional[List[str]], options: Dict[str, Any]) -> None:
+        run.set_status("in_progress")
+        conclusion = "failure"
+        run_dir = os.path.join(self.work_dir, run.id)
+        try:
+            prepare = run.add_job("prepare")
+            source_host, source_port = resolve_host(workflow_data.pg_host_prod)
+            target_host, target_port = resolve_host(workflow_data.pg_host_dev)
+            try:
+                if databases is None:
+                    with run.step(prepare, "Resolve databases"):
+                        conninfo = build_conninfo(source_host, "postgres", workflow_data.pg_user, source_port, workflow_data.pg_password)
+                        with psycopg.connect(conninfo) as conn:
+                            databases = [row[0] for row in conn.execute(DATABASES_QUERY).fetchall()]
+                if options.get("include_globals", True):
+                    with run.step(prepare, "Copy roles"):
+                        self._copy_globals(workflow_data, (source_host, source_port), (target_host, target_port), run_dir)
+            except Exception:
+                run.finish_job(prepare, "failure")
+                raise
+            run.finish_job(prepare, "success")
+
+            pipelines = [
+                LocalPipeline(self, run, run.add_job(f"refresh {database}"), workflow_data, database, options,
+                              os.path.join(run_dir, database))
+                for database in databases
+            ]
+            with ThreadPoolExecutor(max_workers=max(1, options.get("max_parallel_databases", 2))) as pool:
+                results = list(pool.map(lambda pipeline: pipeline.execute(), pipelines))
+            conclusion = "success" if results and all(results) else "failure"
+        except Exception:
+            logging.exception(f"Local refresh {run.id} failed")
+        finally:
+            shutil.rmtree(run_dir, ignore_errors=True)
+            run.set_status("completed", conclusion)
+
+    def _copy_globals(self, workflow_data: Any, source: Tuple[str, int], target: Tuple[str, int], run_dir: str) -> None:
+        """Copia los roles una sola vez por ejecución; los que ya existen fallan de forma individual."""
+        os.makedirs(run_dir, exist_ok=True)
+        globals_path = os.path.join(run_dir, "globals.sql")
+        code, _ = self.run_tool(
+            ["pg_dumpall", "-h", source[0], "-p", str(source[1]), "-U", workflow_data.pg_user, "-l", "postgres",
+             "--globals-only", "--no-role-passwords", "--no-tablespaces", "-f", globals_path],
+            workflow_data.pg_password
+        )
+        if code != 0:
+            logging.warning("pg_dumpall --globals-only failed; restores will use the roles already present on the target")
+            return
+        self.run_tool(
+            ["psql", "-h", target[0], "-p", str(target[1]), "-U", workflow_data.pg_user, "-d", "postgres", "-q", "-f", globals_path],
+            workflow_data.pg_password
+        )
+
+
+_local_executor: Optional[LocalExecutor] = None
+_local_executor_lock = threading.Lock()
+
+
+def get_local_executor() -> LocalExecutor:
+    """Ejecutor local compartido por todas las peticiones de la instancia."""
+    global _local_executor
+    with _local_executor_lock:
+        if _local_executor is None:
+            config = get_executor_config()
+            _local_executor = LocalExecutor(config["local_workers"], config["local_work_dir"], config["pg_bin_dir"])
+        return _local_executor
+
+
+def get_executor(name: Optional[str] = None):
+    """Devuelve el ejecutor indicado, o el configurado por defecto (REFRESH_EXECUTOR)."""
+    name = name or get_executor_config()["default"]
+    if name == LocalExecutor.name:
+        return get_local_executor()
+    return GitHubExecutor()
+
+
+def is_local_run(run_id: Optional[str]) -> bool:
+    return bool(run_id) and str(run_id).startswith(LOCAL_RUN_PREFIX)
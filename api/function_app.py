@@ -16,7 +16,23 @@ asgi_handler = AsgiMiddleware(main.app)
 app = func.FunctionApp()
 
 # Define a route for all HTTP requests
-@app.route(route="{*route}", auth_level=func.AuthLevel.FUNCTION, methods=["GET", "POST"])
+@app.route(route="{*route}", auth_level=func.AuthLevel.FUNCTION, methods=["GET", "POST", "PUT", "DELETE"])
 def handle_http(req: func.HttpRequest) -> func.HttpResponse:
     """Main entry point for the Azure Function."""
     return asgi_handler.handle(req)
+
+# Lanza cada minuto los refrescos programados cuya hora ha llegado (ver scheduler.py)
+@app.timer_trigger(schedule="0 */1 * * * *", arg_name="timer", run_on_startup=False, use_monitor=False)
+def refresh_scheduler(timer: func.TimerRequest) -> None:
+    """Timer del planificador de refrescos."""
+    if timer.past_due:
+        logging.warning("Refresh scheduler timer is past due")
+    main.run_scheduled_refreshes()
+
+# Retoma el sondeo de las operaciones de ARM pendientes tras un reinicio (ver operations.py)
+@app.timer_trigger(schedule="30 */1 * * * *", arg_name="timer", run_on_startup=False, use_monitor=False)
+def operation_poller(timer: func.TimerRequest) -> None:
+    """Timer del seguimiento de operaciones de larga duración."""
+    pending = main.resume_operation_polling()
+    if pending:
+        logging.info("Operation poller running for pending ARM operations")
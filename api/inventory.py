@@ -0,0 +1,202 @@
+"""
+Inventario de Azure Database for PostgreSQL Flexible Servers.
+
+Recorre las suscripciones configuradas (INVENTORY_SUBSCRIPTIONS, o todas las visibles para
+la identidad de la Function App) en paralelo, siguiendo la paginación (nextLink) de cada una,
+y guarda en memoria los datos necesarios para elegir servidores: versión, SKU, estado,
+almacenamiento, ubicación y FQDN.
+
+- El índice se sirve desde memoria durante `ttl_seconds`; pasado ese tiempo la siguiente
+  consulta lo reconstruye. Una actualización explícita (refresh) lo reconstruye al momento.
+- La reconstrucción es single-flight: las consultas que llegan mientras otra está en curso
+  esperan su resultado en lugar de repetir las llamadas a ARM.
+- Si una suscripción falla se conservan sus servidores del índice anterior y el error se
+  publica en `errors`, de modo que un fallo puntual no vacía los desplegables.
+- Con el circuito de ARM abierto (resilience.py) las suscripciones se listan con la última
+  respuesta correcta; esas suscripciones se publican en `stale_subscriptions` y `stale` es true.
+- Cada servidor lleva su texto de búsqueda precalculado (nombre, grupo de recursos, FQDN), así
+  que la búsqueda y los filtros no recorren las propiedades de ARM en cada consulta.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from config import get_inventory_config
+from upgrades import ArmClient
+
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+# Filtros exactos que admite query() (además de la búsqueda de texto)
+FILTER_FIELDS = ("subscription_id", "resource_group", "location", "version", "state", "sku_tier")
+
+
+def summarize_server(resource: Dict[str, Any]) -> Dict[str, Any]:
+    """Datos del inventario de un servidor a partir del recurso de ARM."""
+    parts = resource.get("id", "").split("/")
+    properties = resource.get("properties") or {}
+    sku = resource.get("sku") or {}
+    storage = properties.get("storage") or {}
+    server = {
+        "id": resource.get("id"),
+        "name": resource.get("name"),
+        "subscription_id": parts[2] if len(parts) > 4 else None,
+        "resource_group": parts[4] if len(parts) > 4 else None,
+        "location": resource.get("location"),
+        "version": properties.get("version"),
+        "minor_version": properties.get("minorVersion"),
+        "state": properties.get("state"),
+        "sku_name": sku.get("name"),
+        "sku_tier": sku.get("tier"),
+        "storage_gb": storage.get("storageSizeGB"),
+        "fqdn": properties.get("fullyQualifiedDomainName"),
+        "tags": resource.get("tags") or {}
+    }
+    server["_search"] = " ".join(filter(None, (server["name"], server["resource_group"], server["fqdn"]))).lower()
+    return server
+
+
+class Inventory:
+    """Índice en memoria de los Flexible Servers, reconstruido con TTL o bajo petición."""
+
+    def __init__(self, client: Optional[ArmClient] = None, config: Optional[Dict[str, Any]] = None):
+        self.client = client
+        self.config = config or get_inventory_config()
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._servers: List[Dict[str, Any]] = []
+        self._by_subscription: Dict[str, List[Dict[str, Any]]] = {}
+        self._errors: Dict[str, str] = {}
+        self._stale: List[str] = []
+        self._refreshed_at: Optional[float] = None
+        self._duration: Optional[float] = None
+
+    def _client(self) -> ArmClient:
+        if self.client is None:
+            self.client = ArmClient()
+        return self.client
+
+    def _is_fresh(self) -> bool:
+        with self._lock:
+            return self._refreshed_at is not None and time.time() - self._refreshed_at < self.config["ttl_seconds"]
+
+    def refresh(self, force: bool = True) -> None:
+        """
+        Reconstruye el índice (si no es `force`, solo cuando ha caducado). Si otra petición lo
+        está reconstruyendo, espera a que termine y usa su resultado.
+        """
+        with self._lock:
+            seen = self._refreshed_at
+        with self._refresh_lock:
+            with self._lock:
+                rebuilt = self._refreshed_at != seen
+            if rebuilt or (not force and self._is_fresh()):
+                return
+            self._rebuild()
+
+    def _rebuild(self) -> None:
+        started = time.monotonic()
+        client = self._client()
+        errors: Dict[str, str] = {}
+        subscriptions = self.config["subscriptions"]
+        if not subscriptions:
+            try:
+                subscriptions = client.list_subscriptions()
+            except Exception as e:
+                logging.exception("Listing subscriptions for the server inventory failed")
+                errors["*"] = str(e)
+                with self._lock:
+                    subscriptions = list(self._by_subscription)
+
+        stale: List[str] = []
+
+        def fetch(subscription_id: str):
+            try:
+                resources = client.list_servers(subscription_id)
+                if getattr(resources, "stale", False):
+                    stale.append(subscription_id)
+                return subscription_id, [summarize_server(resource) for resource in resources], None
+            except Exception as e:
+                logging.warning(f"Listing flexible servers of subscription {subscription_id} failed: {e}")
+                return subscription_id, None, str(e)
+
+        workers = max(1, min(self.config["concurrency"], len(subscriptions) or 1))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(fetch, subscriptions))
+
+        with self._lock:
+            by_subscription = {}
+            for subscription_id, servers, error in results:
+                if error is not None:
+                    errors[subscription_id] = error
+                    servers = self._by_subscription.get(subscription_id, [])
+                by_subscription[subscription_id] = servers
+            self._by_subscription = by_subscription
+            self._servers = sorted((server for servers in by_subscription.values() for server in servers),
+                                   key=lambda server: ((server["name"] or "").lower(), server["resource_group"] or ""))
+            self._errors = errors
+            self._stale = sorted(stale)
+            self._duration = time.monotonic() - started
+            # Sin la lista de suscripciones el índice no se da por actualizado: se reintenta
+            # en la siguiente consulta en lugar de servir un índice incompleto durante el TTL
+            if "*" not in errors:
+                self._refreshed_at = time.time()
+
+    def query(self, search: Optional[str] = None, refresh: bool = False,
+              **filters: Optional[str]) -> Dict[str, Any]:
+        """
+        Servidores que contienen `search` en el nombre, grupo de recursos o FQDN y cumplen los
+        filtros exactos (sin distinguir mayúsculas), junto con los valores disponibles de cada
+        filtro para construir desplegables.
+        """
+        unknown = set(filters) - set(FILTER_FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown filters: {', '.join(sorted(unknown))}")
+        if refresh:
+            self.refresh(force=True)
+        elif not self._is_fresh():
+            self.refresh(force=False)
+
+        with self._lock:
+            servers = self._servers
+            errors = dict(self._errors)
+            stale = list(self._stale)
+            refreshed_at, duration = self._refreshed_at, self._duration
+            subscriptions = sorted(self._by_subscription)
+
+        needle = (search or "").strip().lower()
+        wanted = {field: str(value).lower() for field, value in filters.items() if value}
+        matches = [
+            server for server in servers
+            if needle in server["_search"]
+            and all(str(server[field] or "").lower() == value for field, value in wanted.items())
+        ]
+        facets = {
+            field: sorted({str(server[field]) for server in servers if server[field] is not None})
+            for field in FILTER_FIELDS
+        }
+        return {
+            "total": len(matches),
+            "servers": [{k: v for k, v in server.items() if k != "_search"} for server in matches],
+            "facets": facets,
+            "subscriptions": subscriptions,
+            "errors": errors,
+            "stale": bool(stale),
+            "stale_subscriptions": stale,
+            "refreshed_at": time.strftime(TIMESTAMP_FORMAT, time.gmtime(refreshed_at)) if refreshed_at else None,
+            "age_seconds": round(time.time() - refreshed_at) if refreshed_at else None,
+            "refresh_seconds": round(duration, 2) if duration is not None else None
+        }
+
+
+_inventory: Optional[Inventory] = None
+_inventory_lock = threading.Lock()
+
+
+def get_inventory() -> Inventory:
+    """Inventario compartido por el proceso."""
+    global _inventory
+    with _inventory_lock:
+        if _inventory is None:
+            _inventory = Inventory()
+        return _inventory
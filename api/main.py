@@ -1,17 +1,42 @@
-import json
 import logging
 import os
+import re
 import time
 import datetime
-from typing import Optional, Dict, Any, Union, List
+import gzip
+import hashlib
+from typing import Optional, Dict, Any, Union, List, Literal
 
 import azure.functions as func
+import psycopg
 import requests
-from fastapi import FastAPI, HTTPException, Query
-from pydantic import BaseModel
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel, Field
+
+try:
+    import brotli
+except ImportError:  # Sin el paquete brotli las respuestas solo se comprimen con gzip
+    brotli = None
 
 # Importar la configuración
-from config import get_github_config
+from config import get_executor_config, get_github_config, get_scheduler_config, get_status_config, get_storage_config
+from catalog import filter_backups, latest_backup, load_catalog, manifest_name
+from storage import read_json_blob
+from reports import SUMMARY_REPORT_KINDS, summarize_databases, try_load_run_reports
+from progress import summarize_progress
+from estimator import collect_source, estimate_database, schedule_total, try_load_history
+from executors import (DATABASES_QUERY, MAX_RUN_HISTORY, TABLES_QUERY, GitHubExecutor, filter_runs, format_duration,
+                       get_executor, get_local_executor, is_local_run, resolve_host)
+from replication import DEFAULT_CATCH_UP_TIMEOUT, ReplicationRefresh
+from resilience import STALE_HEADER, UpstreamError, get_metrics as get_resilience_metrics, get_upstream
+import scheduler
+from inventory import get_inventory
+import operations
+import upgrades
+from templates import clone_from_template, read_template, template_age_minutes, template_name
+from verification import build_conninfo
+from watchers import WatcherHub, state_version
 
 # Set the path for the docs - ensure it works when deployed
 app = FastAPI(
@@ -21,15 +46,167 @@ app = FastAPI(
     openapi_url="/api/openapi.json"
 )
 
+@app.middleware("http")
+async def conditional_get(request: Request, call_next):
+    """
+    Añade un ETag (hash del cuerpo) a las respuestas JSON de los GET y responde 304 sin cuerpo
+    si coincide con If-None-Match, para que el frontend revalide su caché sin descargarlas.
+    """
+    response = await call_next(request)
+    if (request.method != "GET" or response.status_code != 200
+            or not response.headers.get("content-type", "").startswith("application/json")):
+        return response
+    body = b"".join([chunk async for chunk in response.body_iterator])
+    etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+    headers = {name: value for name, value in response.headers.items() if name.lower() != "content-length"}
+    headers["ETag"] = etag
+    # Comparación débil: la respuesta comprimida lleva el mismo ETag marcado como W/
+    if etag in [tag.strip().removeprefix("W/") for tag in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(content=body, status_code=200, headers=headers)
+
+# Respuestas JSON a partir de este tamaño (bytes) se comprimen si el cliente lo acepta
+COMPRESSION_MIN_BYTES = 1024
+
+def accepted_encoding(accept_encoding: str) -> Optional[str]:
+    """Codificación a usar según Accept-Encoding: br (si está instalado brotli), gzip o ninguna."""
+    accepted = set()
+    for item in accept_encoding.lower().split(","):
+        name, _, params = item.strip().partition(";")
+        if params.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            accepted.add(name.strip())
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+# Registrado después de conditional_get, así que la envuelve: el ETag y el 304 se calculan
+# sobre el JSON sin comprimir y la compresión se aplica a la respuesta final
+@app.middleware("http")
+async def compress_response(request: Request, call_next):
+    """
+    Comprime con br o gzip las respuestas JSON grandes (p. ej. el estado completo de una
+    ejecución con todos sus jobs y pasos) cuando el cliente lo acepta.
+    """
+    response = await call_next(request)
+    encoding = accepted_encoding(request.headers.get("accept-encoding", ""))
+    if (encoding is None or response.status_code != 200 or "content-encoding" in response.headers
+            or not response.headers.get("content-type", "").startswith("application/json")):
+        return response
+    body = b"".join([chunk async for chunk in response.body_iterator])
+    headers = {name: value for name, value in response.headers.items() if name.lower() != "content-length"}
+    if len(body) < COMPRESSION_MIN_BYTES:
+        return Response(content=body, status_code=200, headers=headers)
+    body = brotli.compress(body, quality=5) if encoding == "br" else gzip.compress(body, compresslevel=6)
+    headers["Content-Encoding"] = encoding
+    headers["Vary"] = "Accept-Encoding"
+    if headers.get("etag") and not headers["etag"].startswith("W/"):
+        headers["etag"] = "W/" + headers["etag"]
+    return Response(content=body, status_code=200, headers=headers)
+
+class SubsetRoot(BaseModel):
+    table: str  # schema.table (public by default)
+    ratio: Optional[float] = Field(None, gt=0, le=1, description="Fraction of rows sampled with TABLESAMPLE BERNOULLI")
+    where: Optional[str] = None  # SQL filter evaluated on production instead of sampling
+
+class SubsetSpec(BaseModel):
+    roots: List[SubsetRoot] = Field(..., min_length=1)
+    seed: int = 0  # REPEATABLE seed: the same seed and data give the same subset
+
 class WorkflowRequest(BaseModel):
     pg_host_prod: str
     pg_host_dev: str
-    pg_database: str
+    pg_database: Optional[str] = None
+    pg_databases: Optional[List[str]] = None  # Several databases refreshed in the same run
+    all_databases: bool = False  # Every non-template database of the production server
     pg_user: str
     pg_password: str  # New field for database password
     resource_group: str
     storage_account: str  # New field for storage account
     storage_container: str  # New field for storage container
+    restore_only: bool = False  # Restore an existing backup without running pg_dump
+    backup_name: Optional[str] = None  # Explicit backup to restore (implies no new dump)
+    max_backup_age: Optional[int] = Field(
+        None, ge=1,
+        description="Minutes; reuse the newest catalogued backup if it is at most this old"
+    )
+    restore_profile: Literal["standard", "fast"] = "standard"  # fast: deferred indexes, bulk-load settings, ANALYZE
+    restore_jobs: int = Field(4, ge=1, le=32, description="pg_restore/vacuumdb parallelism for the fast profile")
+    restore_target: Literal["database", "template"] = "database"  # template: restore into <db>__tpl and clone it
+    verify: bool = True  # Compare per-table row counts between prod (at dump time) and dev after restore
+    verify_exact_threshold_mb: int = Field(512, ge=0, description="Tables above this size use estimated row counts")
+    verify_checksum_rows: int = Field(0, ge=0, le=100000, description="Rows per table in the sampled checksum (0 disables it)")
+    max_parallel_databases: int = Field(2, ge=1, le=8, description="Per-database dump/restore pipelines running at the same time")
+    include_globals: bool = True  # Dump roles once from production (without passwords) and apply them on dev
+    executor: Optional[Literal["github", "local"]] = None  # None: REFRESH_EXECUTOR app setting (github by default)
+    subset: Optional[SubsetSpec] = None  # Copy a referentially closed subset instead of a full dump/restore
+    selective: bool = False  # Re-copy only the tables that changed since the previous refresh (full refresh otherwise)
+    selective_threshold: float = Field(
+        0.01, ge=0, le=1,
+        description="Fraction of a table's rows modified in production above which it is copied again"
+    )
+    chunked_backup: bool = False  # Store new dumps uncompressed in the deduplicated chunk store (chunks/)
+
+class TemplateResetRequest(BaseModel):
+    pg_host_dev: str
+    pg_database: str
+    pg_user: str
+    pg_password: str
+    max_template_age: Optional[int] = Field(
+        None, ge=1,
+        description="Minutes; refuse to reset from a template whose data is older than this"
+    )
+
+class ReplicationRequest(BaseModel):
+    pg_host_prod: str
+    pg_host_dev: str
+    pg_database: str
+    pg_user: str
+    pg_password: str
+
+class ReplicationSnapshotRequest(ReplicationRequest):
+    target_database: Optional[str] = None  # Database cut from staging (pg_database by default)
+    catch_up_timeout: int = Field(
+        DEFAULT_CATCH_UP_TIMEOUT, ge=1, le=200,
+        description="Seconds to wait for the subscription to reach the current production WAL position"
+    )
+
+class ReplicationTeardownRequest(ReplicationRequest):
+    drop_staging: bool = True  # Also drop <db>__repl on the dev server
+
+class ScheduleRequest(BaseModel):
+    name: str = Field(..., min_length=1, max_length=100)
+    cron: str = Field(..., description="5-field cron expression (minute hour day month weekday) or @daily/@weekly/...")
+    timezone: str = "UTC"  # IANA timezone of the cron expression and the maintenance window
+    window_start: Optional[str] = Field(None, description="HH:MM; runs only start inside the maintenance window")
+    window_minutes: Optional[int] = Field(None, ge=1, le=1440)
+    expected_minutes: int = Field(
+        scheduler.DEFAULT_EXPECTED_MINUTES, ge=1, le=1440,
+        description="Duration used to stagger runs on the same production host and fit them in the window"
+    )
+    enabled: bool = True
+    password_setting: str = Field(
+        ..., pattern=r"^PG_PASSWORD_[A-Z0-9_]+$",
+        description="App setting PG_PASSWORD_<NAME> holding the PostgreSQL password (never stored)"
+    )
+    refresh: Dict[str, Any]  # Body of /api/workflow/dump-restore without pg_password
+
+class UpgradeTarget(BaseModel):
+    subscription_id: str
+    resource_group: str
+    server_name: str
+    target_version: str  # Major version, e.g. "16"
+
+class UpgradeRequest(BaseModel):
+    servers: List[UpgradeTarget] = Field(..., min_length=1, max_length=100)
+    max_concurrency: Optional[int] = Field(None, ge=1, le=20, description="None: UPGRADE_MAX_CONCURRENCY app setting")
+    dry_run: bool = False  # Only validate the servers against ARM
+
+class OperationRequest(BaseModel):
+    url: str  # Azure-AsyncOperation or Location header returned by ARM
+    kind: str = Field("arm", max_length=50)
+    resource: Optional[str] = None  # ARM resource the operation belongs to
 
 class HealthStatus(BaseModel):
     status: str
@@ -44,7 +221,7 @@ class HealthStatus(BaseModel):
 start_time = time.time()
 
 @app.get("/api/health", response_model=HealthStatus)
-async def health_check():
+def health_check():
     """
     Health check endpoint que verifica varios componentes del sistema:
     - Estado general de la API
@@ -65,7 +242,8 @@ async def health_check():
     github_api_status = "unknown"
     github_api_details = {}
     try:
-        response = requests.get("https://api.github.com/rate_limit", 
+        # Sin caché: con el circuito abierto la comprobación falla en lugar de dar un "ok" antiguo
+        response = get_upstream("github").call("GET", "https://api.github.com/rate_limit", requests.get, cache=False,
                            headers={"Authorization": f"Bearer {github_config['token']}"} if github_config['token'] else {})
         if response.status_code == 200:
             github_api_status = "ok"
@@ -99,6 +277,8 @@ async def health_check():
         github_config_status=config_status,
         details={
             "github_api": github_api_details,
+            "upstreams": {name: {"state": upstream["state"], "retry_after_seconds": upstream["retry_after_seconds"]}
+                          for name, upstream in get_resilience_metrics().items()},
             "environment": {
                 "python_version": os.environ.get("PYTHON_VERSION", "unknown"),
                 "function_name": os.environ.get("FUNCTIONS_WORKER_RUNTIME", "unknown")
@@ -106,6 +286,18 @@ async def health_check():
         }
     )
 
+@app.get("/api/metrics")
+async def get_metrics():
+    """
+    Métricas de las llamadas a GitHub y ARM (estado del circuit breaker, peticiones, fallos,
+    timeouts, respuestas servidas desde caché, hedging y latencias p50/p95/p99) y de los
+    vigilantes de /api/workflow/status.
+    """
+    return {
+        "upstreams": get_resilience_metrics(),
+        "status_watchers": status_watchers.stats()
+    }
+
 @app.get("/api/config")
 async def get_config():
     """
@@ -123,227 +315,424 @@ async def get_config():
         "token_loaded": bool(config["token"])
     }
 
-@app.post("/api/workflow/dump-restore", status_code=202)
-async def dump_restore_workflow(workflow_data: WorkflowRequest):
+# Los nombres de base de datos llegan a los scripts del workflow, así que se limitan a identificadores simples
+DATABASE_NAME_PATTERN = re.compile(r"^[A-Za-z_][A-Za-z0-9_$-]{0,62}$")
+
+def resolve_databases(workflow_data: WorkflowRequest) -> Optional[List[str]]:
     """
-    Ejecuta un workflow de GitHub para hacer backup y restauración de una base de datos PostgreSQL.
+    Devuelve la lista de bases de datos a refrescar, o None si se piden todas las bases de
+    datos del servidor (la lista se resuelve en el workflow consultando producción).
     """
-    logging.info('Request received to execute PostgreSQL dump-restore workflow.')
-    
-    # Obtener la configuración de GitHub
-    github_config = get_github_config()
-    github_token = github_config["token"]
-    github_owner = github_config["owner"]
-    github_repo = github_config["repo"]
-    github_workflow_id = github_config["workflow_id"]
-    
-    if not all([github_token, github_owner, github_repo]):
+    selectors = [bool(workflow_data.pg_database), bool(workflow_data.pg_databases), workflow_data.all_databases]
+    if sum(selectors) != 1:
         raise HTTPException(
-            status_code=500,
-            detail="Missing GitHub configuration in function app settings."
+            status_code=422,
+            detail="Specify exactly one of pg_database, pg_databases or all_databases"
         )
-    
-    # Extract parameters from request
-    inputs = {
-        'pg_host_prod': workflow_data.pg_host_prod,
-        'pg_host_dev': workflow_data.pg_host_dev,
-        'pg_database': workflow_data.pg_database,
-        'pg_user': workflow_data.pg_user,
-        'pg_password': workflow_data.pg_password,  # Add password
-        'resource_group': workflow_data.resource_group,
-        'storage_account': workflow_data.storage_account,  # Add storage account
-        'storage_container': workflow_data.storage_container  # Add storage container
-    }
-    
-    logging.info(f"Received parameters: {inputs}")
-    
-    # Construct GitHub API URL to trigger workflow
-    url = f"https://api.github.com/repos/{github_owner}/{github_repo}/actions/workflows/{github_workflow_id}/dispatches"
-    
-    # Prepare payload for GitHub API
-    payload = {
-        "ref": "main",  # or your default branch
-        "inputs": inputs
-    }
-    
-    # Prepare headers for GitHub API
-    headers = {
-        "Accept": "application/vnd.github+json",
-        "Authorization": f"Bearer {github_token}",
-        "Content-Type": "application/json",
-        "X-GitHub-Api-Version": "2022-11-28"
-    }
-    
-    try:
-        # Call GitHub API to trigger workflow
-        response = requests.post(url, headers=headers, json=payload)
-        
-        if response.status_code == 204:  # GitHub returns 204 No Content on success
+    if workflow_data.all_databases:
+        return None
+
+    databases = [workflow_data.pg_database] if workflow_data.pg_database else workflow_data.pg_databases
+    invalid = [name for name in databases if not DATABASE_NAME_PATTERN.match(name)]
+    if invalid:
+        raise HTTPException(status_code=422, detail=f"Invalid database names: {', '.join(invalid)}")
+    # Mantener el orden indicado pero sin duplicados
+    return list(dict.fromkeys(databases))
+
+def resolve_backup_plans(workflow_data: WorkflowRequest, databases: Optional[List[str]]) -> Dict[str, Dict[str, Any]]:
+    """
+    Resuelve el plan de backup de cada base de datos. Con all_databases la lista no se conoce
+    hasta que el workflow consulta producción, así que siempre se hace un backup nuevo.
+    """
+    if databases is None:
+        if workflow_data.restore_only or workflow_data.backup_name or workflow_data.max_backup_age:
+            raise HTTPException(
+                status_code=422,
+                detail="Backup reuse requires an explicit database list (pg_database or pg_databases)"
+            )
+        return {}
+    if workflow_data.backup_name and len(databases) > 1:
+        raise HTTPException(status_code=422, detail="backup_name can only be used with a single database")
+    return {database: resolve_backup_plan(workflow_data, database) for database in databases}
+
+def resolve_backup_plan(workflow_data: WorkflowRequest, pg_database: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Decide si el refresco necesita un nuevo pg_dump o puede reutilizar un backup existente.
+    - backup_name: se restaura ese backup sin volver a leer producción.
+    - max_backup_age: se reutiliza el último backup válido del catálogo si es suficientemente reciente.
+    - restore_only: exige una de las dos opciones anteriores y nunca lanza pg_dump.
+    """
+    pg_database = pg_database or workflow_data.pg_database
+    if workflow_data.backup_name:
+        return {"source": "reused", "name": workflow_data.backup_name, "reason": "explicit backup_name"}
+
+    if workflow_data.max_backup_age:
+        try:
+            catalog = load_catalog(
+                workflow_data.storage_account,
+                workflow_data.storage_container,
+                get_storage_config()["catalog_blob"]
+            )
+        except Exception as e:
+            logging.exception("Exception occurred while reading the backup catalog")
+            raise HTTPException(status_code=502, detail=f"Failed to read backup catalog: {str(e)}")
+
+        backup = latest_backup(
+            catalog["backups"],
+            pg_database=pg_database,
+            pg_host=workflow_data.pg_host_prod,
+            max_age=datetime.timedelta(minutes=workflow_data.max_backup_age)
+        )
+        if backup:
+            logging.info(f"Reusing catalogued backup {backup['name']} created at {backup['created_at']}")
             return {
-                "message": "PostgreSQL dump-restore workflow initiated successfully",
-                "workflowUrl": f"https://github.com/{github_owner}/{github_repo}/actions/workflows/{github_workflow_id}"
+                "source": "reused",
+                "name": backup["name"],
+                "created_at": backup["created_at"],
+                "reason": f"newer than {workflow_data.max_backup_age} minutes"
             }
-        else:
-            logging.error(f"GitHub API returned: {response.status_code} - {response.text}")
+        if workflow_data.restore_only:
             raise HTTPException(
-                status_code=500,
-                detail=f"Failed to trigger GitHub workflow: {response.text}"
+                status_code=409,
+                detail=f"No valid backup of {pg_database} newer than {workflow_data.max_backup_age} minutes"
             )
-    except Exception as e:
-        logging.exception("Exception occurred while triggering GitHub workflow")
+        return {"source": "new", "name": None, "reason": "no catalogued backup fresh enough"}
+
+    if workflow_data.restore_only:
         raise HTTPException(
-            status_code=500,
-            detail=str(e)
+            status_code=422,
+            detail="restore_only requires backup_name or max_backup_age"
         )
+    return {"source": "new", "name": None, "reason": "full refresh"}
 
-@app.get("/api/workflow/status")
-async def get_workflow_status(run_id: Optional[str] = Query(None, description="Specific workflow run ID")):
+def validate_subset(workflow_data: WorkflowRequest, databases: Optional[List[str]]) -> None:
     """
-    Get status of GitHub workflow runs, with detailed job and step information.
-    If no run_id is provided, returns the latest run with details.
+    El modo subconjunto copia directamente de producción a desarrollo, sin backup intermedio:
+    es incompatible con la reutilización de backups y con las plantillas.
     """
-    logging.info('Request received to check GitHub workflow status.')
-    
-    # Obtener la configuración de GitHub
-    github_config = get_github_config()
-    github_token = github_config["token"]
-    github_owner = github_config["owner"]
-    github_repo = github_config["repo"]
+    if workflow_data.subset is None:
+        return
+    if databases is None or len(databases) != 1:
+        raise HTTPException(status_code=422, detail="subset can only be used with a single database")
+    if workflow_data.restore_only or workflow_data.backup_name or workflow_data.max_backup_age:
+        raise HTTPException(status_code=422, detail="subset copies from production and cannot reuse a backup")
+    if workflow_data.restore_target != "database":
+        raise HTTPException(status_code=422, detail="subset does not support restore_target=template")
+    for root in workflow_data.subset.roots:
+        if (root.ratio is None) == (root.where is None):
+            raise HTTPException(status_code=422, detail=f"Subset root {root.table} needs exactly one of ratio or where")
+
+def validate_selective(workflow_data: WorkflowRequest) -> None:
+    """El modo selectivo compara con producción en la propia ejecución: no reutiliza backups."""
+    if not workflow_data.selective:
+        return
+    if workflow_data.subset is not None:
+        raise HTTPException(status_code=422, detail="selective and subset cannot be combined")
+    if workflow_data.restore_only or workflow_data.backup_name or workflow_data.max_backup_age:
+        raise HTTPException(status_code=422, detail="selective reads production statistics and cannot reuse a backup")
+    if workflow_data.restore_target != "database":
+        raise HTTPException(status_code=422, detail="selective does not support restore_target=template")
+
+def validate_template_names(databases: Optional[List[str]]) -> None:
+    """
+    El nombre de la plantilla (<base_de_datos>__tpl) también debe caber en un identificador
+    de PostgreSQL, así que las bases de datos con nombres muy largos no pueden tener plantilla.
+    """
+    for database in databases or []:
+        try:
+            template_name(database)
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+
+def build_workflow_options(workflow_data: WorkflowRequest, backup_plans: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Construye el input 'options' del workflow. Las opciones se empaquetan en un único JSON
+    para no depender del límite de inputs de workflow_dispatch.
+    """
+    options = {
+        "restore_profile": workflow_data.restore_profile,
+        "restore_jobs": workflow_data.restore_jobs,
+        "restore_target": workflow_data.restore_target,
+        "verify": workflow_data.verify,
+        "verify_exact_threshold_mb": workflow_data.verify_exact_threshold_mb,
+        "verify_checksum_rows": workflow_data.verify_checksum_rows,
+        "max_parallel_databases": workflow_data.max_parallel_databases,
+        "include_globals": workflow_data.include_globals
+    }
+    # Backups reutilizados por base de datos; el resto hace pg_dump en la ejecución
+    backups = {database: plan["name"] for database, plan in backup_plans.items() if plan["source"] == "reused"}
+    if backups:
+        options["backups"] = backups
+    if workflow_data.subset is not None:
+        options["subset"] = workflow_data.subset.model_dump(exclude_none=True)
+    if workflow_data.selective:
+        options["selective"] = {"threshold": workflow_data.selective_threshold}
+    if workflow_data.chunked_backup:
+        options["chunked_backup"] = True
+    return options
+
+@app.post("/api/workflow/dump-restore", status_code=202)
+def dump_restore_workflow(workflow_data: WorkflowRequest):
+    """
+    Ejecuta el refresco (backup y restauración) de una o varias bases de datos PostgreSQL,
+    en GitHub Actions o en el ejecutor local de la API según 'executor'.
+    """
+    logging.info('Request received to execute PostgreSQL dump-restore workflow.')
+    return dispatch_refresh(workflow_data)
+
+def dispatch_refresh(workflow_data: WorkflowRequest) -> Dict[str, Any]:
+    """Valida y lanza un refresco; lo usan el endpoint de refresco y el planificador."""
+    databases = resolve_databases(workflow_data)
+    validate_subset(workflow_data, databases)
+    validate_selective(workflow_data)
+    if workflow_data.restore_target == "template":
+        validate_template_names(databases)
+    if workflow_data.subset is not None:
+        backup_plans = {databases[0]: {"source": "subset", "name": None, "reason": "referentially closed subset"}}
+    else:
+        backup_plans = resolve_backup_plans(workflow_data, databases)
+    options = build_workflow_options(workflow_data, backup_plans)
     
-    if not all([github_token, github_owner, github_repo]):
+    try:
+        executor = get_executor(workflow_data.executor)
+        result = executor.dispatch(workflow_data, databases, options)
+    except HTTPException:
+        raise
+    except UpstreamError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except Exception as e:
+        logging.exception("Exception occurred while triggering the dump-restore workflow")
         raise HTTPException(
             status_code=500,
-            detail="Missing GitHub configuration in function app settings."
+            detail=str(e)
         )
     
-    # Prepare headers for GitHub API
-    headers = {
-        "Accept": "application/vnd.github+json",
-        "Authorization": f"Bearer {github_token}",
-        "X-GitHub-Api-Version": "2022-11-28"
+    result["databases"] = databases if databases is not None else "all"
+    result["backups"] = backup_plans
+    if databases is not None and len(databases) == 1:
+        result["backup"] = backup_plans[databases[0]]
+    return result
+
+@app.post("/api/workflow/estimate")
+def estimate_workflow(workflow_data: WorkflowRequest):
+    """
+    Estima, antes de lanzarlo, la duración de cada fase (dump, transferencia y restauración)
+    y el tamaño del backup a partir del tamaño actual en producción y del rendimiento de los
+    refrescos anteriores. Cada fase incluye límites p10/p90.
+    """
+    databases = resolve_databases(workflow_data)
+    if workflow_data.subset is not None:
+        raise HTTPException(status_code=422, detail="Estimation is not available for subset refreshes")
+    backup_plans = resolve_backup_plans(workflow_data, databases)
+    source_host, source_port = resolve_host(workflow_data.pg_host_prod)
+
+    def conninfo(database: str) -> str:
+        return build_conninfo(source_host, database, workflow_data.pg_user, source_port, workflow_data.pg_password)
+
+    try:
+        if databases is None:
+            with psycopg.connect(conninfo("postgres")) as conn:
+                databases = [row[0] for row in conn.execute(DATABASES_QUERY).fetchall()]
+        source = collect_source({database: conninfo(database) for database in databases}, TABLES_QUERY)
+    except psycopg.Error as e:
+        raise HTTPException(status_code=502, detail=f"Failed to read database sizes from {workflow_data.pg_host_prod}: {str(e)}")
+
+    account, container = workflow_data.storage_account, workflow_data.storage_container
+    samples = try_load_history(account, container, get_storage_config()["catalog_blob"])
+    options = build_workflow_options(workflow_data, backup_plans)
+    local = (workflow_data.executor or get_executor_config()["default"]) == "local"
+
+    estimates = {}
+    for database in databases:
+        plan = backup_plans.get(database, {})
+        reused = None
+        if plan.get("source") == "reused":
+            try:
+                reused = read_json_blob(account, container, manifest_name(plan["name"])) or {}
+            except Exception as e:
+                logging.warning(f"Could not read the manifest of {plan['name']}: {str(e)}")
+                reused = {}
+        estimates[database] = estimate_database(
+            database, workflow_data.pg_host_prod, source[database]["size_bytes"], source[database]["table_sizes"],
+            samples, options, reused, local
+        )
+
+    return {
+        "executor": "local" if local else "github",
+        "history_samples": len(samples),
+        # El refresco selectivo solo copia las tablas modificadas: la estimación es el peor caso
+        "upper_bound": workflow_data.selective,
+        "databases": estimates,
+        "total": schedule_total([estimate["total"] for estimate in estimates.values()], workflow_data.max_parallel_databases)
     }
+
+@app.post("/api/workflow/reset-from-template")
+def reset_from_template(reset_data: TemplateResetRequest):
+    """
+    Recrea una base de datos de desarrollo como copia de su plantilla (<base_de_datos>__tpl),
+    creada por un refresco con restore_target="template". La copia se hace con
+    CREATE DATABASE ... TEMPLATE y tarda segundos frente a repetir el pg_restore completo.
+    """
+    logging.info(f"Request received to reset {reset_data.pg_database} on {reset_data.pg_host_dev} from its template.")
+    
+    if not DATABASE_NAME_PATTERN.match(reset_data.pg_database):
+        raise HTTPException(status_code=422, detail=f"Invalid database name: {reset_data.pg_database}")
+    validate_template_names([reset_data.pg_database])
     
+    host, port = resolve_host(reset_data.pg_host_dev)
+    conninfo = build_conninfo(host, "postgres", reset_data.pg_user, port, reset_data.pg_password)
     try:
-        if run_id is None:
-            # Get latest workflow run
-            runs_url = f"https://api.github.com/repos/{github_owner}/{github_repo}/actions/runs"
-            response = requests.get(runs_url, headers=headers)
-            
-            if response.status_code != 200:
+        with psycopg.connect(conninfo, autocommit=True) as conn:
+            template = read_template(conn, reset_data.pg_database)
+            if template is None:
                 raise HTTPException(
-                    status_code=response.status_code,
-                    detail=f"Failed to retrieve workflow runs: {response.text}"
+                    status_code=404,
+                    detail=f"No template for {reset_data.pg_database}; run a refresh with restore_target=template first"
                 )
-                
-            runs_data = response.json()
-            if not runs_data["workflow_runs"]:
-                return {
-                    "message": "No workflow runs found",
-                    "runs_count": 0
-                }
-                
-            # Get the most recent run
-            run_id = runs_data["workflow_runs"][0]["id"]
-        
-        # Get detailed information about the run
-        run_url = f"https://api.github.com/repos/{github_owner}/{github_repo}/actions/runs/{run_id}"
-        run_response = requests.get(run_url, headers=headers)
-        
-        if run_response.status_code != 200:
-            raise HTTPException(
-                status_code=run_response.status_code,
-                detail=f"Failed to retrieve run details: {run_response.text}"
-            )
-            
-        run_data = run_response.json()
-        
-        # Get jobs for this run
-        jobs_url = f"https://api.github.com/repos/{github_owner}/{github_repo}/actions/runs/{run_id}/jobs"
-        jobs_response = requests.get(jobs_url, headers=headers)
-        
-        if jobs_response.status_code != 200:
-            raise HTTPException(
-                status_code=jobs_response.status_code,
-                detail=f"Failed to retrieve job details: {jobs_response.text}"
-            )
-            
-        jobs_data = jobs_response.json()
-        
-        # Calculate duration and format timestamps
-        if run_data.get("created_at"):
-            created_at = datetime.datetime.strptime(run_data["created_at"], "%Y-%m-%dT%H:%M:%SZ")
+            if not template["sealed"]:
+                raise HTTPException(
+                    status_code=409,
+                    detail=f"Template {template['template']} is not ready (restore in progress or failed verification)"
+                )
+            age = template_age_minutes(template)
+            if reset_data.max_template_age and age is not None and age > reset_data.max_template_age:
+                raise HTTPException(
+                    status_code=409,
+                    detail=f"Template {template['template']} is {age} minutes old (maximum {reset_data.max_template_age})"
+                )
+            result = clone_from_template(conn, reset_data.pg_database)
+    except HTTPException:
+        raise
+    except psycopg.Error as e:
+        logging.exception("Exception occurred while resetting the database from its template")
+        raise HTTPException(
+            status_code=502,
+            detail=f"Failed to reset {reset_data.pg_database} from its template: {str(e)}"
+        )
+    
+    result["template_age_minutes"] = age
+    result["template_metadata"] = template
+    return result
+
+def build_replication(replication_data: ReplicationRequest) -> ReplicationRefresh:
+    """Valida la petición y construye el refresco por replicación lógica de la base de datos."""
+    for name in filter(None, [replication_data.pg_database, getattr(replication_data, "target_database", None)]):
+        if not DATABASE_NAME_PATTERN.match(name):
+            raise HTTPException(status_code=422, detail=f"Invalid database name: {name}")
+    prod, dev = resolve_host(replication_data.pg_host_prod), resolve_host(replication_data.pg_host_dev)
+    if prod == dev:
+        raise HTTPException(status_code=422, detail="Production and development servers must be different")
+    try:
+        replication = ReplicationRefresh(prod, dev, replication_data.pg_database, replication_data.pg_user,
+                                         replication_data.pg_password, get_executor_config()["pg_bin_dir"])
+        if hasattr(replication_data, "target_database"):
+            replication.check_target(replication_data.target_database or replication_data.pg_database)
+        return replication
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+def run_replication_operation(operation: str, fn, *args):
+    """Ejecuta una operación de replicación traduciendo sus errores a respuestas HTTP."""
+    try:
+        return fn(*args)
+    except RuntimeError as e:
+        # Estado incompatible con la operación (wal_level, sincronización inicial, timeouts...)
+        raise HTTPException(status_code=409, detail=str(e))
+    except psycopg.Error as e:
+        logging.exception(f"Exception occurred during replication {operation}")
+        raise HTTPException(status_code=502, detail=f"Replication {operation} failed: {str(e)}")
+
+# Las operaciones de replicación bloquean mientras esperan a PostgreSQL (copia del esquema,
+# recuperación del retraso): se declaran síncronas para que FastAPI las ejecute en su pool de hilos
+@app.post("/api/replication/setup")
+def setup_replication(replication_data: ReplicationRequest):
+    """
+    Configura el refresco continuo por replicación lógica: publicación en producción y
+    suscripción en la base de datos de staging <base_de_datos>__repl del servidor de desarrollo.
+    """
+    logging.info(f"Request received to set up replication of {replication_data.pg_database} "
+                 f"from {replication_data.pg_host_prod} to {replication_data.pg_host_dev}.")
+    replication = build_replication(replication_data)
+    return run_replication_operation("setup", replication.setup)
+
+@app.post("/api/replication/lag")
+def get_replication_lag(replication_data: ReplicationRequest):
+    """Estado de la replicación: retraso en bytes, tablas sincronizadas y estado de la suscripción."""
+    replication = build_replication(replication_data)
+    return run_replication_operation("lag", replication.lag)
+
+@app.post("/api/replication/snapshot")
+def snapshot_replication(replication_data: ReplicationSnapshotRequest):
+    """
+    Corta una copia consistente de staging para los desarrolladores: espera a que la
+    suscripción alcance la posición actual de producción y recrea la base de datos de
+    trabajo con CREATE DATABASE ... TEMPLATE <base_de_datos>__repl.
+    """
+    logging.info(f"Request received to cut a replication snapshot of {replication_data.pg_database}.")
+    replication = build_replication(replication_data)
+    return run_replication_operation("snapshot", replication.snapshot,
+                                     replication_data.target_database, replication_data.catch_up_timeout)
+
+@app.post("/api/replication/teardown")
+def teardown_replication(replication_data: ReplicationTeardownRequest):
+    """Elimina la suscripción, el slot y la publicación (y opcionalmente la base de datos de staging)."""
+    logging.info(f"Request received to tear down replication of {replication_data.pg_database}.")
+    replication = build_replication(replication_data)
+    return run_replication_operation("teardown", replication.teardown, replication_data.drop_staging)
+
+def build_workflow_status(run_id: Optional[str], storage_account: Optional[str], storage_container: Optional[str],
+                          view: str, requested: Optional[set]) -> Dict[str, Any]:
+    """Documento de estado de /api/workflow/status (bloqueante: GitHub y los informes del storage)."""
+    needs_jobs = requested is None or bool(requested & {"jobs", "job_summary"})
+    needs_reports = requested is None or bool(requested & {"reports", "databases", "progress"})
+    # Sin "reports" en la respuesta solo se leen los informes con los que se calculan
+    # "databases" y "progress" (la vista summary la piden a menudo todos los runs activos)
+    report_kinds = None
+    if view == "summary" or (requested is not None and "reports" not in requested):
+        report_kinds = SUMMARY_REPORT_KINDS if requested is None or "databases" in requested else ("progress",)
+    
+    try:
+        if is_local_run(run_id):
+            enhanced_response = get_local_executor().get_status(run_id, view)
+            if enhanced_response is None:
+                raise HTTPException(status_code=404, detail=f"Local run {run_id} not found on this instance")
+        else:
+            enhanced_response = GitHubExecutor().get_status(run_id, view, include_jobs=needs_jobs)
+            if "id" not in enhanced_response:
+                return enhanced_response
             
-            if run_data.get("updated_at"):
-                updated_at = datetime.datetime.strptime(run_data["updated_at"], "%Y-%m-%dT%H:%M:%SZ")
-                duration_seconds = (updated_at - created_at).total_seconds()
-            else:
-                duration_seconds = (datetime.datetime.utcnow() - created_at).total_seconds()
-                
-            run_data["duration"] = {
-                "seconds": round(duration_seconds),
-                "formatted": format_duration(duration_seconds)
-            }
+            storage_config = get_storage_config()
+            reports_account = storage_account or storage_config["account"]
+            reports_container = storage_container or storage_config["container"]
+            if needs_reports and reports_account and reports_container:
+                enhanced_response["reports"] = try_load_run_reports(reports_account, reports_container,
+                                                                   str(enhanced_response["id"]), report_kinds)
         
-        # Format job steps
-        formatted_jobs = []
-        for job in jobs_data.get("jobs", []):
-            job_steps = []
-            for step in job.get("steps", []):
-                # Calculate step duration
-                step_duration = None
-                if step.get("started_at") and step.get("completed_at"):
-                    started = datetime.datetime.strptime(step["started_at"], "%Y-%m-%dT%H:%M:%SZ")
-                    completed = datetime.datetime.strptime(step["completed_at"], "%Y-%m-%dT%H:%M:%SZ")
-                    step_duration = (completed - started).total_seconds()
-                
-                job_steps.append({
-                    "name": step.get("name", "Unknown step"),
-                    "status": step.get("status", "unknown"),
-                    "conclusion": step.get("conclusion", None),
-                    "started_at": step.get("started_at"),
-                    "completed_at": step.get("completed_at"),
-                    "duration": format_duration(step_duration) if step_duration else None
-                })
-            
-            # Calculate job duration
-            job_duration = None
-            if job.get("started_at") and job.get("completed_at"):
-                job_started = datetime.datetime.strptime(job["started_at"], "%Y-%m-%dT%H:%M:%SZ")
-                job_completed = datetime.datetime.strptime(job["completed_at"], "%Y-%m-%dT%H:%M:%SZ")
-                job_duration = (job_completed - job_started).total_seconds()
+        reports = enhanced_response.get("reports")
+        if reports:
+            enhanced_response["databases"] = summarize_databases(reports)
             
-            formatted_jobs.append({
-                "id": job.get("id"),
-                "name": job.get("name", "Unknown job"),
-                "status": job.get("status", "unknown"),
-                "conclusion": job.get("conclusion", None),
-                "started_at": job.get("started_at"),
-                "completed_at": job.get("completed_at"),
-                "duration": format_duration(job_duration) if job_duration else None,
-                "steps": job_steps
-            })
-        
-        # Build enhanced response
-        enhanced_response = {
-            "id": run_data.get("id"),
-            "name": run_data.get("name", "Unknown workflow"),
-            "status": run_data.get("status", "unknown"),
-            "conclusion": run_data.get("conclusion", None),
-            "html_url": run_data.get("html_url"),
-            "created_at": run_data.get("created_at"),
-            "updated_at": run_data.get("updated_at"),
-            "duration": run_data.get("duration"),
-            "jobs": formatted_jobs,
-            "raw_data_urls": {
-                "run_url": run_url,
-                "jobs_url": jobs_url
-            }
-        }
+            # Porcentaje completado y ETA a partir de los eventos de progreso de pg_dump/pg_restore
+            progress_docs = reports.get("progress")
+            if progress_docs:
+                progress = summarize_progress(progress_docs)
+                progress["eta"] = format_duration(progress["eta_seconds"]) if progress["eta_seconds"] is not None else None
+                enhanced_response["progress"] = progress
         
+        if view == "summary":
+            enhanced_response.pop("reports", None)
+        if requested is not None:
+            # El id se devuelve siempre para identificar la ejecución (también sin run_id), y
+            # "stale" para no presentar datos de la caché como actuales
+            enhanced_response = {key: value for key, value in enhanced_response.items()
+                                 if key in requested or key in ("id", "stale")}
         return enhanced_response
     
     except HTTPException:
         raise
+    except UpstreamError as e:
+        # Circuito abierto (503) o plazo vencido (504) en la llamada a GitHub
+        raise HTTPException(status_code=e.status_code, detail=str(e))
     except Exception as e:
         logging.exception("Exception occurred while retrieving GitHub workflow status")
         raise HTTPException(
@@ -351,26 +740,383 @@ async def get_workflow_status(run_id: Optional[str] = Query(None, description="S
             detail=str(e)
         )
 
-def format_duration(seconds: float) -> str:
+# Vigilantes compartidos por las peticiones que esperan cambios en el mismo estado
+status_watchers = WatcherHub()
+
+@app.get("/api/workflow/status")
+async def get_workflow_status(
+    response: Response,
+    run_id: Optional[str] = Query(None, description="Specific workflow run ID (local-... for the local executor)"),
+    storage_account: Optional[str] = Query(None, description="Storage account holding the run reports"),
+    storage_container: Optional[str] = Query(None, description="Storage container holding the run reports"),
+    view: Literal["summary", "full"] = Query("full", description="summary: job and step counts instead of jobs, no raw reports"),
+    fields: Optional[str] = Query(None, description="Comma-separated top-level fields to return, e.g. status,conclusion,progress"),
+    version: Optional[str] = Query(None, description="Version of the last state received (\"version\" field)"),
+    wait: int = Query(0, ge=0, le=300, description="Seconds to hold the request until the state differs from version")
+):
     """
-    Formatea una duración en segundos a un formato legible.
-    Por ejemplo: "2h 5m 30s" o "45s"
+    Get status of GitHub workflow runs, with detailed job and step information.
+    If no run_id is provided, returns the latest run with details.
+    Runs of the local executor (run_id local-...) are returned with the same model.
+    When a storage account is configured, the reports published by the run
+    (restore phase timings, per-table verification, progress events) are included
+    under "reports", "progress" summarizes percent complete and ETA, and
+    "databases" gives the outcome of each database refreshed in the run.
+    Pollers that only need to know whether the run has finished can ask for
+    view=summary (jobs reduced to "job_summary" counts) and/or a subset of
+    fields; the jobs and reports are only fetched when the response needs them.
+    Every response carries a "version" of the state. With version and wait the
+    request is held until the state changes or wait seconds elapse (capped by
+    STATUS_MAX_WAIT_SECONDS); requests waiting on the same run share one watcher.
+    While the GitHub circuit is open the last good data is returned with
+    "stale": true and the X-Upstream-Cache: stale header.
     """
-    if seconds is None:
-        return None
-        
-    seconds = int(seconds)
-    hours, remainder = divmod(seconds, 3600)
-    minutes, seconds = divmod(remainder, 60)
-    
-    parts = []
-    if hours > 0:
-        parts.append(f"{hours}h")
-    if minutes > 0 or hours > 0:
-        parts.append(f"{minutes}m")
-    parts.append(f"{seconds}s")
-    
-    return " ".join(parts)
+    logging.info('Request received to check GitHub workflow status.')
+    requested = {field.strip() for field in fields.split(",") if field.strip()} if fields else None
+
+    def build() -> Dict[str, Any]:
+        return build_workflow_status(run_id, storage_account, storage_container, view, requested)
+
+    if version and wait:
+        config = get_status_config()
+        key = (run_id, storage_account, storage_container, view, tuple(sorted(requested)) if requested else None)
+        interval = config["local_watch_interval_seconds"] if is_local_run(run_id) else config["watch_interval_seconds"]
+        document = await status_watchers.wait_for_change(key, build, version, min(wait, config["max_wait_seconds"]), interval)
+    else:
+        document = await run_in_threadpool(build)
+    if document.get("stale"):
+        response.headers[STALE_HEADER] = "stale"
+    return dict(document, version=state_version(document))
+
+@app.get("/api/workflow/runs")
+def list_workflow_runs(
+    database: Optional[str] = Query(None, description="Only runs refreshing this database (or all databases)"),
+    host: Optional[str] = Query(None, description="Only runs whose production or development server is this host"),
+    state: Optional[Literal["active", "completed"]] = Query(None, description="active: queued or in progress"),
+    page: int = Query(1, ge=1),
+    per_page: int = Query(25, ge=1, le=100)
+):
+    """
+    Ejecuciones activas y recientes de GitHub Actions (últimas 200) y del ejecutor local de
+    esta instancia, de más reciente a más antigua, sin jobs ni informes. La base de datos y los
+    servidores se obtienen del título de cada ejecución (run-name del workflow); las
+    ejecuciones anteriores a ese título no los tienen y solo aparecen sin filtros.
+    """
+    runs = get_local_executor().list_runs()
+    github_config = get_github_config()
+    if all([github_config["token"], github_config["owner"], github_config["repo"]]):
+        try:
+            runs += GitHubExecutor(github_config).list_runs(MAX_RUN_HISTORY)
+        except HTTPException:
+            raise
+        except UpstreamError as e:
+            raise HTTPException(status_code=e.status_code, detail=str(e))
+        except Exception as e:
+            logging.exception("Exception occurred while listing GitHub workflow runs")
+            raise HTTPException(status_code=502, detail=f"Failed to list GitHub workflow runs: {str(e)}")
+
+    runs.sort(key=lambda run: run["created_at"] or "", reverse=True)
+    runs = filter_runs(runs, database, host, state)
+    start = (page - 1) * per_page
+    return {
+        "total": len(runs),
+        "active": sum(1 for run in runs if run["status"] != "completed"),
+        "page": page,
+        "per_page": per_page,
+        "pages": max(1, -(-len(runs) // per_page)),
+        "runs": runs[start:start + per_page]
+    }
+
+@app.post("/api/upgrades", status_code=202)
+def start_upgrades(upgrade_data: UpgradeRequest):
+    """
+    Actualiza la versión mayor de varios Flexible Servers. Cada servidor se valida contra ARM
+    y los válidos se actualizan con un máximo de `max_concurrency` a la vez; el progreso de
+    cada uno se consulta en /api/upgrades/{id}.
+    """
+    servers = [server.model_dump() for server in upgrade_data.servers]
+    keys = [(s["subscription_id"].lower(), s["resource_group"].lower(), s["server_name"].lower()) for s in servers]
+    if len(set(keys)) != len(keys):
+        raise HTTPException(status_code=422, detail="Each server can only appear once in a batch")
+    try:
+        return upgrades.start_batch(servers, upgrade_data.max_concurrency, upgrade_data.dry_run)
+    except Exception as e:
+        logging.exception("Exception occurred while starting the upgrade batch")
+        raise HTTPException(status_code=500, detail=f"Failed to start the upgrade batch: {str(e)}")
+
+@app.get("/api/upgrades")
+def list_upgrades():
+    """Lotes de actualización de esta instancia, del más reciente al más antiguo."""
+    return {"batches": upgrades.list_batches()}
+
+@app.get("/api/upgrades/{batch_id}")
+def get_upgrade(batch_id: str):
+    """Estado de un lote de actualización: validación, operación y progreso de cada servidor."""
+    batch = upgrades.get_batch(batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail=f"Upgrade batch {batch_id} not found on this instance")
+    return batch
+
+@app.post("/api/operations", status_code=202)
+def track_operation(operation_data: OperationRequest):
+    """
+    Registra una operación asíncrona de ARM (p. ej. la URL Azure-AsyncOperation de una
+    actualización lanzada desde el frontend) para seguirla en segundo plano.
+    """
+    try:
+        operation = operations.register(operation_data.url, operation_data.kind, operation_data.resource)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    operations.start_poller()
+    return operation
+
+@app.get("/api/operations")
+def list_operations(
+    kind: Optional[str] = Query(None, description="major_upgrade, arm..."),
+    active: Optional[bool] = Query(None, description="true: only operations still in progress"),
+    limit: int = Query(100, ge=1, le=500)
+):
+    """Operaciones seguidas por la API, de la más reciente a la más antigua."""
+    return {"operations": operations.list_operations(kind, active, limit)}
+
+@app.get("/api/operations/{operation_id}")
+def get_operation(operation_id: str):
+    """Estado persistido de una operación: estado de ARM, progreso, sondeos y siguiente sondeo."""
+    operation = operations.get_operation(operation_id)
+    if operation is None:
+        raise HTTPException(status_code=404, detail=f"Operation {operation_id} not found")
+    return operation
+
+@app.get("/api/servers")
+def list_servers(
+    response: Response,
+    search: Optional[str] = Query(None, description="Text contained in the server name, resource group or FQDN"),
+    subscription_id: Optional[str] = Query(None),
+    resource_group: Optional[str] = Query(None),
+    location: Optional[str] = Query(None),
+    version: Optional[str] = Query(None, description="PostgreSQL major version"),
+    state: Optional[str] = Query(None, description="Ready, Stopped, Updating..."),
+    sku_tier: Optional[str] = Query(None, description="Burstable, GeneralPurpose, MemoryOptimized"),
+    refresh: bool = Query(False, description="Rebuild the inventory from ARM before answering")
+):
+    """
+    Inventario de Flexible Servers de las suscripciones configuradas (versión, SKU, estado,
+    almacenamiento). Se sirve desde un índice en memoria que se reconstruye pasado
+    INVENTORY_TTL_SECONDS o con `refresh=true`; `facets` lista los valores de cada filtro.
+    Con el circuito de ARM abierto se responde con "stale": true y la cabecera
+    X-Upstream-Cache: stale.
+    """
+    try:
+        result = get_inventory().query(
+            search, refresh, subscription_id=subscription_id, resource_group=resource_group,
+            location=location, version=version, state=state, sku_tier=sku_tier
+        )
+    except Exception as e:
+        logging.exception("Exception occurred while querying the server inventory")
+        raise HTTPException(status_code=502, detail=f"Failed to load the server inventory: {str(e)}")
+    if result["stale"]:
+        response.headers[STALE_HEADER] = "stale"
+    return result
+
+@app.post("/api/servers/refresh")
+def refresh_servers():
+    """Reconstruye el inventario desde ARM y devuelve el resumen (sin la lista de servidores)."""
+    try:
+        result = get_inventory().query(refresh=True)
+    except Exception as e:
+        logging.exception("Exception occurred while refreshing the server inventory")
+        raise HTTPException(status_code=502, detail=f"Failed to refresh the server inventory: {str(e)}")
+    return {key: value for key, value in result.items() if key not in ("servers", "facets")}
+
+def resolve_storage(storage_account: Optional[str], storage_container: Optional[str]):
+    """
+    Resuelve la cuenta y el contenedor de almacenamiento a usar, tomando los valores
+    de la configuración de la Function App cuando no se indican en la petición.
+    """
+    storage_config = get_storage_config()
+    account = storage_account or storage_config["account"]
+    container = storage_container or storage_config["container"]
+    if not account or not container:
+        raise HTTPException(
+            status_code=400,
+            detail="Storage account and container are required (query parameters or app settings)."
+        )
+    return account, container
+
+@app.get("/api/backups")
+def list_backups(
+    storage_account: Optional[str] = Query(None, description="Azure Storage account name"),
+    storage_container: Optional[str] = Query(None, description="Azure Storage container name"),
+    pg_database: Optional[str] = Query(None, description="Filter by database name"),
+    pg_host: Optional[str] = Query(None, description="Filter by source (production) host"),
+    status: Optional[str] = Query("valid", description="Filter by backup status; empty for any"),
+    max_age_minutes: Optional[int] = Query(None, ge=1, description="Only backups newer than this"),
+    latest: bool = Query(False, description="Return only the most recent matching backup"),
+    limit: int = Query(50, ge=1, le=500)
+):
+    """
+    Lista los backups registrados en el catálogo del contenedor. Se resuelve con una
+    única lectura del índice de catálogo en lugar de listar el contenedor completo.
+    """
+    account, container = resolve_storage(storage_account, storage_container)
+
+    try:
+        catalog = load_catalog(account, container, get_storage_config()["catalog_blob"])
+    except Exception as e:
+        logging.exception("Exception occurred while reading the backup catalog")
+        raise HTTPException(
+            status_code=502,
+            detail=f"Failed to read backup catalog: {str(e)}"
+        )
+
+    filters = {
+        "pg_database": pg_database,
+        "pg_host": pg_host,
+        "status": status or None,
+        "max_age": datetime.timedelta(minutes=max_age_minutes) if max_age_minutes else None
+    }
+
+    if latest:
+        backup = latest_backup(catalog["backups"], **filters)
+        if backup is None:
+            raise HTTPException(status_code=404, detail="No backup matches the given filters")
+        return backup
+
+    backups = filter_backups(catalog["backups"], **filters)
+    return {
+        "catalog_updated_at": catalog.get("updated_at"),
+        "count": len(backups),
+        "backups": backups[:limit]
+    }
+
+@app.get("/api/backups/{backup_name}/manifest")
+def get_backup_manifest(
+    backup_name: str,
+    storage_account: Optional[str] = Query(None, description="Azure Storage account name"),
+    storage_container: Optional[str] = Query(None, description="Azure Storage container name")
+):
+    """
+    Devuelve el manifiesto completo de un backup (tablas, tiempos, checksum, versión de origen).
+    """
+    account, container = resolve_storage(storage_account, storage_container)
+
+    try:
+        manifest = read_json_blob(account, container, manifest_name(backup_name))
+    except Exception as e:
+        logging.exception("Exception occurred while reading the backup manifest")
+        raise HTTPException(
+            status_code=502,
+            detail=f"Failed to read backup manifest: {str(e)}"
+        )
+
+    if manifest is None:
+        raise HTTPException(status_code=404, detail=f"Manifest for {backup_name} not found")
+    return manifest
+
+def validate_schedule_request(schedule_data: ScheduleRequest) -> Dict[str, Any]:
+    """
+    Valida la petición de refresco de una programación como si se lanzara ahora (sin la
+    contraseña, que se lee de la app setting al lanzar) y devuelve la programación a guardar.
+    """
+    if "pg_password" in schedule_data.refresh:
+        raise HTTPException(status_code=422, detail="Do not include pg_password; use password_setting")
+    try:
+        workflow_data = WorkflowRequest.model_validate(dict(schedule_data.refresh, pg_password=""))
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=f"Invalid refresh request: {str(e)}")
+    databases = resolve_databases(workflow_data)
+    validate_subset(workflow_data, databases)
+    validate_selective(workflow_data)
+    return dict(schedule_data.model_dump(), pg_host_prod=workflow_data.pg_host_prod)
+
+def describe_schedule(schedule: Dict[str, Any], plan: List[Dict[str, Any]],
+                      recent: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Programación con sus próximas ejecuciones, la última lanzada y si la contraseña está configurada."""
+    runs = [entry for entry in plan if entry["schedule_id"] == schedule["id"]]
+    last = [run for run in recent if run["schedule_id"] == schedule["id"]]
+    return dict(
+        schedule,
+        password_configured=bool(scheduler.PASSWORD_SETTING_RE.fullmatch(schedule["password_setting"])
+                                 and os.environ.get(schedule["password_setting"])),
+        next_runs=runs[:3],
+        last_run=last[0] if last else None
+    )
+
+def run_schedule_operation(operation: str, fn, *args):
+    """Ejecuta una operación del planificador traduciendo sus errores a respuestas HTTP."""
+    try:
+        return fn(*args)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Schedule not found")
+    except Exception as e:
+        logging.exception(f"Exception occurred during schedule {operation}")
+        raise HTTPException(status_code=500, detail=f"Schedule {operation} failed: {str(e)}")
+
+@app.get("/api/schedules")
+def list_schedules(hours: int = Query(48, ge=1, le=24 * 14, description="Planning horizon for next_runs")):
+    """Programaciones de refresco recurrentes con sus próximas ejecuciones (ya escalonadas)."""
+    now = datetime.datetime.utcnow()
+    schedules = run_schedule_operation("listing", scheduler.list_schedules)
+    plan = run_schedule_operation("planning", scheduler.upcoming, now, hours, get_scheduler_config()["grace_minutes"])
+    recent = run_schedule_operation("listing", scheduler.recent_runs, now - scheduler.FIRED_LOOKBACK)
+    return {"schedules": [describe_schedule(schedule, plan, recent) for schedule in schedules]}
+
+@app.get("/api/schedules/upcoming")
+def get_upcoming_runs(hours: int = Query(48, ge=1, le=24 * 14, description="Planning horizon in hours")):
+    """
+    Próximas ejecuciones de todas las programaciones, ordenadas por inicio. Incluye el retraso
+    aplicado por el escalonado y las ejecuciones que se omitirán por no caber en su ventana.
+    """
+    now = datetime.datetime.utcnow()
+    runs = run_schedule_operation("planning", scheduler.upcoming, now, hours, get_scheduler_config()["grace_minutes"])
+    return {"generated_at": scheduler.format_timestamp(now), "hours": hours, "runs": runs}
+
+@app.post("/api/schedules", status_code=201)
+def create_schedule(schedule_data: ScheduleRequest):
+    """Crea una programación de refresco recurrente."""
+    schedule = validate_schedule_request(schedule_data)
+    return run_schedule_operation("creation", scheduler.save_schedule, schedule)
+
+@app.get("/api/schedules/{schedule_id}")
+def get_schedule(schedule_id: str):
+    """Programación con sus próximas ejecuciones y las lanzadas en los últimos días."""
+    schedule = run_schedule_operation("lookup", scheduler.get_schedule, schedule_id)
+    if schedule is None:
+        raise HTTPException(status_code=404, detail="Schedule not found")
+    now = datetime.datetime.utcnow()
+    plan = run_schedule_operation("planning", scheduler.upcoming, now, 24 * 7, get_scheduler_config()["grace_minutes"])
+    recent = run_schedule_operation("lookup", scheduler.recent_runs, now - scheduler.FIRED_LOOKBACK, schedule_id)
+    return dict(describe_schedule(schedule, plan, recent), recent_runs=recent)
+
+@app.put("/api/schedules/{schedule_id}")
+def update_schedule(schedule_id: str, schedule_data: ScheduleRequest):
+    """Reemplaza una programación existente."""
+    schedule = validate_schedule_request(schedule_data)
+    return run_schedule_operation("update", scheduler.save_schedule, schedule, schedule_id)
+
+@app.delete("/api/schedules/{schedule_id}")
+def delete_schedule(schedule_id: str):
+    """Elimina una programación y su historial de ejecuciones."""
+    if not run_schedule_operation("deletion", scheduler.delete_schedule, schedule_id):
+        raise HTTPException(status_code=404, detail="Schedule not found")
+    return {"deleted": schedule_id}
+
+def run_scheduled_refreshes() -> List[Dict[str, Any]]:
+    """Lanza los refrescos programados cuya hora ha llegado (timer de function_app.py)."""
+    config = get_scheduler_config()
+    if not config["enabled"]:
+        return []
+    return scheduler.run_due(
+        datetime.datetime.utcnow(),
+        lambda request: dispatch_refresh(WorkflowRequest.model_validate(request)),
+        config["grace_minutes"]
+    )
+
+def resume_operation_polling() -> int:
+    """Vuelve a arrancar el seguimiento de operaciones pendientes (timer de function_app.py)."""
+    return operations.resume()
 
 # Note: The Azure Functions integration now happens in function_app.py 
 # so we don't need the original main() function here
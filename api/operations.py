@@ -0,0 +1,322 @@
+"""
+Seguimiento duradero de operaciones de larga duración de Azure Resource Manager.
+
+ARM responde a una actualización de versión con la URL de una operación asíncrona
+(Azure-AsyncOperation o Location) que hay que consultar hasta que termina, a veces durante
+horas. Cada operación se guarda en SQLite (ver state.py) con su URL, su estado y la hora del
+siguiente sondeo, de modo que el seguimiento no depende de que siga abierta una pestaña del
+navegador ni sobrevive solo en memoria:
+
+- Un bucle en segundo plano sondea las operaciones pendientes por lotes: en cada pasada
+  reserva hasta `poll_batch_size` operaciones vencidas y las consulta en paralelo, con una
+  sola petición por URL aunque se haya registrado varias veces.
+- El intervalo de cada operación se duplica desde `poll_initial_seconds` hasta
+  `poll_max_seconds`; si ARM indica Retry-After, el siguiente sondeo espera ese valor.
+- Una pasada reserva sus operaciones adelantando `next_poll_at` (LEASE_SECONDS), así que
+  dos procesos que compartan el fichero, o el bucle y el timer, no sondean la misma operación
+  a la vez; si el proceso muere a mitad de sondeo, la reserva caduca y otro la retoma.
+- Tras un reinicio de la Function App el timer de function_app.py vuelve a arrancar el bucle
+  si quedan operaciones pendientes.
+"""
+import datetime
+import json
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import state
+from config import get_arm_config
+
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+# Estados terminales de una operación asíncrona de ARM
+TERMINAL_STATUSES = {"succeeded", "failed", "canceled"}
+# Tiempo que una pasada reserva las operaciones que está sondeando
+LEASE_SECONDS = 120
+# Espera máxima del bucle entre pasadas cuando no hay operaciones vencidas
+IDLE_SECONDS = 30
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS operations (
+        id TEXT PRIMARY KEY,
+        kind TEXT NOT NULL,
+        resource TEXT,
+        url TEXT NOT NULL,
+        status TEXT NOT NULL,
+        percent_complete REAL,
+        error TEXT,
+        polls INTEGER NOT NULL,
+        poll_interval REAL NOT NULL,
+        next_poll_at REAL NOT NULL,
+        deadline_at REAL NOT NULL,
+        metadata TEXT NOT NULL,
+        created_at TEXT NOT NULL,
+        updated_at TEXT NOT NULL,
+        completed_at TEXT
+    )""",
+    "CREATE INDEX IF NOT EXISTS operations_due ON operations (completed_at, next_poll_at)"
+]
+
+Fetch = Callable[[str], Dict[str, Any]]
+
+
+def _schema() -> None:
+    state.ensure_schema("operations", SCHEMA)
+
+
+def _now() -> str:
+    return datetime.datetime.utcnow().strftime(TIMESTAMP_FORMAT)
+
+
+def _to_dict(row: Any) -> Dict[str, Any]:
+    operation = dict(row)
+    operation["metadata"] = json.loads(operation["metadata"])
+    operation["active"] = operation["completed_at"] is None
+    operation["next_poll_at"] = (
+        None if operation["completed_at"] else
+        datetime.datetime.utcfromtimestamp(operation["next_poll_at"]).strftime(TIMESTAMP_FORMAT)
+    )
+    del operation["deadline_at"]
+    return operation
+
+
+def next_delay(interval: float, retry_after: Optional[float], maximum: float) -> Tuple[float, float]:
+    """
+    Espera hasta el siguiente sondeo e intervalo para el sondeo posterior: Retry-After tiene
+    prioridad; si no, se espera `interval` y el intervalo se duplica hasta `maximum`.
+    """
+    wait = retry_after if retry_after is not None else interval
+    return wait, min(interval * 2, maximum)
+
+
+def register(url: str, kind: str, resource: Optional[str] = None,
+             metadata: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Registra una operación para seguirla en segundo plano y devuelve su estado. Solo se
+    aceptan URLs del endpoint de ARM configurado: el sondeo envía el token de la identidad de
+    la API. Si la URL ya se está siguiendo, se devuelve la operación existente.
+    """
+    config = get_arm_config()
+    if not url.startswith(config["endpoint"] + "/"):
+        raise ValueError(f"Operation URL must belong to {config['endpoint']}")
+    _schema()
+    now = time.time()
+    with state.transaction() as conn:
+        existing = conn.execute(
+            "SELECT * FROM operations WHERE url = ? AND completed_at IS NULL", (url,)
+        ).fetchone()
+        if existing is not None:
+            return _to_dict(existing)
+        operation_id = uuid.uuid4().hex[:12]
+        timestamp = _now()
+        conn.execute(
+            """INSERT INTO operations (id, kind, resource, url, status, percent_complete, error, polls,
+                   poll_interval, next_poll_at, deadline_at, metadata, created_at, updated_at, completed_at)
+               VALUES (?, ?, ?, ?, 'InProgress', NULL, NULL, 0, ?, ?, ?, ?, ?, ?, NULL)""",
+            (operation_id, kind, resource, url, config["poll_initial_seconds"],
+             now + config["poll_initial_seconds"], now + config["operation_timeout_minutes"] * 60,
+             json.dumps(metadata or {}), timestamp, timestamp)
+        )
+        row = conn.execute("SELECT * FROM operations WHERE id = ?", (operation_id,)).fetchone()
+    wake()
+    return _to_dict(row)
+
+
+def get_operation(operation_id: str) -> Optional[Dict[str, Any]]:
+    _schema()
+    with state.transaction() as conn:
+        row = conn.execute("SELECT * FROM operations WHERE id = ?", (operation_id,)).fetchone()
+    return _to_dict(row) if row else None
+
+
+def list_operations(kind: Optional[str] = None, active: Optional[bool] = None,
+                    limit: int = 100) -> List[Dict[str, Any]]:
+    """Operaciones de la más reciente a la más antigua, opcionalmente por tipo y estado."""
+    _schema()
+    clauses, params = [], []
+    if kind:
+        clauses.append("kind = ?")
+        params.append(kind)
+    if active is not None:
+        clauses.append("completed_at IS NULL" if active else "completed_at IS NOT NULL")
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    with state.transaction() as conn:
+        rows = conn.execute(
+            f"SELECT * FROM operations {where} ORDER BY created_at DESC, rowid DESC LIMIT ?",
+            (*params, limit)
+        ).fetchall()
+    return [_to_dict(row) for row in rows]
+
+
+def _claim_due(now: float, limit: int) -> List[Dict[str, Any]]:
+    with state.transaction() as conn:
+        rows = conn.execute(
+            """SELECT * FROM operations WHERE completed_at IS NULL AND next_poll_at <= ?
+               ORDER BY next_poll_at LIMIT ?""",
+            (now, limit)
+        ).fetchall()
+        conn.executemany(
+            "UPDATE operations SET next_poll_at = ? WHERE id = ?",
+            [(now + LEASE_SECONDS, row["id"]) for row in rows]
+        )
+    return [dict(row) for row in rows]
+
+
+def _apply(row: Dict[str, Any], result: Dict[str, Any], now: float, maximum: float) -> None:
+    """Guarda el resultado de un sondeo y programa el siguiente (o cierra la operación)."""
+    status, error = row["status"], row["error"]
+    percent = row["percent_complete"]
+    if "exception" in result:
+        # Error transitorio consultando ARM: se reintenta con el mismo backoff
+        error = result["exception"]
+        wait, interval = next_delay(row["poll_interval"], None, maximum)
+    else:
+        status, error = result["status"], result["error"]
+        percent = result["percent_complete"] if result["percent_complete"] is not None else percent
+        wait, interval = next_delay(row["poll_interval"], result["retry_after"], maximum)
+    next_poll_at = now + wait
+    finished = status.lower() in TERMINAL_STATUSES
+    if not finished and next_poll_at > row["deadline_at"]:
+        status, finished = "Failed", True
+        error = "Operation did not finish before its timeout"
+    if finished and status.lower() == "succeeded":
+        percent, error = 100, None
+    elif finished and not error:
+        error = f"Operation {status}"
+    timestamp = _now()
+    with state.transaction() as conn:
+        conn.execute(
+            """UPDATE operations SET status = ?, percent_complete = ?, error = ?, polls = polls + 1,
+                   poll_interval = ?, next_poll_at = ?, updated_at = ?, completed_at = ?
+               WHERE id = ?""",
+            (status, percent, error, interval, next_poll_at, timestamp, timestamp if finished else None, row["id"])
+        )
+
+
+_client = None
+
+
+def default_fetch(url: str) -> Dict[str, Any]:
+    """Consulta la operación con el cliente de ARM de la API (identidad de la Function App)."""
+    global _client
+    if _client is None:
+        from upgrades import ArmClient
+        _client = ArmClient()
+    return _client.get_operation(url)
+
+
+def poll_due(fetch: Optional[Fetch] = None, now: Optional[float] = None) -> int:
+    """
+    Sondea un lote de operaciones vencidas y devuelve cuántas se han consultado. Las URLs
+    repetidas se consultan una sola vez y las peticiones van en paralelo.
+    """
+    _schema()
+    config = get_arm_config()
+    fetch = fetch or default_fetch
+    now = time.time() if now is None else now
+    rows = _claim_due(now, config["poll_batch_size"])
+    if not rows:
+        return 0
+
+    def poll(url: str) -> Dict[str, Any]:
+        try:
+            return fetch(url)
+        except Exception as e:
+            logging.warning(f"Polling operation {url} failed: {e}")
+            return {"exception": str(e)}
+
+    urls = sorted({row["url"] for row in rows})
+    with ThreadPoolExecutor(max_workers=max(1, min(config["poll_workers"], len(urls)))) as pool:
+        results = dict(zip(urls, pool.map(poll, urls)))
+    # Los siguientes sondeos se cuentan desde que han terminado los de esta pasada
+    finished_at = max(now, time.time())
+    for row in rows:
+        _apply(row, results[row["url"]], finished_at, config["poll_max_seconds"])
+    with _changed:
+        _changed.notify_all()
+    return len(rows)
+
+
+def _seconds_until_due() -> Optional[float]:
+    _schema()
+    with state.transaction() as conn:
+        row = conn.execute("SELECT MIN(next_poll_at) AS due FROM operations WHERE completed_at IS NULL").fetchone()
+    return None if row["due"] is None else max(0.0, row["due"] - time.time())
+
+
+_poller: Optional[threading.Thread] = None
+_poller_lock = threading.Lock()
+_wakeup = threading.Event()
+_stop = threading.Event()
+_changed = threading.Condition()
+
+
+def _poll_loop(fetch: Optional[Fetch]) -> None:
+    while not _stop.is_set():
+        try:
+            while poll_due(fetch):
+                pass
+            due = _seconds_until_due()
+        except Exception:
+            logging.exception("Operation poller pass failed")
+            due = None
+        _wakeup.wait(IDLE_SECONDS if due is None else min(due, IDLE_SECONDS))
+        _wakeup.clear()
+
+
+def start_poller(fetch: Optional[Fetch] = None) -> None:
+    """Arranca el bucle de sondeo del proceso si no está en marcha."""
+    global _poller
+    with _poller_lock:
+        if _poller is not None and _poller.is_alive():
+            return
+        _stop.clear()
+        _poller = threading.Thread(target=_poll_loop, args=(fetch,), name="operation-poller", daemon=True)
+        _poller.start()
+
+
+def stop_poller() -> None:
+    global _poller
+    with _poller_lock:
+        if _poller is None:
+            return
+        _stop.set()
+        _wakeup.set()
+        _poller.join()
+        _poller = None
+
+
+def wake() -> None:
+    """Adelanta la siguiente pasada del bucle (operación nueva)."""
+    _wakeup.set()
+
+
+def resume() -> int:
+    """Arranca el bucle si quedan operaciones pendientes (timer tras un reinicio)."""
+    pending = len(list_operations(active=True, limit=1))
+    if pending:
+        start_poller()
+    return pending
+
+
+def wait(operation_id: str, on_update: Optional[Callable[[Dict[str, Any]], None]] = None,
+         check_seconds: float = 5) -> Dict[str, Any]:
+    """
+    Espera a que el bucle de sondeo cierre la operación y la devuelve. `on_update` recibe el
+    estado cada vez que cambia el número de sondeos. Se despierta con cada pasada del bucle
+    de este proceso o, como mucho, cada `check_seconds` (pasadas de otro proceso).
+    """
+    polls = None
+    while True:
+        operation = get_operation(operation_id)
+        if operation is None:
+            raise KeyError(operation_id)
+        if on_update is not None and operation["polls"] != polls:
+            polls = operation["polls"]
+            on_update(operation)
+        if not operation["active"]:
+            return operation
+        with _changed:
+            _changed.wait(check_seconds)
@@ -0,0 +1,369 @@
+"""
+Eventos de progreso estructurados para pg_dump/pg_restore.
+
+Los scripts del workflow redirigen la salida verbose (-v) de pg_dump/pg_restore a este
+módulo, que la reenvía tal cual al log y la convierte en un documento de progreso (tablas
+completadas/totales, bytes escritos, objeto en curso, MB/s). El documento se publica
+periódicamente en runs/<run_id>/progress/<base_de_datos>.json, donde la API lo lee para
+calcular el porcentaje completado y la hora estimada de fin.
+
+    pg_dump -v ... 2>&3   con   exec 3> >(python3 progress.py dump --database db ...)
+
+Al final del flujo se escribe la línea "__EXIT__ <código>" para registrar el resultado.
+Solo depende de la librería estándar y de Azure CLI para publicar.
+"""
+import argparse
+import datetime
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+EXIT_SENTINEL = "__EXIT__"
+MAX_RECENT_EVENTS = 20
+
+# pg_dump -v
+DUMP_TABLE_RE = re.compile(r'dumping contents of table "(?P<name>[^"]+)"')
+# pg_restore -v, restauración secuencial
+RESTORE_DATA_RE = re.compile(r'processing data for table "(?P<name>[^"]+)"')
+# pg_restore -v -j, restauración en paralelo: "launching item <id> <desc> <tag>". Para los
+# datos de una tabla el tag es el nombre de la tabla sin esquema ("TABLE DATA orders")
+LAUNCH_RE = re.compile(r'launching item (?P<item>\d+) (?P<what>.+)$')
+FINISH_RE = re.compile(r'finished item (?P<item>\d+) (?P<what>.+)$')
+TABLE_DATA_PREFIX = "TABLE DATA "
+# pg_restore -v, creación de objetos (tablas, índices, restricciones...)
+CREATING_RE = re.compile(r'creating (?P<kind>[A-Z]+(?: [A-Z]+)*) "(?P<name>[^"]+)"')
+
+
+def utc_now() -> str:
+    return datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+class ProgressTracker:
+    """Mantiene el estado de progreso de una etapa a partir de las líneas verbose."""
+
+    def __init__(
+        self,
+        stage: str,
+        database: str,
+        table_sizes: Optional[Dict[str, int]] = None,
+        database_size: Optional[int] = None,
+        output_file: Optional[str] = None,
+        stage_index: int = 1,
+        stage_count: int = 1,
+        clock: Callable[[], float] = time.time,
+        parallel: bool = False
+    ):
+        self.stage = stage
+        self.database = database
+        self.table_sizes = table_sizes or {}
+        self.database_size = database_size or sum(self.table_sizes.values()) or None
+        self.output_file = output_file
+        self.stage_index = stage_index
+        self.stage_count = stage_count
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._started = clock()
+        self._started_at = utc_now()
+        self._done: List[str] = []
+        self._running: List[str] = []
+        self._current_object: Optional[str] = None
+        self._events: List[Dict[str, Any]] = []
+        self._state = "running"
+        self._exit_code: Optional[int] = None
+        self._version = 0
+        # Con pg_restore -j varias tablas se cargan a la vez: una tabla solo termina con su
+        # "finished item", no cuando otro worker empieza la siguiente
+        self.parallel = parallel
+        self._items: Dict[str, str] = {}
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def _event(self, kind: str, name: str) -> None:
+        self._events.append({"at": utc_now(), "type": kind, "object": name})
+        del self._events[:-MAX_RECENT_EVENTS]
+        self._version += 1
+
+    def _start_table(self, name: str, sequential: bool) -> None:
+        if sequential:
+            # En modo secuencial, empezar una tabla implica que la anterior ha terminado
+            for previous in list(self._running):
+                self._finish_table(previous)
+        if name not in self._running:
+            self._running.append(name)
+        self._current_object = f"TABLE DATA {name}"
+        self._event("table_started", name)
+
+    def _qualify(self, table: str) -> str:
+        """Nombre esquema.tabla de un tag de pg_restore -j, si la tabla es única en table_sizes."""
+        matches = [name for name in self.table_sizes if name.split(".", 1)[-1] == table]
+        return matches[0] if len(matches) == 1 else table
+
+    def _finish_table(self, name: str) -> None:
+        if name in self._running:
+            self._running.remove(name)
+        if name not in self._done:
+            self._done.append(name)
+            self._event("table_done", name)
+
+    def feed(self, line: str) -> Optional[int]:
+        """
+        Procesa una línea de salida. Devuelve el código de salida si la línea es el
+        centinela de fin de flujo.
+        """
+        line = line.rstrip("\n")
+        with self._lock:
+            if line.startswith(EXIT_SENTINEL):
+                parts = line.split()
+                self._exit_code = int(parts[1]) if len(parts) > 1 and parts[1].lstrip("-").isdigit() else 0
+                return self._exit_code
+
+            match = LAUNCH_RE.search(line)
+            if match:
+                self.parallel = True
+                what = match.group("what")
+                if what.startswith(TABLE_DATA_PREFIX):
+                    name = self._qualify(what[len(TABLE_DATA_PREFIX):])
+                    self._items[match.group("item")] = name
+                    self._start_table(name, sequential=False)
+                else:
+                    self._current_object = what
+                    self._version += 1
+                return None
+
+            match = FINISH_RE.search(line)
+            if match:
+                name = self._items.pop(match.group("item"), None)
+                if name is not None:
+                    self._finish_table(name)
+                return None
+
+            match = DUMP_TABLE_RE.search(line) or RESTORE_DATA_RE.search(line)
+            if match:
+                name = match.group("name")
+                if not self.parallel:
+                    self._start_table(name, sequential=True)
+                elif name not in self._running:
+                    # Tag ambiguo (misma tabla en varios esquemas): el worker da el nombre completo
+                    table = name.split(".", 1)[-1]
+                    for item, running in self._items.items():
+                        if running == table and table in self._running:
+                            self._items[item] = name
+                            self._running[self._running.index(table)] = name
+                            break
+                return None
+
+            match = CREATING_RE.search(line)
+            if match:
+                # En modo secuencial, los objetos post-data indican que la carga de datos ha terminado
+                if not self.parallel:
+                    for previous in list(self._running):
+                        self._finish_table(previous)
+                self._current_object = f"{match.group('kind')} {match.group('name')}"
+                self._version += 1
+        return None
+
+    def finish(self, exit_code: Optional[int] = None) -> None:
+        with self._lock:
+            if exit_code is None:
+                exit_code = self._exit_code if self._exit_code is not None else 0
+            self._exit_code = exit_code
+            if exit_code == 0:
+                for name in list(self._running):
+                    self._finish_table(name)
+                self._state = "completed"
+            else:
+                self._state = "failed"
+            self._current_object = None
+            self._version += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Documento de progreso publicable."""
+        with self._lock:
+            elapsed = max(self._clock() - self._started, 0.001)
+            source_bytes_done = sum(self.table_sizes.get(name, 0) for name in self._done)
+            bytes_written = None
+            if self.output_file and os.path.exists(self.output_file):
+                bytes_written = os.path.getsize(self.output_file)
+            # Ritmo sobre datos de origen procesados; en el dump, si no hay tamaños por tabla,
+            # se usa el tamaño del fichero escrito
+            processed = source_bytes_done or bytes_written or 0
+            return {
+                "stage": self.stage,
+                "stage_index": self.stage_index,
+                "stage_count": self.stage_count,
+                "database": self.database,
+                "state": self._state,
+                "exit_code": self._exit_code if self._state != "running" else None,
+                "started_at": self._started_at,
+                "updated_at": utc_now(),
+                "elapsed_seconds": round(elapsed, 1),
+                "tables_total": len(self.table_sizes) or None,
+                "tables_done": len(self._done),
+                "tables_running": list(self._running),
+                "current_object": self._current_object,
+                "bytes_written": bytes_written,
+                "source_bytes_total": self.database_size,
+                "source_bytes_done": source_bytes_done,
+                "throughput_mb_s": round(processed / elapsed / (1024 * 1024), 2),
+                "recent_events": list(self._events)
+            }
+
+
+def estimate_progress(doc: Dict[str, Any], now: Optional[datetime.datetime] = None) -> Dict[str, Any]:
+    """
+    Calcula el porcentaje y la hora estimada de fin a partir de un documento de progreso.
+    El porcentaje de la etapa usa los bytes de origen completados frente al tamaño de la base
+    de datos (o tablas completadas frente al total); la ETA extrapola el ritmo observado a lo
+    que queda de la etapa y a las etapas siguientes, que procesan el mismo volumen de datos.
+    """
+    now = now or datetime.datetime.utcnow()
+    stage_index = doc.get("stage_index") or 1
+    stage_count = doc.get("stage_count") or 1
+
+    if doc.get("state") == "completed":
+        stage_fraction = 1.0
+    elif doc.get("source_bytes_total"):
+        stage_fraction = min(doc.get("source_bytes_done", 0) / doc["source_bytes_total"], 0.99)
+    elif doc.get("tables_total"):
+        stage_fraction = min(doc.get("tables_done", 0) / doc["tables_total"], 0.99)
+    else:
+        stage_fraction = 0.0
+
+    percent = round(((stage_index - 1) + stage_fraction) / stage_count * 100, 1)
+
+    eta_seconds = None
+    started_at = doc.get("started_at")
+    if doc.get("state") == "running" and stage_fraction > 0 and started_at:
+        elapsed = (now - datetime.datetime.strptime(started_at, "%Y-%m-%dT%H:%M:%SZ")).total_seconds()
+        stage_total = elapsed / stage_fraction
+        eta_seconds = round(stage_total - elapsed + stage_total * (stage_count - stage_index))
+    elif doc.get("state") == "completed" and stage_index == stage_count:
+        eta_seconds = 0
+
+    return {
+        "stage": doc.get("stage"),
+        "state": doc.get("state"),
+        "percent": percent,
+        "stage_percent": round(stage_fraction * 100, 1),
+        "eta_seconds": eta_seconds,
+        "tables_done": doc.get("tables_done"),
+        "tables_total": doc.get("tables_total"),
+        "current_object": doc.get("current_object"),
+        "bytes_written": doc.get("bytes_written"),
+        "throughput_mb_s": doc.get("throughput_mb_s"),
+        "updated_at": doc.get("updated_at")
+    }
+
+
+def summarize_progress(docs: Dict[str, Dict[str, Any]], now: Optional[datetime.datetime] = None) -> Dict[str, Any]:
+    """Agrega el progreso de todas las bases de datos de una ejecución."""
+    databases = {database: estimate_progress(doc, now) for database, doc in docs.items()}
+    percents = [estimate["percent"] for estimate in databases.values()]
+    etas = [estimate["eta_seconds"] for estimate in databases.values() if estimate["eta_seconds"] is not None]
+    return {
+        "percent": round(sum(percents) / len(percents), 1) if percents else None,
+        "eta_seconds": max(etas) if etas else None,
+        "databases": databases
+    }
+
+
+class AzCliPublisher:
+    """Publica el documento de progreso con Azure CLI, como el resto de scripts del workflow."""
+
+    def __init__(self, account: str, container: str, blob_name: str):
+        self.account = account
+        self.container = container
+        self.blob_name = blob_name
+
+    def publish(self, doc: Dict[str, Any]) -> None:
+        with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as file:
+            json.dump(doc, file)
+            path = file.name
+        try:
+            subprocess.run(
+                ["az", "storage", "blob", "upload",
+                 "--account-name", self.account, "--container-name", self.container,
+                 "--name", self.blob_name, "--file", path, "--content-type", "application/json",
+                 "--overwrite", "--auth-mode", "login", "--only-show-errors"],
+                stdout=subprocess.DEVNULL, check=False, timeout=60
+            )
+        except Exception as e:
+            print(f"Warning: failed to publish progress: {e}", file=sys.stderr)
+        finally:
+            os.unlink(path)
+
+
+def _load_table_sizes(path: Optional[str]) -> Dict[str, int]:
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path) as file:
+        data = json.load(file)
+    # Acepta tanto la lista de tablas como un manifiesto completo
+    tables = data.get("tables", []) if isinstance(data, dict) else data
+    return {f"{t['schema']}.{t['table']}": int(t.get("size_bytes") or 0) for t in tables}
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Structured progress for pg_dump/pg_restore verbose output")
+    parser.add_argument("stage", choices=["dump", "restore"])
+    parser.add_argument("--database", required=True)
+    parser.add_argument("--tables-file", help="JSON list of tables (or manifest) with size_bytes")
+    parser.add_argument("--database-size", type=int)
+    parser.add_argument("--output-file", help="File whose size is reported as bytes written")
+    parser.add_argument("--stage-index", type=int, default=1)
+    parser.add_argument("--stage-count", type=int, default=1)
+    parser.add_argument("--account")
+    parser.add_argument("--container")
+    parser.add_argument("--blob")
+    parser.add_argument("--interval", type=float, default=15.0)
+    parser.add_argument("--parallel", action="store_true", help="pg_restore runs with -j")
+    args = parser.parse_args(argv)
+
+    tracker = ProgressTracker(
+        args.stage, args.database, _load_table_sizes(args.tables_file), args.database_size,
+        args.output_file, args.stage_index, args.stage_count, parallel=args.parallel
+    )
+    publisher = AzCliPublisher(args.account, args.container, args.blob) if args.account and args.container and args.blob else None
+
+    # La publicación va en un hilo aparte para no frenar la lectura de la salida de pg_dump
+    stop = threading.Event()
+
+    def publish_loop() -> None:
+        published_version = -1
+        while not stop.wait(args.interval):
+            if tracker.version != published_version or args.output_file:
+                published_version = tracker.version
+                publisher.publish(tracker.snapshot())
+
+    if publisher:
+        publish_thread = threading.Thread(target=publish_loop, daemon=True)
+        publish_thread.start()
+        publisher.publish(tracker.snapshot())
+
+    exit_code = None
+    for line in sys.stdin:
+        code = tracker.feed(line)
+        if code is not None:
+            exit_code = code
+            continue
+        sys.stdout.write(line)
+        sys.stdout.flush()
+
+    tracker.finish(exit_code)
+    stop.set()
+    if publisher:
+        publish_thread.join()
+        publisher.publish(tracker.snapshot())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
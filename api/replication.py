@@ -0,0 +1,342 @@
+"""
+Refresco continuo por replicación lógica.
+
+Alternativa al ciclo completo de pg_dump/pg_restore para bases de datos grandes: producción
+publica todas sus tablas (CREATE PUBLICATION ... FOR ALL TABLES) y una base de datos de staging
+en desarrollo (<base_de_datos>__repl) se suscribe a ellas. Tras la copia inicial, el coste de
+mantener staging al día depende del volumen de cambios y no del tamaño de la base de datos.
+
+Los desarrolladores no trabajan sobre staging: bajo petición se corta una copia consistente.
+Se anota la posición actual del WAL de producción, se espera a que la suscripción la confirme,
+se pausa la suscripción (su worker es la única conexión a staging) y la base de datos de
+trabajo se recrea con CREATE DATABASE ... TEMPLATE <base_de_datos>__repl. La suscripción se
+reanuda a continuación; el slot de producción retiene el WAL mientras tanto.
+
+La replicación lógica no copia el esquema ni los valores de las secuencias: el esquema se copia
+con pg_dump --schema-only al crear staging y las secuencias se ajustan en cada copia con los
+valores de producción. Los cambios de esquema posteriores en producción requieren un teardown y
+un nuevo setup.
+
+Requiere wal_level=logical en producción (en Azure Database for PostgreSQL, el parámetro de
+servidor wal_level) y un usuario con permiso para crear publicaciones y suscripciones.
+"""
+import datetime
+import hashlib
+import logging
+import os
+import re
+import subprocess
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import psycopg
+from psycopg import sql
+
+from templates import MAX_IDENTIFIER_LENGTH, TEMPLATE_SUFFIX, clone_from_template
+from verification import build_conninfo
+
+STAGING_SUFFIX = "__repl"
+OBJECT_PREFIX = "devrefresh_"
+APPLICATION_NAME = "pg-replication"
+DEFAULT_CATCH_UP_TIMEOUT = 120
+POLL_INTERVAL_SECONDS = 1.0
+# Bases de datos del servidor que una copia nunca puede sustituir
+RESERVED_DATABASES = ("postgres", "template0", "template1")
+
+# Estados de pg_subscription_rel: i = inicializando, d = copiando datos, f/s = sincronizando, r = lista
+READY_STATE = "r"
+
+
+def staging_name(database: str) -> str:
+    """Nombre de la base de datos de staging suscrita a producción."""
+    name = f"{database}{STAGING_SUFFIX}"
+    if len(name) > MAX_IDENTIFIER_LENGTH:
+        raise ValueError(f"Database name {database} is too long to derive a staging database name")
+    return name
+
+
+def replication_object_name(database: str) -> str:
+    """
+    Nombre de la publicación, la suscripción y el slot de una base de datos. Los slots solo
+    admiten minúsculas, dígitos y guiones bajos; el hash evita colisiones al normalizar.
+    """
+    normalized = re.sub(r"[^a-z0-9_]", "_", database.lower())[:40]
+    digest = hashlib.sha1(database.encode("utf-8")).hexdigest()[:8]
+    return f"{OBJECT_PREFIX}{normalized}_{digest}"
+
+
+def summarize_lag(slot: Optional[Dict[str, Any]], subscription: Optional[Dict[str, Any]],
+                  relation_states: Dict[str, int], now: Optional[datetime.datetime] = None) -> Dict[str, Any]:
+    """
+    Resume el estado de la replicación a partir del slot en producción, la suscripción en
+    staging y el estado de sincronización de sus tablas.
+    """
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    tables_total = sum(relation_states.values())
+    tables_ready = relation_states.get(READY_STATE, 0)
+
+    if subscription is None:
+        state = "not_configured"
+    elif not subscription["enabled"]:
+        state = "paused"
+    elif subscription["pid"] is None:
+        # Suscripción activa sin worker: normalmente un error de aplicación (ver el log de dev)
+        state = "stopped"
+    elif tables_ready < tables_total:
+        state = "initial_sync"
+    else:
+        state = "streaming"
+
+    last_report = subscription.get("latest_end_time") if subscription else None
+    return {
+        "state": state,
+        "lag_bytes": slot["lag_bytes"] if slot else None,
+        "slot_active": slot["active"] if slot else None,
+        "current_lsn": slot["current_lsn"] if slot else None,
+        "confirmed_lsn": slot["confirmed_flush_lsn"] if slot else None,
+        "last_report_seconds": round((now - last_report).total_seconds(), 1) if last_report else None,
+        "tables_total": tables_total,
+        "tables_ready": tables_ready
+    }
+
+
+class ReplicationRefresh:
+    """
+    Operaciones de refresco por replicación lógica de una base de datos entre un servidor de
+    producción y uno de desarrollo. Cada operación abre y cierra sus propias conexiones.
+    """
+
+    def __init__(self, prod: Tuple[str, int], dev: Tuple[str, int], database: str, user: str,
+                 password: str, pg_bin_dir: Optional[str] = None):
+        self.prod = prod
+        self.dev = dev
+        self.database = database
+        self.staging = staging_name(database)
+        self.name = replication_object_name(database)
+        self.user = user
+        self.password = password
+        self.pg_bin_dir = pg_bin_dir
+
+    def check_target(self, target_database: str) -> None:
+        """
+        La copia recrea la base de datos destino con DROP DATABASE ... WITH (FORCE): no puede ser
+        staging, otra base de datos de staging o plantilla, ni una base de datos del sistema.
+        """
+        if (target_database == self.staging or target_database in RESERVED_DATABASES
+                or target_database.endswith((STAGING_SUFFIX, TEMPLATE_SUFFIX))):
+            raise ValueError(f"{target_database} cannot be the target of a replication snapshot")
+
+    def _conninfo(self, server: Tuple[str, int], dbname: str, password: bool = True) -> str:
+        return psycopg.conninfo.make_conninfo(
+            build_conninfo(server[0], dbname, self.user, server[1], self.password if password else None),
+            application_name=APPLICATION_NAME
+        )
+
+    def _connect(self, server: Tuple[str, int], dbname: str) -> psycopg.Connection:
+        return psycopg.connect(self._conninfo(server, dbname), autocommit=True)
+
+    def _staging_exists(self, dev_admin: psycopg.Connection) -> bool:
+        return dev_admin.execute("SELECT 1 FROM pg_database WHERE datname = %s", (self.staging,)).fetchone() is not None
+
+    def _copy_schema(self) -> None:
+        """Copia el esquema de producción a staging (pg_dump --schema-only | psql)."""
+        def tool(name: str) -> str:
+            return os.path.join(self.pg_bin_dir, name) if self.pg_bin_dir else name
+
+        env = dict(os.environ, PGPASSWORD=self.password)
+        dump = subprocess.Popen(
+            [tool("pg_dump"), "--schema-only", "--no-owner", "--no-privileges", "--no-publications",
+             "--no-subscriptions", "-d", self._conninfo(self.prod, self.database, password=False)],
+            env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+        load = subprocess.run(
+            [tool("psql"), "-X", "-q", "-v", "ON_ERROR_STOP=1", "-d", self._conninfo(self.dev, self.staging, password=False)],
+            env=env, stdin=dump.stdout, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True
+        )
+        dump.stdout.close()
+        dump_error = dump.stderr.read().decode("utf-8", errors="replace")
+        if dump.wait() != 0:
+            raise RuntimeError(f"pg_dump --schema-only failed: {dump_error.strip()[-500:]}")
+        if load.returncode != 0:
+            raise RuntimeError(f"Could not load the schema into {self.staging}: {load.stderr.strip()[-500:]}")
+
+    def _read_slot(self, prod: psycopg.Connection) -> Optional[Dict[str, Any]]:
+        row = prod.execute(
+            "SELECT active, pg_current_wal_lsn()::text, confirmed_flush_lsn::text, "
+            "pg_wal_lsn_diff(pg_current_wal_lsn(), confirmed_flush_lsn)::bigint "
+            "FROM pg_replication_slots WHERE slot_name = %s",
+            (self.name,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {"active": row[0], "current_lsn": row[1], "confirmed_flush_lsn": row[2], "lag_bytes": row[3]}
+
+    def _read_subscription(self, dev: psycopg.Connection) -> Tuple[Optional[Dict[str, Any]], Dict[str, int]]:
+        # pg_subscription es un catálogo compartido: se puede consultar desde cualquier base de datos
+        row = dev.execute(
+            "SELECT s.subenabled, st.pid, st.latest_end_lsn::text, st.latest_end_time "
+            "FROM pg_subscription s "
+            "LEFT JOIN pg_stat_subscription st ON st.subid = s.oid AND st.relid IS NULL "
+            "WHERE s.subname = %s",
+            (self.name,)
+        ).fetchone()
+        if row is None:
+            return None, {}
+        subscription = {"enabled": row[0], "pid": row[1], "latest_end_lsn": row[2], "latest_end_time": row[3]}
+        relation_states = dict(dev.execute(
+            "SELECT r.srsubstate::text, count(*) FROM pg_subscription_rel r "
+            "JOIN pg_subscription s ON s.oid = r.srsubid WHERE s.subname = %s GROUP BY 1",
+            (self.name,)
+        ).fetchall())
+        return subscription, relation_states
+
+    def setup(self) -> Dict[str, Any]:
+        """
+        Crea la publicación en producción, la base de datos de staging con el esquema de
+        producción y la suscripción, que arranca con la copia inicial de los datos.
+        Es idempotente: si la suscripción ya existe se devuelve su estado.
+        """
+        with self._connect(self.prod, self.database) as prod:
+            wal_level = prod.execute("SHOW wal_level").fetchone()[0]
+            if wal_level != "logical":
+                raise RuntimeError(f"wal_level is '{wal_level}' on {self.prod[0]}; logical replication requires 'logical'")
+            if prod.execute("SELECT 1 FROM pg_publication WHERE pubname = %s", (self.name,)).fetchone() is None:
+                prod.execute(sql.SQL("CREATE PUBLICATION {} FOR ALL TABLES").format(sql.Identifier(self.name)))
+                logging.info(f"Publication {self.name} created on {self.prod[0]}/{self.database}")
+
+        with self._connect(self.dev, "postgres") as dev_admin:
+            subscription, _ = self._read_subscription(dev_admin)
+            if subscription is not None:
+                return {"created": False, **self.lag()}
+            if not self._staging_exists(dev_admin):
+                dev_admin.execute(sql.SQL("CREATE DATABASE {}").format(sql.Identifier(self.staging)))
+                try:
+                    self._copy_schema()
+                except Exception:
+                    dev_admin.execute(sql.SQL("DROP DATABASE IF EXISTS {} WITH (FORCE)").format(sql.Identifier(self.staging)))
+                    raise
+
+        with self._connect(self.dev, self.staging) as staging:
+            # CREATE SUBSCRIPTION crea también el slot en producción y lanza la copia inicial
+            staging.execute(sql.SQL(
+                "CREATE SUBSCRIPTION {name} CONNECTION {conninfo} PUBLICATION {name} "
+                "WITH (copy_data = true, slot_name = {slot})"
+            ).format(
+                name=sql.Identifier(self.name),
+                conninfo=sql.Literal(self._conninfo(self.prod, self.database)),
+                slot=sql.Literal(self.name)
+            ))
+        logging.info(f"Subscription {self.name} created on {self.dev[0]}/{self.staging}")
+        return {"created": True, "staging_database": self.staging, "subscription": self.name}
+
+    def lag(self) -> Dict[str, Any]:
+        """Estado de la replicación: retraso en bytes, tablas sincronizadas y estado del worker."""
+        with self._connect(self.prod, self.database) as prod:
+            slot = self._read_slot(prod)
+        with self._connect(self.dev, "postgres") as dev_admin:
+            subscription, relation_states = self._read_subscription(dev_admin)
+        return {"staging_database": self.staging, "subscription": self.name,
+                **summarize_lag(slot, subscription, relation_states)}
+
+    def _set_subscription_enabled(self, enabled: bool) -> None:
+        with self._connect(self.dev, self.staging) as staging:
+            staging.execute(sql.SQL("ALTER SUBSCRIPTION {} {}").format(
+                sql.Identifier(self.name), sql.SQL("ENABLE" if enabled else "DISABLE")))
+
+    def _wait_for(self, condition, timeout: float, description: str) -> float:
+        started = time.monotonic()
+        while not condition():
+            if time.monotonic() - started > timeout:
+                raise RuntimeError(f"Timed out after {timeout}s waiting for {description}")
+            time.sleep(POLL_INTERVAL_SECONDS)
+        return round(time.monotonic() - started, 1)
+
+    def _sync_sequences(self, prod: psycopg.Connection) -> int:
+        """Lleva a la copia los valores de las secuencias de producción, que no se replican."""
+        sequences = prod.execute(
+            "SELECT schemaname, sequencename, last_value FROM pg_sequences WHERE last_value IS NOT NULL"
+        ).fetchall()
+        if not sequences:
+            return 0
+        with self._connect(self.dev, self.database) as copy:
+            for schema, name, last_value in sequences:
+                copy.execute("SELECT setval(format('%%I.%%I', %s::text, %s::text), %s)", (schema, name, last_value))
+        return len(sequences)
+
+    def snapshot(self, target_database: Optional[str] = None, catch_up_timeout: float = DEFAULT_CATCH_UP_TIMEOUT) -> Dict[str, Any]:
+        """
+        Corta una copia consistente de staging en la base de datos de trabajo: espera a que la
+        suscripción confirme la posición actual del WAL de producción, la pausa, clona staging
+        y la reanuda.
+        """
+        target_database = target_database or self.database
+        self.check_target(target_database)
+        with self._connect(self.prod, self.database) as prod, self._connect(self.dev, "postgres") as dev_admin:
+            subscription, relation_states = self._read_subscription(dev_admin)
+            if subscription is None:
+                raise RuntimeError(f"No subscription for {self.database}; run the replication setup first")
+            if relation_states.get(READY_STATE, 0) < sum(relation_states.values()):
+                raise RuntimeError(f"Initial synchronization of {self.staging} has not finished yet")
+            if not subscription["enabled"]:
+                self._set_subscription_enabled(True)
+
+            target_lsn = prod.execute("SELECT pg_current_wal_lsn()::text").fetchone()[0]
+
+            def caught_up() -> bool:
+                row = prod.execute(
+                    "SELECT pg_wal_lsn_diff(confirmed_flush_lsn, %s::pg_lsn) >= 0 FROM pg_replication_slots WHERE slot_name = %s",
+                    (target_lsn, self.name)
+                ).fetchone()
+                return bool(row and row[0])
+
+            catch_up_seconds = self._wait_for(caught_up, catch_up_timeout, f"{self.staging} to reach {target_lsn}")
+
+            self._set_subscription_enabled(False)
+            try:
+                self._wait_for(
+                    lambda: dev_admin.execute(
+                        "SELECT count(*) FROM pg_stat_activity WHERE datname = %s", (self.staging,)
+                    ).fetchone()[0] == 0,
+                    30, f"the apply worker of {self.name} to stop"
+                )
+                result = clone_from_template(dev_admin, target_database, template=self.staging)
+            finally:
+                self._set_subscription_enabled(True)
+
+            sequences = self._sync_sequences(prod)
+
+        logging.info(f"{target_database} cloned from {self.staging} at {target_lsn} in {result['clone_seconds']}s")
+        return {**result, "source_lsn": target_lsn, "catch_up_seconds": catch_up_seconds, "sequences_synced": sequences}
+
+    def teardown(self, drop_staging: bool = True) -> Dict[str, Any]:
+        """
+        Elimina la suscripción (y con ella el slot de producción), la publicación y, si se
+        indica, la base de datos de staging. Un slot abandonado retiene WAL en producción
+        indefinidamente, por lo que se elimina también si DROP SUBSCRIPTION no pudo hacerlo.
+        """
+        removed: List[str] = []
+        with self._connect(self.dev, "postgres") as dev_admin:
+            subscription, _ = self._read_subscription(dev_admin)
+            staging_exists = self._staging_exists(dev_admin)
+        if subscription is not None and staging_exists:
+            with self._connect(self.dev, self.staging) as staging:
+                staging.execute(sql.SQL("DROP SUBSCRIPTION IF EXISTS {}").format(sql.Identifier(self.name)))
+            removed.append("subscription")
+
+        with self._connect(self.prod, self.database) as prod:
+            if prod.execute(
+                "SELECT pg_drop_replication_slot(slot_name) FROM pg_replication_slots WHERE slot_name = %s AND NOT active",
+                (self.name,)
+            ).fetchone() is not None:
+                removed.append("slot")
+            if prod.execute("SELECT 1 FROM pg_publication WHERE pubname = %s", (self.name,)).fetchone() is not None:
+                prod.execute(sql.SQL("DROP PUBLICATION {}").format(sql.Identifier(self.name)))
+                removed.append("publication")
+
+        if drop_staging and staging_exists:
+            with self._connect(self.dev, "postgres") as dev_admin:
+                dev_admin.execute(sql.SQL("DROP DATABASE IF EXISTS {} WITH (FORCE)").format(sql.Identifier(self.staging)))
+            removed.append("staging_database")
+
+        logging.info(f"Replication {self.name} removed: {', '.join(removed) or 'nothing to remove'}")
+        return {"staging_database": self.staging, "subscription": self.name, "removed": removed}
@@ -0,0 +1,103 @@
+import logging
+from typing import Any, Dict, Iterable, Optional
+
+from storage import list_blob_names, read_json_blob
+
+# Los scripts del workflow publican sus informes en runs/<run_id>/<tipo>/<base_de_datos>.json
+RUN_REPORTS_PREFIX = "runs"
+# Tipos de informe que usa summarize_databases; el resto (verificación, ...) solo se
+# devuelven completos en "reports"
+SUMMARY_REPORT_KINDS = ("pipeline", "restore", "progress", "subset", "selective", "chunks")
+
+
+def run_report_blob(run_id: str, kind: str, database: str) -> str:
+    """Devuelve el nombre del blob de un informe de ejecución."""
+    return f"{RUN_REPORTS_PREFIX}/{run_id}/{kind}/{database}.json"
+
+
+def load_run_reports(storage_account: str, container: str, run_id: str,
+                     kinds: Optional[Iterable[str]] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    Carga los informes publicados para una ejecución, agrupados por tipo
+    (restore, verification, ...) y por base de datos. Con `kinds` solo se leen
+    los blobs de esos tipos.
+    """
+    kinds = set(kinds) if kinds is not None else None
+    reports: Dict[str, Dict[str, Any]] = {}
+    prefix = f"{RUN_REPORTS_PREFIX}/{run_id}/"
+    for blob_name in list_blob_names(storage_account, container, prefix):
+        parts = blob_name[len(prefix):].split("/")
+        if len(parts) != 2 or not parts[1].endswith(".json"):
+            continue
+        kind, database = parts[0], parts[1][:-len(".json")]
+        if kinds is not None and kind not in kinds:
+            continue
+        report = read_json_blob(storage_account, container, blob_name)
+        if report is not None:
+            reports.setdefault(kind, {})[database] = report
+    return reports
+
+
+def try_load_run_reports(storage_account: str, container: str, run_id: str,
+                         kinds: Optional[Iterable[str]] = None) -> Dict[str, Dict[str, Any]]:
+    """Igual que load_run_reports, pero un fallo de Storage no impide devolver el estado del run."""
+    try:
+        return load_run_reports(storage_account, container, run_id, kinds)
+    except Exception as e:
+        logging.warning(f"Could not load reports for run {run_id}: {str(e)}")
+        return {}
+
+
+def summarize_databases(reports: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """
+    Resume el resultado de cada base de datos de una ejecución a partir de sus informes.
+    El informe 'pipeline' lo publica refresh.sh al terminar cada base de datos; mientras
+    no existe, la base de datos sigue en curso.
+    """
+    databases = set()
+    for kind in ("pipeline", "restore", "progress"):
+        databases.update(reports.get(kind, {}))
+
+    summary = {}
+    for database in sorted(databases):
+        pipeline = reports.get("pipeline", {}).get(database) or {}
+        restore = reports.get("restore", {}).get(database) or {}
+        progress = reports.get("progress", {}).get(database) or {}
+        subset = reports.get("subset", {}).get(database)
+        selective = reports.get("selective", {}).get(database)
+        chunks = reports.get("chunks", {}).get(database)
+        summary[database] = {
+            "status": pipeline.get("status", "running"),
+            "failed_stage": pipeline.get("failed_stage"),
+            "stage": progress.get("stage"),
+            "backup": pipeline.get("backup") or restore.get("backup"),
+            "backup_created": pipeline.get("backup_created"),
+            "verification": restore.get("verification"),
+            "total_seconds": pipeline.get("total_seconds"),
+            # Modo subconjunto: tamaño copiado frente al de producción
+            "subset": {
+                "rows": subset.get("rows"),
+                "bytes": subset.get("bytes"),
+                "source_bytes": subset.get("source_database_size_bytes"),
+                "tables_copied": subset.get("tables_copied"),
+                "seconds": subset.get("total_seconds")
+            } if subset else None,
+            # Modo selectivo: tablas copiadas de nuevo y reutilizadas, o motivo del refresco completo
+            "selective": {
+                "mode": selective.get("mode"),
+                "reason": selective.get("reason"),
+                "tables_refreshed": selective.get("tables_refreshed"),
+                "tables_reused": selective.get("tables_reused"),
+                "bytes_copied": selective.get("bytes_copied"),
+                "bytes_reused": selective.get("bytes_reused")
+            } if selective else None,
+            # Backup troceado: deduplicación frente a los chunks ya almacenados
+            "dedup": {
+                "chunks": chunks.get("chunks"),
+                "new_chunks": chunks.get("new_chunks"),
+                "bytes_total": chunks.get("bytes_total"),
+                "bytes_uploaded": chunks.get("bytes_uploaded"),
+                "dedup_ratio": chunks.get("dedup_ratio")
+            } if chunks else None
+        }
+    return summary
@@ -0,0 +1,293 @@
+"""
+Llamadas resilientes a los servicios externos (GitHub y ARM).
+
+Cada servicio (upstream) tiene su propia configuración (get_resilience_config) y estado:
+
+- Plazo: todas las peticiones llevan timeout; una petición que lo supera falla con
+  DeadlineExceeded (504) en lugar de retener al worker hasta que el host corta la petición.
+- Circuit breaker: tras `failure_threshold` fallos seguidos (errores de red, timeouts, 429 y
+  5xx) el circuito se abre durante `open_seconds` y las peticiones fallan al momento con
+  CircuitOpenError (503). Pasado ese tiempo se deja pasar una sola petición de prueba
+  (half_open): si va bien el circuito se cierra y si falla vuelve a abrirse.
+- Caché: se guarda la última respuesta correcta de cada GET (URL y parámetros); con el
+  circuito abierto se sirve esa respuesta, marcada con la cabecera X-Upstream-Cache: stale,
+  en lugar de fallar. Los endpoints que la usan lo indican con "stale": true y la misma
+  cabecera en su respuesta (is_stale).
+- Hedging: las peticiones GET (idempotentes) que tardan más que el p95 de las últimas
+  respuestas lanzan una segunda petición igual y se usa la primera que termina. El p95 solo
+  se usa con al menos MIN_HEDGE_SAMPLES muestras y nunca por debajo de `hedge_min_seconds`.
+
+El estado y las métricas de cada servicio se publican en /api/health y /api/metrics.
+"""
+import copy
+import functools
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from config import get_resilience_config
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+# Respuestas que cuentan como fallo del servicio (el resto de 4xx son errores de la petición)
+FAILURE_STATUS_CODES = {429}
+# Latencias recientes con las que se calcula el p95 y muestras mínimas para hacer hedging
+LATENCY_WINDOW = 200
+MIN_HEDGE_SAMPLES = 20
+# Respuestas GET guardadas por servicio para servirlas con el circuito abierto
+MAX_CACHED_RESPONSES = 500
+# Hilos compartidos por las peticiones con hedging
+HEDGE_WORKERS = 32
+# Cabecera de las respuestas servidas desde la caché con el circuito abierto
+STALE_HEADER = "X-Upstream-Cache"
+
+_hedge_pool = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix="hedge")
+
+
+class UpstreamError(Exception):
+    status_code = 502
+
+
+class CircuitOpenError(UpstreamError):
+    status_code = 503
+
+    def __init__(self, upstream: str, retry_after: float):
+        super().__init__(f"{upstream} is unavailable (circuit open, retry in {retry_after:.0f}s)")
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(UpstreamError):
+    status_code = 504
+
+    def __init__(self, upstream: str, timeout: float):
+        super().__init__(f"{upstream} did not respond within {timeout:g}s")
+
+
+def percentile(values, fraction: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def is_failure(response: requests.Response) -> bool:
+    return response.status_code >= 500 or response.status_code in FAILURE_STATUS_CODES
+
+
+def is_stale(response: requests.Response) -> bool:
+    """La respuesta viene de la caché porque el circuito está abierto."""
+    return (getattr(response, "headers", None) or {}).get(STALE_HEADER) == "stale"
+
+
+class Upstream:
+    """Plazo, circuit breaker, caché de GET y hedging de un servicio externo."""
+
+    def __init__(self, name: str, config: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.config = config or get_resilience_config(name)
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+        self._latencies: Deque[float] = deque(maxlen=LATENCY_WINDOW)
+        self._cache: "OrderedDict[Tuple[str, str], requests.Response]" = OrderedDict()
+        self.counters = {key: 0 for key in ("requests", "failures", "timeouts", "short_circuits",
+                                            "cache_hits", "hedges", "hedge_wins")}
+        self._lock = threading.Lock()
+
+    # Circuit breaker
+
+    def _count(self, key: str) -> None:
+        with self._lock:
+            self.counters[key] += 1
+
+    def _admit(self) -> Tuple[bool, bool]:
+        """(se permite la petición, es la petición de prueba del estado half_open)."""
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.config["open_seconds"]:
+                self.state = HALF_OPEN
+            if self.state == CLOSED:
+                return True, False
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True, True
+            return False, False
+
+    def _record(self, ok: bool, probe: bool, latency: Optional[float] = None) -> None:
+        with self._lock:
+            if probe:
+                self._probing = False
+            if ok:
+                if latency is not None:
+                    self._latencies.append(latency)
+                self.consecutive_failures = 0
+                if self.state != CLOSED:
+                    logging.info(f"Circuit of upstream {self.name} closed")
+                self.state, self.opened_at = CLOSED, None
+                return
+            self.counters["failures"] += 1
+            self.consecutive_failures += 1
+            if probe or (self.state == CLOSED and self.consecutive_failures >= self.config["failure_threshold"]):
+                if self.state != OPEN:
+                    logging.warning(f"Circuit of upstream {self.name} opened after "
+                                    f"{self.consecutive_failures} consecutive failures")
+                self.state, self.opened_at = OPEN, time.monotonic()
+
+    def retry_after(self) -> float:
+        with self._lock:
+            if self.opened_at is None:
+                return 0.0
+            return max(0.0, self.config["open_seconds"] - (time.monotonic() - self.opened_at))
+
+    def hedge_delay(self) -> Optional[float]:
+        """Segundos tras los que se lanza la segunda petición; None si no hay hedging."""
+        with self._lock:
+            if not self.config["hedge_enabled"] or self.state != CLOSED or len(self._latencies) < MIN_HEDGE_SAMPLES:
+                return None
+            return max(self.config["hedge_min_seconds"], percentile(self._latencies, 0.95))
+
+    # Caché de GET
+
+    @staticmethod
+    def _cache_key(url: str, kwargs: Dict[str, Any]) -> Tuple[str, str]:
+        params = kwargs.get("params") or {}
+        return url, repr(sorted(params.items()) if isinstance(params, dict) else params)
+
+    def _store(self, key: Tuple[str, str], response: requests.Response) -> None:
+        with self._lock:
+            self._cache[key] = response
+            self._cache.move_to_end(key)
+            while len(self._cache) > MAX_CACHED_RESPONSES:
+                self._cache.popitem(last=False)
+
+    def _cached(self, key: Tuple[str, str]) -> Optional[requests.Response]:
+        with self._lock:
+            response = self._cache.get(key)
+        if response is None:
+            return None
+        stale = copy.copy(response)
+        stale.headers = CaseInsensitiveDict(getattr(response, "headers", None) or {})
+        stale.headers[STALE_HEADER] = "stale"
+        return stale
+
+    # Peticiones
+
+    def _send(self, send: Callable[..., requests.Response], url: str, timeout: float, **kwargs) -> requests.Response:
+        started = time.monotonic()
+        try:
+            response = send(url, timeout=timeout, **kwargs)
+        except requests.Timeout:
+            self._count("timeouts")
+            raise DeadlineExceeded(self.name, timeout)
+        response.elapsed_seconds = time.monotonic() - started
+        return response
+
+    def _hedged(self, send: Callable[..., requests.Response], url: str, timeout: float, delay: float,
+                **kwargs) -> requests.Response:
+        deadline = time.monotonic() + timeout
+        primary = _hedge_pool.submit(self._send, send, url, timeout, **kwargs)
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            return primary.result()
+        self._count("hedges")
+        hedge = _hedge_pool.submit(self._send, send, url, timeout, **kwargs)
+        pending = {primary, hedge}
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = wait(pending, timeout=max(0.0, deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+            if not done:
+                # La petición que queda sigue en su hilo; su resultado se descarta
+                self._count("timeouts")
+                raise DeadlineExceeded(self.name, timeout)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        self._count("hedge_wins")
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def call(self, method: str, url: str, send: Optional[Callable[..., requests.Response]] = None,
+             cache: bool = True, **kwargs) -> requests.Response:
+        """
+        Petición `method` a `url` con `send(url, timeout=..., **kwargs)` (requests.request por
+        defecto). Los GET se cachean (salvo cache=False) y admiten hedging. Devuelve la
+        respuesta tal cual (también 4xx/5xx); los errores de red se propagan.
+        """
+        send = send or functools.partial(requests.request, method)
+        idempotent = method.upper() == "GET"
+        key = self._cache_key(url, kwargs) if idempotent and cache else None
+        timeout = min(kwargs.pop("timeout", None) or self.config["timeout_seconds"], self.config["timeout_seconds"])
+        self._count("requests")
+
+        allowed, probe = self._admit()
+        if not allowed:
+            cached = self._cached(key) if key else None
+            if cached is not None:
+                self._count("cache_hits")
+                return cached
+            self._count("short_circuits")
+            raise CircuitOpenError(self.name, self.retry_after())
+
+        delay = self.hedge_delay() if idempotent and not probe else None
+        try:
+            if delay is not None and delay < timeout:
+                response = self._hedged(send, url, timeout, delay, **kwargs)
+            else:
+                response = self._send(send, url, timeout, **kwargs)
+        except Exception:
+            self._record(False, probe)
+            raise
+        failed = is_failure(response)
+        self._record(not failed, probe, getattr(response, "elapsed_seconds", None))
+        if key and response.status_code == 200:
+            self._store(key, response)
+        return response
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            latencies = list(self._latencies)
+            state, failures, cached = self.state, self.consecutive_failures, len(self._cache)
+            counters = dict(self.counters)
+        delay = self.hedge_delay()
+        return {
+            "state": state,
+            "consecutive_failures": failures,
+            "retry_after_seconds": round(self.retry_after(), 1) if state != CLOSED else None,
+            **counters,
+            "latency_ms": {name: round(value * 1000) if value is not None else None
+                           for name, value in (("p50", percentile(latencies, 0.5)),
+                                               ("p95", percentile(latencies, 0.95)),
+                                               ("p99", percentile(latencies, 0.99)))},
+            "hedge_delay_ms": round(delay * 1000) if delay is not None else None,
+            "cached_responses": cached,
+            "config": dict(self.config)
+        }
+
+
+UPSTREAMS = ("github", "arm")
+_upstreams: Dict[str, Upstream] = {}
+_upstreams_lock = threading.Lock()
+
+
+def get_upstream(name: str) -> Upstream:
+    """Estado compartido por el proceso de un servicio externo."""
+    with _upstreams_lock:
+        if name not in _upstreams:
+            _upstreams[name] = Upstream(name)
+        return _upstreams[name]
+
+
+def get_metrics() -> Dict[str, Dict[str, Any]]:
+    return {name: get_upstream(name).metrics() for name in UPSTREAMS}
+
+
+def reset() -> None:
+    """Olvida el estado de los servicios (p. ej. tras cambiar la configuración en pruebas)."""
+    with _upstreams_lock:
+        _upstreams.clear()
@@ -0,0 +1,494 @@
+"""
+Planificador de refrescos recurrentes.
+
+Cada programación guarda una expresión cron de 5 campos (minuto hora día mes día_semana, en
+la zona horaria de la programación), una ventana de mantenimiento opcional y la petición de
+refresco sin contraseña: la contraseña se lee al lanzar de la app setting indicada en
+`password_setting`, para no guardar secretos en el estado. Solo se admiten app settings con
+el prefijo PG_PASSWORD_, de modo que una programación no puede enviar al workflow otros
+secretos de la Function App (token de GitHub, claves de almacenamiento...).
+
+El plan se calcula de forma determinista a partir de las programaciones y de las ejecuciones
+ya lanzadas, así que la API muestra exactamente lo que el timer va a lanzar:
+
+- Las horas cron se calculan campo a campo (mes, día, hora, minuto) en lugar de minuto a minuto.
+- Una hora cron fuera de la ventana de mantenimiento se aplaza a la siguiente apertura.
+- Las ejecuciones que comparten servidor de producción se escalonan para no solaparse,
+  usando `expected_minutes` como duración; si una ejecución no cabe completa en su ventana
+  pasa a la siguiente, y si se retrasaría más de MAX_DELAY se omite.
+
+El timer de function_app.py llama a run_due cada minuto. Cada ejecución se reserva con una
+fila única (programación, hora nominal) antes de lanzarse, por lo que dos invocaciones
+solapadas del timer no lanzan dos veces el mismo refresco.
+"""
+import datetime
+import json
+import logging
+import os
+import re
+import uuid
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+import state
+
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+DEFAULT_EXPECTED_MINUTES = 60
+# Una ejecución que no encuentra hueco en este plazo se omite en lugar de acumularse
+MAX_DELAY = datetime.timedelta(days=2)
+# Las ejecuciones lanzadas ocupan su servidor durante expected_minutes desde su inicio planificado
+FIRED_LOOKBACK = datetime.timedelta(days=2)
+# App settings de las que se puede leer la contraseña de PostgreSQL
+PASSWORD_SETTING_RE = re.compile(r"PG_PASSWORD_[A-Z0-9_]+")
+
+MACROS = {
+    "@yearly": "0 0 1 1 *",
+    "@annually": "0 0 1 1 *",
+    "@monthly": "0 0 1 * *",
+    "@weekly": "0 0 * * 0",
+    "@daily": "0 0 * * *",
+    "@midnight": "0 0 * * *",
+    "@hourly": "0 * * * *"
+}
+MONTH_NAMES = {name: index + 1 for index, name in enumerate(
+    ["jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"])}
+WEEKDAY_NAMES = {name: index for index, name in enumerate(["sun", "mon", "tue", "wed", "thu", "fri", "sat"])}
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS schedules (
+        id TEXT PRIMARY KEY,
+        name TEXT NOT NULL UNIQUE,
+        cron TEXT NOT NULL,
+        timezone TEXT NOT NULL,
+        window_start TEXT,
+        window_minutes INTEGER,
+        expected_minutes INTEGER NOT NULL,
+        enabled INTEGER NOT NULL,
+        pg_host_prod TEXT NOT NULL,
+        refresh TEXT NOT NULL,
+        password_setting TEXT NOT NULL,
+        created_at TEXT NOT NULL,
+        updated_at TEXT NOT NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS schedule_runs (
+        schedule_id TEXT NOT NULL,
+        nominal_at TEXT NOT NULL,
+        start_at TEXT NOT NULL,
+        fired_at TEXT NOT NULL,
+        status TEXT NOT NULL,
+        run_id TEXT,
+        error TEXT,
+        PRIMARY KEY (schedule_id, nominal_at)
+    )""",
+    "CREATE INDEX IF NOT EXISTS schedule_runs_start ON schedule_runs (start_at)"
+]
+
+
+def format_timestamp(value: datetime.datetime) -> str:
+    return value.strftime(TIMESTAMP_FORMAT)
+
+
+def parse_timestamp(value: str) -> datetime.datetime:
+    return datetime.datetime.strptime(value, TIMESTAMP_FORMAT)
+
+
+def _parse_value(text: str, names: Dict[str, int]) -> int:
+    text = text.lower()
+    if text in names:
+        return names[text]
+    if not text.isdigit():
+        raise ValueError(f"invalid value '{text}'")
+    return int(text)
+
+
+def parse_field(text: str, low: int, high: int, names: Optional[Dict[str, int]] = None) -> Set[int]:
+    """Valores de un campo cron: *, a, a-b, lista separada por comas y paso /n."""
+    names = names or {}
+    values = set()
+    for part in text.split(","):
+        spec, _, step_text = part.partition("/")
+        step = int(step_text) if step_text else 1
+        if step_text and (not step_text.isdigit() or step < 1):
+            raise ValueError(f"invalid step in '{part}'")
+        if spec == "*":
+            start, end = low, high
+        elif "-" in spec:
+            start, end = (_parse_value(value, names) for value in spec.split("-", 1))
+        else:
+            start = _parse_value(spec, names)
+            # 'a/n' equivale a 'a-máximo/n'
+            end = high if step_text else start
+        if start < low or end > high or start > end:
+            raise ValueError(f"'{part}' out of range {low}-{high}")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class CronExpression:
+    """Expresión cron de 5 campos con la semántica de Vixie cron."""
+
+    def __init__(self, expression: str):
+        self.expression = expression.strip()
+        fields = MACROS.get(self.expression.lower(), self.expression).split()
+        if len(fields) != 5:
+            raise ValueError(f"Cron expression '{expression}' must have 5 fields (minute hour day month weekday)")
+        try:
+            self.minutes = sorted(parse_field(fields[0], 0, 59))
+            self.hours = sorted(parse_field(fields[1], 0, 23))
+            self.days = parse_field(fields[2], 1, 31)
+            self.months = parse_field(fields[3], 1, 12, MONTH_NAMES)
+            # 7 también es domingo
+            self.weekdays = {day % 7 for day in parse_field(fields[4], 0, 7, WEEKDAY_NAMES)}
+        except ValueError as e:
+            raise ValueError(f"Invalid cron expression '{expression}': {str(e)}")
+        # Como Vixie cron, un campo que empieza por "*" (p. ej. "*/2") no cuenta como
+        # restringido para la regla O entre día del mes y día de la semana
+        self.days_restricted = not fields[2].startswith("*")
+        self.weekdays_restricted = not fields[4].startswith("*")
+        if self.next_after(datetime.datetime(2000, 1, 1)) is None:
+            raise ValueError(f"Cron expression '{expression}' never fires")
+
+    def _day_matches(self, value: datetime.datetime) -> bool:
+        day_match = value.day in self.days
+        weekday_match = (value.weekday() + 1) % 7 in self.weekdays
+        # Con día del mes y día de la semana restringidos basta con que coincida uno de los dos
+        if self.days_restricted and self.weekdays_restricted:
+            return day_match or weekday_match
+        if self.days_restricted:
+            return day_match
+        if self.weekdays_restricted:
+            return weekday_match
+        return True
+
+    def next_after(self, after: datetime.datetime) -> Optional[datetime.datetime]:
+        """Primera hora (naive, en la zona de la expresión) estrictamente posterior a `after`."""
+        value = after.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+        limit = value + datetime.timedelta(days=366 * 5)
+        while value < limit:
+            if value.month not in self.months:
+                year, month = (value.year + 1, 1) if value.month == 12 else (value.year, value.month + 1)
+                value = datetime.datetime(year, month, 1)
+                continue
+            if not self._day_matches(value):
+                value = datetime.datetime(value.year, value.month, value.day) + datetime.timedelta(days=1)
+                continue
+            if value.hour not in self.hours:
+                hour = next((hour for hour in self.hours if hour > value.hour), None)
+                if hour is None:
+                    value = datetime.datetime(value.year, value.month, value.day) + datetime.timedelta(days=1)
+                else:
+                    value = value.replace(hour=hour, minute=0)
+                continue
+            if value.minute not in self.minutes:
+                minute = next((minute for minute in self.minutes if minute > value.minute), None)
+                if minute is None:
+                    value = value.replace(minute=0) + datetime.timedelta(hours=1)
+                else:
+                    value = value.replace(minute=minute)
+                continue
+            return value
+        return None
+
+
+def get_timezone(name: str) -> ZoneInfo:
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise ValueError(f"Unknown timezone '{name}'")
+
+
+def _to_utc(local: datetime.datetime, tz: ZoneInfo) -> datetime.datetime:
+    return local.replace(tzinfo=tz).astimezone(datetime.timezone.utc).replace(tzinfo=None)
+
+
+def _to_local(value: datetime.datetime, tz: ZoneInfo) -> datetime.datetime:
+    return value.replace(tzinfo=datetime.timezone.utc).astimezone(tz).replace(tzinfo=None)
+
+
+def fire_times(cron: CronExpression, timezone: str, start: datetime.datetime,
+               end: datetime.datetime) -> List[datetime.datetime]:
+    """Horas cron (UTC naive) en [start, end)."""
+    tz = get_timezone(timezone)
+    times = []
+    local = _to_local(start, tz) - datetime.timedelta(minutes=1)
+    while True:
+        local = cron.next_after(local)
+        if local is None:
+            return times
+        value = _to_utc(local, tz)
+        if value >= end:
+            return times
+        if value >= start:
+            times.append(value)
+
+
+def parse_window_start(value: str) -> int:
+    """Minutos desde medianoche de una hora HH:MM."""
+    try:
+        hours, minutes = value.split(":")
+        hours, minutes = int(hours), int(minutes)
+    except ValueError:
+        raise ValueError(f"Invalid window start '{value}', expected HH:MM")
+    if not (0 <= hours < 24 and 0 <= minutes < 60):
+        raise ValueError(f"Invalid window start '{value}', expected HH:MM")
+    return hours * 60 + minutes
+
+
+def window_bounds(value: datetime.datetime, schedule: Dict[str, Any]) -> Tuple[datetime.datetime, datetime.datetime]:
+    """
+    Ventana de mantenimiento (UTC) que contiene `value` o, si está cerrada, la siguiente.
+    Sin ventana configurada la programación puede ejecutarse en cualquier momento.
+    """
+    if not schedule.get("window_start"):
+        return value, datetime.datetime.max
+    tz = get_timezone(schedule["timezone"])
+    opens_at = parse_window_start(schedule["window_start"])
+    local_day = _to_local(value, tz).date()
+    for offset in range(-1, 3):
+        day = datetime.datetime.combine(local_day + datetime.timedelta(days=offset), datetime.time())
+        open_local = day + datetime.timedelta(minutes=opens_at)
+        open_utc = _to_utc(open_local, tz)
+        close_utc = _to_utc(open_local + datetime.timedelta(minutes=schedule["window_minutes"]), tz)
+        if close_utc > value:
+            return open_utc, close_utc
+    raise AssertionError("unreachable: a window opens every day")
+
+
+def _place(nominal: datetime.datetime, duration: datetime.timedelta, schedule: Dict[str, Any],
+           busy: List[Tuple[datetime.datetime, datetime.datetime]]) -> Optional[datetime.datetime]:
+    """Primer inicio >= nominal dentro de la ventana y sin solaparse con `busy`."""
+    start = nominal
+    while start - nominal <= MAX_DELAY:
+        opens, closes = window_bounds(start, schedule)
+        start = max(start, opens)
+        if start + duration > closes:
+            # No cabe completa en esta ventana: se pasa a la siguiente
+            start = closes
+            continue
+        overlap = next((end for begin, end in busy if begin < start + duration and start < end), None)
+        if overlap is None:
+            return start
+        start = overlap
+    return None
+
+
+def build_plan(schedules: List[Dict[str, Any]], fired: List[Dict[str, Any]], start: datetime.datetime,
+               end: datetime.datetime, not_before: Optional[datetime.datetime] = None) -> List[Dict[str, Any]]:
+    """
+    Calcula las ejecuciones con hora nominal en [start, end) con su hora escalonada. `fired` son
+    las ejecuciones ya lanzadas (schedule_runs), que ocupan su servidor y no se vuelven a
+    planificar. Las que habría que haber lanzado antes de `not_before` quedan como 'missed'
+    y no ocupan el servidor.
+    """
+    by_id = {schedule["id"]: schedule for schedule in schedules}
+    busy: Dict[str, List[Tuple[datetime.datetime, datetime.datetime]]] = {}
+    launched = set()
+    for run in fired:
+        schedule = by_id.get(run["schedule_id"])
+        launched.add((run["schedule_id"], run["nominal_at"]))
+        if schedule is not None and run["status"] != "failed":
+            run_start = parse_timestamp(run["start_at"])
+            busy.setdefault(schedule["pg_host_prod"], []).append(
+                (run_start, run_start + datetime.timedelta(minutes=schedule["expected_minutes"])))
+
+    candidates = []
+    for schedule in schedules:
+        if not schedule["enabled"]:
+            continue
+        cron = CronExpression(schedule["cron"])
+        for nominal in fire_times(cron, schedule["timezone"], start, end):
+            if (schedule["id"], format_timestamp(nominal)) not in launched:
+                candidates.append((nominal, schedule["name"], schedule))
+
+    plan = []
+    for nominal, _, schedule in sorted(candidates, key=lambda candidate: candidate[:2]):
+        duration = datetime.timedelta(minutes=schedule["expected_minutes"])
+        host_busy = busy.setdefault(schedule["pg_host_prod"], [])
+        run_start = _place(nominal, duration, schedule, host_busy)
+        entry = {
+            "schedule_id": schedule["id"],
+            "name": schedule["name"],
+            "pg_host_prod": schedule["pg_host_prod"],
+            "nominal_at": format_timestamp(nominal),
+            "start_at": None,
+            "end_at": None,
+            "delay_minutes": None,
+            "status": "skipped"
+        }
+        if run_start is not None:
+            missed = not_before is not None and run_start < not_before
+            if not missed:
+                host_busy.append((run_start, run_start + duration))
+            entry.update({
+                "start_at": format_timestamp(run_start),
+                "end_at": format_timestamp(run_start + duration),
+                "delay_minutes": int((run_start - nominal).total_seconds() // 60),
+                "status": "missed" if missed else "planned"
+            })
+        plan.append(entry)
+    return plan
+
+
+def validate_password_setting(name: str) -> None:
+    """Lanza ValueError si la app setting no es de contraseñas de PostgreSQL (PG_PASSWORD_*)."""
+    if not PASSWORD_SETTING_RE.fullmatch(name or ""):
+        raise ValueError(f"password_setting '{name}' must be an app setting named PG_PASSWORD_<NAME>")
+
+
+def validate_schedule(schedule: Dict[str, Any]) -> None:
+    """
+    Lanza ValueError si la expresión cron, la zona horaria, la ventana o la app setting de la
+    contraseña no son válidas.
+    """
+    validate_password_setting(schedule["password_setting"])
+    CronExpression(schedule["cron"])
+    get_timezone(schedule["timezone"])
+    if schedule.get("window_start"):
+        parse_window_start(schedule["window_start"])
+        if not schedule.get("window_minutes"):
+            raise ValueError("window_minutes is required together with window_start")
+        if schedule["expected_minutes"] > schedule["window_minutes"]:
+            raise ValueError("expected_minutes does not fit in the maintenance window")
+
+
+def _row_to_schedule(row) -> Dict[str, Any]:
+    schedule = dict(row)
+    schedule["enabled"] = bool(schedule["enabled"])
+    schedule["refresh"] = json.loads(schedule["refresh"])
+    return schedule
+
+
+def _ensure_schema() -> None:
+    state.ensure_schema("scheduler", SCHEMA)
+
+
+def list_schedules() -> List[Dict[str, Any]]:
+    _ensure_schema()
+    with state.transaction() as conn:
+        rows = conn.execute("SELECT * FROM schedules ORDER BY name").fetchall()
+    return [_row_to_schedule(row) for row in rows]
+
+
+def get_schedule(schedule_id: str) -> Optional[Dict[str, Any]]:
+    _ensure_schema()
+    with state.transaction() as conn:
+        row = conn.execute("SELECT * FROM schedules WHERE id = ?", (schedule_id,)).fetchone()
+    return _row_to_schedule(row) if row else None
+
+
+def save_schedule(schedule: Dict[str, Any], schedule_id: Optional[str] = None) -> Dict[str, Any]:
+    """Crea o reemplaza una programación. Lanza ValueError si no es válida o el nombre ya existe."""
+    schedule = dict(schedule, expected_minutes=schedule.get("expected_minutes") or DEFAULT_EXPECTED_MINUTES)
+    validate_schedule(schedule)
+    _ensure_schema()
+    now = format_timestamp(datetime.datetime.utcnow())
+    with state.transaction() as conn:
+        duplicate = conn.execute("SELECT id FROM schedules WHERE name = ? AND id != ?",
+                                 (schedule["name"], schedule_id or "")).fetchone()
+        if duplicate:
+            raise ValueError(f"A schedule named '{schedule['name']}' already exists")
+        values = (
+            schedule["name"], schedule["cron"], schedule["timezone"], schedule.get("window_start"),
+            schedule.get("window_minutes"), schedule["expected_minutes"], int(schedule.get("enabled", True)),
+            schedule["pg_host_prod"], json.dumps(schedule["refresh"]), schedule["password_setting"]
+        )
+        if schedule_id is None:
+            schedule_id = uuid.uuid4().hex[:12]
+            conn.execute(
+                "INSERT INTO schedules (name, cron, timezone, window_start, window_minutes, expected_minutes, enabled, "
+                "pg_host_prod, refresh, password_setting, id, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", values + (schedule_id, now, now))
+        else:
+            updated = conn.execute(
+                "UPDATE schedules SET name = ?, cron = ?, timezone = ?, window_start = ?, window_minutes = ?, "
+                "expected_minutes = ?, enabled = ?, pg_host_prod = ?, refresh = ?, password_setting = ?, updated_at = ? "
+                "WHERE id = ?", values + (now, schedule_id))
+            if updated.rowcount == 0:
+                raise KeyError(schedule_id)
+    return get_schedule(schedule_id)
+
+
+def delete_schedule(schedule_id: str) -> bool:
+    _ensure_schema()
+    with state.transaction() as conn:
+        deleted = conn.execute("DELETE FROM schedules WHERE id = ?", (schedule_id,)).rowcount
+        conn.execute("DELETE FROM schedule_runs WHERE schedule_id = ?", (schedule_id,))
+    return deleted > 0
+
+
+def recent_runs(since: datetime.datetime, schedule_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    _ensure_schema()
+    query = "SELECT * FROM schedule_runs WHERE start_at >= ?"
+    params: Tuple[Any, ...] = (format_timestamp(since),)
+    if schedule_id:
+        query += " AND schedule_id = ?"
+        params += (schedule_id,)
+    with state.transaction() as conn:
+        return [dict(row) for row in conn.execute(query + " ORDER BY start_at DESC", params).fetchall()]
+
+
+def plan_from_state(now: datetime.datetime, hours: int, grace_minutes: int) -> List[Dict[str, Any]]:
+    """
+    Plan vigente: incluye las horas nominales de los últimos días, porque el escalonado puede
+    haberlas retrasado hasta ahora. La API y el timer usan el mismo cálculo.
+    """
+    grace = datetime.timedelta(minutes=grace_minutes)
+    return build_plan(list_schedules(), recent_runs(now - FIRED_LOOKBACK), now - MAX_DELAY - grace,
+                      now + datetime.timedelta(hours=hours), not_before=now - grace)
+
+
+def upcoming(now: datetime.datetime, hours: int, grace_minutes: int = 15) -> List[Dict[str, Any]]:
+    """Próximas ejecuciones (planificadas u omitidas) con el escalonado aplicado."""
+    plan = plan_from_state(now, hours, grace_minutes)
+    return sorted((entry for entry in plan if entry["status"] in ("planned", "skipped")),
+                  key=lambda entry: entry["start_at"] or entry["nominal_at"])
+
+
+def _claim(entry: Dict[str, Any], now: datetime.datetime) -> bool:
+    with state.transaction() as conn:
+        inserted = conn.execute(
+            "INSERT OR IGNORE INTO schedule_runs (schedule_id, nominal_at, start_at, fired_at, status) "
+            "VALUES (?, ?, ?, ?, 'dispatching')",
+            (entry["schedule_id"], entry["nominal_at"], entry["start_at"], format_timestamp(now))
+        )
+        return inserted.rowcount == 1
+
+
+def _record(entry: Dict[str, Any], status: str, run_id: Optional[str] = None, error: Optional[str] = None) -> None:
+    with state.transaction() as conn:
+        conn.execute("UPDATE schedule_runs SET status = ?, run_id = ?, error = ? WHERE schedule_id = ? AND nominal_at = ?",
+                     (status, run_id, error, entry["schedule_id"], entry["nominal_at"]))
+
+
+def run_due(now: datetime.datetime, dispatch: Callable[[Dict[str, Any]], Dict[str, Any]],
+            grace_minutes: int = 15) -> List[Dict[str, Any]]:
+    """
+    Lanza las ejecuciones planificadas cuya hora de inicio ya ha llegado (con un margen de
+    `grace_minutes` para las que se pasaron). `dispatch` recibe la petición de refresco
+    completa, con la contraseña, y devuelve la respuesta del endpoint de refresco.
+    """
+    schedules = {schedule["id"]: schedule for schedule in list_schedules()}
+    launched = []
+    for entry in plan_from_state(now, 0, grace_minutes):
+        if entry["status"] != "planned" or parse_timestamp(entry["start_at"]) > now:
+            continue
+        if not _claim(entry, now):
+            continue
+        schedule = schedules[entry["schedule_id"]]
+        try:
+            # Programaciones guardadas antes de restringir el nombre no leen otros secretos
+            validate_password_setting(schedule["password_setting"])
+            password = os.environ.get(schedule["password_setting"])
+            if not password:
+                raise RuntimeError(f"App setting {schedule['password_setting']} is not set")
+            result = dispatch(dict(schedule["refresh"], pg_password=password))
+            _record(entry, "dispatched", run_id=result.get("run_id"))
+            entry = dict(entry, status="dispatched", run_id=result.get("run_id"))
+            logging.info(f"Scheduled refresh '{schedule['name']}' dispatched (nominal {entry['nominal_at']})")
+        except Exception as e:
+            logging.exception(f"Scheduled refresh '{schedule['name']}' could not be dispatched")
+            _record(entry, "failed", error=str(getattr(e, "detail", None) or e))
+            entry = dict(entry, status="failed", error=str(e))
+        launched.append(entry)
+    return launched
@@ -0,0 +1,448 @@
+"""
+Refresco selectivo de tablas a partir de las estadísticas del catálogo.
+
+En cada refresco se guardan en stats/<servidor>/<base_de_datos>.json los contadores de
+modificación de pg_stat_user_tables (n_tup_ins/upd/del), el número de filas y el tamaño de cada
+tabla, tanto en producción (antes del dump) como en desarrollo (al terminar). En el siguiente
+refresco solo se vuelven a copiar las tablas cuyos cambios en producción superan un umbral
+relativo a su número de filas, o que se han modificado en desarrollo; el resto se reutiliza.
+
+Para las tablas refrescadas, las claves foráneas que las relacionan con cualquier otra tabla se
+eliminan, las tablas se vacían (TRUNCATE) y se copian con COPY en paralelo sobre un snapshot
+exportado común, y las claves se vuelven a crear NOT VALID y se validan (VALIDATE CONSTRAINT).
+Si una clave entre una tabla reutilizada y una refrescada no valida, la tabla reutilizada se
+añade a las refrescadas y se repite la ronda.
+
+Antes de vaciar tablas se invalidan las estadísticas guardadas (TRUNCATE no cambia los
+contadores n_tup_*, así que una tabla vaciada y no copiada parecería sin cambios). Si la copia
+falla, las claves foráneas eliminadas se vuelven a crear NOT VALID y el error se propaga: 'run'
+termina con código distinto de 0 y 3, y el siguiente refresco es completo.
+
+Se hace un refresco completo (pg_dump/pg_restore) cuando no hay estadísticas previas, el
+destino ha cambiado o se ha recreado, las estadísticas de producción se han reiniciado o el
+esquema de las tablas difiere entre producción y desarrollo.
+
+    python selective.py run --source-host H --target-host H --user U --database D \\
+        [--previous stats.json] --threshold 0.01 --stats-output stats.json --output report.json
+    python selective.py record-target --target-host H --user U --database D --stats stats.json
+
+'run' termina con código 3 si hace falta un refresco completo; en ese caso 'record-target'
+completa las estadísticas de desarrollo cuando termina la restauración. La contraseña se toma de
+PGPASSWORD, como en el resto de herramientas de PostgreSQL.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import psycopg
+from psycopg import sql
+
+from verification import ConnectionSet, build_conninfo, utc_now
+
+DEFAULT_THRESHOLD = 0.01
+DEFAULT_JOBS = 4
+MAX_VALIDATION_ROUNDS = 3
+# Código de salida de 'run' cuando la base de datos necesita un refresco completo
+EXIT_FULL_REFRESH = 3
+STATS_PREFIX = "stats"
+
+TABLE_STATS_QUERY = """
+    SELECT s.schemaname, s.relname, s.n_tup_ins, s.n_tup_upd, s.n_tup_del, s.n_live_tup, pg_total_relation_size(s.relid)
+    FROM pg_stat_user_tables s
+    JOIN pg_class c ON c.oid = s.relid
+    WHERE c.relkind = 'r'
+"""
+
+# Huella de las columnas de todas las tablas; el orden de las columnas no importa porque
+# COPY usa listas de columnas explícitas
+SCHEMA_FINGERPRINT_QUERY = """
+    SELECT md5(coalesce(string_agg(format('%s.%s.%s:%s', n.nspname, c.relname, a.attname, format_type(a.atttypid, a.atttypmod)),
+                                   ',' ORDER BY n.nspname, c.relname, a.attname), ''))
+    FROM pg_class c
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+    WHERE c.relkind IN ('r', 'p') AND n.nspname NOT IN ('pg_catalog', 'information_schema') AND n.nspname NOT LIKE 'pg_toast%'
+"""
+
+# Claves foráneas declaradas que relacionan alguna de las tablas (o sus tablas particionadas padre)
+FOREIGN_KEYS_QUERY = """
+    SELECT con.conname, con.conrelid::regclass::text, pg_get_constraintdef(con.oid)
+    FROM pg_constraint con
+    WHERE con.contype = 'f' AND con.conparentid = 0
+      AND EXISTS (SELECT 1 FROM unnest(%s::text[], %s::text[]) AS t(schema_name, table_name)
+                  JOIN pg_namespace n ON n.nspname = t.schema_name
+                  JOIN pg_class c ON c.relnamespace = n.oid AND c.relname = t.table_name
+                  CROSS JOIN LATERAL pg_partition_ancestors(c.oid) AS a(relid)
+                  WHERE a.relid IN (con.conrelid, con.confrelid))
+"""
+
+
+def stats_blob(host: str, database: str) -> str:
+    """Nombre del blob con las estadísticas del último refresco de una base de datos."""
+    return f"{STATS_PREFIX}/{host}/{database}.json"
+
+
+def capture_stats(conn: psycopg.Connection) -> Dict[str, Any]:
+    """Contadores y tamaños por tabla, huella del esquema e identidad de la base de datos."""
+    tables = {
+        f"{schema}.{name}": {"n_tup_ins": ins, "n_tup_upd": upd, "n_tup_del": dele, "n_live_tup": live, "size_bytes": size}
+        for schema, name, ins, upd, dele, live, size in conn.execute(TABLE_STATS_QUERY).fetchall()
+    }
+    database_oid, stats_reset = conn.execute(
+        "SELECT d.oid, s.stats_reset::text FROM pg_database d LEFT JOIN pg_stat_database s ON s.datid = d.oid "
+        "WHERE d.datname = current_database()"
+    ).fetchone()
+    return {
+        "captured_at": utc_now(),
+        "database_oid": database_oid,
+        "stats_reset": stats_reset,
+        "schema_fingerprint": conn.execute(SCHEMA_FINGERPRINT_QUERY).fetchone()[0],
+        "tables": tables
+    }
+
+
+def _modifications(table: Dict[str, Any]) -> int:
+    return table["n_tup_ins"] + table["n_tup_upd"] + table["n_tup_del"]
+
+
+def invalidate_stats(previous: Dict[str, Any]) -> Dict[str, Any]:
+    """Registro que obliga al siguiente refresco a ser completo (se guarda antes de vaciar tablas)."""
+    return dict(previous, target=None, invalidated_at=utc_now())
+
+
+def plan_selective(previous: Optional[Dict[str, Any]], source: Dict[str, Any], target: Optional[Dict[str, Any]],
+                   target_host: str, threshold: float = DEFAULT_THRESHOLD) -> Dict[str, Any]:
+    """
+    Decide qué tablas se vuelven a copiar comparando las estadísticas actuales con las del último
+    refresco. Devuelve mode "full" con el motivo, o mode "selective" con las tablas a refrescar
+    (y el motivo de cada una) y las reutilizadas.
+    """
+    def full(reason: str) -> Dict[str, Any]:
+        return {"mode": "full", "reason": reason, "refresh": [], "reuse": []}
+
+    if previous is not None and previous.get("invalidated_at"):
+        return full("the previous selective refresh did not complete")
+    if previous is None or not previous.get("target"):
+        return full("no statistics from a previous refresh")
+    if previous.get("target_host") != target_host:
+        return full(f"the previous refresh went to {previous.get('target_host')}")
+    if target is None:
+        return full("the database does not exist on the dev server")
+    if target["database_oid"] != previous["target"]["database_oid"]:
+        return full("the dev database was recreated after the previous refresh")
+    if source["stats_reset"] != previous["source"]["stats_reset"]:
+        return full("statistics were reset on the production server")
+    if source["schema_fingerprint"] != target["schema_fingerprint"]:
+        return full("table definitions differ between production and dev")
+
+    refresh, reuse = [], []
+    for name, current in sorted(source["tables"].items()):
+        before = previous["source"]["tables"].get(name)
+        dev_before = previous["target"]["tables"].get(name)
+        dev_now = target["tables"].get(name)
+        reason, changes = None, None
+        if before is None:
+            reason = "new table"
+        else:
+            changes = _modifications(current) - _modifications(before)
+            rows = max(before["n_live_tup"], 1)
+            size_change = abs(current["size_bytes"] - before["size_bytes"]) / max(before["size_bytes"], 1)
+            if changes < 0:
+                reason = "statistics reset"
+            elif changes / rows > threshold:
+                reason = "changed"
+            elif size_change > threshold:
+                reason = "size changed"
+            elif dev_before is None or dev_now is None or _modifications(dev_now) != _modifications(dev_before):
+                reason = "modified on dev"
+        entry = {"table": name, "changes": changes, "rows": current["n_live_tup"], "size_bytes": current["size_bytes"]}
+        if reason:
+            refresh.append(dict(entry, reason=reason))
+        else:
+            reuse.append(entry)
+    return {"mode": "selective", "reason": None, "refresh": refresh, "reuse": reuse}
+
+
+def _split(name: str) -> Tuple[str, str]:
+    schema, _, table = name.partition(".")
+    return schema, table
+
+
+def _table_columns(conn: psycopg.Connection, name: str) -> List[str]:
+    return [row[0] for row in conn.execute(
+        "SELECT a.attname::text FROM pg_attribute a JOIN pg_class c ON c.oid = a.attrelid "
+        "JOIN pg_namespace n ON n.oid = c.relnamespace "
+        "WHERE n.nspname = %s AND c.relname = %s AND a.attnum > 0 AND NOT a.attisdropped AND a.attgenerated = '' "
+        "ORDER BY a.attnum", _split(name)
+    ).fetchall()]
+
+
+def _copy_tables(tables: List[str], source_conninfo: str, target_conninfo: str, snapshot_id: str, jobs: int) -> Dict[str, Dict[str, Any]]:
+    """Copia tablas completas de producción a desarrollo con hasta 'jobs' flujos COPY en paralelo."""
+    stats: Dict[str, Dict[str, Any]] = {}
+    lock = threading.Lock()
+    sources = ConnectionSet(source_conninfo, jobs, snapshot_id)
+    targets = ConnectionSet(target_conninfo, jobs)
+
+    def copy_table(name: str) -> None:
+        started = time.monotonic()
+        copied = 0
+        relation = sql.Identifier(*_split(name))
+        with sources.connection() as source, targets.connection() as target:
+            columns = sql.SQL(", ").join(sql.Identifier(column) for column in _table_columns(source, name))
+            with source.cursor().copy(sql.SQL("COPY (SELECT {} FROM ONLY {}) TO STDOUT").format(columns, relation)) as copy_out:
+                with target.cursor().copy(sql.SQL("COPY {} ({}) FROM STDIN").format(relation, columns)) as copy_in:
+                    for data in copy_out:
+                        copy_in.write(data)
+                        copied += len(data)
+        with lock:
+            stats[name] = {"bytes": copied, "seconds": round(time.monotonic() - started, 1)}
+
+    try:
+        with ThreadPoolExecutor(max_workers=jobs, thread_name_prefix="selective-copy") as pool:
+            for future in [pool.submit(copy_table, name) for name in tables]:
+                future.result()
+    finally:
+        sources.close()
+        targets.close()
+    return stats
+
+
+def _restore_foreign_keys(conn: psycopg.Connection, foreign_keys: List[Tuple[str, str, str]]) -> None:
+    """Vuelve a crear NOT VALID las claves eliminadas por una ronda que ha fallado."""
+    for constraint, relation, definition in foreign_keys:
+        statement = sql.SQL("ALTER TABLE {} ADD CONSTRAINT {} {} NOT VALID").format(
+            sql.SQL(relation), sql.Identifier(constraint), sql.SQL(definition))
+        try:
+            conn.execute(statement)
+        except Exception as e:
+            logging.error(f"Could not re-create foreign key {constraint} on {relation} ({definition}): {str(e)}")
+
+
+def refresh_tables(source_conninfo: str, target_conninfo: str, tables: List[str], jobs: int = DEFAULT_JOBS) -> Dict[str, Any]:
+    """
+    Vuelve a copiar las tablas indicadas en desarrollo y valida las claves foráneas que las
+    relacionan con el resto. Una tabla reutilizada cuya clave foránea no valida contra las
+    tablas refrescadas se refresca en la ronda siguiente. Si algo falla, las claves eliminadas
+    se vuelven a crear (NOT VALID) antes de propagar el error.
+    """
+    pending = list(tables)
+    refreshed: List[str] = []
+    copied: Dict[str, Dict[str, Any]] = {}
+    # Claves eliminadas en la ronda en curso que aún no se han vuelto a crear
+    dropped: List[Tuple[str, str, str]] = []
+    with psycopg.connect(source_conninfo, autocommit=True) as exporter, \
+            psycopg.connect(target_conninfo, autocommit=True) as target:
+        try:
+            rounds = _refresh_rounds(exporter, target, source_conninfo, target_conninfo, pending, refreshed,
+                                     copied, dropped, jobs)
+        except Exception:
+            if dropped:
+                logging.error(f"Selective refresh failed; re-creating {len(dropped)} dropped foreign keys as NOT VALID")
+                _restore_foreign_keys(target, dropped)
+            raise
+
+        sequences = exporter.execute(
+            "SELECT schemaname, sequencename, last_value FROM pg_sequences WHERE last_value IS NOT NULL"
+        ).fetchall()
+        exporter.execute("COMMIT")
+        for schema, name, last_value in sequences:
+            target.execute("SELECT setval(format('%%I.%%I', %s::text, %s::text), %s)", (schema, name, last_value))
+        for name in refreshed:
+            target.execute(sql.SQL("ANALYZE {}").format(sql.Identifier(*_split(name))))
+    return {"refreshed": refreshed, "copied": copied, "rounds": rounds}
+
+
+def _refresh_rounds(exporter: psycopg.Connection, target: psycopg.Connection, source_conninfo: str,
+                    target_conninfo: str, pending: List[str], refreshed: List[str], copied: Dict[str, Dict[str, Any]],
+                    dropped: List[Tuple[str, str, str]], jobs: int) -> List[Dict[str, Any]]:
+    """Rondas de vaciado, copia y validación de claves; `dropped` lleva las claves pendientes de recrear."""
+    rounds = []
+    # Todas las rondas copian el mismo estado de producción
+    exporter.execute("BEGIN ISOLATION LEVEL REPEATABLE READ READ ONLY")
+    snapshot_id = exporter.execute("SELECT pg_export_snapshot()").fetchone()[0]
+
+    while pending:
+        if len(rounds) == MAX_VALIDATION_ROUNDS:
+            raise RuntimeError(f"Foreign keys still fail after {MAX_VALIDATION_ROUNDS} rounds: {', '.join(pending)}")
+        started = time.monotonic()
+        round_tables = len(pending)
+        schemas, names = zip(*(_split(name) for name in pending))
+        foreign_keys = target.execute(FOREIGN_KEYS_QUERY, (list(schemas), list(names))).fetchall()
+
+        for constraint, relation, definition in foreign_keys:
+            # En el log por si no se pudieran volver a crear
+            logging.info(f"Dropping foreign key {constraint} on {relation}: {definition}")
+        with target.transaction():
+            for constraint, relation, _ in foreign_keys:
+                target.execute(sql.SQL("ALTER TABLE {} DROP CONSTRAINT {}").format(sql.SQL(relation), sql.Identifier(constraint)))
+            target.execute(sql.SQL("TRUNCATE {}").format(
+                sql.SQL(", ").join(sql.SQL("ONLY {}").format(sql.Identifier(*_split(name))) for name in pending)))
+        dropped[:] = foreign_keys
+        copied.update(_copy_tables(pending, source_conninfo, target_conninfo, snapshot_id, jobs))
+        refreshed.extend(pending)
+
+        # NOT VALID evita comprobar las filas al crear la clave; VALIDATE lo hace sin bloquear escrituras
+        failed = []
+        for foreign_key in foreign_keys:
+            constraint, relation, definition = foreign_key
+            target.execute(sql.SQL("ALTER TABLE {} ADD CONSTRAINT {} {} NOT VALID").format(
+                sql.SQL(relation), sql.Identifier(constraint), sql.SQL(definition)))
+            dropped.remove(foreign_key)
+            try:
+                target.execute(sql.SQL("ALTER TABLE {} VALIDATE CONSTRAINT {}").format(sql.SQL(relation), sql.Identifier(constraint)))
+            except psycopg.errors.ForeignKeyViolation:
+                failed.append(foreign_key)
+
+        pending = []
+        for constraint, relation, _ in failed:
+            # La clave queda NOT VALID; en la siguiente ronda se refresca la tabla reutilizada implicada
+            reused = [name for name in _foreign_key_tables(target, constraint, relation) if name not in refreshed]
+            if not reused:
+                raise RuntimeError(f"Foreign key {constraint} on {relation} does not validate after refreshing both tables")
+            pending.extend(name for name in reused if name not in pending)
+        rounds.append({"tables": round_tables,
+                       "foreign_keys": len(foreign_keys), "failed_foreign_keys": [fk[0] for fk in failed],
+                       "seconds": round(time.monotonic() - started, 1)})
+    return rounds
+
+
+def _foreign_key_tables(conn: psycopg.Connection, constraint: str, relation: str) -> List[str]:
+    """Tablas físicas (particiones incluidas) de los dos extremos de una clave foránea."""
+    return [row[0] for row in conn.execute(
+        "SELECT DISTINCT n.nspname || '.' || c.relname FROM pg_constraint con "
+        "CROSS JOIN LATERAL (VALUES (con.conrelid), (con.confrelid)) AS ends(relid) "
+        "CROSS JOIN LATERAL (SELECT relid FROM pg_partition_tree(ends.relid) WHERE isleaf) AS leaf "
+        "JOIN pg_class c ON c.oid = leaf.relid JOIN pg_namespace n ON n.oid = c.relnamespace "
+        "WHERE con.conname = %s AND con.conrelid = %s::regclass",
+        (constraint, relation)
+    ).fetchall()]
+
+
+def run_selective(source: Tuple[str, int], target: Tuple[str, int], database: str, user: str, password: str,
+                  previous: Optional[Dict[str, Any]], source_host: str, target_host: str,
+                  threshold: float = DEFAULT_THRESHOLD, jobs: int = DEFAULT_JOBS,
+                  invalidate: Optional[Callable[[Dict[str, Any]], None]] = None) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Planifica y, si es posible, aplica el refresco selectivo. Devuelve el informe 'selective' y el
+    registro de estadísticas; con mode "full" el llamador hace el refresco completo y completa el
+    registro con record_target al terminar. Antes de vaciar tablas se llama a `invalidate` con el
+    registro invalidado (invalidate_stats) para que el llamador lo guarde en lugar del anterior.
+    """
+    started_at = utc_now()
+    started = time.monotonic()
+    source_conninfo = build_conninfo(source[0], database, user, source[1], password)
+    target_conninfo = build_conninfo(target[0], database, user, target[1], password)
+
+    # Las estadísticas de producción se toman antes de copiar: los cambios posteriores se
+    # vuelven a contar en el siguiente refresco en lugar de perderse
+    with psycopg.connect(source_conninfo, autocommit=True) as conn:
+        source_stats = capture_stats(conn)
+    try:
+        with psycopg.connect(target_conninfo, autocommit=True) as conn:
+            target_stats = capture_stats(conn)
+    except psycopg.OperationalError:
+        target_stats = None
+
+    plan = plan_selective(previous, source_stats, target_stats, target_host, threshold)
+    record = {"version": 1, "database": database, "source_host": source_host, "target_host": target_host,
+              "threshold": threshold, "source": source_stats, "target": None}
+    report = {
+        "database": database,
+        "mode": plan["mode"],
+        "reason": plan["reason"],
+        "threshold": threshold,
+        "tables_total": len(source_stats["tables"]),
+        "tables_reused": len(plan["reuse"]),
+        "bytes_reused": sum(table["size_bytes"] for table in plan["reuse"]),
+        "refresh": plan["refresh"],
+        "started_at": started_at
+    }
+    if plan["mode"] == "selective":
+        if invalidate is not None:
+            invalidate(invalidate_stats(previous))
+        result = refresh_tables(source_conninfo, target_conninfo, [table["table"] for table in plan["refresh"]], jobs)
+        escalated = [name for name in result["refreshed"] if name not in {table["table"] for table in plan["refresh"]}]
+        report.update({
+            "tables_refreshed": len(result["refreshed"]),
+            "tables_reused": len(plan["reuse"]) - len(escalated),
+            "bytes_copied": sum(table["bytes"] for table in result["copied"].values()),
+            "escalated": escalated,
+            "rounds": result["rounds"],
+            "copy": result["copied"]
+        })
+        record_target(record, target_conninfo)
+    report.update({"completed_at": utc_now(), "total_seconds": round(time.monotonic() - started, 1)})
+    return report, record
+
+
+def record_target(record: Dict[str, Any], target_conninfo: str) -> Dict[str, Any]:
+    """Completa el registro con las estadísticas de desarrollo tras el refresco."""
+    with psycopg.connect(target_conninfo, autocommit=True) as conn:
+        # Los contadores de las conexiones de carga ya cerradas pueden tardar en publicarse
+        time.sleep(1)
+        conn.execute("SELECT pg_stat_clear_snapshot()")
+        record["target"] = capture_stats(conn)
+    return record
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Change-aware selective table refresh")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    run = subparsers.add_parser("run")
+    record = subparsers.add_parser("record-target")
+    for sub in (run, record):
+        sub.add_argument("--target-host", required=True)
+        sub.add_argument("--target-port", type=int, default=5432)
+        sub.add_argument("--user", required=True)
+        sub.add_argument("--database", required=True)
+    run.add_argument("--source-host", required=True)
+    run.add_argument("--source-port", type=int, default=5432)
+    run.add_argument("--source-name", help="Server name recorded in the statistics (defaults to --source-host)")
+    run.add_argument("--target-name", help="Server name recorded in the statistics (defaults to --target-host)")
+    run.add_argument("--previous", help="Statistics of the previous refresh (missing file: full refresh)")
+    run.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    run.add_argument("--jobs", type=int, default=DEFAULT_JOBS)
+    run.add_argument("--stats-output", required=True)
+    run.add_argument("--output", required=True)
+    record.add_argument("--stats", required=True)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    password = os.environ.get("PGPASSWORD", "")
+
+    if args.command == "record-target":
+        with open(args.stats) as file:
+            stats = json.load(file)
+        record_target(stats, build_conninfo(args.target_host, args.database, args.user, args.target_port, password))
+        with open(args.stats, "w") as file:
+            json.dump(stats, file)
+        return 0
+
+    previous = None
+    if args.previous and os.path.exists(args.previous):
+        with open(args.previous) as file:
+            previous = json.load(file)
+    report, stats = run_selective(
+        (args.source_host, args.source_port), (args.target_host, args.target_port), args.database, args.user, password,
+        previous, args.source_name or args.source_host, args.target_name or args.target_host, args.threshold, args.jobs
+    )
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=2)
+    with open(args.stats_output, "w") as file:
+        json.dump(stats, file)
+    if report["mode"] == "full":
+        logging.info(f"Full refresh of {args.database} required: {report['reason']}")
+        return EXIT_FULL_REFRESH
+    logging.info(f"{args.database}: {report['tables_refreshed']} tables refreshed, {report['tables_reused']} reused "
+                 f"({report['bytes_copied']} bytes copied)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
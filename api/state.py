@@ -0,0 +1,71 @@
+"""
+Estado persistente de la API en SQLite.
+
+Cada módulo declara sus tablas con `ensure_schema` y accede a ellas con `transaction()`.
+Se usa una única conexión por proceso protegida por un lock: el volumen de escrituras es
+mínimo (programaciones, operaciones en curso) y así no hay contención entre hilos del host.
+El fichero se ubica según STATE_DB_PATH (ver config.get_state_config).
+"""
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Iterator, List, Optional
+
+from config import get_state_config
+
+_lock = threading.RLock()
+_connection: Optional[sqlite3.Connection] = None
+_connection_path: Optional[str] = None
+_schemas_applied = set()
+
+
+def _connect() -> sqlite3.Connection:
+    global _connection, _connection_path
+    path = get_state_config()["db_path"]
+    if _connection is None or _connection_path != path:
+        if _connection is not None:
+            _connection.close()
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # isolation_level None: las transacciones se abren explícitamente en transaction()
+        _connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        _connection.row_factory = sqlite3.Row
+        _connection_path = path
+        _schemas_applied.clear()
+    return _connection
+
+
+def ensure_schema(name: str, statements: List[str]) -> None:
+    """Crea las tablas de un módulo la primera vez que se usan en el proceso."""
+    with _lock:
+        conn = _connect()
+        if name in _schemas_applied:
+            return
+        for statement in statements:
+            conn.execute(statement)
+        _schemas_applied.add(name)
+
+
+@contextmanager
+def transaction() -> Iterator[sqlite3.Connection]:
+    """Transacción con escritura reservada (BEGIN IMMEDIATE); se confirma al salir sin error."""
+    with _lock:
+        conn = _connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+
+def reset() -> None:
+    """Cierra la conexión (tests o cambio de STATE_DB_PATH)."""
+    global _connection, _connection_path
+    with _lock:
+        if _connection is not None:
+            _connection.close()
+        _connection, _connection_path = None, None
+        _schemas_applied.clear()
@@ -0,0 +1,122 @@
+import json
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceExistsError, ResourceModifiedError, ResourceNotFoundError
+from azure.identity import DefaultAzureCredential
+from azure.storage.blob import BlobServiceClient, ContainerClient
+
+from config import get_storage_config
+
+# Los clientes de Blob Storage mantienen un pool de conexiones, por lo que se
+# reutilizan entre peticiones en lugar de crearse en cada llamada.
+_clients_lock = threading.Lock()
+_service_clients: Dict[str, BlobServiceClient] = {}
+_credential = None
+
+
+def _get_service_client(storage_account: str) -> BlobServiceClient:
+    global _credential
+    with _clients_lock:
+        client = _service_clients.get(storage_account)
+        if client is None:
+            connection_string = get_storage_config()["connection_string"]
+            if connection_string:
+                client = BlobServiceClient.from_connection_string(connection_string)
+            else:
+                if _credential is None:
+                    _credential = DefaultAzureCredential()
+                client = BlobServiceClient(
+                    account_url=f"https://{storage_account}.blob.core.windows.net",
+                    credential=_credential
+                )
+            _service_clients[storage_account] = client
+        return client
+
+
+def get_container_client(storage_account: str, container: str) -> ContainerClient:
+    """Devuelve un cliente del contenedor indicado reutilizando el cliente de la cuenta."""
+    return _get_service_client(storage_account).get_container_client(container)
+
+
+def read_json_blob(storage_account: str, container: str, blob_name: str) -> Optional[Any]:
+    """Lee y decodifica un blob JSON. Devuelve None si el blob no existe."""
+    try:
+        data = get_container_client(storage_account, container).download_blob(blob_name).readall()
+    except ResourceNotFoundError:
+        logging.info(f"Blob {container}/{blob_name} no encontrado en {storage_account}")
+        return None
+    return json.loads(data)
+
+
+def write_json_blob(storage_account: str, container: str, blob_name: str, payload: Any) -> None:
+    """Serializa y sube un documento JSON, sobrescribiendo el blob si ya existe."""
+    get_container_client(storage_account, container).upload_blob(
+        blob_name,
+        json.dumps(payload, separators=(",", ":")).encode("utf-8"),
+        overwrite=True
+    )
+
+
+def list_blob_names(storage_account: str, container: str, prefix: str) -> List[str]:
+    """Lista los nombres de blob bajo un prefijo."""
+    container_client = get_container_client(storage_account, container)
+    return [blob.name for blob in container_client.list_blobs(name_starts_with=prefix)]
+
+
+def upload_file_blob(storage_account: str, container: str, blob_name: str, path: str) -> None:
+    """Sube un fichero local, sobrescribiendo el blob si ya existe."""
+    with open(path, "rb") as file:
+        get_container_client(storage_account, container).upload_blob(blob_name, file, overwrite=True, max_concurrency=4)
+
+
+def download_file_blob(storage_account: str, container: str, blob_name: str, path: str) -> bool:
+    """Descarga un blob a un fichero local. Devuelve False si el blob no existe."""
+    try:
+        downloader = get_container_client(storage_account, container).download_blob(blob_name, max_concurrency=4)
+    except ResourceNotFoundError:
+        return False
+    with open(path, "wb") as file:
+        downloader.readinto(file)
+    return True
+
+
+def update_json_blob(
+    storage_account: str,
+    container: str,
+    blob_name: str,
+    update: Callable[[Any], Any],
+    initial: Any,
+    max_retries: int = 5
+) -> Any:
+    """
+    Aplica `update` sobre un blob JSON con control de concurrencia optimista por ETag,
+    igual que json_blob_update en scripts/blob.sh. Si el blob no existe se parte de `initial`.
+    Devuelve el documento escrito.
+    """
+    container_client = get_container_client(storage_account, container)
+    for attempt in range(1, max_retries + 1):
+        blob_client = container_client.get_blob_client(blob_name)
+        try:
+            downloader = blob_client.download_blob()
+            document = json.loads(downloader.readall())
+            etag = downloader.properties.etag
+        except ResourceNotFoundError:
+            document = json.loads(json.dumps(initial))
+            etag = None
+
+        updated = update(document)
+        data = json.dumps(updated, separators=(",", ":")).encode("utf-8")
+        try:
+            if etag:
+                blob_client.upload_blob(data, overwrite=True, etag=etag, match_condition=MatchConditions.IfNotModified)
+            else:
+                blob_client.upload_blob(data, overwrite=False)
+            return updated
+        except (ResourceModifiedError, ResourceExistsError):
+            logging.info(f"Update conflict on {container}/{blob_name} (attempt {attempt} of {max_retries}), retrying...")
+            time.sleep(attempt)
+    raise RuntimeError(f"Could not update {container}/{blob_name} after {max_retries} attempts")
@@ -0,0 +1,392 @@
+"""
+Refresco de un subconjunto referencialmente consistente de una base de datos.
+
+El operador elige unas tablas raíz y, para cada una, un ratio de muestreo (TABLESAMPLE
+BERNOULLI ... REPEATABLE, reproducible con la misma semilla) o un filtro WHERE. A partir de
+ellas se recorren las claves foráneas del catálogo:
+
+1. Hacia abajo, una vez por tabla: las filas hijas de las filas seleccionadas (los pedidos de
+   los clientes elegidos, las líneas de esos pedidos...). Las autorreferencias no se siguen en
+   este sentido para no arrastrar la tabla completa.
+2. Hacia arriba, hasta un punto fijo: las filas padre a las que apunta cualquier fila
+   seleccionada, de modo que todas las claves foráneas de la copia se resuelven.
+
+Las tablas que no se alcanzan desde ninguna raíz se copian vacías (para copiarlas enteras basta
+con añadirlas como raíz con ratio 1). La selección se guarda como (tableoid, ctid) en tablas
+temporales de una conexión de planificación que exporta su snapshot; los workers lo importan y
+copian las filas por lotes de ctid (Tid Scan) con COPY en paralelo, directamente de producción a
+desarrollo y sin fichero intermedio. El esquema se restaura en el orden de pg_restore:
+pre-data antes de los datos y post-data (índices, claves, triggers) después.
+
+El módulo solo depende de psycopg para poder ejecutarse tanto desde la API como desde los
+scripts del workflow:
+
+    python subset.py --source-host H --target-host H --user U --database D --spec '{"roots": [...]}' --output report.json
+
+La contraseña se toma de PGPASSWORD, como en el resto de herramientas de PostgreSQL.
+"""
+import argparse
+import collections
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import psycopg
+from psycopg import sql
+
+from verification import ConnectionSet, build_conninfo, utc_now
+
+DEFAULT_JOBS = 4
+# Filas por COPY; cada lote viaja como un array de ctid en la consulta
+COPY_BATCH_ROWS = 50000
+
+TABLES_QUERY = """
+    SELECT c.oid, n.nspname, c.relname,
+           array_agg(a.attname::text ORDER BY a.attnum) FILTER (WHERE a.attnum > 0 AND NOT a.attisdropped AND a.attgenerated = '')
+    FROM pg_class c
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    JOIN pg_attribute a ON a.attrelid = c.oid
+    WHERE c.relkind IN ('r', 'p') AND NOT c.relispartition
+      AND n.nspname NOT IN ('pg_catalog', 'information_schema') AND n.nspname NOT LIKE 'pg_toast%'
+      AND NOT EXISTS (SELECT 1 FROM pg_depend d WHERE d.objid = c.oid AND d.deptype = 'e')
+    GROUP BY c.oid, n.nspname, c.relname
+"""
+
+# Claves foráneas declaradas (las copias en particiones, con conparentid, se omiten)
+FOREIGN_KEYS_QUERY = """
+    SELECT con.conname, con.conrelid, con.confrelid,
+           (SELECT array_agg(a.attname::text ORDER BY k.ord) FROM unnest(con.conkey) WITH ORDINALITY AS k(attnum, ord)
+            JOIN pg_attribute a ON a.attrelid = con.conrelid AND a.attnum = k.attnum),
+           (SELECT array_agg(a.attname::text ORDER BY k.ord) FROM unnest(con.confkey) WITH ORDINALITY AS k(attnum, ord)
+            JOIN pg_attribute a ON a.attrelid = con.confrelid AND a.attnum = k.attnum)
+    FROM pg_constraint con
+    WHERE con.contype = 'f' AND con.conparentid = 0
+"""
+
+
+def parse_table_name(name: str) -> Tuple[str, str]:
+    """'schema.tabla' o 'tabla' (esquema public)."""
+    schema, _, table = name.rpartition(".")
+    return schema or "public", table
+
+
+def load_catalog(conn: psycopg.Connection) -> Tuple[Dict[str, Dict[str, Any]], List[Dict[str, Any]]]:
+    """Tablas de usuario (por 'schema.tabla') y claves foráneas entre ellas."""
+    tables, by_oid = {}, {}
+    for oid, schema, name, columns in conn.execute(TABLES_QUERY).fetchall():
+        key = f"{schema}.{name}"
+        tables[key] = {"schema": schema, "table": name, "columns": columns or []}
+        by_oid[oid] = key
+    foreign_keys = []
+    for name, child, parent, child_columns, parent_columns in conn.execute(FOREIGN_KEYS_QUERY).fetchall():
+        if child in by_oid and parent in by_oid:
+            foreign_keys.append({
+                "name": name, "child": by_oid[child], "parent": by_oid[parent],
+                "child_columns": child_columns, "parent_columns": parent_columns
+            })
+    return tables, foreign_keys
+
+
+def plan_subset(tables: Dict[str, Any], foreign_keys: List[Dict[str, Any]], roots: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Planifica el recorrido: las raíces normalizadas y las claves foráneas que se siguen hacia
+    abajo, en orden de recorrido en anchura desde las raíces. El cierre hacia arriba se aplica
+    sobre todas las claves foráneas hasta que no añade filas.
+    """
+    normalized = []
+    for root in roots:
+        key = "{}.{}".format(*parse_table_name(root["table"]))
+        if key not in tables:
+            raise ValueError(f"Root table {root['table']} does not exist")
+        if (root.get("ratio") is None) == (root.get("where") is None):
+            raise ValueError(f"Root table {root['table']} needs exactly one of ratio or where")
+        normalized.append(dict(root, table=key))
+
+    children = collections.defaultdict(list)
+    for fk in foreign_keys:
+        if fk["child"] != fk["parent"]:
+            children[fk["parent"]].append(fk)
+
+    root_tables = {root["table"] for root in normalized}
+    visited = set(root_tables)
+    queue = collections.deque(sorted(root_tables))
+    downward = []
+    while queue:
+        parent = queue.popleft()
+        for fk in sorted(children[parent], key=lambda fk: (fk["child"], fk["name"])):
+            if fk["child"] in visited:
+                continue
+            visited.add(fk["child"])
+            downward.append(fk)
+            queue.append(fk["child"])
+    return {"roots": normalized, "downward": downward}
+
+
+def _relation(tables: Dict[str, Any], key: str) -> sql.Composable:
+    return sql.Identifier(tables[key]["schema"], tables[key]["table"])
+
+
+def _join_condition(fk: Dict[str, Any]) -> sql.Composable:
+    return sql.SQL(" AND ").join(
+        sql.SQL("p.{} = c.{}").format(sql.Identifier(parent), sql.Identifier(child))
+        for parent, child in zip(fk["parent_columns"], fk["child_columns"])
+    )
+
+
+class SubsetSelection:
+    """
+    Selección de filas en tablas temporales (tableoid, ctid) de la conexión de planificación,
+    que debe tener abierta una transacción REPEATABLE READ con el snapshot exportado.
+    """
+
+    def __init__(self, conn: psycopg.Connection, tables: Dict[str, Any]):
+        self.conn = conn
+        self.tables = tables
+        self._selected: Dict[str, sql.Identifier] = {}
+
+    def selection_table(self, key: str) -> sql.Identifier:
+        if key not in self._selected:
+            name = sql.Identifier(f"subset_{len(self._selected)}")
+            self.conn.execute(sql.SQL(
+                "CREATE TEMP TABLE {} (source oid, row_id tid, PRIMARY KEY (source, row_id)) ON COMMIT DROP"
+            ).format(name))
+            self._selected[key] = name
+        return self._selected[key]
+
+    @property
+    def selected_tables(self) -> List[str]:
+        return list(self._selected)
+
+    def _insert(self, key: str, query: sql.Composable) -> int:
+        cursor = self.conn.execute(sql.SQL("INSERT INTO {} {} ON CONFLICT DO NOTHING").format(self.selection_table(key), query))
+        return cursor.rowcount
+
+    def add_root(self, root: Dict[str, Any], seed: int) -> int:
+        relation = _relation(self.tables, root["table"])
+        if root.get("ratio") is not None:
+            query = sql.SQL("SELECT tableoid, ctid FROM {} TABLESAMPLE BERNOULLI ({}) REPEATABLE ({})").format(
+                relation, sql.Literal(float(root["ratio"]) * 100), sql.Literal(seed))
+        else:
+            # El filtro lo escribe el operador, que ya dispone de las credenciales de producción
+            query = sql.SQL("SELECT tableoid, ctid FROM {} WHERE {}").format(relation, sql.SQL(root["where"]))
+        return self._insert(root["table"], query)
+
+    def add_children(self, fk: Dict[str, Any]) -> int:
+        """Filas de la tabla hija que apuntan a filas seleccionadas de la tabla padre."""
+        return self._insert(fk["child"], sql.SQL(
+            "SELECT c.tableoid, c.ctid FROM {child} c JOIN {parent} p ON {condition} "
+            "JOIN {selected} s ON s.source = p.tableoid AND s.row_id = p.ctid"
+        ).format(child=_relation(self.tables, fk["child"]), parent=_relation(self.tables, fk["parent"]),
+                 condition=_join_condition(fk), selected=self.selection_table(fk["parent"])))
+
+    def add_parents(self, fk: Dict[str, Any]) -> int:
+        """Filas de la tabla padre a las que apuntan filas seleccionadas de la tabla hija."""
+        return self._insert(fk["parent"], sql.SQL(
+            "SELECT p.tableoid, p.ctid FROM {parent} p JOIN {child} c ON {condition} "
+            "JOIN {selected} s ON s.source = c.tableoid AND s.row_id = c.ctid"
+        ).format(child=_relation(self.tables, fk["child"]), parent=_relation(self.tables, fk["parent"]),
+                 condition=_join_condition(fk), selected=self.selection_table(fk["child"])))
+
+    def close_upward(self, foreign_keys: List[Dict[str, Any]]) -> int:
+        """Añade filas padre hasta que todas las claves foráneas de la selección se resuelven."""
+        passes = 0
+        while True:
+            passes += 1
+            added = sum(self.add_parents(fk) for fk in foreign_keys if fk["child"] in self._selected)
+            if not added:
+                return passes
+
+    def batches(self, key: str, batch_rows: int = COPY_BATCH_ROWS) -> Iterator[Tuple[sql.Composable, List[str]]]:
+        """Lotes de ctid por relación física (cada partición de una tabla particionada por separado)."""
+        query = sql.SQL(
+            "SELECT n.nspname, c.relname, s.row_id::text FROM {} s "
+            "JOIN pg_class c ON c.oid = s.source JOIN pg_namespace n ON n.oid = c.relnamespace "
+            "ORDER BY s.source, s.row_id"
+        ).format(self.selection_table(key))
+        current, row_ids = None, []
+        for schema, name, row_id in self.conn.execute(query):
+            if (schema, name) != current or len(row_ids) >= batch_rows:
+                if row_ids:
+                    yield sql.Identifier(*current), row_ids
+                current, row_ids = (schema, name), []
+            row_ids.append(row_id)
+        if row_ids:
+            yield sql.Identifier(*current), row_ids
+
+
+def _run_pg_tool(pg_bin_dir: Optional[str], args: List[str], password: str) -> None:
+    command = [os.path.join(pg_bin_dir, args[0]) if pg_bin_dir else args[0], *args[1:]]
+    result = subprocess.run(command, env=dict(os.environ, PGPASSWORD=password),
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, errors="replace")
+    if result.returncode != 0:
+        if args[0] == "pg_restore":
+            # Como en restore.sh: pg_restore termina con advertencias (roles, extensiones) y la base de datos es utilizable
+            logging.warning(f"pg_restore completed with warnings or errors: {result.stderr.strip()[-500:]}")
+        else:
+            raise RuntimeError(f"{args[0]} failed with exit code {result.returncode}: {result.stderr.strip()[-500:]}")
+
+
+def run_subset(source: Tuple[str, int], target: Tuple[str, int], database: str, user: str, password: str,
+               spec: Dict[str, Any], jobs: int = DEFAULT_JOBS, work_dir: Optional[str] = None,
+               pg_bin_dir: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Recrea la base de datos en desarrollo con el esquema completo de producción y el
+    subconjunto de filas descrito en spec ({"roots": [{"table", "ratio" | "where"}], "seed"}).
+    Devuelve el informe 'subset' con filas, bytes y tiempos por tabla.
+    """
+    started_at = utc_now()
+    started = time.monotonic()
+    phases: Dict[str, float] = {}
+    seed = int(spec.get("seed", 0))
+    source_conninfo = build_conninfo(source[0], database, user, source[1], password)
+    target_conninfo = build_conninfo(target[0], database, user, target[1], password)
+    work_dir = tempfile.mkdtemp(prefix="subset.", dir=work_dir)
+    schema_file = os.path.join(work_dir, f"{database}.schema.dump")
+    target_args = ["-h", target[0], "-p", str(target[1]), "-U", user, "-d", database]
+
+    def phase(name: str, since: float) -> None:
+        phases[name] = round(time.monotonic() - since, 1)
+
+    try:
+        with psycopg.connect(source_conninfo, autocommit=True) as planner:
+            # Transacción de lectura con snapshot exportado; no READ ONLY porque la selección
+            # se guarda en tablas temporales
+            planner.execute("BEGIN ISOLATION LEVEL REPEATABLE READ")
+            snapshot_id = planner.execute("SELECT pg_export_snapshot()").fetchone()[0]
+            source_size = planner.execute("SELECT pg_database_size(current_database())").fetchone()[0]
+
+            since = time.monotonic()
+            _run_pg_tool(pg_bin_dir, ["pg_dump", "-h", source[0], "-p", str(source[1]), "-U", user, "-d", database,
+                                      "--schema-only", "-F", "c", f"--snapshot={snapshot_id}", "-f", schema_file], password)
+            with psycopg.connect(build_conninfo(target[0], "postgres", user, target[1], password), autocommit=True) as admin:
+                admin.execute(sql.SQL("DROP DATABASE IF EXISTS {} WITH (FORCE)").format(sql.Identifier(database)))
+                admin.execute(sql.SQL("CREATE DATABASE {}").format(sql.Identifier(database)))
+            _run_pg_tool(pg_bin_dir, ["pg_restore", *target_args, "--section=pre-data", schema_file], password)
+            phase("pre_data", since)
+
+            since = time.monotonic()
+            tables, foreign_keys = load_catalog(planner)
+            plan = plan_subset(tables, foreign_keys, spec.get("roots", []))
+            selection = SubsetSelection(planner, tables)
+            for root in plan["roots"]:
+                selection.add_root(root, seed)
+            for fk in plan["downward"]:
+                selection.add_children(fk)
+            closure_passes = selection.close_upward(foreign_keys)
+            phase("plan", since)
+
+            since = time.monotonic()
+            table_stats = _copy_selection(selection, tables, source_conninfo, target_conninfo, snapshot_id, jobs)
+            phase("data", since)
+
+            since = time.monotonic()
+            sequences = planner.execute(
+                "SELECT schemaname, sequencename, last_value FROM pg_sequences WHERE last_value IS NOT NULL"
+            ).fetchall()
+            planner.execute("COMMIT")
+
+        with psycopg.connect(target_conninfo, autocommit=True) as conn:
+            # Las secuencias continúan después de los valores de producción (pg_dump --schema-only no los incluye)
+            for schema, name, last_value in sequences:
+                conn.execute("SELECT setval(format('%%I.%%I', %s::text, %s::text), %s)", (schema, name, last_value))
+        _run_pg_tool(pg_bin_dir, ["pg_restore", *target_args, "--section=post-data", "-j", str(jobs), schema_file], password)
+        _run_pg_tool(pg_bin_dir, ["vacuumdb", *target_args, "--analyze-only", "--jobs", str(jobs)], password)
+        phase("post_data", since)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    total_rows = sum(stats["rows"] for stats in table_stats.values())
+    total_bytes = sum(stats["bytes"] for stats in table_stats.values())
+    return {
+        "database": database,
+        "seed": seed,
+        "roots": plan["roots"],
+        "jobs": jobs,
+        "tables_total": len(tables),
+        "tables_copied": len(table_stats),
+        "closure_passes": closure_passes,
+        "rows": total_rows,
+        "bytes": total_bytes,
+        "source_database_size_bytes": source_size,
+        "sequences_synced": len(sequences),
+        "tables": [dict(table=key, **stats) for key, stats in sorted(table_stats.items(), key=lambda item: -item[1]["bytes"])],
+        "started_at": started_at,
+        "completed_at": utc_now(),
+        "total_seconds": round(time.monotonic() - started, 1),
+        "phases": phases
+    }
+
+
+def _copy_selection(selection: SubsetSelection, tables: Dict[str, Any], source_conninfo: str, target_conninfo: str,
+                    snapshot_id: str, jobs: int) -> Dict[str, Dict[str, Any]]:
+    """Copia los lotes de ctid seleccionados con hasta 'jobs' flujos COPY en paralelo."""
+    stats: Dict[str, Dict[str, Any]] = {}
+    lock = threading.Lock()
+    sources = ConnectionSet(source_conninfo, jobs, snapshot_id)
+    targets = ConnectionSet(target_conninfo, jobs)
+
+    def copy_batch(key: str, relation: sql.Composable, row_ids: List[str]) -> None:
+        columns = sql.SQL(", ").join(sql.Identifier(column) for column in tables[key]["columns"])
+        started = time.monotonic()
+        copied = 0
+        with sources.connection() as source, targets.connection() as target:
+            with source.cursor().copy(sql.SQL("COPY (SELECT {} FROM {} WHERE ctid = ANY({}::tid[])) TO STDOUT").format(
+                    columns, relation, sql.Literal(row_ids))) as copy_out:
+                with target.cursor().copy(sql.SQL("COPY {} ({}) FROM STDIN").format(_relation(tables, key), columns)) as copy_in:
+                    for data in copy_out:
+                        copy_in.write(data)
+                        copied += len(data)
+        with lock:
+            table = stats.setdefault(key, {"rows": 0, "bytes": 0, "seconds": 0.0})
+            table["rows"] += len(row_ids)
+            table["bytes"] += copied
+            table["seconds"] = round(table["seconds"] + time.monotonic() - started, 1)
+
+    try:
+        with ThreadPoolExecutor(max_workers=jobs, thread_name_prefix="subset-copy") as pool:
+            # Los lotes se leen de la conexión de planificación mientras los workers copian
+            futures = [pool.submit(copy_batch, key, relation, row_ids)
+                       for key in selection.selected_tables
+                       for relation, row_ids in selection.batches(key)]
+            for future in futures:
+                future.result()
+    finally:
+        sources.close()
+        targets.close()
+    return stats
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Referentially consistent subset refresh")
+    parser.add_argument("--source-host", required=True)
+    parser.add_argument("--source-port", type=int, default=5432)
+    parser.add_argument("--target-host", required=True)
+    parser.add_argument("--target-port", type=int, default=5432)
+    parser.add_argument("--user", required=True)
+    parser.add_argument("--database", required=True)
+    parser.add_argument("--spec", required=True, help="JSON: {\"roots\": [{\"table\": ..., \"ratio\" | \"where\": ...}], \"seed\": 0}")
+    parser.add_argument("--jobs", type=int, default=DEFAULT_JOBS)
+    parser.add_argument("--work-dir")
+    parser.add_argument("--output", required=True)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    report = run_subset((args.source_host, args.source_port), (args.target_host, args.target_port), args.database,
+                        args.user, os.environ.get("PGPASSWORD", ""), json.loads(args.spec), args.jobs, args.work_dir)
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=2)
+    logging.info(f"Subset of {args.database}: {report['rows']} rows, {report['bytes']} bytes "
+                 f"in {report['tables_copied']} tables ({report['total_seconds']}s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
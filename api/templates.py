@@ -0,0 +1,149 @@
+"""
+Plantillas de base de datos en el servidor de desarrollo.
+
+Un refresco con restore_target="template" restaura el backup una sola vez en la base de datos
+<base_de_datos>__tpl, que queda cerrada a conexiones y con sus metadatos de frescura (backup,
+fecha de los datos, fecha de restauración) en el comentario de la base de datos. Los resets
+posteriores recrean la base de datos de trabajo con CREATE DATABASE ... TEMPLATE, una copia
+a nivel de fichero (STRATEGY FILE_COPY a partir de PostgreSQL 15) que tarda segundos en lugar
+de repetir el pg_restore completo.
+
+Se usa desde la API y desde restore.sh:
+
+    python templates.py seal --host H --user U --database D --backup B [--source-host S] [--backup-created-at T]
+    python templates.py clone --host H --user U --database D
+
+La contraseña se toma de PGPASSWORD, como en el resto de herramientas de PostgreSQL.
+"""
+import argparse
+import datetime
+import json
+import logging
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+import psycopg
+from psycopg import sql
+
+TEMPLATE_SUFFIX = "__tpl"
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+# Longitud máxima de un identificador en PostgreSQL
+MAX_IDENTIFIER_LENGTH = 63
+
+
+def utc_now() -> str:
+    return datetime.datetime.utcnow().strftime(TIMESTAMP_FORMAT)
+
+
+def template_name(database: str) -> str:
+    """Nombre de la plantilla de una base de datos."""
+    name = f"{database}{TEMPLATE_SUFFIX}"
+    if len(name) > MAX_IDENTIFIER_LENGTH:
+        raise ValueError(f"Database name {database} is too long to derive a template name")
+    return name
+
+
+def read_template(conn: psycopg.Connection, database: str) -> Optional[Dict[str, Any]]:
+    """Metadatos de la plantilla de una base de datos, o None si no existe."""
+    row = conn.execute(
+        "SELECT shobj_description(oid, 'pg_database'), datallowconn, pg_database_size(oid) "
+        "FROM pg_database WHERE datname = %s",
+        (template_name(database),)
+    ).fetchone()
+    if row is None:
+        return None
+    comment, allow_connections, size_bytes = row
+    try:
+        metadata = json.loads(comment) if comment else {}
+    except ValueError:
+        metadata = {"comment": comment}
+    metadata.update({"template": template_name(database), "sealed": not allow_connections, "size_bytes": size_bytes})
+    return metadata
+
+
+def template_age_minutes(metadata: Dict[str, Any], now: Optional[datetime.datetime] = None) -> Optional[float]:
+    """
+    Antigüedad de los datos de la plantilla en minutos: desde la creación del backup si se
+    conoce y, si no, desde la restauración.
+    """
+    now = now or datetime.datetime.utcnow()
+    for key in ("backup_created_at", "restored_at"):
+        if metadata.get(key):
+            try:
+                created = datetime.datetime.strptime(metadata[key], TIMESTAMP_FORMAT)
+            except ValueError:
+                continue
+            return round((now - created).total_seconds() / 60, 1)
+    return None
+
+
+def seal_template(conn: psycopg.Connection, database: str, metadata: Dict[str, Any]) -> None:
+    """
+    Cierra la plantilla a nuevas conexiones (CREATE DATABASE ... TEMPLATE falla si hay sesiones
+    abiertas en ella) y guarda sus metadatos de frescura en el comentario de la base de datos.
+    """
+    name = sql.Identifier(template_name(database))
+    conn.execute(sql.SQL("ALTER DATABASE {} WITH ALLOW_CONNECTIONS false").format(name))
+    conn.execute(sql.SQL("SELECT pg_terminate_backend(pid) FROM pg_stat_activity WHERE datname = {}").format(
+        sql.Literal(template_name(database))))
+    conn.execute(sql.SQL("COMMENT ON DATABASE {} IS {}").format(name, sql.Literal(json.dumps(metadata))))
+
+
+def clone_from_template(conn: psycopg.Connection, database: str, template: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Recrea la base de datos de trabajo como copia de su plantilla (o de la base de datos
+    indicada en template, que no debe tener conexiones abiertas).
+    """
+    template = template or template_name(database)
+    started = time.monotonic()
+    # FILE_COPY copia los ficheros de la plantilla tras un checkpoint, en lugar de escribir
+    # cada bloque en el WAL (WAL_LOG, la estrategia por defecto desde PostgreSQL 15)
+    strategy = sql.SQL(" STRATEGY = FILE_COPY") if conn.info.server_version >= 150000 else sql.SQL("")
+    conn.execute(sql.SQL("DROP DATABASE IF EXISTS {} WITH (FORCE)").format(sql.Identifier(database)))
+    conn.execute(sql.SQL("CREATE DATABASE {} TEMPLATE {}{}").format(
+        sql.Identifier(database), sql.Identifier(template), strategy))
+    return {"database": database, "template": template, "clone_seconds": round(time.monotonic() - started, 1)}
+
+
+def _admin_connection(args: argparse.Namespace) -> psycopg.Connection:
+    return psycopg.connect(host=args.host, port=args.port, dbname="postgres", user=args.user,
+                           application_name="pg-templates", autocommit=True)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Template databases for fast dev resets")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    for name in ("seal", "clone"):
+        sub = subparsers.add_parser(name)
+        sub.add_argument("--host", required=True)
+        sub.add_argument("--port", type=int, default=5432)
+        sub.add_argument("--user", required=True)
+        sub.add_argument("--database", required=True)
+        if name == "seal":
+            sub.add_argument("--backup", required=True)
+            sub.add_argument("--source-host")
+            sub.add_argument("--backup-created-at")
+            sub.add_argument("--run-id")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    with _admin_connection(args) as conn:
+        if args.command == "seal":
+            seal_template(conn, args.database, {
+                "database": args.database,
+                "backup": args.backup,
+                "source_host": args.source_host,
+                "backup_created_at": args.backup_created_at,
+                "restored_at": utc_now(),
+                "run_id": args.run_id
+            })
+            logging.info(f"Template {template_name(args.database)} sealed with backup {args.backup}")
+        else:
+            result = clone_from_template(conn, args.database)
+            logging.info(f"Database {args.database} cloned from {result['template']} in {result['clone_seconds']}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,139 @@
+import datetime
+import pytest
+import sys
+import os
+
+# Agregar el directorio de la API al path para importar los módulos
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from catalog import filter_backups, latest_backup, manifest_name
+
+NOW = datetime.datetime(2026, 3, 1, 12, 0, 0)
+
+BACKUPS = [
+    {"name": "sales_20260301_100000.dump", "database": "sales", "source_host": "prod-a",
+     "created_at": "2026-03-01T10:00:00Z", "status": "valid"},
+    {"name": "sales_20260301_113000.dump", "database": "sales", "source_host": "prod-a",
+     "created_at": "2026-03-01T11:30:00Z", "status": "invalid"},
+    {"name": "sales_20260228_090000.dump", "database": "sales", "source_host": "prod-b",
+     "created_at": "2026-02-28T09:00:00Z", "status": "valid"},
+    {"name": "hr_20260301_110000.dump", "database": "hr", "source_host": "prod-a",
+     "created_at": "2026-03-01T11:00:00Z", "status": "valid"},
+]
+
+def test_manifest_name():
+    """The manifest lives next to the dump with the same base name"""
+    assert manifest_name("sales_20260301_100000.dump") == "sales_20260301_100000.manifest.json"
+
+def test_filter_backups_orders_newest_first():
+    """Only valid backups are returned by default, newest first"""
+    names = [b["name"] for b in filter_backups(BACKUPS, now=NOW)]
+    assert names == ["hr_20260301_110000.dump", "sales_20260301_100000.dump", "sales_20260228_090000.dump"]
+
+def test_filter_backups_by_database_host_and_age():
+    """Filters combine database, source host and maximum age"""
+    matches = filter_backups(BACKUPS, pg_database="sales", max_age=datetime.timedelta(hours=6), now=NOW)
+    assert [b["name"] for b in matches] == ["sales_20260301_100000.dump"]
+    assert filter_backups(BACKUPS, pg_database="sales", pg_host="prod-b", now=NOW)[0]["source_host"] == "prod-b"
+
+def test_latest_backup():
+    """The latest backup ignores invalid entries unless asked for any status"""
+    assert latest_backup(BACKUPS, pg_database="sales", now=NOW)["name"] == "sales_20260301_100000.dump"
+    assert latest_backup(BACKUPS, pg_database="sales", status=None, now=NOW)["name"] == "sales_20260301_113000.dump"
+    assert latest_backup(BACKUPS, pg_database="sales", max_age=datetime.timedelta(minutes=10), now=NOW) is None
+
+def _request(**overrides):
+    from main import WorkflowRequest
+    data = {
+        "pg_host_prod": "prod-a", "pg_host_dev": "dev-a", "pg_database": "sales",
+        "pg_user": "postgres", "pg_password": "secret", "resource_group": "rg",
+        "storage_account": "acct", "storage_container": "backups"
+    }
+    data.update(overrides)
+    return WorkflowRequest(**data)
+
+def test_resolve_backup_plan_reuses_fresh_backup(monkeypatch):
+    """A fresh catalogued backup is reused instead of dumping production again"""
+    import main
+    fresh = dict(BACKUPS[0], created_at=datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ"))
+    monkeypatch.setattr(main, "load_catalog", lambda *args: {"backups": [fresh]})
+    plan = main.resolve_backup_plan(_request(max_backup_age=60))
+    assert plan["source"] == "reused"
+    assert main.build_workflow_options(_request(), {"sales": plan})["backups"] == {"sales": fresh["name"]}
+
+def test_resolve_backup_plan_restore_only_without_backup(monkeypatch):
+    """restore_only fails when no backup is fresh enough"""
+    import main
+    from fastapi import HTTPException
+    monkeypatch.setattr(main, "load_catalog", lambda *args: {"backups": BACKUPS})
+    assert main.resolve_backup_plan(_request(max_backup_age=5))["source"] == "new"
+    for overrides, status_code in (({"max_backup_age": 5}, 409), ({}, 422)):
+        with pytest.raises(HTTPException) as excinfo:
+            main.resolve_backup_plan(_request(restore_only=True, **overrides))
+        assert excinfo.value.status_code == status_code
+
+def test_resolve_databases():
+    """Exactly one database selector is accepted and names are validated"""
+    import main
+    from fastapi import HTTPException
+    assert main.resolve_databases(_request()) == ["sales"]
+    assert main.resolve_databases(_request(pg_database=None, pg_databases=["sales", "hr", "sales"])) == ["sales", "hr"]
+    assert main.resolve_databases(_request(pg_database=None, all_databases=True)) is None
+    for overrides in ({"all_databases": True}, {"pg_database": None}, {"pg_database": "sales; drop"}):
+        with pytest.raises(HTTPException) as excinfo:
+            main.resolve_databases(_request(**overrides))
+        assert excinfo.value.status_code == 422
+
+def test_resolve_backup_plans_per_database(monkeypatch):
+    """Backups are reused per database; backup_name only applies to a single database"""
+    import main
+    from fastapi import HTTPException
+    fresh = dict(BACKUPS[3], created_at=datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ"))
+    monkeypatch.setattr(main, "load_catalog", lambda *args: {"backups": [fresh]})
+    plans = main.resolve_backup_plans(_request(max_backup_age=60), ["sales", "hr"])
+    assert plans["sales"]["source"] == "new"
+    assert plans["hr"]["name"] == fresh["name"]
+    assert main.build_workflow_options(_request(), plans)["backups"] == {"hr": fresh["name"]}
+    with pytest.raises(HTTPException):
+        main.resolve_backup_plans(_request(backup_name="x.dump"), ["sales", "hr"])
+    with pytest.raises(HTTPException):
+        main.resolve_backup_plans(_request(max_backup_age=60), None)
+
+def test_validate_subset():
+    """Subsets copy a single database straight from production"""
+    import main
+    from fastapi import HTTPException
+    subset = {"roots": [{"table": "public.customers", "ratio": 0.05}]}
+    main.validate_subset(_request(subset=subset), ["sales"])
+    assert main.build_workflow_options(_request(subset=subset), {})["subset"] == dict(subset, seed=0)
+    for overrides, databases in (({}, ["sales", "hr"]), ({"max_backup_age": 60}, ["sales"]),
+                                 ({"restore_target": "template"}, ["sales"])):
+        with pytest.raises(HTTPException) as excinfo:
+            main.validate_subset(_request(subset=subset, **overrides), databases)
+        assert excinfo.value.status_code == 422
+
+def test_validate_selective():
+    """Selective refreshes read production statistics and cannot reuse backups"""
+    import main
+    from fastapi import HTTPException
+    main.validate_selective(_request(selective=True))
+    assert main.build_workflow_options(_request(selective=True, selective_threshold=0.05), {})["selective"] == {"threshold": 0.05}
+    assert "selective" not in main.build_workflow_options(_request(), {})
+    for overrides in ({"backup_name": "sales.dump"}, {"subset": {"roots": [{"table": "t", "ratio": 0.1}]}}):
+        with pytest.raises(HTTPException) as excinfo:
+            main.validate_selective(_request(selective=True, **overrides))
+        assert excinfo.value.status_code == 422
+
+def test_template_names_must_fit_an_identifier(monkeypatch):
+    """Databases whose <name>__tpl exceeds 63 characters are rejected with 422"""
+    import main
+    from fastapi import HTTPException
+    long_name = "d" * 59
+    main.validate_template_names(["sales", "d" * 58])
+    monkeypatch.setattr(main.psycopg, "connect", lambda *args, **kwargs: pytest.fail("must not connect"))
+    reset = main.TemplateResetRequest(pg_host_dev="dev", pg_database=long_name, pg_user="u", pg_password="p")
+    for call in (lambda: main.dispatch_refresh(_request(pg_database=long_name, restore_target="template")),
+                 lambda: main.reset_from_template(reset)):
+        with pytest.raises(HTTPException) as excinfo:
+            call()
+        assert excinfo.value.status_code == 422
@@ -0,0 +1,107 @@
+import random
+import sys
+import os
+
+import pytest
+
+# Agregar el directorio de la API al path para importar los módulos
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from azure.core.exceptions import ResourceExistsError
+
+import chunkstore
+from chunkstore import chunk_boundaries, chunk_file, chunk_manifest_name
+
+SIZES = {"min_size": 2048, "avg_size": 8192, "max_size": 32768}
+
+def _data(size, seed=1):
+    return random.Random(seed).randbytes(size)
+
+class FakeContainer:
+    """Contenedor en memoria con la misma semántica de overwrite que el SDK"""
+    def __init__(self):
+        self.blobs = {}
+        self.uploads = 0
+
+    def upload_blob(self, name, data, overwrite=False):
+        if name in self.blobs and not overwrite:
+            raise ResourceExistsError("exists")
+        self.uploads += 1
+        self.blobs[name] = data
+
+    def download_blob(self, name):
+        data = self.blobs[name]
+        return type("Downloader", (), {"readall": lambda self: data})()
+
+@pytest.fixture
+def container(monkeypatch):
+    fake = FakeContainer()
+    documents = {}
+    monkeypatch.setattr(chunkstore, "get_container_client", lambda account, name: fake)
+    monkeypatch.setattr(chunkstore, "list_blob_names", lambda account, name, prefix: [n for n in fake.blobs if n.startswith(prefix)])
+    monkeypatch.setattr(chunkstore, "write_json_blob", lambda account, name, blob, payload: documents.__setitem__(blob, payload))
+    monkeypatch.setattr(chunkstore, "read_json_blob", lambda account, name, blob: documents.get(blob))
+    fake.documents = documents
+    return fake
+
+def test_chunk_manifest_name():
+    """The chunk manifest sits next to the backup, like the regular manifest"""
+    assert chunk_manifest_name("sales_20260301_020000.dump") == "sales_20260301_020000.chunks.json"
+
+def test_chunk_boundaries_respect_size_bounds():
+    """Chunks cover the whole buffer and stay within the configured sizes"""
+    data = _data(512 * 1024)
+    boundaries = chunk_boundaries(data, **SIZES)
+    assert sum(length for _, length in boundaries) == len(data)
+    assert all(SIZES["min_size"] <= length <= SIZES["max_size"] for _, length in boundaries[:-1])
+    assert boundaries == chunk_boundaries(data, **SIZES)
+    # Datos sin variación (páginas vacías) cortan en el máximo
+    assert {length for _, length in chunk_boundaries(bytes(100000), **SIZES)} == {32768, 100000 - 3 * 32768}
+
+def test_chunk_boundaries_resynchronize_after_insert():
+    """An insertion only changes the chunks around it"""
+    data = _data(512 * 1024)
+    edited = data[:100000] + b"inserted row" * 10 + data[100000:]
+    original = {data[offset:offset + length] for offset, length in chunk_boundaries(data, **SIZES)}
+    changed = [edited[offset:offset + length] for offset, length in chunk_boundaries(edited, **SIZES)]
+    assert len([chunk for chunk in changed if chunk not in original]) <= 2
+
+def test_chunk_file_segments(tmp_path):
+    """Each segment ends in a forced cut"""
+    path = tmp_path / "db.dump"
+    path.write_bytes(_data(300000))
+    boundaries = chunk_file(str(path), workers=1, segment_size=100000, **SIZES)
+    assert sum(length for _, length in boundaries) == 300000
+    assert {100000, 200000} <= {offset for offset, _ in boundaries}
+
+def test_put_and_get_deduplicate(container, tmp_path):
+    """A second backup with a small change only uploads the chunks that changed"""
+    first, second = tmp_path / "first.dump", tmp_path / "second.dump"
+    data = _data(400 * 1024)
+    first.write_bytes(data)
+    second.write_bytes(data[:200000] + b"new" * 100 + data[200000:])
+
+    stats = chunkstore.put_file("acct", "backups", "db_1.dump", str(first), jobs=2, workers=1, **SIZES)
+    assert stats["new_chunks"] == stats["chunks"]
+    assert stats["dedup_ratio"] == 1.0
+
+    stats = chunkstore.put_file("acct", "backups", "db_2.dump", str(second), jobs=2, workers=1, **SIZES)
+    assert 0 < stats["new_chunks"] <= 2
+    assert stats["bytes_uploaded"] < stats["bytes_total"] / 10
+    assert stats["dedup_ratio"] > 10
+    assert container.documents["db_2.chunks.json"]["size_bytes"] == second.stat().st_size
+
+    restored = tmp_path / "restored.dump"
+    assert chunkstore.get_file("acct", "backups", "db_2.dump", str(restored), jobs=2)
+    assert restored.read_bytes() == second.read_bytes()
+    assert not chunkstore.get_file("acct", "backups", "legacy.dump", str(restored))
+
+def test_get_detects_corrupted_chunk(container, tmp_path):
+    """A chunk whose content does not match its digest aborts the restore"""
+    path = tmp_path / "db.dump"
+    path.write_bytes(_data(100000))
+    chunkstore.put_file("acct", "backups", "db.dump", str(path), workers=1, **SIZES)
+    name = next(name for name in container.blobs)
+    container.blobs[name] = chunkstore.zlib.compress(b"garbage")
+    with pytest.raises(RuntimeError, match="corrupted"):
+        chunkstore.get_file("acct", "backups", "db.dump", str(tmp_path / "restored.dump"))
@@ -0,0 +1,81 @@
+import sys
+import os
+
+# Agregar el directorio de la API al path para importar los módulos
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from estimator import (DEFAULT_THROUGHPUT, build_sample, effective_parallelism, estimate_database, quantile,
+                       schedule_total, select_samples)
+
+GB = 1024 ** 3
+
+def _sample(database="sales", host="prod-a", dump=50e6, transfer=100e6, restore=20e6, compression=0.25):
+    return {"database": database, "source_host": host, "dump": dump, "transfer": transfer,
+            "restore": restore, "compression": compression}
+
+def test_quantile_and_parallelism():
+    """A table larger than the rest cannot be split between pg_restore jobs"""
+    assert quantile([1, 2, 3, 4, 5], 0.5) == 3
+    assert quantile([10, 20], 0.9) == 19
+    assert effective_parallelism([100, 100, 100, 100], 8) == 4
+    assert effective_parallelism([900, 50, 50], 8) == 1000 / 900
+    assert effective_parallelism([100, 100], 1) == 1.0
+    assert effective_parallelism([], 4) == 1.0
+
+def test_build_sample_from_history():
+    """Throughputs come from the catalog entry, the manifest timings and the restore report"""
+    entry = {"database": "sales", "source_host": "prod-a", "database_size_bytes": 1000, "size_bytes": 250, "dump_seconds": 10}
+    manifest = {"timings": {"upload_seconds": 4}, "tables": [{"size_bytes": 500}, {"size_bytes": 500}]}
+    restore = {"profile": "fast", "jobs": 4, "total_seconds": 26, "phases": {"download": 1}}
+    sample = build_sample(entry, manifest, restore)
+    assert sample["dump"] == 100
+    assert sample["compression"] == 0.25
+    assert sample["transfer"] == 250 * 2 / 5
+    # 25 s de restauración con dos tablas iguales: dos flujos efectivos
+    assert sample["restore"] == 1000 / 25 / 2
+
+    legacy = build_sample(dict(entry, dump_seconds=0), None, None)
+    assert legacy["dump"] == 1000
+    assert legacy["transfer"] is None and legacy["restore"] is None
+
+def test_select_samples_prefers_same_database():
+    """The most specific group with enough samples is used"""
+    samples = [_sample(dump=10)] * 3 + [_sample(database="hr", dump=99)] * 5
+    assert select_samples(samples, "dump", "sales", "prod-a") == ([10] * 3, "database")
+    values, basis = select_samples(samples, "dump", "crm", "prod-a")
+    assert basis == "server" and len(values) == 8
+    assert select_samples([], "dump", "sales", "prod-a") == ([], "default")
+
+def test_estimate_database_bounds():
+    """Predictions scale with the database size and the bounds enclose the median"""
+    samples = [_sample(dump=d, restore=r) for d, r in ((40e6, 15e6), (50e6, 20e6), (60e6, 25e6), (55e6, 22e6))]
+    estimate = estimate_database("sales", "prod-a", 10 * GB, [5 * GB, 5 * GB], samples,
+                                 {"restore_profile": "fast", "restore_jobs": 8})
+    assert estimate["backup_size_bytes"] == int(10 * GB * 0.25)
+    assert estimate["restore_parallelism"] == 2.0
+    for phase in ("dump", "transfer", "restore"):
+        assert estimate[phase]["low_seconds"] <= estimate[phase]["seconds"] <= estimate[phase]["high_seconds"]
+        assert estimate[phase]["basis"] == "database"
+    assert estimate["total"]["seconds"] == sum(estimate[phase]["seconds"] for phase in ("dump", "transfer", "restore"))
+
+    reused = estimate_database("sales", "prod-a", 10 * GB, [10 * GB], samples, {}, reused_backup={"size_bytes": GB})
+    assert reused["dump"] is None
+    assert reused["backup_reused"] is True
+    # Solo se descarga el backup reutilizado
+    assert reused["transfer"]["seconds"] == round(GB / 100e6)
+
+def test_estimate_database_without_history():
+    """Without history the defaults are used with wide bounds"""
+    estimate = estimate_database("sales", "prod-a", GB, [GB], [], {}, local=True)
+    assert estimate["dump"]["basis"] == "default"
+    assert estimate["dump"]["seconds"] == round(GB / DEFAULT_THROUGHPUT["dump"])
+    assert estimate["dump"]["high_seconds"] == round(2 * GB / DEFAULT_THROUGHPUT["dump"])
+    # Ejecutor local: la subida se solapa con la restauración
+    assert estimate["total"]["seconds"] == estimate["dump"]["seconds"] + max(estimate["transfer"]["seconds"], estimate["restore"]["seconds"])
+
+def test_schedule_total():
+    """Databases start in order as soon as a pipeline slot is free"""
+    totals = [{"seconds": s, "low_seconds": s, "high_seconds": s} for s in (100, 30, 30, 50)]
+    assert schedule_total(totals, 1)["seconds"] == 210
+    assert schedule_total(totals, 2)["seconds"] == 110
+    assert schedule_total(totals, 8)["seconds"] == 100
@@ -0,0 +1,174 @@
+import os
+import shutil
+import sys
+import time
+from types import SimpleNamespace
+
+import pytest
+
+# Agregar el directorio de la API al path para importar los módulos
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import executors
+from executors import LocalExecutor, LocalRun, is_local_run, resolve_host
+
+def _request(**overrides):
+    data = {
+        "pg_host_prod": "prod-a", "pg_host_dev": "dev-a", "pg_user": "postgres", "pg_password": "secret",
+        "resource_group": "rg", "storage_account": "acct", "storage_container": "backups"
+    }
+    data.update(overrides)
+    return SimpleNamespace(**data)
+
+def _wait_completed(executor, run_id, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        status = executor.get_status(run_id)
+        if status["status"] == "completed":
+            return status
+        time.sleep(0.1)
+    raise AssertionError(f"Run {run_id} did not complete in {timeout}s")
+
+def test_resolve_host():
+    """Short names are Flexible Servers; FQDNs, IPs and localhost are used as-is"""
+    assert resolve_host("prod-a", "postgres.database.azure.com") == ("prod-a.postgres.database.azure.com", 5432)
+    assert resolve_host("db.example.com:6432") == ("db.example.com", 6432)
+    assert resolve_host("localhost:5433") == ("localhost", 5433)
+
+def test_local_run_status_model():
+    """Local runs report jobs and steps with the same keys as GitHub runs"""
+    run = LocalRun("local-abc", "test")
+    job = run.add_job("refresh sales")
+    with run.step(job, "Create backup"):
+        pass
+    with pytest.raises(RuntimeError):
+        with run.step(job, "Restore backup"):
+            raise RuntimeError("boom")
+    run.finish_job(job, "failure")
+    run.set_status("completed", "failure")
+
+    status = run.snapshot()
+    assert is_local_run(status["id"])
+    assert status["conclusion"] == "failure"
+    assert set(status["jobs"][0]) == {"id", "name", "status", "conclusion", "started_at", "completed_at", "duration", "steps"}
+    assert [step["conclusion"] for step in status["jobs"][0]["steps"]] == ["success", "failure"]
+
+def test_local_run_summary_view():
+    """The summary view counts jobs and steps instead of listing them"""
+    run = LocalRun("local-abc", "test")
+    done = run.add_job("prepare")
+    with run.step(done, "Resolve databases"):
+        pass
+    run.finish_job(done, "success")
+    running = run.add_job("refresh sales")
+    run.start_step(running, "Create backup")
+    run.add_job("refresh crm")
+
+    status = run.snapshot("summary")
+    assert "jobs" not in status
+    assert status["job_summary"] == {
+        "total": 3, "queued": 1, "in_progress": 1, "completed": 1, "failed": 0,
+        "steps_total": 2, "steps_completed": 1, "current_job": "refresh sales", "current_step": "Create backup"
+    }
+
+def test_local_executor_runs_pipelines(monkeypatch, tmp_path):
+    """Every database gets its own job and the run concludes once all pipelines finish"""
+    def fake_execute(pipeline):
+        with pipeline.run.step(pipeline.job, "Restore backup"):
+            pass
+        succeeded = pipeline.database != "hr"
+        pipeline.run.add_report("pipeline", pipeline.database, {"status": "succeeded" if succeeded else "failed"})
+        pipeline.run.finish_job(pipeline.job, "success" if succeeded else "failure")
+        return succeeded
+
+    monkeypatch.setattr(executors.LocalPipeline, "execute", fake_execute)
+    executor = LocalExecutor(work_dir=str(tmp_path))
+    result = executor.dispatch(_request(), ["sales", "hr"], {"include_globals": False})
+    status = _wait_completed(executor, result["run_id"])
+
+    assert status["conclusion"] == "failure"
+    assert [job["name"] for job in status["jobs"]] == ["prepare", "refresh sales", "refresh hr"]
+    assert set(status["reports"]["pipeline"]) == {"sales", "hr"}
+    assert executor.get_status("local-unknown") is None
+
+def test_local_executor_rejects_same_server(tmp_path):
+    """Restoring onto the production server would drop the source database"""
+    from fastapi import HTTPException
+    with pytest.raises(HTTPException) as excinfo:
+        LocalExecutor(work_dir=str(tmp_path)).dispatch(_request(pg_host_dev="prod-a"), ["sales"], {})
+    assert excinfo.value.status_code == 422
+
+# Prueba de extremo a extremo contra dos servidores PostgreSQL locales, por ejemplo:
+#   PG_TEST_SOURCE_HOST=localhost:5432 PG_TEST_TARGET_HOST=localhost:5433 PG_TEST_USER=postgres PG_TEST_PASSWORD=...
+E2E_SOURCE = os.environ.get("PG_TEST_SOURCE_HOST")
+E2E_TARGET = os.environ.get("PG_TEST_TARGET_HOST")
+
+@pytest.mark.skipif(not (E2E_SOURCE and E2E_TARGET and shutil.which("pg_dump")),
+                    reason="PG_TEST_SOURCE_HOST/PG_TEST_TARGET_HOST not set or PostgreSQL client tools missing")
+def test_local_executor_end_to_end(monkeypatch, tmp_path):
+    """A database is dumped, uploaded, restored and verified without GitHub Actions"""
+    import psycopg
+    from verification import build_conninfo
+
+    user = os.environ.get("PG_TEST_USER", "postgres")
+    password = os.environ.get("PG_TEST_PASSWORD", "")
+    database = "executor_e2e"
+    source_host, source_port = resolve_host(E2E_SOURCE)
+    with psycopg.connect(build_conninfo(source_host, "postgres", user, source_port, password), autocommit=True) as conn:
+        conn.execute(f"DROP DATABASE IF EXISTS {database} WITH (FORCE)")
+        conn.execute(f"CREATE DATABASE {database}")
+    with psycopg.connect(build_conninfo(source_host, database, user, source_port, password)) as conn:
+        conn.execute("CREATE TABLE items (id int PRIMARY KEY, name text)")
+        conn.execute("INSERT INTO items SELECT g, 'item ' || g FROM generate_series(1, 1000) g")
+
+    # Blob Storage sustituido por un directorio local
+    blobs = tmp_path / "blobs"
+    blobs.mkdir()
+    monkeypatch.setattr(executors, "upload_file_blob", lambda account, container, name, path: shutil.copy(path, blobs / name))
+    monkeypatch.setattr(executors, "write_json_blob", lambda account, container, name, payload: (blobs / name).write_text(__import__("json").dumps(payload)))
+    monkeypatch.setattr(executors, "add_catalog_entry", lambda *args: None)
+
+    executor = LocalExecutor(work_dir=str(tmp_path / "work"))
+    result = executor.dispatch(
+        _request(pg_host_prod=E2E_SOURCE, pg_host_dev=E2E_TARGET, pg_user=user, pg_password=password),
+        [database], {"include_globals": False, "verify": True, "restore_jobs": 2}
+    )
+    status = _wait_completed(executor, result["run_id"], timeout=300)
+
+    assert status["conclusion"] == "success", status
+    assert status["reports"]["verification"][database]["status"] == "passed"
+    assert (blobs / status["reports"]["pipeline"][database]["backup"]).exists()
+
+def test_run_titles_and_filters():
+    """Run titles carry the databases and servers used to filter the run list"""
+    title = executors.run_title(["sales", "hr"], "prod-a", "dev-a")
+    assert executors.parse_run_title(title) == {"databases": ["sales", "hr"], "all_databases": False,
+                                                "source_host": "prod-a", "target_host": "dev-a"}
+    assert executors.parse_run_title("PostgreSQL Backup and Restore")["source_host"] is None
+
+    runs = [
+        executors.summarize_run(1, "github", "wf", title, "completed", "success", "2026-01-01T00:00:00Z", "2026-01-01T00:10:00Z", None),
+        executors.summarize_run(2, "github", "wf", executors.run_title(None, "prod-b", "dev-b"), "in_progress", None, "2026-01-02T00:00:00Z", None, None),
+        executors.summarize_run(3, "github", "wf", "old run", "completed", "failure", None, None, None)
+    ]
+    assert runs[0]["duration_seconds"] == 600
+    assert [run["id"] for run in executors.filter_runs(runs, database="sales")] == [1, 2]
+    assert [run["id"] for run in executors.filter_runs(runs, host="dev-a")] == [1]
+    assert [run["id"] for run in executors.filter_runs(runs, state="active")] == [2]
+    assert len(executors.filter_runs(runs)) == 3
+
+def test_github_list_runs_fetches_pages(monkeypatch):
+    """The first page gives the total and the remaining pages are fetched up to the limit"""
+    requested = []
+
+    def fake_get(url, headers=None, params=None, timeout=None):
+        requested.append(params["page"])
+        start = (params["page"] - 1) * params["per_page"]
+        runs = [{"id": i, "status": "completed", "display_title": f"run {i}"} for i in range(start, min(start + params["per_page"], 250))]
+        return SimpleNamespace(status_code=200, json=lambda: {"total_count": 250, "workflow_runs": runs})
+
+    monkeypatch.setattr(executors.requests, "get", fake_get)
+    github = executors.GitHubExecutor({"token": "t", "owner": "o", "repo": "r", "workflow_id": "wf.yml"})
+    runs = github.list_runs(200)
+    assert sorted(requested) == [1, 2]
+    assert [run["id"] for run in runs] == list(range(200))
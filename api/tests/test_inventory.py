@@ -0,0 +1,107 @@
+import sys
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Agregar el directorio de la API al path para importar los módulos
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from inventory import Inventory, summarize_server
+from upgrades import ArmClient
+
+
+def _resource(sub, rg, name, version="15", state="Ready", tier="GeneralPurpose"):
+    return {
+        "id": f"/subscriptions/{sub}/resourceGroups/{rg}/providers/Microsoft.DBforPostgreSQL/flexibleServers/{name}",
+        "name": name,
+        "location": "westeurope",
+        "sku": {"name": "Standard_D2ds_v4", "tier": tier},
+        "properties": {"version": version, "state": state, "storage": {"storageSizeGB": 128},
+                       "fullyQualifiedDomainName": f"{name}.postgres.database.azure.com"}
+    }
+
+
+class FakeClient:
+    """Cliente de ARM con latencia que cuenta las llamadas y la concurrencia."""
+
+    def __init__(self, servers, delay=0.05):
+        self.servers = servers
+        self.delay = delay
+        self.calls = 0
+        self.active = 0
+        self.max_active = 0
+        self.fail = set()
+        self.lock = threading.Lock()
+
+    def list_subscriptions(self):
+        return list(self.servers)
+
+    def list_servers(self, subscription_id):
+        with self.lock:
+            self.calls += 1
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(self.delay)
+        with self.lock:
+            self.active -= 1
+        if subscription_id in self.fail:
+            raise RuntimeError("ARM returned 503: unavailable")
+        return self.servers[subscription_id]
+
+
+def _inventory(client, ttl=900):
+    return Inventory(client, {"subscriptions": [], "ttl_seconds": ttl, "concurrency": 8})
+
+
+def test_summarize_server():
+    """Subscription and resource group come from the resource id"""
+    server = summarize_server(_resource("sub-a", "rg-prod", "pg-ventas", version="14"))
+    assert (server["subscription_id"], server["resource_group"], server["version"]) == ("sub-a", "rg-prod", "14")
+    assert server["sku_tier"] == "GeneralPurpose" and server["storage_gb"] == 128
+    assert "pg-ventas.postgres.database.azure.com" in server["_search"]
+
+
+def test_paginate_follows_next_link():
+    """All pages of an ARM list are returned"""
+    pages = {
+        "https://arm.test/subscriptions/s/providers/Microsoft.DBforPostgreSQL/flexibleServers":
+            {"value": [{"name": "a"}], "nextLink": "https://arm.test/page2"},
+        "https://arm.test/page2": {"value": [{"name": "b"}]}
+    }
+    client = ArmClient("https://arm.test", "x", token_provider=lambda: "token")
+    client._request = lambda method, url, **kwargs: type("R", (), {"json": lambda self: pages[url]})()
+    assert [server["name"] for server in client.list_servers("s")] == ["a", "b"]
+
+
+def test_inventory_search_filters_and_ttl():
+    """Subscriptions are listed concurrently and queries are served from memory"""
+    client = FakeClient({
+        f"sub-{i}": [_resource(f"sub-{i}", "rg-prod", f"pg-{i}", version="15" if i % 2 else "16")]
+        for i in range(6)
+    })
+    inventory = _inventory(client)
+    result = inventory.query()
+    assert result["total"] == 6 and client.max_active > 1
+    assert result["facets"]["version"] == ["15", "16"]
+
+    assert [s["name"] for s in inventory.query("PG-3")["servers"]] == ["pg-3"]
+    assert inventory.query(version="15", resource_group="RG-PROD")["total"] == 3
+    assert client.calls == 6  # búsquedas y filtros sin volver a ARM
+
+    inventory.query(refresh=True)
+    assert client.calls == 12
+
+
+def test_inventory_single_flight_and_partial_failure():
+    """Concurrent queries share one rebuild and a failing subscription keeps its servers"""
+    client = FakeClient({"sub-a": [_resource("sub-a", "rg", "pg-a")], "sub-b": [_resource("sub-b", "rg", "pg-b")]})
+    inventory = _inventory(client, ttl=0)
+    with ThreadPoolExecutor(max_workers=5) as pool:
+        results = list(pool.map(lambda _: inventory.query(), range(5)))
+    assert all(result["total"] == 2 for result in results)
+    assert client.calls < 10
+
+    client.fail.add("sub-b")
+    result = inventory.query(refresh=True)
+    assert result["total"] == 2 and "503" in result["errors"]["sub-b"]
@@ -0,0 +1,98 @@
+import sys
+import os
+
+import pytest
+
+# Agregar el directorio de la API al path para importar los módulos
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import operations
+import state
+
+ENDPOINT = "https://arm.test"
+
+
+@pytest.fixture
+def state_db(tmp_path, monkeypatch):
+    monkeypatch.setenv("STATE_DB_PATH", str(tmp_path / "state.db"))
+    monkeypatch.setenv("ARM_ENDPOINT", ENDPOINT)
+    monkeypatch.setenv("ARM_POLL_INITIAL_SECONDS", "10")
+    monkeypatch.setenv("ARM_POLL_MAX_SECONDS", "40")
+    monkeypatch.setenv("ARM_OPERATION_TIMEOUT_MINUTES", "60")
+    state.reset()
+    yield
+    state.reset()
+
+
+def _result(status="InProgress", retry_after=None, percent=None, error=None):
+    return {"status": status, "retry_after": retry_after, "percent_complete": percent, "error": error}
+
+
+def _due(operation_id):
+    with state.transaction() as conn:
+        return conn.execute("SELECT next_poll_at FROM operations WHERE id = ?", (operation_id,)).fetchone()[0]
+
+
+def test_next_delay_backoff():
+    """Polling doubles the interval up to the maximum unless Retry-After is given"""
+    interval, waits = 1, []
+    for retry_after in (None, None, None, None, 7.0, None):
+        wait, interval = operations.next_delay(interval, retry_after, 5)
+        waits.append(wait)
+    assert waits == [1, 2, 4, 5, 7.0, 5]
+
+
+def test_register_only_accepts_arm_urls(state_db):
+    """Operations outside the ARM endpoint are rejected and duplicates are reused"""
+    with pytest.raises(ValueError):
+        operations.register("https://evil.test/operations/1", "major_upgrade")
+    first = operations.register(f"{ENDPOINT}/operations/1", "major_upgrade", resource="/pg0")
+    assert operations.register(f"{ENDPOINT}/operations/1", "major_upgrade")["id"] == first["id"]
+    assert first["status"] == "InProgress" and first["active"]
+
+
+def test_poll_due_batches_and_persists(state_db):
+    """Due operations are polled once per URL, honour Retry-After and survive a restart"""
+    fast = operations.register(f"{ENDPOINT}/operations/fast", "major_upgrade")
+    slow = operations.register(f"{ENDPOINT}/operations/slow", "major_upgrade")
+    calls = []
+    responses = {f"{ENDPOINT}/operations/fast": _result("Succeeded"),
+                 f"{ENDPOINT}/operations/slow": _result(retry_after=300, percent=40)}
+
+    def fetch(url):
+        calls.append(url)
+        return responses[url]
+
+    # Aún no ha vencido el primer sondeo (10 s tras el registro)
+    assert operations.poll_due(fetch) == 0
+    now = _due(slow["id"]) + 1
+    assert operations.poll_due(fetch, now=now) == 2
+    assert sorted(calls) == sorted(responses)
+
+    # Tras un "reinicio" el estado sigue en SQLite
+    state.reset()
+    done = operations.get_operation(fast["id"])
+    assert done["status"] == "Succeeded" and not done["active"] and done["percent_complete"] == 100
+    pending = operations.get_operation(slow["id"])
+    assert pending["active"] and pending["percent_complete"] == 40 and pending["polls"] == 1
+    # Retry-After manda sobre el backoff: el siguiente sondeo es 300 s después
+    assert _due(slow["id"]) - now >= 299
+    assert [op["id"] for op in operations.list_operations(active=True)] == [slow["id"]]
+
+
+def test_poll_due_errors_and_timeout(state_db):
+    """Transient errors keep the operation pending; past the deadline it fails"""
+    operation = operations.register(f"{ENDPOINT}/operations/1", "major_upgrade")
+
+    def failing(url):
+        raise ConnectionError("ARM unavailable")
+
+    now = _due(operation["id"]) + 1
+    operations.poll_due(failing, now=now)
+    pending = operations.get_operation(operation["id"])
+    assert pending["active"] and pending["error"] == "ARM unavailable"
+
+    # Más allá del plazo (60 minutos) la operación se cierra como fallida
+    operations.poll_due(lambda url: _result(), now=now + 3600)
+    failed = operations.get_operation(operation["id"])
+    assert failed["status"] == "Failed" and not failed["active"] and "timeout" in failed["error"]
@@ -0,0 +1,56 @@
+import datetime
+import sys
+import os
+
+# Agregar el directorio de la API al path para importar los módulos
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from progress import ProgressTracker, estimate_progress
+
+SIZES = {"public.orders": 300, "public.customers": 100}
+
+def test_tracker_parses_sequential_dump_output():
+    """Starting a table in pg_dump -v output completes the previous one"""
+    tracker = ProgressTracker("dump", "shop", SIZES)
+    tracker.feed('pg_dump: dumping contents of table "public.orders"\n')
+    tracker.feed('pg_dump: dumping contents of table "public.customers"\n')
+    doc = tracker.snapshot()
+    assert doc["tables_done"] == 1 and doc["tables_total"] == 2
+    assert doc["source_bytes_done"] == 300
+    assert doc["current_object"] == "TABLE DATA public.customers"
+    assert tracker.feed("__EXIT__ 0") == 0
+    tracker.finish()
+    assert tracker.snapshot()["state"] == "completed"
+    assert tracker.snapshot()["tables_done"] == 2
+
+def test_tracker_parses_parallel_restore_output():
+    """pg_restore -v -j items are tracked independently; a worker starting a table does not finish another"""
+    tracker = ProgressTracker("restore", "shop", dict(SIZES, **{"sales.orders": 50}))
+    for line in (
+        "pg_restore: entering main parallel loop",
+        "pg_restore: launching item 3380 TABLE DATA customers",
+        "pg_restore: launching item 3381 TABLE DATA orders",
+        'pg_restore: processing data for table "public.customers"',
+        'pg_restore: processing data for table "sales.orders"',
+        "pg_restore: launching item 3382 TABLE DATA orders",
+        'pg_restore: processing data for table "public.orders"',
+        "pg_restore: finished item 3381 TABLE DATA orders",
+        "pg_restore: launching item 3383 SEQUENCE SET orders_id_seq",
+    ):
+        tracker.feed(line)
+    doc = tracker.snapshot()
+    assert doc["tables_running"] == ["public.customers", "public.orders"]
+    assert doc["tables_done"] == 1 and doc["source_bytes_done"] == 50
+    assert doc["current_object"] == "SEQUENCE SET orders_id_seq"
+
+    tracker.feed("pg_restore: finished item 3380 TABLE DATA customers")
+    assert tracker.snapshot()["source_bytes_done"] == 150
+
+def test_estimate_progress_extrapolates_eta_over_remaining_stages():
+    """Half of the dump in 10 minutes leaves 10 minutes of dump plus a restore of similar size"""
+    doc = {"stage": "dump", "state": "running", "stage_index": 1, "stage_count": 2,
+           "started_at": "2026-03-01T10:00:00Z", "source_bytes_total": 400, "source_bytes_done": 200}
+    estimate = estimate_progress(doc, now=datetime.datetime(2026, 3, 1, 10, 10, 0))
+    assert estimate["percent"] == 25.0
+    assert estimate["stage_percent"] == 50.0
+    assert estimate["eta_seconds"] == 600 + 1200
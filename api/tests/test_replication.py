@@ -0,0 +1,109 @@
+import datetime
+import os
+import shutil
+import sys
+import time
+
+import pytest
+
+# Agregar el directorio de la API al path para importar los módulos
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from executors import resolve_host
+from replication import ReplicationRefresh, replication_object_name, staging_name, summarize_lag
+
+NOW = datetime.datetime(2026, 3, 1, 12, 0, 0, tzinfo=datetime.timezone.utc)
+
+def test_replication_names():
+    """Slot names only allow lowercase letters, digits and underscores"""
+    assert staging_name("Sales-EU") == "Sales-EU__repl"
+    name = replication_object_name("Sales-EU")
+    assert name.startswith("devrefresh_sales_eu_")
+    assert name != replication_object_name("sales_eu")
+    assert len(replication_object_name("x" * 63)) <= 63
+    with pytest.raises(ValueError):
+        staging_name("x" * 60)
+
+def test_snapshot_target_cannot_replace_staging_or_system_databases():
+    """Snapshots recreate the target with DROP DATABASE, so staging, templates and postgres are rejected"""
+    import main
+    from fastapi import HTTPException
+    request = {"pg_host_prod": "prod", "pg_host_dev": "dev", "pg_database": "sales", "pg_user": "u", "pg_password": "p"}
+    assert main.build_replication(main.ReplicationSnapshotRequest(**request, target_database="sales_copy")).database == "sales"
+    main.build_replication(main.ReplicationRequest(**dict(request, pg_database="postgres")))
+    for target in ("sales__repl", "hr__repl", "sales__tpl", "postgres", "template1"):
+        with pytest.raises(HTTPException) as excinfo:
+            main.build_replication(main.ReplicationSnapshotRequest(**request, target_database=target))
+        assert excinfo.value.status_code == 422
+    with pytest.raises(ValueError):
+        ReplicationRefresh(("prod", 5432), ("dev", 5432), "sales", "u", "p").snapshot("sales__repl")
+
+def test_summarize_lag_states():
+    """The state reflects the subscription worker and the initial table synchronization"""
+    slot = {"active": True, "current_lsn": "0/3000100", "confirmed_flush_lsn": "0/3000000", "lag_bytes": 256}
+    subscription = {"enabled": True, "pid": 4242, "latest_end_lsn": "0/3000000",
+                    "latest_end_time": NOW - datetime.timedelta(seconds=5)}
+
+    streaming = summarize_lag(slot, subscription, {"r": 3}, NOW)
+    assert streaming["state"] == "streaming"
+    assert streaming["lag_bytes"] == 256
+    assert streaming["last_report_seconds"] == 5.0
+    assert streaming["tables_ready"] == streaming["tables_total"] == 3
+
+    assert summarize_lag(slot, subscription, {"r": 2, "d": 1}, NOW)["state"] == "initial_sync"
+    assert summarize_lag(slot, dict(subscription, pid=None), {"r": 3}, NOW)["state"] == "stopped"
+    assert summarize_lag(slot, dict(subscription, enabled=False), {"r": 3}, NOW)["state"] == "paused"
+    missing = summarize_lag(None, None, {}, NOW)
+    assert missing["state"] == "not_configured"
+    assert missing["lag_bytes"] is None
+
+# Prueba de integración contra dos servidores PostgreSQL locales (producción con wal_level=logical):
+#   PG_TEST_SOURCE_HOST=localhost:5432 PG_TEST_TARGET_HOST=localhost:5433 PG_TEST_USER=postgres PG_TEST_PASSWORD=...
+E2E_SOURCE = os.environ.get("PG_TEST_SOURCE_HOST")
+E2E_TARGET = os.environ.get("PG_TEST_TARGET_HOST")
+
+@pytest.mark.skipif(not (E2E_SOURCE and E2E_TARGET and shutil.which("pg_dump")),
+                    reason="PG_TEST_SOURCE_HOST/PG_TEST_TARGET_HOST not set or PostgreSQL client tools missing")
+def test_replication_refresh_end_to_end():
+    """Changes made in production after setup reach the copy cut from staging"""
+    import psycopg
+    from verification import build_conninfo
+
+    user = os.environ.get("PG_TEST_USER", "postgres")
+    password = os.environ.get("PG_TEST_PASSWORD", "")
+    database = "replication_e2e"
+    source = resolve_host(E2E_SOURCE)
+    replication = ReplicationRefresh(source, resolve_host(E2E_TARGET), database, user, password)
+    try:
+        # Restos de una ejecución anterior: el slot impediría eliminar la base de datos
+        replication.teardown()
+    except psycopg.OperationalError:
+        pass
+
+    with psycopg.connect(build_conninfo(source[0], "postgres", user, source[1], password), autocommit=True) as conn:
+        conn.execute(f"DROP DATABASE IF EXISTS {database} WITH (FORCE)")
+        conn.execute(f"CREATE DATABASE {database}")
+    prod_conninfo = build_conninfo(source[0], database, user, source[1], password)
+    with psycopg.connect(prod_conninfo) as conn:
+        conn.execute("CREATE TABLE items (id serial PRIMARY KEY, name text)")
+        conn.execute("INSERT INTO items (name) SELECT 'item ' || g FROM generate_series(1, 1000) g")
+
+    try:
+        assert replication.setup()["created"] is True
+        deadline = time.monotonic() + 120
+        while replication.lag()["state"] != "streaming":
+            assert time.monotonic() < deadline, "initial synchronization did not finish"
+            time.sleep(1)
+
+        with psycopg.connect(prod_conninfo) as conn:
+            conn.execute("INSERT INTO items (name) SELECT 'late ' || g FROM generate_series(1, 10) g")
+        result = replication.snapshot(catch_up_timeout=60)
+        assert result["sequences_synced"] == 1
+
+        target = resolve_host(E2E_TARGET)
+        with psycopg.connect(build_conninfo(target[0], database, user, target[1], password)) as conn:
+            assert conn.execute("SELECT count(*) FROM items").fetchone()[0] == 1010
+            # La secuencia continúa después de los valores de producción
+            assert conn.execute("INSERT INTO items (name) VALUES ('dev') RETURNING id").fetchone()[0] == 1011
+    finally:
+        assert "publication" in replication.teardown()["removed"]
@@ -0,0 +1,49 @@
+import sys
+import os
+
+# Agregar el directorio de la API al path para importar los módulos
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import reports
+from reports import SUMMARY_REPORT_KINDS, load_run_reports, run_report_blob, summarize_databases
+
+def test_run_report_blob():
+    """Reports are grouped by run, kind and database"""
+    assert run_report_blob("42", "pipeline", "sales") == "runs/42/pipeline/sales.json"
+
+def test_summarize_databases():
+    """Each database reports its pipeline outcome, or running while the pipeline report is missing"""
+    reports = {
+        "pipeline": {
+            "sales": {"status": "succeeded", "backup": "sales_1.dump", "backup_created": True, "total_seconds": 120},
+            "hr": {"status": "failed", "failed_stage": "backup", "backup": None, "total_seconds": 15}
+        },
+        "restore": {"sales": {"backup": "sales_1.dump", "verification": "passed"}},
+        "progress": {"crm": {"stage": "dump", "state": "running"}},
+        "selective": {"sales": {"mode": "selective", "tables_refreshed": 2, "tables_reused": 40, "bytes_copied": 1024}},
+        "chunks": {"sales": {"chunks": 120, "new_chunks": 6, "bytes_total": 125829120, "bytes_uploaded": 2097152, "dedup_ratio": 20.0}},
+        "subset": {"hr": {"rows": 500, "bytes": 4096, "source_database_size_bytes": 1048576, "tables_copied": 3, "total_seconds": 2.5}}
+    }
+    summary = summarize_databases(reports)
+    assert list(summary) == ["crm", "hr", "sales"]
+    assert summary["sales"]["status"] == "succeeded"
+    assert summary["sales"]["verification"] == "passed"
+    assert summary["hr"]["failed_stage"] == "backup"
+    assert summary["crm"]["status"] == "running"
+    assert summary["crm"]["stage"] == "dump"
+    assert summary["hr"]["subset"]["rows"] == 500
+    assert summary["sales"]["subset"] is None
+    assert summary["sales"]["selective"]["tables_reused"] == 40
+    assert summary["sales"]["dedup"]["bytes_uploaded"] == 2097152
+    assert summary["hr"]["dedup"] is None
+
+def test_load_run_reports_reads_only_requested_kinds(monkeypatch):
+    """Reports of other kinds are skipped without reading their blobs"""
+    blobs = ["runs/42/pipeline/sales.json", "runs/42/progress/sales.json", "runs/42/verification/sales.json"]
+    read = []
+    monkeypatch.setattr(reports, "list_blob_names", lambda account, container, prefix: blobs)
+    monkeypatch.setattr(reports, "read_json_blob", lambda account, container, name: read.append(name) or {"name": name})
+    assert set(load_run_reports("a", "c", "42")) == {"pipeline", "progress", "verification"}
+    read.clear()
+    assert set(load_run_reports("a", "c", "42", SUMMARY_REPORT_KINDS)) == {"pipeline", "progress"}
+    assert "runs/42/verification/sales.json" not in read
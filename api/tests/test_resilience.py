@@ -0,0 +1,115 @@
+import sys
+import os
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+import requests
+
+# Agregar el directorio de la API al path para importar los módulos
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import executors
+import resilience
+from resilience import CircuitOpenError, DeadlineExceeded, Upstream
+from upgrades import ArmClient
+
+
+def _upstream(**overrides):
+    config = {"timeout_seconds": 2, "failure_threshold": 3, "open_seconds": 60,
+              "hedge_enabled": True, "hedge_min_seconds": 0.05}
+    config.update(overrides)
+    return Upstream("test", config)
+
+
+def _response(status_code=200, body=None):
+    return SimpleNamespace(status_code=status_code, headers={}, json=lambda: body)
+
+
+def test_breaker_opens_serves_cache_and_recovers():
+    """Consecutive failures open the circuit; cached GETs are served and a probe closes it"""
+    upstream = _upstream()
+    assert upstream.call("GET", "https://up/runs", lambda url, **kw: _response(body={"runs": 1})).json() == {"runs": 1}
+
+    for _ in range(3):
+        assert upstream.call("GET", "https://up/other", lambda url, **kw: _response(503)).status_code == 503
+    assert upstream.state == resilience.OPEN
+
+    calls = []
+    cached = upstream.call("GET", "https://up/runs", lambda url, **kw: calls.append(url))
+    assert cached.json() == {"runs": 1} and cached.headers["X-Upstream-Cache"] == "stale" and not calls
+    with pytest.raises(CircuitOpenError):
+        upstream.call("POST", "https://up/dispatch", lambda url, **kw: calls.append(url))
+    assert not calls and upstream.metrics()["short_circuits"] == 1
+
+    # Pasado open_seconds una petición de prueba correcta cierra el circuito
+    upstream.opened_at -= 60
+    assert upstream.call("GET", "https://up/runs", lambda url, **kw: _response(body={"runs": 2})).json() == {"runs": 2}
+    assert upstream.state == resilience.CLOSED
+
+
+def test_timeout_becomes_deadline_and_counts_as_failure():
+    """Requests carry the upstream timeout and a timeout is reported as DeadlineExceeded"""
+    upstream = _upstream(timeout_seconds=1.5, failure_threshold=1)
+    seen = []
+
+    def slow(url, timeout=None, **kwargs):
+        seen.append(timeout)
+        raise requests.Timeout()
+
+    with pytest.raises(DeadlineExceeded):
+        upstream.call("GET", "https://up/runs", slow, timeout=30)
+    assert seen == [1.5] and upstream.state == resilience.OPEN
+    assert upstream.metrics()["timeouts"] == 1
+
+
+def test_slow_get_is_hedged():
+    """A GET slower than the p95 launches a second request and the first to finish wins"""
+    upstream = _upstream()
+    for _ in range(resilience.MIN_HEDGE_SAMPLES):
+        upstream.call("GET", "https://up/runs", lambda url, **kw: _response())
+    assert upstream.hedge_delay() == 0.05
+
+    calls = []
+    lock = threading.Lock()
+
+    def first_slow(url, **kwargs):
+        with lock:
+            calls.append(url)
+            attempt = len(calls)
+        time.sleep(1 if attempt == 1 else 0)
+        return _response(body={"attempt": attempt})
+
+    started = time.monotonic()
+    assert upstream.call("GET", "https://up/runs", first_slow).json() == {"attempt": 2}
+    assert time.monotonic() - started < 0.5
+    metrics = upstream.metrics()
+    assert metrics["hedges"] == 1 and metrics["hedge_wins"] == 1
+
+    # Las peticiones que no son idempotentes nunca se duplican
+    calls.clear()
+    upstream.call("POST", "https://up/dispatch", first_slow)
+    assert len(calls) == 1
+
+
+def test_stale_responses_are_flagged(monkeypatch):
+    """Data served from the cache while the circuit is open is marked as stale"""
+    resilience.reset()
+    monkeypatch.setattr(executors.requests, "get",
+                        lambda url, **kw: _response(body={"id": 7, "status": "in_progress", "jobs": []}))
+    github = executors.GitHubExecutor({"token": "t", "owner": "o", "repo": "r", "workflow_id": "wf.yml"})
+    assert "stale" not in github.get_status("7")
+
+    upstream = resilience.get_upstream("github")
+    upstream.state, upstream.opened_at = resilience.OPEN, time.monotonic()
+    assert github.get_status("7")["stale"] is True
+
+    client = ArmClient("https://arm.test", "x", token_provider=lambda: "token")
+    client.session.request = lambda method, url, **kw: _response(body={"value": [{"name": "pg-a"}]})
+    assert not client.list_servers("s").stale
+    arm = resilience.get_upstream("arm")
+    arm.state, arm.opened_at = resilience.OPEN, time.monotonic()
+    servers = client.list_servers("s")
+    assert servers.stale and [server["name"] for server in servers] == ["pg-a"]
+    resilience.reset()
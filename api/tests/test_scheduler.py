@@ -0,0 +1,119 @@
+import datetime
+import sys
+import os
+
+import pytest
+
+# Agregar el directorio de la API al path para importar los módulos
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import scheduler
+import state
+from scheduler import CronExpression, build_plan, fire_times, window_bounds
+
+def _dt(text):
+    return datetime.datetime.strptime(text, "%Y-%m-%d %H:%M")
+
+def _schedule(id, host="prod-a", cron="0 2 * * *", expected=60, window=None, timezone="UTC"):
+    schedule = {"id": id, "name": id, "cron": cron, "timezone": timezone, "expected_minutes": expected,
+                "enabled": True, "pg_host_prod": host, "window_start": None, "window_minutes": None}
+    if window:
+        schedule["window_start"], schedule["window_minutes"] = window
+    return schedule
+
+@pytest.fixture
+def state_db(tmp_path, monkeypatch):
+    monkeypatch.setenv("STATE_DB_PATH", str(tmp_path / "state.db"))
+    state.reset()
+    yield
+    state.reset()
+
+def test_cron_next_after():
+    """Fire times are found field by field, including month and year carries"""
+    cron = CronExpression("30 2 * * mon-fri")
+    assert cron.next_after(_dt("2026-03-06 03:00")) == _dt("2026-03-09 02:30")  # viernes -> lunes
+    assert CronExpression("*/15 * * * *").next_after(_dt("2026-03-01 10:50")) == _dt("2026-03-01 11:00")
+    assert CronExpression("0 0 29 2 *").next_after(_dt("2026-03-01 00:00")) == _dt("2028-02-29 00:00")
+    assert CronExpression("@monthly").next_after(_dt("2026-12-15 00:00")) == _dt("2027-01-01 00:00")
+    # Día del mes y día de la semana restringidos: basta con uno de los dos
+    assert CronExpression("0 0 13 * fri").next_after(_dt("2026-03-01 00:00")) == _dt("2026-03-06 00:00")
+    # Un día del mes que empieza por "*" no está restringido: solo cuenta el día de la semana
+    assert CronExpression("0 3 */2 * 1").next_after(_dt("2026-03-02 04:00")) == _dt("2026-03-09 03:00")
+
+def test_cron_validation():
+    """Invalid expressions are rejected with a descriptive error"""
+    for expression in ("* * * *", "60 * * * *", "0 0 * * 8", "*/0 * * * *", "0 0 31 2 *", "0 0 * foo *"):
+        with pytest.raises(ValueError):
+            CronExpression(expression)
+
+def test_fire_times_in_timezone():
+    """Fire times are computed in the schedule timezone and returned in UTC"""
+    cron = CronExpression("0 2 * * *")
+    times = fire_times(cron, "Europe/Madrid", _dt("2026-03-27 00:00"), _dt("2026-03-30 00:00"))
+    # Cambio de hora el 29 de marzo: 02:00 CET es 01:00 UTC, y 02:00 CEST (inexistente) se desplaza
+    assert times[:2] == [_dt("2026-03-27 01:00"), _dt("2026-03-28 01:00")]
+    assert len(times) == 3
+
+def test_window_bounds():
+    """A window crossing midnight contains early-morning times of the next day"""
+    schedule = _schedule("a", window=("22:00", 360))
+    assert window_bounds(_dt("2026-03-02 01:00"), schedule) == (_dt("2026-03-01 22:00"), _dt("2026-03-02 04:00"))
+    assert window_bounds(_dt("2026-03-02 12:00"), schedule) == (_dt("2026-03-02 22:00"), _dt("2026-03-03 04:00"))
+    assert window_bounds(_dt("2026-03-02 12:00"), _schedule("b"))[0] == _dt("2026-03-02 12:00")
+
+def test_plan_staggers_jobs_on_the_same_host():
+    """Jobs sharing a production host start one after another; other hosts are not delayed"""
+    schedules = [_schedule("a", expected=90), _schedule("b", expected=30), _schedule("c", host="prod-b")]
+    plan = build_plan(schedules, [], _dt("2026-03-01 00:00"), _dt("2026-03-02 00:00"))
+    starts = {entry["name"]: (entry["start_at"], entry["delay_minutes"]) for entry in plan}
+    assert starts == {"a": ("2026-03-01T02:00:00Z", 0), "b": ("2026-03-01T03:30:00Z", 90), "c": ("2026-03-01T02:00:00Z", 0)}
+
+def test_plan_respects_maintenance_window():
+    """Fire times outside the window are deferred and a job that does not fit moves to the next window"""
+    schedules = [
+        _schedule("a", cron="0 9 * * *", expected=120, window=("01:00", 180)),
+        _schedule("b", cron="0 9 * * *", expected=120, window=("01:00", 180))
+    ]
+    plan = build_plan(schedules, [], _dt("2026-03-01 00:00"), _dt("2026-03-01 12:00"))
+    assert [(entry["name"], entry["start_at"]) for entry in plan] == [
+        ("a", "2026-03-02T01:00:00Z"),
+        ("b", "2026-03-03T01:00:00Z")
+    ]
+
+def test_plan_skips_and_excludes_fired_runs():
+    """Fired runs are not planned again and still occupy their host"""
+    schedules = [_schedule("a"), _schedule("b")]
+    fired = [{"schedule_id": "a", "nominal_at": "2026-03-01T02:00:00Z", "start_at": "2026-03-01T02:00:00Z", "status": "dispatched"}]
+    plan = build_plan(schedules, fired, _dt("2026-03-01 00:00"), _dt("2026-03-02 00:00"))
+    assert [(entry["name"], entry["start_at"]) for entry in plan] == [("b", "2026-03-01T03:00:00Z")]
+
+    # Una ejecución perdida (fuera del margen de gracia) no ocupa el servidor
+    schedules = [_schedule("a", expected=120), _schedule("b", cron="0 3 * * *")]
+    plan = build_plan(schedules, [], _dt("2026-03-01 00:00"), _dt("2026-03-02 00:00"), not_before=_dt("2026-03-01 02:30"))
+    assert [(entry["name"], entry["status"], entry["start_at"]) for entry in plan] == [
+        ("a", "missed", "2026-03-01T02:00:00Z"), ("b", "planned", "2026-03-01T03:00:00Z")]
+
+def test_run_due_dispatches_once(state_db, monkeypatch):
+    """Overlapping timer invocations dispatch each planned run once"""
+    monkeypatch.setenv("PG_PASSWORD_SCHEDULE_TEST", "secret")
+    refresh = {"pg_host_prod": "prod-a", "pg_database": "sales"}
+    first = scheduler.save_schedule(dict(_schedule("nightly"), refresh=refresh, password_setting="PG_PASSWORD_SCHEDULE_TEST"))
+    scheduler.save_schedule(dict(_schedule("second", expected=30), refresh=refresh, password_setting="PG_PASSWORD_SCHEDULE_TEST"))
+    with pytest.raises(ValueError):
+        scheduler.save_schedule(dict(_schedule("nightly"), refresh=refresh, password_setting="PG_PASSWORD_X"))
+    # Solo app settings de contraseñas: nunca el token de GitHub u otros secretos
+    with pytest.raises(ValueError):
+        scheduler.save_schedule(dict(_schedule("third"), refresh=refresh, password_setting="GITHUB_TOKEN"))
+
+    dispatched = []
+    dispatch = lambda request: dispatched.append(request) or {"run_id": f"local-{len(dispatched)}"}
+    now = _dt("2026-03-01 02:01")
+    launched = scheduler.run_due(now, dispatch)
+    assert [entry["name"] for entry in launched] == ["nightly"]
+    assert dispatched == [dict(refresh, pg_password="secret")]
+    assert scheduler.run_due(now, dispatch) == []
+
+    # El segundo trabajo espera a que termine el primero en el mismo servidor
+    assert scheduler.upcoming(now, 24)[0]["start_at"] == "2026-03-01T03:00:00Z"
+    assert [entry["name"] for entry in scheduler.run_due(_dt("2026-03-01 03:00"), dispatch)] == ["second"]
+    assert scheduler.recent_runs(_dt("2026-03-01 00:00"), first["id"])[0]["run_id"] == "local-1"
@@ -0,0 +1,102 @@
+import copy
+import sys
+import os
+from contextlib import contextmanager
+
+import pytest
+
+# Agregar el directorio de la API al path para importar los módulos
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import selective
+from selective import invalidate_stats, plan_selective, stats_blob
+
+def _table(ins, upd=0, dele=0, live=None, size=8192):
+    return {"n_tup_ins": ins, "n_tup_upd": upd, "n_tup_del": dele, "n_live_tup": ins - dele if live is None else live, "size_bytes": size}
+
+SOURCE = {
+    "database_oid": 16384, "stats_reset": None, "schema_fingerprint": "abc",
+    "tables": {"public.history": _table(1000000, size=10 ** 9), "public.orders": _table(1000), "public.settings": _table(10)}
+}
+TARGET = {
+    "database_oid": 20000, "stats_reset": None, "schema_fingerprint": "abc",
+    "tables": {"public.history": _table(1000000), "public.orders": _table(1000), "public.settings": _table(10)}
+}
+PREVIOUS = {"target_host": "dev-a", "source": SOURCE, "target": TARGET}
+
+def _current(**changes):
+    source = copy.deepcopy(SOURCE)
+    for name, table in changes.items():
+        source["tables"][f"public.{name}"] = table
+    return source
+
+def test_stats_blob():
+    """Statistics are kept per production server and database"""
+    assert stats_blob("prod-a", "sales") == "stats/prod-a/sales.json"
+
+def test_plan_selective_reuses_unchanged_tables():
+    """Only tables whose changes exceed the threshold are copied again"""
+    source = _current(history=_table(1000500, size=10 ** 9), orders=_table(1100, upd=50, size=8192))
+    plan = plan_selective(PREVIOUS, source, copy.deepcopy(TARGET), "dev-a", threshold=0.01)
+    assert plan["mode"] == "selective"
+    assert [(table["table"], table["reason"]) for table in plan["refresh"]] == [("public.orders", "changed")]
+    assert [table["table"] for table in plan["reuse"]] == ["public.history", "public.settings"]
+
+def test_plan_selective_detects_dev_changes_and_new_tables():
+    """Tables written on dev or created in production since the last refresh are copied again"""
+    source = _current(audit=_table(5))
+    target = copy.deepcopy(TARGET)
+    target["tables"]["public.settings"] = _table(10, upd=1)
+    reasons = {table["table"]: table["reason"] for table in plan_selective(PREVIOUS, source, target, "dev-a")["refresh"]}
+    assert reasons == {"public.audit": "new table", "public.settings": "modified on dev"}
+
+def test_plan_selective_falls_back_to_full_refresh():
+    """Without a trustworthy baseline the whole database is refreshed"""
+    target = copy.deepcopy(TARGET)
+    assert plan_selective(None, SOURCE, target, "dev-a")["mode"] == "full"
+    assert plan_selective(PREVIOUS, SOURCE, target, "dev-b")["mode"] == "full"
+    assert plan_selective(PREVIOUS, SOURCE, None, "dev-a")["mode"] == "full"
+    assert plan_selective(PREVIOUS, SOURCE, dict(target, database_oid=1), "dev-a")["mode"] == "full"
+    assert plan_selective(PREVIOUS, dict(SOURCE, stats_reset="2026-03-01 00:00:00+00"), target, "dev-a")["mode"] == "full"
+    assert plan_selective(PREVIOUS, dict(SOURCE, schema_fingerprint="def"), target, "dev-a")["mode"] == "full"
+    assert plan_selective(invalidate_stats(PREVIOUS), SOURCE, target, "dev-a")["reason"] == \
+        "the previous selective refresh did not complete"
+
+class FakeConnection:
+    """Conexión que registra las sentencias y devuelve una clave foránea para FOREIGN_KEYS_QUERY."""
+
+    def __init__(self, statements):
+        self.statements = statements
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    @contextmanager
+    def transaction(self):
+        yield
+
+    def execute(self, query, params=None):
+        text = query if isinstance(query, str) else query.as_string(None)
+        self.statements.append(text)
+        rows = [("orders_customer_fk", "public.orders", "FOREIGN KEY (customer_id) REFERENCES public.customers(id)")]
+        return type("Cursor", (), {"fetchall": lambda _: rows if query is selective.FOREIGN_KEYS_QUERY else [],
+                                   "fetchone": lambda _: ("snapshot-1",)})()
+
+def test_refresh_tables_restores_foreign_keys_when_copy_fails(monkeypatch):
+    """A failed COPY re-creates the dropped foreign keys and the error reaches the caller"""
+    statements = []
+    monkeypatch.setattr(selective.psycopg, "connect", lambda conninfo, **kwargs: FakeConnection(statements))
+
+    def failing_copy(*args):
+        raise RuntimeError("COPY failed")
+
+    monkeypatch.setattr(selective, "_copy_tables", failing_copy)
+    with pytest.raises(RuntimeError, match="COPY failed"):
+        selective.refresh_tables("source", "target", ["public.customers"])
+    truncate = next(i for i, text in enumerate(statements) if text.startswith("TRUNCATE"))
+    restored = [text for text in statements[truncate:] if "ADD CONSTRAINT" in text]
+    assert restored == ['ALTER TABLE public.orders ADD CONSTRAINT "orders_customer_fk" '
+                        'FOREIGN KEY (customer_id) REFERENCES public.customers(id) NOT VALID']
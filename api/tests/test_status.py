@@ -0,0 +1,124 @@
+import asyncio
+import sys
+import os
+import threading
+import time
+
+import pytest
+
+# Agregar el directorio de la API al path para importar los módulos
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from executors import LocalRun, get_local_executor
+from watchers import WatcherHub, state_version
+
+
+@pytest.fixture
+def api(monkeypatch):
+    from fastapi.testclient import TestClient
+    import main
+    monkeypatch.setenv("STATUS_LOCAL_WATCH_INTERVAL_SECONDS", "0.05")
+    run = LocalRun("local-status", "test")
+    job = run.add_job("refresh sales")
+    # Suficientes pasos para que la vista completa supere el umbral de compresión
+    for index in range(40):
+        with run.step(job, f"Restore table public.table_{index}"):
+            pass
+    run.finish_job(job, "success")
+    run.set_status("completed", "success")
+    executor = get_local_executor()
+    executor._runs[run.id] = run
+    yield TestClient(main.app)
+    executor._runs.pop(run.id, None)
+
+
+def test_status_summary_and_fields(api):
+    """Summary and field selection return only what pollers need"""
+    summary = api.get("/api/workflow/status", params={"run_id": "local-status", "view": "summary"}).json()
+    assert "jobs" not in summary and "reports" not in summary
+    assert summary["job_summary"]["steps_completed"] == 40
+
+    fields = api.get("/api/workflow/status", params={"run_id": "local-status", "fields": "status,conclusion"}).json()
+    assert fields.pop("version")
+    assert fields == {"id": "local-status", "status": "completed", "conclusion": "success"}
+
+
+def test_full_status_is_compressed(api):
+    """Large JSON responses are gzipped and revalidated with the weak ETag"""
+    response = api.get("/api/workflow/status", params={"run_id": "local-status"},
+                       headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["etag"].startswith("W/")
+    assert len(response.json()["jobs"][0]["steps"]) == 40
+
+    revalidated = api.get("/api/workflow/status", params={"run_id": "local-status"},
+                          headers={"Accept-Encoding": "gzip", "If-None-Match": response.headers["etag"]})
+    assert revalidated.status_code == 304
+
+    plain = api.get("/api/workflow/status", params={"run_id": "local-status"}, headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in plain.headers
+    assert plain.headers["etag"] == response.headers["etag"].removeprefix("W/")
+
+
+def test_long_poll_returns_on_change(api):
+    """A request with the current version is held until the run changes"""
+    params = {"run_id": "local-status", "view": "summary"}
+    # Los vigilantes se detienen con la ejecución terminada: se sigue una ejecución en curso
+    run = get_local_executor()._runs["local-status"]
+    run.set_status("in_progress")
+    first = api.get("/api/workflow/status", params=params).json()
+    threading.Timer(0.3, lambda: run.add_report("restore", "sales", {"total_seconds": 12})).start()
+
+    started = time.monotonic()
+    changed = api.get("/api/workflow/status", params=dict(params, version=first["version"], wait=10)).json()
+    assert time.monotonic() - started < 5
+    assert changed["version"] != first["version"] and changed["databases"]["sales"]
+
+    # Sin cambios la petición vuelve al vencer la espera con la misma versión
+    started = time.monotonic()
+    same = api.get("/api/workflow/status", params=dict(params, version=changed["version"], wait=1)).json()
+    assert time.monotonic() - started >= 0.9 and same["version"] == changed["version"]
+
+
+def test_waiters_share_one_watcher():
+    """Concurrent waiters on the same key share the upstream fetches"""
+    hub, state, fetches = WatcherHub(), {"status": "in_progress", "step": 0}, []
+
+    def fetch():
+        fetches.append(time.monotonic())
+        return {"id": 1, "status": state["status"], "conclusion": None, "step": state["step"]}
+
+    version = state_version(fetch())
+    fetches.clear()
+
+    async def scenario():
+        waiters = [hub.wait_for_change("run-1", fetch, version, 5, 0.05) for _ in range(10)]
+        asyncio.get_running_loop().call_later(0.3, lambda: state.update(step=1))
+        return await asyncio.gather(*waiters)
+
+    results = asyncio.run(scenario())
+    assert all(result["step"] == 1 for result in results)
+    # Una consulta por intervalo para todas las peticiones, no una por petición
+    assert len(fetches) < 20
+
+
+def test_clock_fields_do_not_wake_waiters():
+    """Progress ETAs recomputed from the clock do not count as a change of state"""
+    hub, fetches = WatcherHub(), []
+
+    def fetch():
+        fetches.append(time.monotonic())
+        eta = 1800 + len(fetches) * 15
+        return {"id": 1, "status": "in_progress", "conclusion": None, "duration": {"seconds": len(fetches)},
+                "progress": {"percent": 40.0, "eta_seconds": eta, "eta": f"{eta}s",
+                             "databases": {"sales": {"percent": 40.0, "eta_seconds": eta}}}}
+
+    version = state_version(fetch())
+
+    async def scenario():
+        return await hub.wait_for_change("run-clock", fetch, version, 0.5, 0.05)
+
+    started = time.monotonic()
+    document = asyncio.run(scenario())
+    assert time.monotonic() - started >= 0.45 and len(fetches) > 3
+    assert state_version(document) == version
@@ -0,0 +1,45 @@
+import sys
+import os
+import pytest
+
+# Agregar el directorio de la API al path para importar los módulos
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from subset import parse_table_name, plan_subset
+
+TABLES = {key: {} for key in ("public.customers", "public.orders", "public.order_items", "public.products",
+                              "public.employees", "audit.events")}
+
+def _fk(name, child, parent):
+    return {"name": name, "child": child, "parent": parent, "child_columns": ["x"], "parent_columns": ["x"]}
+
+FOREIGN_KEYS = [
+    _fk("orders_customer_fk", "public.orders", "public.customers"),
+    _fk("items_order_fk", "public.order_items", "public.orders"),
+    _fk("items_product_fk", "public.order_items", "public.products"),
+    _fk("employees_manager_fk", "public.employees", "public.employees"),
+    _fk("orders_employee_fk", "public.orders", "public.employees"),
+]
+
+def test_parse_table_name():
+    """Unqualified tables belong to the public schema"""
+    assert parse_table_name("customers") == ("public", "customers")
+    assert parse_table_name("audit.events") == ("audit", "events")
+
+def test_plan_subset_follows_children_once():
+    """Children of the roots are followed breadth-first; parents are left to the upward closure"""
+    plan = plan_subset(TABLES, FOREIGN_KEYS, [{"table": "customers", "ratio": 0.1}])
+    assert plan["roots"] == [{"table": "public.customers", "ratio": 0.1}]
+    assert [fk["name"] for fk in plan["downward"]] == ["orders_customer_fk", "items_order_fk"]
+
+def test_plan_subset_skips_self_references():
+    """Self-referencing keys are never expanded downward, which would pull the whole table"""
+    plan = plan_subset(TABLES, FOREIGN_KEYS, [{"table": "public.employees", "where": "id < 10"}])
+    assert [fk["name"] for fk in plan["downward"]] == ["orders_employee_fk", "items_order_fk"]
+
+def test_plan_subset_validates_roots():
+    """Roots must exist and use exactly one selection method"""
+    with pytest.raises(ValueError):
+        plan_subset(TABLES, FOREIGN_KEYS, [{"table": "public.missing", "ratio": 0.1}])
+    with pytest.raises(ValueError):
+        plan_subset(TABLES, FOREIGN_KEYS, [{"table": "customers", "ratio": 0.1, "where": "true"}])
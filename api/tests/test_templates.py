@@ -0,0 +1,23 @@
+import datetime
+import pytest
+import sys
+import os
+
+# Agregar el directorio de la API al path para importar los módulos
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from templates import template_age_minutes, template_name
+
+NOW = datetime.datetime(2026, 3, 1, 12, 0, 0)
+
+def test_template_name():
+    """Templates live next to the working database with a fixed suffix"""
+    assert template_name("sales") == "sales__tpl"
+    with pytest.raises(ValueError):
+        template_name("x" * 62)
+
+def test_template_age_uses_data_age():
+    """Freshness is measured from the backup, falling back to the restore time"""
+    assert template_age_minutes({"backup_created_at": "2026-03-01T10:00:00Z", "restored_at": "2026-03-01T11:30:00Z"}, NOW) == 120
+    assert template_age_minutes({"backup_created_at": "", "restored_at": "2026-03-01T11:30:00Z"}, NOW) == 30
+    assert template_age_minutes({"comment": "created by hand"}, NOW) is None
@@ -0,0 +1,161 @@
+import json
+import re
+import sys
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+# Agregar el directorio de la API al path para importar los módulos
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import operations
+import state
+from upgrades import ArmClient, UpgradeBatch, run_batch, validate_target
+
+SERVER_RE = re.compile(r"^/subscriptions/(?P<sub>[^/]+)/resourceGroups/(?P<rg>[^/]+)"
+                       r"/providers/Microsoft.DBforPostgreSQL/flexibleServers/(?P<name>[^/?]+)")
+
+
+class FakeArm:
+    """ARM local: servidores en memoria y operaciones que terminan tras varios sondeos."""
+
+    def __init__(self, servers, polls_to_finish=2, fail=()):
+        self.servers = servers
+        self.polls_to_finish = polls_to_finish
+        self.fail = set(fail)
+        self.operations = {}
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+        arm = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, body=None, headers=None):
+                payload = json.dumps(body).encode() if body is not None else b""
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):
+                if self.path.startswith("/operations/"):
+                    return self._send(200, arm.poll(self.path.split("/")[2].split("?")[0]), {"Retry-After": "0"})
+                match = SERVER_RE.match(self.path)
+                server = arm.servers.get(match.group("name")) if match else None
+                if server is None:
+                    return self._send(404, {"error": {"code": "ResourceNotFound", "message": "Server not found"}})
+                self._send(200, {"name": match.group("name"), "properties": dict(server)})
+
+            def do_PATCH(self):
+                name = SERVER_RE.match(self.path).group("name")
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                operation_id = f"op-{name}"
+                with arm.lock:
+                    arm.operations[operation_id] = {"server": name, "version": body["properties"]["version"], "polls": 0}
+                    arm.servers[name]["state"] = "Updating"
+                    arm.active += 1
+                    arm.max_active = max(arm.max_active, arm.active)
+                host, port = self.server.server_address
+                self._send(202, None, {"Azure-AsyncOperation": f"http://{host}:{port}/operations/{operation_id}?api-version=x"})
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def poll(self, operation_id):
+        time.sleep(0.02)
+        with self.lock:
+            operation = self.operations[operation_id]
+            operation["polls"] += 1
+            if operation["polls"] < self.polls_to_finish:
+                return {"status": "InProgress", "percentComplete": 50}
+            if operation.get("done") is None:
+                self.active -= 1
+                server = self.servers[operation["server"]]
+                server["state"] = "Ready"
+                operation["done"] = operation["server"] not in self.fail
+                if operation["done"]:
+                    server["version"] = operation["version"]
+            if operation["done"]:
+                return {"status": "Succeeded"}
+            return {"status": "Failed", "error": {"message": "Upgrade precheck failed"}}
+
+    @property
+    def endpoint(self):
+        host, port = self.httpd.server_address
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.httpd.shutdown()
+
+
+@pytest.fixture
+def tracker(tmp_path, monkeypatch):
+    """Seguimiento de operaciones en un SQLite temporal, con sondeos rápidos"""
+    monkeypatch.setenv("STATE_DB_PATH", str(tmp_path / "state.db"))
+    monkeypatch.setenv("ARM_POLL_INITIAL_SECONDS", "0.01")
+    monkeypatch.setenv("ARM_POLL_MAX_SECONDS", "0.05")
+    state.reset()
+    yield monkeypatch
+    operations.stop_poller()
+    state.reset()
+
+
+def _server(name, target="16"):
+    return {"subscription_id": "sub", "resource_group": "rg", "server_name": name, "target_version": target}
+
+
+def test_validate_target():
+    """Only higher major versions on Ready servers are accepted"""
+    assert validate_target({"properties": {"version": "15", "state": "Ready"}}, "16") is None
+    assert "not higher" in validate_target({"properties": {"version": "16"}}, "16")
+    assert "Stopped" in validate_target({"properties": {"version": "14", "state": "Stopped"}}, "16")
+    assert "Cannot compare" in validate_target({"properties": {}}, "16")
+
+
+def test_batch_upgrades_with_bounded_concurrency(tracker):
+    """Valid servers are upgraded at most N at a time and invalid ones are skipped"""
+    servers = {f"pg{i}": {"version": "15", "state": "Ready"} for i in range(5)}
+    servers["current"] = {"version": "16", "state": "Ready"}
+    with FakeArm(servers, polls_to_finish=3, fail={"pg4"}) as arm:
+        tracker.setenv("ARM_ENDPOINT", arm.endpoint)
+        client = ArmClient(arm.endpoint, "2024-11-01-preview", token_provider=lambda: "token")
+        operations.start_poller(client.get_operation)
+        batch = UpgradeBatch([_server(name) for name in list(servers) + ["missing"]], max_concurrency=2)
+        run_batch(batch, client)
+
+    result = {server["server_name"]: server for server in batch.snapshot()["servers"]}
+    assert arm.max_active == 2
+    assert [result[f"pg{i}"]["state"] for i in range(4)] == ["succeeded"] * 4
+    assert result["pg4"]["state"] == "failed" and result["pg4"]["error"] == "Upgrade precheck failed"
+    assert result["current"]["state"] == "invalid"
+    assert result["missing"]["state"] == "invalid" and "404" in result["missing"]["error"]
+    assert result["pg0"]["polls"] == 3 and result["pg0"]["current_version"] == "15"
+    assert servers["pg0"]["version"] == "16"
+    assert batch.snapshot()["status"] == "completed"
+    # Las operaciones quedan registradas en el seguimiento duradero
+    operation = operations.get_operation(result["pg0"]["operation_id"])
+    assert operation["status"] == "Succeeded" and operation["metadata"]["batch_id"] == batch.id
+    assert operation["resource"].endswith("/flexibleServers/pg0")
+
+
+def test_dry_run_only_validates(tracker):
+    """A dry run reports which servers would be upgraded without patching them"""
+    servers = {"pg0": {"version": "15", "state": "Ready"}}
+    with FakeArm(servers) as arm:
+        client = ArmClient(arm.endpoint, "x", token_provider=lambda: "token")
+        batch = UpgradeBatch([_server("pg0")], max_concurrency=1, dry_run=True)
+        run_batch(batch, client)
+    assert batch.snapshot()["servers"][0]["state"] == "validated"
+    assert arm.operations == {}
@@ -0,0 +1,42 @@
+import sys
+import os
+
+# Agregar el directorio de la API al path para importar los módulos
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from verification import compare_snapshots, plan_measurements
+
+def _table(name, method="exact", rows=100, checksum=None):
+    return {"schema": "public", "table": name, "method": method, "row_count": rows,
+            "checksum": checksum, "checksum_rows": 10 if checksum else 0}
+
+def test_plan_measurements():
+    """Large tables are estimated and only tables with a primary key get a sampled checksum"""
+    tables = [
+        {"schema": "public", "table": "events", "size_bytes": 10_000, "reltuples": 5000, "primary_key": ["id"]},
+        {"schema": "public", "table": "logs", "size_bytes": 10, "reltuples": 10, "primary_key": []},
+        {"schema": "public", "table": "fresh", "size_bytes": 10_000, "reltuples": -1, "primary_key": ["id"]},
+    ]
+    specs = {s["table"]: s for s in plan_measurements(tables, exact_threshold_bytes=1000, checksum_rows=50)}
+    assert specs["events"]["method"] == "estimate" and specs["events"]["checksum_rows"] == 50
+    assert specs["logs"]["method"] == "exact" and specs["logs"]["checksum_rows"] == 0
+    assert specs["fresh"]["method"] == "exact"
+
+def test_compare_snapshots_passes_matching_tables():
+    """Identical exact counts and estimates within tolerance pass"""
+    source = {"tables": [_table("a"), _table("b", method="estimate", rows=1000, checksum="x")]}
+    target = {"tables": [_table("a"), _table("b", method="estimate", rows=1050, checksum="x")]}
+    report = compare_snapshots(source, target)
+    assert report["status"] == "passed"
+    assert report["summary"] == {"tables": 2, "passed": 2, "failed": 0, "exact": 1, "estimated": 1, "checksummed": 1}
+
+def test_compare_snapshots_detects_partial_restore():
+    """Half-restored, empty, missing and checksum-mismatched tables fail and are listed first"""
+    source = {"tables": [_table("ok"), _table("half"), _table("empty", method="estimate", rows=10),
+                         _table("gone"), _table("sum", checksum="x")]}
+    target = {"tables": [_table("ok"), _table("half", rows=50), _table("empty", method="estimate", rows=0),
+                         _table("sum", checksum="y")]}
+    report = compare_snapshots(source, target)
+    assert report["status"] == "failed"
+    assert [t["table"] for t in report["tables"]] == ["half", "empty", "gone", "sum", "ok"]
+    assert report["tables"][2]["issues"] == ["missing on target"]
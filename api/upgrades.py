@@ -0,0 +1,292 @@
+"""
+Actualización de versión mayor de varios Azure Database for PostgreSQL Flexible Servers.
+
+Un lote recibe una lista de servidores con su versión de destino y:
+
+1. Valida cada servidor contra ARM (existe, está Ready y la versión de destino es mayor que
+   la actual); los servidores no válidos no se actualizan.
+2. Envía el PATCH (createMode Update) de los válidos con un máximo de servidores a la vez.
+3. Registra la operación de larga duración de cada uno (Azure-AsyncOperation o Location) en
+   el seguimiento de operaciones (operations.py), que la sondea en segundo plano, y espera a
+   que termine antes de pasar al siguiente servidor.
+
+El estado de cada servidor se publica en el lote (/api/upgrades/{id}); el lote vive en
+memoria, pero sus operaciones quedan en SQLite y se siguen consultando en
+/api/operations/{id} aunque la Function App se reinicie. Las llamadas a ARM usan
+DefaultAzureCredential; ARM_ENDPOINT permite usar un ARM local en pruebas.
+"""
+import functools
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+import requests
+
+import operations
+from config import get_arm_config
+from resilience import get_upstream, is_stale
+
+ARM_SCOPE = "https://management.azure.com/.default"
+SUBSCRIPTIONS_API_VERSION = "2022-12-01"
+SERVER_PATH = ("/subscriptions/{subscription_id}/resourceGroups/{resource_group}"
+               "/providers/Microsoft.DBforPostgreSQL/flexibleServers/{server_name}")
+# Lotes terminados que se conservan en memoria para consultar su estado
+MAX_BATCHES = 20
+
+_credential = None
+_token_lock = threading.Lock()
+_token: Optional[Any] = None
+
+
+def default_token_provider() -> str:
+    """Token de ARM de la identidad de la Function App, reutilizado hasta poco antes de caducar."""
+    global _credential, _token
+    with _token_lock:
+        if _token is None or _token.expires_on - time.time() < 300:
+            if _credential is None:
+                from azure.identity import DefaultAzureCredential
+                _credential = DefaultAzureCredential()
+            _token = _credential.get_token(ARM_SCOPE)
+        return _token.token
+
+
+def parse_major(version: Any) -> int:
+    """Versión mayor de PostgreSQL ("16", "16.4" o 16); ValueError si no es numérica."""
+    return int(str(version).split(".")[0])
+
+
+class ResourceList(list):
+    """Elementos de una lista de ARM; `stale` si alguna página vino de la caché (circuito abierto)."""
+    stale = False
+
+
+class ArmError(Exception):
+    def __init__(self, status_code: int, message: str):
+        super().__init__(f"ARM returned {status_code}: {message}")
+        self.status_code = status_code
+
+
+class ArmClient:
+    """Llamadas a ARM para los Flexible Servers, con una sesión HTTP reutilizada."""
+
+    def __init__(self, endpoint: Optional[str] = None, api_version: Optional[str] = None,
+                 token_provider: Callable[[], str] = default_token_provider):
+        config = get_arm_config()
+        self.endpoint = (endpoint or config["endpoint"]).rstrip("/")
+        self.api_version = api_version or config["api_version"]
+        self.token_provider = token_provider
+        self.session = requests.Session()
+
+    def _request(self, method: str, url: str, **kwargs) -> requests.Response:
+        headers = {"Authorization": f"Bearer {self.token_provider()}", "Content-Type": "application/json"}
+        # Plazo, circuit breaker y hedging de los GET (resilience.py); con el circuito abierto
+        # los GET se sirven con su última respuesta correcta
+        response = get_upstream("arm").call(method, url, functools.partial(self.session.request, method),
+                                            headers=headers, **kwargs)
+        if response.status_code >= 400:
+            try:
+                message = response.json().get("error", {}).get("message") or response.text
+            except ValueError:
+                message = response.text
+            raise ArmError(response.status_code, message)
+        return response
+
+    def server_url(self, server: Dict[str, Any]) -> str:
+        return f"{self.endpoint}{SERVER_PATH.format(**server)}"
+
+    def get_server(self, server: Dict[str, Any]) -> Dict[str, Any]:
+        return self._request("GET", self.server_url(server), params={"api-version": self.api_version}).json()
+
+    def paginate(self, url: str, params: Optional[Dict[str, Any]] = None) -> ResourceList:
+        """Elementos de una lista de ARM, siguiendo nextLink (que ya incluye la query)."""
+        items = ResourceList()
+        while url:
+            response = self._request("GET", url, params=params)
+            body = response.json()
+            items.extend(body.get("value", []))
+            items.stale = items.stale or is_stale(response)
+            url, params = body.get("nextLink"), None
+        return items
+
+    def list_subscriptions(self) -> List[str]:
+        return [sub["subscriptionId"] for sub in self.paginate(
+            f"{self.endpoint}/subscriptions", {"api-version": SUBSCRIPTIONS_API_VERSION})]
+
+    def list_servers(self, subscription_id: str) -> ResourceList:
+        """Flexible Servers de una suscripción (todas las páginas)."""
+        return self.paginate(
+            f"{self.endpoint}/subscriptions/{subscription_id}/providers/Microsoft.DBforPostgreSQL/flexibleServers",
+            {"api-version": self.api_version}
+        )
+
+    def start_upgrade(self, server: Dict[str, Any], target_version: str) -> Optional[str]:
+        """Envía el PATCH de la actualización; devuelve la URL de la operación (None si ya terminó)."""
+        response = self._request(
+            "PATCH", self.server_url(server), params={"api-version": self.api_version},
+            json={"properties": {"createMode": "Update", "version": target_version}}
+        )
+        if response.status_code == 202:
+            return response.headers.get("Azure-AsyncOperation") or response.headers.get("Location")
+        return None
+
+    def get_operation(self, url: str) -> Dict[str, Any]:
+        """Estado de una operación; Retry-After (segundos) se devuelve en "retry_after"."""
+        response = self._request("GET", url)
+        body = response.json() if response.content else {}
+        # Una URL Location responde 202 mientras la operación sigue en curso
+        status = body.get("status") or ("InProgress" if response.status_code == 202 else "Succeeded")
+        retry_after = response.headers.get("Retry-After")
+        return {
+            "status": status,
+            "percent_complete": body.get("percentComplete"),
+            "error": (body.get("error") or {}).get("message"),
+            "retry_after": float(retry_after) if retry_after and retry_after.isdigit() else None
+        }
+
+
+def validate_target(server_info: Dict[str, Any], target_version: str) -> Optional[str]:
+    """Motivo por el que no se puede actualizar el servidor, o None si es válido."""
+    properties = server_info.get("properties", {})
+    try:
+        current, target = parse_major(properties.get("version")), parse_major(target_version)
+    except (TypeError, ValueError):
+        return f"Cannot compare versions {properties.get('version')} and {target_version}"
+    if target <= current:
+        return f"Target version {target_version} is not higher than the current version {properties.get('version')}"
+    state = properties.get("state")
+    if state and state != "Ready":
+        return f"Server is {state}, not Ready"
+    return None
+
+
+class UpgradeBatch:
+    """Estado de un lote de actualizaciones; cada servidor avanza en su propio hilo del pool."""
+
+    def __init__(self, servers: List[Dict[str, Any]], max_concurrency: int, dry_run: bool = False):
+        self.id = uuid.uuid4().hex[:12]
+        self.max_concurrency = max_concurrency
+        self.dry_run = dry_run
+        self.created_at = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+        self._lock = threading.Lock()
+        self.servers = [
+            dict(server, state="pending", current_version=None, error=None, operation_id=None, operation_url=None,
+                 percent_complete=None, polls=0, started_at=None, completed_at=None)
+            for server in servers
+        ]
+
+    def update(self, index: int, **fields: Any) -> None:
+        with self._lock:
+            self.servers[index].update(fields)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            servers = [dict(server) for server in self.servers]
+        counts: Dict[str, int] = {}
+        for server in servers:
+            counts[server["state"]] = counts.get(server["state"], 0) + 1
+        finished = all(server["state"] in ("invalid", "validated", "succeeded", "failed") for server in servers)
+        return {
+            "id": self.id,
+            "created_at": self.created_at,
+            "dry_run": self.dry_run,
+            "max_concurrency": self.max_concurrency,
+            "status": "completed" if finished else "in_progress",
+            "counts": counts,
+            "servers": servers
+        }
+
+
+def _now() -> str:
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+
+
+def run_batch(batch: UpgradeBatch, client: ArmClient) -> None:
+    """Valida todos los servidores y actualiza los válidos con `max_concurrency` a la vez."""
+
+    def validate(index: int) -> bool:
+        server = batch.servers[index]
+        batch.update(index, state="validating")
+        try:
+            info = client.get_server(server)
+        except Exception as e:
+            batch.update(index, state="invalid", error=str(e))
+            return False
+        reason = validate_target(info, server["target_version"])
+        batch.update(index, current_version=info.get("properties", {}).get("version"),
+                     state="invalid" if reason else "validated", error=reason)
+        return reason is None
+
+    def upgrade(index: int) -> None:
+        server = batch.servers[index]
+        batch.update(index, state="submitting", started_at=_now())
+        try:
+            url = client.start_upgrade(server, server["target_version"])
+            if url is None:
+                batch.update(index, state="succeeded", percent_complete=100, completed_at=_now())
+                return
+            operation = operations.register(
+                url, "major_upgrade", resource=client.server_url(server).split(client.endpoint, 1)[1],
+                metadata={"batch_id": batch.id, "target_version": server["target_version"]}
+            )
+            batch.update(index, state="in_progress", operation_id=operation["id"], operation_url=url)
+
+            def on_update(operation: Dict[str, Any]) -> None:
+                batch.update(index, polls=operation["polls"], percent_complete=operation["percent_complete"])
+
+            result = operations.wait(operation["id"], on_update)
+            succeeded = result["status"].lower() == "succeeded"
+            batch.update(index, state="succeeded" if succeeded else "failed", completed_at=_now(),
+                         error=result["error"])
+            logging.info(f"Upgrade of {server['server_name']} to {server['target_version']} finished: {result['status']}")
+        except Exception as e:
+            logging.exception(f"Upgrade of {server['server_name']} failed")
+            batch.update(index, state="failed", error=str(e), completed_at=_now())
+
+    indexes = range(len(batch.servers))
+    if not batch.dry_run:
+        operations.start_poller()
+    with ThreadPoolExecutor(max_workers=max(1, batch.max_concurrency)) as pool:
+        valid = [index for index, ok in zip(indexes, pool.map(validate, indexes)) if ok]
+        if not batch.dry_run:
+            list(pool.map(upgrade, valid))
+
+
+_batches: "OrderedDict[str, UpgradeBatch]" = OrderedDict()
+_batches_lock = threading.Lock()
+
+
+def start_batch(servers: List[Dict[str, Any]], max_concurrency: Optional[int] = None, dry_run: bool = False,
+                client: Optional[ArmClient] = None) -> Dict[str, Any]:
+    """Crea el lote y lo ejecuta en segundo plano; devuelve su estado inicial."""
+    config = get_arm_config()
+    batch = UpgradeBatch(servers, max_concurrency or config["upgrade_concurrency"], dry_run)
+    with _batches_lock:
+        _batches[batch.id] = batch
+        while len(_batches) > MAX_BATCHES:
+            oldest = next(iter(_batches))
+            if _batches[oldest].snapshot()["status"] != "completed":
+                break
+            del _batches[oldest]
+    threading.Thread(
+        target=run_batch,
+        args=(batch, client or ArmClient()),
+        name=f"upgrade-{batch.id}",
+        daemon=True
+    ).start()
+    return batch.snapshot()
+
+
+def get_batch(batch_id: str) -> Optional[Dict[str, Any]]:
+    with _batches_lock:
+        batch = _batches.get(batch_id)
+    return batch.snapshot() if batch else None
+
+
+def list_batches() -> List[Dict[str, Any]]:
+    with _batches_lock:
+        batches = list(_batches.values())
+    return [batch.snapshot() for batch in reversed(batches)]
@@ -0,0 +1,379 @@
+"""
+Verificación de restauraciones por tabla.
+
+En el momento del dump se toma una instantánea en producción con el número de filas de cada
+tabla (exacto por debajo de un umbral de tamaño, estimado por encima) y, opcionalmente, un
+checksum de una muestra de filas ordenada por clave primaria. Tras la restauración se mide lo
+mismo en desarrollo con un número acotado de conexiones concurrentes y se genera un informe
+estructurado de pass/fail por tabla.
+
+El módulo solo depende de psycopg para poder ejecutarse tanto desde la API como desde los
+scripts del workflow:
+
+    python verification.py snapshot --host H --dbname D --user U --output snapshot.json
+    python verification.py verify --snapshot snapshot.json --host H --dbname D --user U --output report.json
+
+La contraseña se toma de PGPASSWORD, como en el resto de herramientas de PostgreSQL.
+"""
+import argparse
+import datetime
+import json
+import logging
+import os
+import queue
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+import psycopg
+from psycopg import sql
+
+DEFAULT_JOBS = 4
+DEFAULT_EXACT_THRESHOLD_BYTES = 512 * 1024 * 1024
+DEFAULT_ESTIMATE_TOLERANCE = 0.1
+
+# Se excluyen los padres de tablas particionadas: sus filas ya se cuentan en cada partición
+TABLES_QUERY = """
+    SELECT n.nspname, c.relname, pg_total_relation_size(c.oid), c.reltuples::bigint,
+           coalesce((SELECT array_agg(a.attname::text ORDER BY k.ord)
+                     FROM pg_index i
+                     CROSS JOIN LATERAL unnest(i.indkey) WITH ORDINALITY AS k(attnum, ord)
+                     JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = k.attnum
+                     WHERE i.indrelid = c.oid AND i.indisprimary), '{}')
+    FROM pg_class c
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE c.relkind = 'r'
+      AND n.nspname NOT IN ('pg_catalog', 'information_schema')
+      AND n.nspname NOT LIKE 'pg_toast%'
+    ORDER BY pg_total_relation_size(c.oid) DESC
+"""
+
+# Ajustes de sesión para que la representación textual de las filas (y por tanto los
+# checksums) sea idéntica en producción y en desarrollo
+SESSION_SETTINGS = [
+    "SET TimeZone TO 'UTC'",
+    "SET DateStyle TO 'ISO, YMD'",
+    "SET IntervalStyle TO 'postgres'",
+    "SET extra_float_digits TO 3",
+    "SET bytea_output TO 'hex'",
+]
+
+
+def utc_now() -> str:
+    return datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def build_conninfo(host: str, dbname: str, user: str, port: int = 5432, password: Optional[str] = None) -> str:
+    """Construye la cadena de conexión; sin contraseña explícita se resuelve desde PGPASSWORD."""
+    params = {"host": host, "port": port, "dbname": dbname, "user": user, "application_name": "pg-verify"}
+    if password:
+        params["password"] = password
+    return psycopg.conninfo.make_conninfo(**params)
+
+
+class ConnectionSet:
+    """
+    Conjunto acotado de conexiones reutilizadas por los workers. Si se indica un snapshot
+    exportado, todas las conexiones lo importan para ver exactamente los mismos datos
+    que pg_dump.
+    """
+
+    def __init__(self, conninfo: str, size: int, snapshot_id: Optional[str] = None):
+        self._connections: "queue.Queue[psycopg.Connection]" = queue.Queue()
+        self._all: List[psycopg.Connection] = []
+        try:
+            for _ in range(size):
+                conn = psycopg.connect(conninfo, autocommit=True)
+                self._all.append(conn)
+                for statement in SESSION_SETTINGS:
+                    conn.execute(statement)
+                if snapshot_id:
+                    conn.execute("BEGIN ISOLATION LEVEL REPEATABLE READ READ ONLY")
+                    conn.execute(sql.SQL("SET TRANSACTION SNAPSHOT {}").format(sql.Literal(snapshot_id)))
+                self._connections.put(conn)
+        except Exception:
+            self.close()
+            raise
+
+    @contextmanager
+    def connection(self) -> Iterator[psycopg.Connection]:
+        conn = self._connections.get()
+        try:
+            yield conn
+        finally:
+            self._connections.put(conn)
+
+    def close(self) -> None:
+        for conn in self._all:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+
+def list_tables(conn: psycopg.Connection) -> List[Dict[str, Any]]:
+    """Lista las tablas de usuario, de mayor a menor tamaño."""
+    return [
+        {"schema": schema, "table": table, "size_bytes": size, "reltuples": reltuples, "primary_key": list(pk)}
+        for schema, table, size, reltuples, pk in conn.execute(TABLES_QUERY).fetchall()
+    ]
+
+
+def plan_measurements(tables: List[Dict[str, Any]], exact_threshold_bytes: int, checksum_rows: int) -> List[Dict[str, Any]]:
+    """
+    Decide cómo medir cada tabla: conteo exacto si su tamaño no supera el umbral (o si nunca
+    se ha analizado), estimación del catálogo en caso contrario, y checksum de muestra solo
+    si la tabla tiene clave primaria que permita ordenar la muestra de forma determinista.
+    """
+    specs = []
+    for table in tables:
+        exact = table["size_bytes"] <= exact_threshold_bytes or table["reltuples"] < 0
+        specs.append({
+            "schema": table["schema"],
+            "table": table["table"],
+            "size_bytes": table["size_bytes"],
+            "primary_key": table["primary_key"],
+            "method": "exact" if exact else "estimate",
+            "checksum_rows": checksum_rows if table["primary_key"] else 0
+        })
+    return specs
+
+
+def measure_table(conn: psycopg.Connection, spec: Dict[str, Any]) -> Dict[str, Any]:
+    """Mide una tabla según su especificación."""
+    table = sql.Identifier(spec["schema"], spec["table"])
+    result = dict(spec)
+    started = time.monotonic()
+
+    row = conn.execute(
+        "SELECT c.reltuples::bigint FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace "
+        "WHERE n.nspname = %s AND c.relname = %s",
+        (spec["schema"], spec["table"])
+    ).fetchone()
+    if row is None:
+        result.update({"row_count": None, "checksum": None, "missing": True})
+        return result
+
+    if spec["method"] == "estimate" and row[0] >= 0:
+        result["row_count"] = row[0]
+    else:
+        result["row_count"] = conn.execute(sql.SQL("SELECT count(*) FROM {}").format(table)).fetchone()[0]
+
+    result["checksum"] = None
+    if spec["checksum_rows"]:
+        order = sql.SQL(", ").join(sql.Identifier(column) for column in spec["primary_key"])
+        query = sql.SQL(
+            "SELECT md5(string_agg(md5(t::text), '' ORDER BY {order})) "
+            "FROM (SELECT * FROM {table} ORDER BY {order} LIMIT %s) t"
+        ).format(order=order, table=table)
+        result["checksum"] = conn.execute(query, (spec["checksum_rows"],)).fetchone()[0]
+
+    result["elapsed_ms"] = round((time.monotonic() - started) * 1000)
+    return result
+
+
+def run_measurements(conninfo: str, specs: List[Dict[str, Any]], jobs: int, snapshot_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Mide todas las tablas con como máximo `jobs` conexiones concurrentes."""
+    if not specs:
+        return []
+    jobs = max(1, min(jobs, len(specs)))
+    connections = ConnectionSet(conninfo, jobs, snapshot_id)
+
+    def measure(spec: Dict[str, Any]) -> Dict[str, Any]:
+        with connections.connection() as conn:
+            return measure_table(conn, spec)
+
+    try:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            return list(executor.map(measure, specs))
+    finally:
+        connections.close()
+
+
+def take_snapshot(
+    conninfo: str,
+    jobs: int = DEFAULT_JOBS,
+    exact_threshold_bytes: int = DEFAULT_EXACT_THRESHOLD_BYTES,
+    checksum_rows: int = 0,
+    snapshot_id: Optional[str] = None
+) -> Dict[str, Any]:
+    """Toma la instantánea de referencia en el servidor de origen."""
+    started = time.monotonic()
+    with psycopg.connect(conninfo, autocommit=True) as conn:
+        if snapshot_id:
+            conn.execute("BEGIN ISOLATION LEVEL REPEATABLE READ READ ONLY")
+            conn.execute(sql.SQL("SET TRANSACTION SNAPSHOT {}").format(sql.Literal(snapshot_id)))
+        database = conn.info.dbname
+        tables = list_tables(conn)
+
+    specs = plan_measurements(tables, exact_threshold_bytes, checksum_rows)
+    measured = run_measurements(conninfo, specs, jobs, snapshot_id)
+    return {
+        "version": 1,
+        "database": database,
+        "taken_at": utc_now(),
+        "consistent_with_dump": bool(snapshot_id),
+        "exact_threshold_bytes": exact_threshold_bytes,
+        "checksum_rows": checksum_rows,
+        "elapsed_seconds": round(time.monotonic() - started, 1),
+        "tables": measured
+    }
+
+
+def compare_snapshots(source: Dict[str, Any], target: Dict[str, Any], estimate_tolerance: float = DEFAULT_ESTIMATE_TOLERANCE) -> Dict[str, Any]:
+    """
+    Compara las mediciones de origen y destino. Los conteos exactos deben coincidir; los
+    estimados admiten una tolerancia relativa, pero una tabla vacía en destino con filas en
+    origen siempre falla. Los checksums de muestra deben coincidir cuando existen.
+    """
+    target_tables = {(t["schema"], t["table"]): t for t in target["tables"]}
+    results = []
+    for src in source["tables"]:
+        tgt = target_tables.get((src["schema"], src["table"]))
+        issues = []
+        target_rows = None
+        if tgt is None or tgt.get("missing"):
+            issues.append("missing on target")
+        else:
+            target_rows = tgt["row_count"]
+            source_rows = src["row_count"]
+            if src["method"] == "exact" and tgt["method"] == "exact":
+                if target_rows != source_rows:
+                    issues.append(f"row count {target_rows} != {source_rows}")
+            elif source_rows > 0 and target_rows == 0:
+                issues.append(f"empty on target, {source_rows} rows expected")
+            elif abs(target_rows - source_rows) > estimate_tolerance * max(source_rows, 1):
+                issues.append(f"estimated row count {target_rows} differs from {source_rows} by more than {estimate_tolerance:.0%}")
+            if src.get("checksum") and tgt.get("checksum") != src["checksum"]:
+                issues.append(f"sampled checksum mismatch ({src['checksum_rows']} rows)")
+
+        results.append({
+            "schema": src["schema"],
+            "table": src["table"],
+            "method": src["method"],
+            "source_rows": src["row_count"],
+            "target_rows": target_rows,
+            "checksummed": bool(src.get("checksum")),
+            "status": "failed" if issues else "passed",
+            "issues": issues
+        })
+
+    failed = [r for r in results if r["status"] == "failed"]
+    return {
+        "status": "failed" if failed else "passed",
+        "database": source.get("database"),
+        "source_taken_at": source.get("taken_at"),
+        "checked_at": utc_now(),
+        "summary": {
+            "tables": len(results),
+            "passed": len(results) - len(failed),
+            "failed": len(failed),
+            "exact": sum(1 for r in results if r["method"] == "exact"),
+            "estimated": sum(1 for r in results if r["method"] == "estimate"),
+            "checksummed": sum(1 for r in results if r["checksummed"])
+        },
+        # Las tablas con fallos primero para que el informe se lea de un vistazo
+        "tables": failed + [r for r in results if r["status"] == "passed"]
+    }
+
+
+def verify_restore(source: Dict[str, Any], conninfo: str, jobs: int = DEFAULT_JOBS, estimate_tolerance: float = DEFAULT_ESTIMATE_TOLERANCE) -> Dict[str, Any]:
+    """Mide en destino las mismas tablas, con los mismos métodos, y genera el informe."""
+    started = time.monotonic()
+    specs = [
+        {key: table[key] for key in ("schema", "table", "size_bytes", "primary_key", "method", "checksum_rows")}
+        for table in source["tables"]
+    ]
+    target = {"tables": run_measurements(conninfo, specs, jobs)}
+    report = compare_snapshots(source, target, estimate_tolerance)
+    report["elapsed_seconds"] = round(time.monotonic() - started, 1)
+    report["jobs"] = jobs
+    return report
+
+
+def _write_json(path: str, payload: Any) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as file:
+        json.dump(payload, file)
+    os.replace(tmp_path, path)
+
+
+def _snapshot_command(args: argparse.Namespace) -> int:
+    conninfo = build_conninfo(args.host, args.dbname, args.user, args.port)
+    exact_threshold_bytes = args.exact_threshold_mb * 1024 * 1024
+
+    if not args.snapshot_id_file:
+        _write_json(args.output, take_snapshot(conninfo, args.jobs, exact_threshold_bytes, args.checksum_rows))
+        return 0
+
+    # Se exporta un snapshot para que pg_dump (--snapshot) y las mediciones vean los mismos datos.
+    # La transacción exportadora debe seguir abierta hasta que pg_dump lo haya importado, por lo
+    # que se espera al fichero de liberación que crea backup.sh al terminar el dump.
+    with psycopg.connect(conninfo, autocommit=True) as exporter:
+        exporter.execute("BEGIN ISOLATION LEVEL REPEATABLE READ READ ONLY")
+        snapshot_id = exporter.execute("SELECT pg_export_snapshot()").fetchone()[0]
+        with open(args.snapshot_id_file, "w") as file:
+            file.write(snapshot_id)
+        logging.info(f"Exported snapshot {snapshot_id}")
+
+        _write_json(args.output, take_snapshot(conninfo, args.jobs, exact_threshold_bytes, args.checksum_rows, snapshot_id))
+
+        deadline = time.monotonic() + args.release_timeout
+        while args.release_file and not os.path.exists(args.release_file):
+            if time.monotonic() > deadline:
+                logging.warning("Timed out waiting for the snapshot release file")
+                break
+            time.sleep(1)
+        exporter.execute("COMMIT")
+    return 0
+
+
+def _verify_command(args: argparse.Namespace) -> int:
+    with open(args.snapshot) as file:
+        source = json.load(file)
+    conninfo = build_conninfo(args.host, args.dbname, args.user, args.port)
+    report = verify_restore(source, conninfo, args.jobs, args.estimate_tolerance)
+    _write_json(args.output, report)
+
+    summary = report["summary"]
+    print(f"Verification {report['status']}: {summary['passed']}/{summary['tables']} tables passed "
+          f"({summary['exact']} exact, {summary['estimated']} estimated, {summary['checksummed']} checksummed)")
+    for table in report["tables"]:
+        if table["status"] == "failed":
+            print(f"  {table['schema']}.{table['table']}: {'; '.join(table['issues'])}")
+    return 0 if report["status"] == "passed" else 2
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Per-table restore verification")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    for name in ("snapshot", "verify"):
+        sub = subparsers.add_parser(name)
+        sub.add_argument("--host", required=True)
+        sub.add_argument("--port", type=int, default=5432)
+        sub.add_argument("--dbname", required=True)
+        sub.add_argument("--user", required=True)
+        sub.add_argument("--output", required=True)
+        sub.add_argument("--jobs", type=int, default=DEFAULT_JOBS)
+        if name == "snapshot":
+            sub.add_argument("--exact-threshold-mb", type=int, default=DEFAULT_EXACT_THRESHOLD_BYTES // (1024 * 1024))
+            sub.add_argument("--checksum-rows", type=int, default=0)
+            sub.add_argument("--snapshot-id-file")
+            sub.add_argument("--release-file")
+            sub.add_argument("--release-timeout", type=int, default=6 * 3600)
+        else:
+            sub.add_argument("--snapshot", required=True)
+            sub.add_argument("--estimate-tolerance", type=float, default=DEFAULT_ESTIMATE_TOLERANCE)
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    if args.command == "snapshot":
+        return _snapshot_command(args)
+    return _verify_command(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
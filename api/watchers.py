@@ -0,0 +1,169 @@
+"""
+Espera de cambios ("long-poll") en el estado de las ejecuciones.
+
+El cliente envía la versión del último estado que recibió (`version`, hash del documento) y
+un tiempo máximo de espera; la petición queda retenida hasta que el estado cambia o vence el
+plazo. Todas las peticiones que esperan la misma consulta (ejecución, vista, campos) comparten
+un único vigilante (RunWatcher): un hilo que consulta el estado cada `interval` segundos y
+despierta a las peticiones en espera cuando cambia la versión. Así, diez pestañas siguiendo
+la misma ejecución generan una sola consulta a GitHub por intervalo.
+
+Las peticiones esperan en el bucle de asyncio (un future por petición), no en un hilo, de
+modo que las esperas largas no agotan el pool de hilos de FastAPI. El vigilante termina cuando
+no quedan peticiones esperando durante IDLE_SECONDS o cuando la ejecución ha terminado.
+"""
+import asyncio
+import hashlib
+import json
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+# Campos que cambian con el reloj y no cuentan como cambio de estado, a cualquier nivel del
+# documento (p. ej. progress.eta_seconds y progress.databases.<db>.eta_seconds se recalculan
+# con la hora actual en cada consulta)
+VOLATILE_FIELDS = ("duration", "version", "eta", "eta_seconds", "elapsed", "elapsed_seconds")
+# Segundos sin peticiones en espera tras los que se detiene un vigilante
+IDLE_SECONDS = 30
+
+
+def _stable(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {key: _stable(item) for key, item in value.items() if key not in VOLATILE_FIELDS}
+    if isinstance(value, list):
+        return [_stable(item) for item in value]
+    return value
+
+
+def state_version(document: Dict[str, Any]) -> str:
+    """Versión de un documento de estado: hash estable sin los campos que dependen del reloj."""
+    stable = _stable(document)
+    return hashlib.sha256(json.dumps(stable, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+def is_finished(document: Dict[str, Any]) -> bool:
+    return document.get("status") == "completed" and document.get("conclusion") is not None
+
+
+class RunWatcher:
+    """Consulta periódica compartida de un estado, con notificación a las peticiones en espera."""
+
+    def __init__(self, hub: "WatcherHub", key: Hashable, fetch: Callable[[], Dict[str, Any]], interval: float):
+        self.hub = hub
+        self.key = key
+        self.fetch = fetch
+        self.interval = interval
+        self.document: Optional[Dict[str, Any]] = None
+        self.version: Optional[str] = None
+        self.error: Optional[Exception] = None
+        self.waiters = 0
+        self.fetches = 0
+        self._idle_since = time.monotonic()
+        self._futures: List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name=f"watch-{key}", daemon=True)
+
+    def _notify(self) -> None:
+        with self._lock:
+            futures, self._futures = self._futures, []
+        for loop, future in futures:
+            # Los futures de peticiones que ya han vencido se descartan
+            if future.done() or loop.is_closed():
+                continue
+            try:
+                loop.call_soon_threadsafe(lambda f=future: f.done() or f.set_result(None))
+            except RuntimeError:
+                pass  # El bucle se ha cerrado entre la comprobación y la llamada
+
+    def _poll(self) -> None:
+        try:
+            document, error = self.fetch(), None
+            version = state_version(document)
+        except Exception as e:
+            document, version, error = None, None, e
+        self.fetches += 1
+        with self._lock:
+            changed = version != self.version or type(error) is not type(self.error) or self.document is None
+            if error is None:
+                self.document = document
+            self.version, self.error = version, error
+        if changed:
+            self._notify()
+
+    def _run(self) -> None:
+        while True:
+            self._poll()
+            finished = self.error is None and is_finished(self.document)
+            time.sleep(0 if finished else self.interval)
+            with self.hub._lock:
+                if finished or (self.waiters == 0 and time.monotonic() - self._idle_since > IDLE_SECONDS):
+                    # Las peticiones siguientes crean un vigilante nuevo
+                    self.hub._watchers.pop(self.key, None)
+                    break
+        self._notify()
+
+    def current(self) -> Tuple[Optional[Dict[str, Any]], Optional[str], Optional[Exception]]:
+        with self._lock:
+            return self.document, self.version, self.error
+
+    def changed(self) -> asyncio.Future:
+        """Future que se completa con el siguiente cambio de estado."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self._lock:
+            self._futures.append((loop, future))
+        return future
+
+
+class WatcherHub:
+    """Vigilantes activos por consulta; las peticiones que esperan lo mismo comparten vigilante."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._watchers: Dict[Hashable, RunWatcher] = {}
+
+    def _acquire(self, key: Hashable, fetch: Callable[[], Dict[str, Any]], interval: float) -> RunWatcher:
+        with self._lock:
+            watcher = self._watchers.get(key)
+            if watcher is None:
+                watcher = RunWatcher(self, key, fetch, interval)
+                self._watchers[key] = watcher
+                watcher._thread.start()
+            watcher.waiters += 1
+            return watcher
+
+    def _release(self, watcher: RunWatcher) -> None:
+        with self._lock:
+            watcher.waiters -= 1
+            if watcher.waiters == 0:
+                watcher._idle_since = time.monotonic()
+
+    async def wait_for_change(self, key: Hashable, fetch: Callable[[], Dict[str, Any]], version: str,
+                              timeout: float, interval: float) -> Dict[str, Any]:
+        """
+        Devuelve el estado en cuanto su versión es distinta de `version`, o el estado actual al
+        vencer `timeout`. Los errores de la consulta (p. ej. 404) se propagan a la petición.
+        """
+        watcher = self._acquire(key, fetch, interval)
+        deadline = time.monotonic() + timeout
+        try:
+            while True:
+                changed = watcher.changed()
+                document, current, error = watcher.current()
+                if error is not None:
+                    raise error
+                remaining = deadline - time.monotonic()
+                if document is not None and (current != version or remaining <= 0):
+                    return document
+                try:
+                    # Sin documento todavía se espera a la primera consulta del vigilante
+                    await asyncio.wait_for(changed, timeout=max(remaining, 0.1))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._release(watcher)
+
+    def stats(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [{"key": str(key), "waiters": watcher.waiters, "fetches": watcher.fetches}
+                    for key, watcher in self._watchers.items()]
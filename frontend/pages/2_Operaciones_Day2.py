@@ -1,8 +1,12 @@
 import streamlit as st
-import requests
-from utils.api import execute_workflow, get_server_info
+import pandas as pd
+from utils import client
+from utils.api import (estimate_workflow, execute_workflow, get_server_info, get_servers, get_upgrade_batch,
+                       list_operations, reset_from_template, start_upgrades, track_operation)
+from utils.client import invalidate_cache
 from utils.auth import get_azure_token
 from utils.config import load_secrets
+from utils.ui import format_seconds, server_label
 
 # Título de la página
 st.title("🛠️ Operaciones Day-2 PostgreSQL")
@@ -22,7 +26,7 @@ Las operaciones Day-2 son aquellas que se realizan durante el ciclo de vida oper
 """)
 
 # Operation selection buttons
-col1, col2 = st.columns(2)
+col1, col2, col3 = st.columns(3)
 
 with col1:
     if st.button("🔄 Refresco de Entornos", key="btn_refresh", 
@@ -38,8 +42,15 @@ with col2:
         st.session_state.selected_operation = "upgrade" if st.session_state.selected_operation != "upgrade" else None
         st.rerun()
 
+with col3:
+    if st.button("♻️ Reset desde Plantilla", key="btn_template_reset", 
+                type="primary" if st.session_state.selected_operation == "template_reset" else "secondary", 
+                use_container_width=True):
+        st.session_state.selected_operation = "template_reset" if st.session_state.selected_operation != "template_reset" else None
+        st.rerun()
+
 # Add descriptive cards below the buttons with green styling
-col1, col2 = st.columns(2)
+col1, col2, col3 = st.columns(3)
 with col1:
     st.markdown("""
     <div class="operation-description">
@@ -54,8 +65,47 @@ with col2:
     </div>
     """, unsafe_allow_html=True)
 
+with col3:
+    st.markdown("""
+    <div class="operation-description">
+        <p>Restablece en segundos una base de datos de desarrollo desde su plantilla</p>
+    </div>
+    """, unsafe_allow_html=True)
+
 st.markdown("---")
 
+# Refrescos cuya duración prevista supera este umbral se recomienda lanzarlos fuera de horas
+OFF_PEAK_THRESHOLD_SECONDS = 30 * 60
+
+def show_estimate(estimate):
+    """Muestra la duración prevista de cada fase y base de datos con sus límites p10/p90"""
+    total = estimate["total"]
+    st.metric(
+        "Duración prevista", format_seconds(total["seconds"]),
+        help="Entre el percentil 10 y el 90 de los refrescos anteriores."
+    )
+    st.caption(f"Entre {format_seconds(total['low_seconds'])} y {format_seconds(total['high_seconds'])} "
+               f"· {estimate['history_samples']} refrescos anteriores en el historial")
+    rows = []
+    for database, result in estimate["databases"].items():
+        row = {
+            "Base de datos": database,
+            "Tamaño (GB)": f"{result['database_size_bytes'] / 1024 ** 3:.2f}",
+            "Backup (GB)": f"{result['backup_size_bytes'] / 1024 ** 3:.2f}" + (" (existente)" if result["backup_reused"] else "")
+        }
+        for phase, label in (("dump", "Dump"), ("transfer", "Transferencia"), ("restore", "Restauración")):
+            prediction = result[phase]
+            row[label] = (f"{format_seconds(prediction['seconds'])} ({format_seconds(prediction['low_seconds'])}"
+                          f" – {format_seconds(prediction['high_seconds'])})") if prediction else "—"
+        rows.append(row)
+    st.dataframe(rows, use_container_width=True)
+    if estimate.get("upper_bound"):
+        st.info("Refresco selectivo: la estimación corresponde al refresco completo y es el peor caso.")
+    if not estimate["history_samples"]:
+        st.info("Sin historial de refrescos: se usan rendimientos por defecto y los márgenes son amplios.")
+    if total["seconds"] > OFF_PEAK_THRESHOLD_SECONDS:
+        st.warning("Refresco largo: considere lanzarlo fuera del horario de mayor actividad.")
+
 # Only show the form if the corresponding operation is selected
 if st.session_state.selected_operation == "refresh":
     st.subheader("🔄 Refresco de Entornos")
@@ -66,7 +116,10 @@ if st.session_state.selected_operation == "refresh":
         col1, col2 = st.columns(2)
         with col1:
             pg_host_prod = st.text_input("Host de Producción", placeholder="prod-postgres")
-            pg_database = st.text_input("Nombre de la Base de Datos", placeholder="mydb")
+            pg_database = st.text_input(
+                "Bases de Datos", placeholder="mydb, otra_db",
+                help="Una o varias bases de datos separadas por comas."
+            )
             resource_group = st.text_input("Grupo de Recursos", placeholder="rg-production")
             storage_account = st.text_input("Cuenta de Almacenamiento", placeholder="mystorage")
         
@@ -76,35 +129,185 @@ if st.session_state.selected_operation == "refresh":
             pg_password = st.text_input("Contraseña PostgreSQL", type="password", placeholder="********")
             storage_container = st.text_input("Contenedor de Almacenamiento", placeholder="backups")
         
-        st.text("Esta operación hará un backup de la base de datos de producción y la restaurará en el entorno de desarrollo.")
-        submit_button = st.form_submit_button("Iniciar Refresco de Entornos")
+        with st.expander("Varias bases de datos"):
+            col1, col2 = st.columns(2)
+            with col1:
+                all_databases = st.checkbox(
+                    "Todas las bases de datos del servidor",
+                    help="Refresca todas las bases de datos de producción que no son plantillas (ignora el campo de bases de datos)."
+                )
+                include_globals = st.checkbox(
+                    "Copiar roles", value=True,
+                    help="Vuelca los roles de producción una sola vez (sin contraseñas) y los crea en desarrollo antes de restaurar."
+                )
+            with col2:
+                max_parallel_databases = st.number_input(
+                    "Bases de datos en paralelo", min_value=1, max_value=8, value=2,
+                    help="Número de pipelines de backup/restore por base de datos que se ejecutan a la vez."
+                )
         
-        if submit_button:
-            if not all([pg_host_prod, pg_host_dev, pg_database, pg_user, pg_password, resource_group, storage_account, storage_container]):
+        with st.expander("Ejecutor"):
+            executor = st.radio(
+                "Dónde ejecutar el refresco", ["github", "local"], horizontal=True,
+                format_func=lambda name: "GitHub Actions" if name == "github" else "Local (API)",
+                help="Local: la API ejecuta pg_dump/pg_restore directamente y evita la cola y el arranque del runner de GitHub. Recomendado para bases de datos pequeñas y medianas."
+            )
+        
+        with st.expander("Reutilización de backups"):
+            col1, col2 = st.columns(2)
+            with col1:
+                max_backup_age = st.number_input(
+                    "Antigüedad máxima del backup (minutos)", min_value=0, value=0, step=15,
+                    help="Si existe en el catálogo un backup válido más reciente, se restaura sin volver a ejecutar pg_dump. 0 = siempre un backup nuevo."
+                )
+                restore_only = st.checkbox(
+                    "Solo restaurar (no ejecutar pg_dump)",
+                    help="Requiere un backup concreto o una antigüedad máxima."
+                )
+            with col2:
+                backup_name = st.text_input("Backup a restaurar (opcional)", placeholder="mydb_20250101_020000.dump")
+            chunked_backup = st.checkbox(
+                "Backup deduplicado por chunks", value=False,
+                help="El dump se genera sin comprimir, se trocea por contenido y solo se suben los fragmentos que no estaban ya almacenados. Reduce el almacenamiento y el tiempo de subida de los backups diarios."
+            )
+        
+        with st.expander("Perfil de restauración"):
+            col1, col2 = st.columns(2)
+            with col1:
+                restore_profile = st.selectbox(
+                    "Perfil", ["standard", "fast"],
+                    help="fast: carga datos antes de crear índices y restricciones, ajusta la sesión para carga masiva y ejecuta ANALYZE en paralelo al terminar."
+                )
+            with col2:
+                restore_jobs = st.number_input("Paralelismo (perfil fast)", min_value=1, max_value=32, value=4)
+            restore_target = st.selectbox(
+                "Destino", ["database", "template"],
+                format_func=lambda target: "Base de datos" if target == "database" else "Plantilla (<base_de_datos>__tpl) + copia",
+                help="Plantilla: el backup se restaura una vez en <base_de_datos>__tpl y la base de datos se crea como copia. Después puede restablecerse en segundos con 'Reset desde Plantilla'."
+            )
+        
+        with st.expander("Verificación tras la restauración"):
+            col1, col2 = st.columns(2)
+            with col1:
+                verify = st.checkbox(
+                    "Comparar tablas con producción", value=True,
+                    help="Compara el número de filas de cada tabla en desarrollo con una instantánea tomada en producción durante el dump."
+                )
+                verify_exact_threshold_mb = st.number_input(
+                    "Umbral de conteo exacto (MB)", min_value=0, value=512,
+                    help="Las tablas mayores usan el número de filas estimado del catálogo."
+                )
+            with col2:
+                verify_checksum_rows = st.number_input(
+                    "Filas en checksum de muestra", min_value=0, max_value=100000, value=0,
+                    help="Número de filas por tabla (ordenadas por clave primaria) incluidas en el checksum. 0 = desactivado."
+                )
+        
+        with st.expander("Refresco selectivo"):
+            selective = st.checkbox(
+                "Copiar solo las tablas modificadas", value=False,
+                help="Compara los contadores de pg_stat_user_tables con los del último refresco y reutiliza en desarrollo las tablas sin cambios. Sin estadísticas previas o si el esquema ha cambiado se hace el refresco completo."
+            )
+            selective_threshold = st.number_input(
+                "Umbral de cambios (% de filas)", min_value=0.0, max_value=100.0, value=1.0, step=0.5,
+                help="Una tabla se vuelve a copiar si las filas insertadas, actualizadas o borradas en producción superan este porcentaje."
+            )
+        
+        with st.expander("Subconjunto de datos"):
+            subset_enabled = st.checkbox(
+                "Copiar solo un subconjunto", value=False,
+                help="En lugar de un backup completo se copia directamente de producción un subconjunto que respeta las claves foráneas. Solo para una base de datos."
+            )
+            subset_roots = st.text_area(
+                "Tablas raíz", placeholder="public.customers=0.05\npublic.orders: created_at > now() - interval '30 days'",
+                help="Una tabla por línea: 'tabla=ratio' para muestrear ese porcentaje de filas o 'tabla: filtro SQL'. Se incluyen las filas hijas y todas las filas padre necesarias; el resto de tablas se crean vacías."
+            )
+            subset_seed = st.number_input("Semilla", min_value=0, value=0, help="La misma semilla devuelve el mismo subconjunto.")
+        
+        st.text("Esta operación hará un backup de las bases de datos de producción y las restaurará en el entorno de desarrollo.")
+        col1, col2 = st.columns(2)
+        with col1:
+            estimate_button = st.form_submit_button(
+                "⏱️ Estimar duración", use_container_width=True,
+                help="Calcula la duración prevista a partir del tamaño actual en producción y de los refrescos anteriores, sin lanzar nada."
+            )
+        with col2:
+            submit_button = st.form_submit_button("Iniciar Refresco de Entornos", type="primary", use_container_width=True)
+        
+        if submit_button or estimate_button:
+            databases = [name.strip() for name in pg_database.split(",") if name.strip()]
+            if not all([pg_host_prod, pg_host_dev, databases or all_databases, pg_user, pg_password, resource_group, storage_account, storage_container]):
                 st.error("Por favor complete todos los campos requeridos.")
             else:
                 workflow_data = {
                     "pg_host_prod": pg_host_prod,
                     "pg_host_dev": pg_host_dev,
-                    "pg_database": pg_database,
                     "pg_user": pg_user,
                     "pg_password": pg_password,
                     "resource_group": resource_group,
                     "storage_account": storage_account,
-                    "storage_container": storage_container
+                    "storage_container": storage_container,
+                    "restore_only": restore_only,
+                    "restore_profile": restore_profile,
+                    "restore_jobs": int(restore_jobs),
+                    "restore_target": restore_target,
+                    "verify": verify,
+                    "verify_exact_threshold_mb": int(verify_exact_threshold_mb),
+                    "verify_checksum_rows": int(verify_checksum_rows),
+                    "max_parallel_databases": int(max_parallel_databases),
+                    "include_globals": include_globals,
+                    "executor": executor
                 }
+                if all_databases:
+                    workflow_data["all_databases"] = True
+                elif len(databases) == 1:
+                    workflow_data["pg_database"] = databases[0]
+                else:
+                    workflow_data["pg_databases"] = databases
+                if backup_name:
+                    workflow_data["backup_name"] = backup_name
+                if max_backup_age:
+                    workflow_data["max_backup_age"] = int(max_backup_age)
+                if chunked_backup:
+                    workflow_data["chunked_backup"] = True
+                if selective:
+                    workflow_data["selective"] = True
+                    workflow_data["selective_threshold"] = selective_threshold / 100
+                if subset_enabled:
+                    roots = []
+                    for line in filter(None, (line.strip() for line in subset_roots.splitlines())):
+                        if ":" in line:
+                            table, where = line.split(":", 1)
+                            roots.append({"table": table.strip(), "where": where.strip()})
+                        else:
+                            table, _, ratio = line.partition("=")
+                            roots.append({"table": table.strip(), "ratio": float(ratio or 1)})
+                    workflow_data["subset"] = {"roots": roots, "seed": int(subset_seed)}
                 
-                with st.spinner("Iniciando workflow..."):
-                    result = execute_workflow(api_base_url, function_key, workflow_data)
-                
-                if result:
-                    st.success(result["message"])
-                    st.markdown(f"[Ver Workflow en GitHub]({result['workflowUrl']})")
+                if estimate_button:
+                    with st.spinner("Estimando duración..."):
+                        estimate = estimate_workflow(api_base_url, function_key, workflow_data)
+                    if estimate:
+                        show_estimate(estimate)
+                else:
+                    with st.spinner("Iniciando workflow..."):
+                        result = execute_workflow(api_base_url, function_key, workflow_data)
+                    if result:
+                        st.success(result["message"])
+                        for database, backup in result.get("backups", {}).items():
+                            if backup.get("source") == "reused":
+                                st.info(f"{database}: se reutiliza el backup existente {backup['name']} ({backup.get('reason')}); no se ejecutará pg_dump.")
+                        if result.get("workflowUrl"):
+                            st.markdown(f"[Ver Workflow en GitHub]({result['workflowUrl']})")
+                        if result.get("run_id"):
+                            # Las ejecuciones locales se consultan por su identificador local-...
+                            st.session_state["last_run_id"] = result["run_id"]
+                            st.info(f"Ejecución local {result['run_id']}: puede seguirla en la sección de Monitoreo.")
                     
-                    # Guardar el workflow_id en la sesión para monitoreo automático
-                    if "workflowUrl" in result:
-                        st.session_state["last_workflow_url"] = result["workflowUrl"]
-                        st.info("Puede ir a la sección de Monitoreo para seguir el estado del workflow.")
+                        # Guardar el workflow_id en la sesión para monitoreo automático
+                        if result.get("workflowUrl"):
+                            st.session_state["last_workflow_url"] = result["workflowUrl"]
+                            st.info("Puede ir a la sección de Monitoreo para seguir el estado del workflow.")
     with st.expander("¿Qué es el refresco de entornos?"):
         st.markdown("""
         El refresco de entornos es una operación común en el ciclo de vida de las bases de datos que consiste en:
@@ -119,6 +322,59 @@ if st.session_state.selected_operation == "refresh":
         - Depuración de problemas que solo ocurren con datos de producción
         """)
 
+elif st.session_state.selected_operation == "template_reset":
+    st.subheader("♻️ Reset desde Plantilla")
+
+    with st.form("template_reset_form"):
+        col1, col2 = st.columns(2)
+        with col1:
+            reset_host_dev = st.text_input("Host de Desarrollo", placeholder="dev-postgres")
+            reset_database = st.text_input("Base de Datos", placeholder="mydb")
+            max_template_age = st.number_input(
+                "Antigüedad máxima de la plantilla (minutos)", min_value=0, value=0, step=60,
+                help="Si los datos de la plantilla son más antiguos, no se restablece. 0 = sin límite."
+            )
+        with col2:
+            reset_user = st.text_input("Usuario PostgreSQL", placeholder="postgres")
+            reset_password = st.text_input("Contraseña PostgreSQL", type="password", placeholder="********")
+
+        st.text("La base de datos se elimina y se vuelve a crear como copia de <base_de_datos>__tpl.")
+        reset_button = st.form_submit_button("Restablecer desde Plantilla")
+
+        if reset_button:
+            if not all([reset_host_dev, reset_database, reset_user, reset_password]):
+                st.error("Por favor complete todos los campos requeridos.")
+            else:
+                reset_data = {
+                    "pg_host_dev": reset_host_dev,
+                    "pg_database": reset_database,
+                    "pg_user": reset_user,
+                    "pg_password": reset_password
+                }
+                if max_template_age:
+                    reset_data["max_template_age"] = int(max_template_age)
+
+                with st.spinner("Restableciendo base de datos..."):
+                    result = reset_from_template(api_base_url, function_key, reset_data)
+
+                if result:
+                    st.success(f"{result['database']} restablecida desde {result['template']} en {result['clone_seconds']} s")
+                    metadata = result.get("template_metadata", {})
+                    st.markdown(f"""
+                    **Backup**: {metadata.get('backup') or 'N/A'}  
+                    **Datos de**: {metadata.get('backup_created_at') or 'N/A'}  
+                    **Plantilla restaurada**: {metadata.get('restored_at') or 'N/A'}  
+                    **Antigüedad**: {result.get('template_age_minutes') or 'N/A'} minutos
+                    """)
+
+    with st.expander("¿Qué es una plantilla?"):
+        st.markdown("""
+        Un refresco con destino **Plantilla** restaura el backup una sola vez en `<base_de_datos>__tpl`,
+        que queda cerrada a conexiones y guarda la fecha de sus datos. Cada reset recrea la base de datos
+        con `CREATE DATABASE ... TEMPLATE`, una copia de ficheros que tarda segundos en lugar de repetir
+        el `pg_restore` completo. Para actualizar los datos basta con lanzar un nuevo refresco en modo plantilla.
+        """)
+
 elif st.session_state.selected_operation == "upgrade":
     st.subheader("⬆️ PostgreSQL Major Version Upgrade")
 
@@ -135,16 +391,45 @@ elif st.session_state.selected_operation == "upgrade":
         except Exception as e:
             st.error(f"Error al contactar la API: {str(e)}")
 
+    # Inventario de Flexible Servers de la API para elegir servidores sin escribirlos a mano
+    col1, col2 = st.columns([3, 1])
+    with col1:
+        use_inventory = st.toggle("Elegir servidores del inventario", value=True,
+                                  help="Servidores de las suscripciones configuradas en la API (INVENTORY_SUBSCRIPTIONS)")
+    with col2:
+        refresh_inventory = st.button("Actualizar inventario", disabled=not use_inventory, use_container_width=True)
+    inventory = get_servers(api_base_url, function_key, refresh=refresh_inventory) if use_inventory else None
+    inventory_servers = inventory["servers"] if inventory else []
+    if inventory:
+        st.caption(f"{inventory['total']} servidores en {len(inventory['subscriptions'])} suscripciones · "
+                   f"actualizado {inventory['refreshed_at'] or 'N/A'}")
+        for subscription, error in inventory["errors"].items():
+            st.warning(f"No se pudo actualizar la suscripción {subscription}: {error}")
+        if inventory.get("stale"):
+            st.warning("ARM no responde: se muestran los últimos datos disponibles de "
+                       f"{', '.join(inventory['stale_subscriptions'])}.")
+
+    selected_server = None
+    if inventory_servers:
+        selected_server = st.selectbox(
+            "Servidor",
+            [None] + inventory_servers,
+            format_func=lambda server: "Introducir manualmente" if server is None else server_label(server)
+        )
+
     with st.form("version_upgrade_form"):
         st.subheader("Detalles del Servidor PostgreSQL")
         
         col1, col2 = st.columns(2)
         with col1:
-            subscription_id = st.text_input("Subscription ID", placeholder="00000000-0000-0000-0000-000000000000")
-            resource_group = st.text_input("Resource Group", placeholder="my-resource-group")
+            subscription_id = st.text_input("Subscription ID", value=selected_server["subscription_id"] if selected_server else "",
+                                            placeholder="00000000-0000-0000-0000-000000000000")
+            resource_group = st.text_input("Resource Group", value=selected_server["resource_group"] if selected_server else "",
+                                           placeholder="my-resource-group")
         
         with col2:
-            server_name = st.text_input("Server Name", placeholder="my-postgres-server")
+            server_name = st.text_input("Server Name", value=selected_server["name"] if selected_server else "",
+                                        placeholder="my-postgres-server")
             api_version = st.text_input("API Version", value="2024-11-01-preview")
         
         # Add help text about version limitations
@@ -248,7 +533,8 @@ elif st.session_state.selected_operation == "upgrade":
                     with st.spinner("Iniciando Major Version Upgrade usando PATCH..."):
                         try:
                             # Always use PATCH method
-                            response = requests.patch(
+                            response = client.send(
+                                "PATCH", "major-upgrade",
                                 upgrade_url,
                                 headers=headers,
                                 json=upgrade_data,
@@ -274,7 +560,14 @@ elif st.session_state.selected_operation == "upgrade":
                                     # If there's an operation URL in the response headers
                                     if 'Azure-AsyncOperation' in response.headers:
                                         st.info(f"Operation URL: {response.headers['Azure-AsyncOperation']}")
-                                        st.markdown("La actualización de versión puede tardar varias horas. Puede seguir el estado de la operación usando la URL anterior.")
+                                        operation = track_operation(
+                                            api_base_url, function_key, response.headers['Azure-AsyncOperation'],
+                                            f"/subscriptions/{subscription_id}/resourceGroups/{resource_group}/providers/Microsoft.DBforPostgreSQL/flexibleServers/{server_name}"
+                                        )
+                                        if operation:
+                                            st.markdown(f"La actualización de versión puede tardar varias horas. La API sigue la operación **{operation['id']}** en segundo plano; puede consultar su estado en *Operaciones en seguimiento* aunque cierre esta página.")
+                                        else:
+                                            st.markdown("La actualización de versión puede tardar varias horas. Puede seguir el estado de la operación usando la URL anterior.")
                                 except Exception as json_err:
                                     st.info("La solicitud fue aceptada pero no devolvió detalles en formato JSON válido.")
                                     st.markdown("**Raw Response:**")
@@ -363,6 +656,103 @@ elif st.session_state.selected_operation == "upgrade":
                     st.error("No se pudo obtener el token de autenticación para Azure.")
                     st.info("Verifique que los datos en secrets.json sean correctos y que la aplicación tenga los permisos necesarios.")
     
+    # Actualización de varios servidores orquestada por la API
+    st.markdown("---")
+    st.subheader("Actualización de varios servidores")
+    st.markdown("""
+    La API valida cada servidor, lanza las actualizaciones con un máximo de servidores a la vez
+    y sigue cada operación hasta que termina. Con "Solo validar" se comprueba qué servidores se
+    actualizarían sin lanzar ninguna actualización.
+    """)
+    preselected = []
+    if inventory_servers:
+        preselect_version = st.selectbox("Preseleccionar los servidores Ready con versión",
+                                         ["-"] + inventory["facets"]["version"])
+        preselected = [server for server in inventory_servers
+                       if server["version"] == preselect_version and server["state"] == "Ready"]
+    with st.form("fleet_upgrade_form"):
+        fleet_selection = []
+        if inventory_servers:
+            fleet_selection = st.multiselect("Servidores del inventario", inventory_servers, default=preselected,
+                                             format_func=server_label)
+        fleet_servers = st.text_area(
+            "Otros servidores (uno por línea: subscription_id/resource_group/server_name)",
+            placeholder="00000000-0000-0000-0000-000000000000/rg-production/pg-ventas"
+        )
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            fleet_version = st.selectbox("Versión de destino", ["12", "13", "14", "15", "16", "17"], index=4)
+        with col2:
+            fleet_concurrency = st.number_input("Servidores a la vez", min_value=1, max_value=20, value=4)
+        with col3:
+            fleet_dry_run = st.checkbox("Solo validar", value=True)
+        fleet_submit = st.form_submit_button("Lanzar actualización")
+
+    if fleet_submit:
+        targets = [{"subscription_id": server["subscription_id"], "resource_group": server["resource_group"],
+                    "server_name": server["name"], "target_version": fleet_version} for server in fleet_selection]
+        invalid_lines = []
+        for line in fleet_servers.splitlines():
+            parts = [part.strip() for part in line.strip().split("/")]
+            if not line.strip():
+                continue
+            if len(parts) != 3 or not all(parts):
+                invalid_lines.append(line)
+                continue
+            targets.append({"subscription_id": parts[0], "resource_group": parts[1],
+                            "server_name": parts[2], "target_version": fleet_version})
+        # Un servidor elegido en el inventario y escrito a mano se envía una sola vez
+        targets = list({(t["subscription_id"].lower(), t["resource_group"].lower(), t["server_name"].lower()): t
+                        for t in targets}.values())
+        if invalid_lines or not targets:
+            st.error("Indique al menos un servidor con el formato subscription_id/resource_group/server_name.")
+        else:
+            batch = start_upgrades(api_base_url, function_key, {
+                "servers": targets, "max_concurrency": int(fleet_concurrency), "dry_run": fleet_dry_run
+            })
+            if batch:
+                st.session_state["upgrade_batch_id"] = batch["id"]
+
+    if st.session_state.get("upgrade_batch_id"):
+        batch_id = st.session_state["upgrade_batch_id"]
+        if st.button("Actualizar progreso"):
+            invalidate_cache("upgrades")
+        batch = get_upgrade_batch(api_base_url, function_key, batch_id)
+        if batch:
+            counts = ", ".join(f"{state}: {count}" for state, count in batch["counts"].items())
+            st.caption(f"Lote {batch['id']}{' (solo validación)' if batch['dry_run'] else ''} · {batch['status']} · {counts}")
+            st.dataframe(pd.DataFrame([{
+                "Servidor": server["server_name"],
+                "Grupo de recursos": server["resource_group"],
+                "Versión actual": server["current_version"] or "-",
+                "Destino": server["target_version"],
+                "Estado": server["state"],
+                "Progreso": f"{server['percent_complete']}%" if server["percent_complete"] is not None else "-",
+                "Sondeos": server["polls"],
+                "Operación": server.get("operation_id") or "-",
+                "Error": server["error"] or ""
+            } for server in batch["servers"]]), use_container_width=True, hide_index=True)
+
+    # Operaciones de ARM que sigue la API (persisten aunque se cierre la página o se reinicie la API)
+    with st.expander("Operaciones en seguimiento"):
+        only_active = st.checkbox("Solo en curso", value=True)
+        if st.button("Actualizar operaciones"):
+            invalidate_cache("operations")
+        tracked = list_operations(api_base_url, function_key, active=True if only_active else None)
+        if tracked:
+            st.dataframe(pd.DataFrame([{
+                "ID": operation["id"],
+                "Recurso": (operation["resource"] or "").split("/")[-1] or "-",
+                "Estado": operation["status"],
+                "Progreso": f"{operation['percent_complete']:.0f}%" if operation["percent_complete"] is not None else "-",
+                "Sondeos": operation["polls"],
+                "Siguiente sondeo": operation["next_poll_at"] or "-",
+                "Registrada": operation["created_at"],
+                "Error": operation["error"] or ""
+            } for operation in tracked]), use_container_width=True, hide_index=True)
+        elif tracked is not None:
+            st.info("No hay operaciones en seguimiento.")
+
     # API Information section
     with st.expander("Información sobre Major Version Upgrade"):
         st.markdown("""
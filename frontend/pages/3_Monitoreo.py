@@ -1,9 +1,9 @@
 import streamlit as st
 import pandas as pd
-import time
 import plotly.express as px
 from utils.api import get_workflow_status
-from utils.ui import format_job_status
+from utils.client import invalidate_cache
+from utils.ui import diff_jobs, format_job_status, is_run_finished
 
 # Título de la página
 st.title("📊 Monitoreo de Workflows")
@@ -12,112 +12,255 @@ st.title("📊 Monitoreo de Workflows")
 api_base_url = st.session_state.get("api_base_url", "")
 function_key = st.session_state.get("function_key", "")
 
+# Refresco automático: la región del estado se vuelve a ejecutar cada REFRESH_SECONDS y cada
+# consulta espera en la API hasta LONG_POLL_SECONDS a que el estado cambie, así que los cambios
+# se muestran al momento sin repetir consultas con el mismo resultado
+REFRESH_SECONDS = 2
+LONG_POLL_SECONDS = 8
+
 # Opción para refrescar automáticamente
-auto_refresh = st.checkbox("Refrescar automáticamente cada 10 segundos", value=False)
+auto_refresh = st.checkbox("Refrescar automáticamente cuando cambie el estado", value=False)
 
 # Obtener último estado o especificar un run_id
 col1, col2 = st.columns([3, 1])
 with col1:
-    run_id = st.text_input("ID de ejecución específica (opcional)", "")
+    run_id = st.text_input(
+        "ID de ejecución específica (opcional)", st.session_state.get("last_run_id", ""),
+        help="Las ejecuciones del ejecutor local tienen identificadores local-..."
+    )
 with col2:
     refresh_button = st.button("Refrescar estado")
 
-if refresh_button or (auto_refresh and "last_refresh" not in st.session_state):
-    st.session_state["last_refresh"] = time.time()
+monitor_key = run_id or "latest"
+if refresh_button:
+    # Un refresco manual no debe servir el estado desde la caché del cliente y reanuda el sondeo
+    invalidate_cache("workflow/status")
+    st.session_state.pop("monitor_finished", None)
+
+# El sondeo se detiene cuando la ejecución monitorizada termina
+polling = auto_refresh and st.session_state.get("monitor_finished") != monitor_key
+# En una ejecución completa de la página el estado se pide sin esperar, para no retrasar la
+# respuesta a la interacción del usuario; solo esperan las ejecuciones del temporizador
+st.session_state["monitor_page_run"] = True
+
+def render_job(job, cached, changed_steps):
+    """Pinta un trabajo reutilizando la tabla de pasos y la línea de tiempo si no ha cambiado"""
+    with st.expander(f"{job['name']} - {job['status'].replace('_', ' ').upper()}", expanded=True):
+        st.markdown(f"""
+        **Estado**: {format_job_status(job['status'], job['conclusion'])}  
+        **Iniciado**: {job['started_at'] or 'No iniciado'}  
+        **Completado**: {job['completed_at'] or 'No completado'}  
+        **Duración**: {job['duration'] or 'N/A'}
+        """, unsafe_allow_html=True)
+
+        if not job.get("steps"):
+            return cached
+        if changed_steps:
+            st.caption("Pasos actualizados: " + ", ".join(sorted(changed_steps)))
+        if cached is None:
+            # Mostrar los pasos como una tabla
+            step_data = []
+            for step in job["steps"]:
+                step_data.append({
+                    "Paso": step["name"],
+                    "Estado": step["status"].replace("_", " ").upper(),
+                    "Resultado": step["conclusion"].replace("_", " ").upper() if step["conclusion"] else "N/A",
+                    "Duración": step["duration"] or "N/A"
+                })
+
+            # Crear gráfico de progresión de los pasos
+            timeline_data = [
+                {
+                    'Paso': step['name'],
+                    'Inicio': pd.to_datetime(step['started_at']) if step['started_at'] else None,
+                    # Un paso en curso se pinta hasta ahora
+                    'Fin': pd.to_datetime(step['completed_at']) if step['completed_at'] else pd.Timestamp.now(tz="UTC")
+                }
+                for step in job["steps"] if step['started_at']
+            ]
+            fig = None
+            if timeline_data:  # Verificar que hay datos para el gráfico
+                fig = px.timeline(
+                    pd.DataFrame(timeline_data),
+                    x_start="Inicio",
+                    x_end="Fin",
+                    y="Paso",
+                    color_discrete_sequence=["#3498DB"]
+                )
+                fig.update_layout(
+                    title="Línea de Tiempo de Ejecución",
+                    xaxis_title="",
+                    yaxis_title="",
+                    height=400
+                )
+            cached = {"steps": pd.DataFrame(step_data), "figure": fig}
+
+        st.dataframe(cached["steps"], use_container_width=True)
+        if cached["figure"] is not None:
+            st.plotly_chart(cached["figure"], use_container_width=True, key=f"timeline_{job['id']}")
+    return cached
+
+@st.fragment(run_every=REFRESH_SECONDS if polling else None)
+def show_run_status():
+    """
+    Región del estado de la ejecución: con el refresco automático solo se vuelve a ejecutar
+    este fragmento. Los trabajos se comparan con la instantánea anterior y solo se reconstruyen
+    las tablas y gráficos de los que han cambiado.
+    """
+    versions = st.session_state.setdefault("monitor_versions", {})
+    page_run = st.session_state.pop("monitor_page_run", False)
+    long_poll = polling and not page_run
+    workflow_status = get_workflow_status(
+        api_base_url, function_key, run_id if run_id else None,
+        version=versions.get(monitor_key) if long_poll else None, wait=LONG_POLL_SECONDS if long_poll else 0
+    )
+    if not workflow_status:
+        st.error("No se pudo obtener información de los workflows. Verifique la conexión con la API.")
+        return
+    if "message" in workflow_status and workflow_status["message"] == "No workflow runs found":
+        st.info("No hay ejecuciones de workflow disponibles.")
+        return
+
+    versions[monitor_key] = workflow_status.get("version")
+
+    # Mostrar información del workflow
+    st.subheader(f"Workflow: {workflow_status['name']}")
+    if workflow_status.get("stale"):
+        st.warning("GitHub no responde: se muestra el último estado disponible, que puede no estar actualizado.")
+
+    # Estado general con el formato adecuado
+    status_class = "job-in-progress" if workflow_status["status"] == "in_progress" else (
+        "job-success" if workflow_status["conclusion"] == "success" else "job-failure"
+    )
+
+    status_text = workflow_status["status"].replace("_", " ").upper()
+    conclusion_text = workflow_status["conclusion"].replace("_", " ").upper() if workflow_status["conclusion"] else ""
+    status_display = f"{status_text} - {conclusion_text}" if conclusion_text else status_text
 
-if auto_refresh and "last_refresh" in st.session_state:
-    # Refrescar cada 10 segundos si está activado
-    if time.time() - st.session_state["last_refresh"] >= 10:
-        st.session_state["last_refresh"] = time.time()
+    st.markdown(f"""
+    <div class="monitoring-card">
+        <h3 class="{status_class}">{status_display}</h3>
+        <p>ID: {workflow_status['id']}</p>
+        <p>Iniciado: {workflow_status['created_at']}</p>
+        <p>Última actualización: {workflow_status['updated_at']}</p>
+        {f"<p>Duración: {workflow_status['duration']['formatted']}</p>" if 'duration' in workflow_status else ""}
+        {f'<a href="{workflow_status["html_url"]}" target="_blank">Ver en GitHub</a>' if workflow_status.get('html_url') else "<p>Ejecutor local</p>"}
+    </div>
+    """, unsafe_allow_html=True)
+
+    # Progreso estructurado de pg_dump/pg_restore
+    progress = workflow_status.get("progress")
+    if progress and progress.get("percent") is not None:
+        eta_text = f" · ETA {progress['eta']}" if progress.get("eta") else ""
+        st.progress(min(progress["percent"] / 100, 1.0), text=f"{progress['percent']}% completado{eta_text}")
+        for database, db_progress in progress.get("databases", {}).items():
+            tables = f"{db_progress['tables_done']}/{db_progress['tables_total']} tablas" if db_progress.get("tables_total") else f"{db_progress.get('tables_done', 0)} tablas"
+            st.caption(
+                f"**{database}** · {db_progress['stage']} ({db_progress['state']}) · {tables} · "
+                f"{db_progress.get('throughput_mb_s') or 0} MB/s · {db_progress.get('current_object') or ''}"
+            )
+    
+    # Resultado por base de datos (refrescos de varias bases de datos)
+    databases = workflow_status.get("databases")
+    if databases:
+        st.subheader("Bases de datos")
+        database_data = [
+            {
+                "Base de datos": database,
+                "Resultado": (result["status"].upper() + (f" ({result['failed_stage']})" if result.get("failed_stage") else "")),
+                "Etapa": result.get("stage") or "N/A",
+                "Backup": result.get("backup") or "N/A",
+                "Backup nuevo": "Sí" if result.get("backup_created") else "No",
+                "Verificación": result.get("verification") or "N/A",
+                "Duración": f"{result['total_seconds']} s" if result.get("total_seconds") is not None else "N/A"
+            }
+            for database, result in databases.items()
+        ]
+        st.dataframe(pd.DataFrame(database_data), use_container_width=True)
+        
+        # Modo subconjunto: tamaño copiado frente al de producción
+        for database, result in databases.items():
+            subset = result.get("subset")
+            if subset:
+                ratio = f" ({subset['bytes'] / subset['source_bytes']:.1%} del tamaño de producción)" if subset.get("source_bytes") else ""
+                st.info(f"{database}: subconjunto de {subset['rows']:,} filas en {subset['tables_copied']} tablas, "
+                        f"{subset['bytes'] / 1024 / 1024:.1f} MB{ratio} en {subset['seconds']} s")
+            selective = result.get("selective")
+            if selective and selective.get("mode") == "selective":
+                st.info(f"{database}: refresco selectivo, {selective['tables_refreshed']} tablas copiadas "
+                        f"({(selective.get('bytes_copied') or 0) / 1024 / 1024:.1f} MB) y {selective['tables_reused']} reutilizadas "
+                        f"({(selective.get('bytes_reused') or 0) / 1024 / 1024:.1f} MB)")
+            elif selective:
+                st.info(f"{database}: refresco completo ({selective.get('reason')})")
+            dedup = result.get("dedup")
+            if dedup:
+                ratio = f"ratio de deduplicación {dedup['dedup_ratio']}x" if dedup.get("dedup_ratio") else "sin chunks nuevos"
+                st.info(f"{database}: backup deduplicado, {dedup['new_chunks']} de {dedup['chunks']} chunks nuevos, "
+                        f"{(dedup.get('bytes_uploaded') or 0) / 1024 / 1024:.1f} MB transferidos de "
+                        f"{(dedup.get('bytes_total') or 0) / 1024 / 1024:.1f} MB ({ratio})")
+    
+    # Mostrar detalles de los trabajos
+    if "jobs" in workflow_status and workflow_status["jobs"]:
+        st.subheader("Trabajos")
+
+        # Instantánea de la ejecución anterior: si cambia la ejecución se empieza de cero
+        previous = st.session_state.get("monitor_snapshot", {})
+        if previous.get("run") != workflow_status["id"]:
+            previous = {"run": workflow_status["id"], "signatures": {}, "rendered": {}}
+        signatures, changed_jobs, changed_steps = diff_jobs(previous["signatures"], workflow_status["jobs"])
+        if previous["signatures"] and changed_jobs:
+            st.caption(f"{len(changed_jobs)} trabajo(s) con cambios desde la última actualización")
+
+        rendered = {}
+        for job in workflow_status["jobs"]:
+            cached = None if job["id"] in changed_jobs else previous["rendered"].get(job["id"])
+            # En la primera instantánea todo es nuevo: solo se señalan los cambios posteriores
+            steps_changed = changed_steps.get(job["id"], set()) if previous["signatures"] else set()
+            rendered[job["id"]] = render_job(job, cached, steps_changed)
+        st.session_state["monitor_snapshot"] = {"run": workflow_status["id"], "signatures": signatures, "rendered": rendered}
+
+    # Mostrar los tiempos por fase publicados por restore.sh
+    restore_reports = workflow_status.get("reports", {}).get("restore", {})
+    if restore_reports:
+        st.subheader("Restauración por fases")
+        for database, report in restore_reports.items():
+            st.markdown(f"**{database}** → {report.get('target_host', '')} · perfil `{report.get('profile')}` · {report.get('total_seconds')} s")
+            phase_data = [{"Fase": phase, "Segundos": seconds} for phase, seconds in report.get("phases", {}).items()]
+            st.dataframe(pd.DataFrame(phase_data), use_container_width=True)
+    
+    # Mostrar el informe de verificación por tabla
+    verification_reports = workflow_status.get("reports", {}).get("verification", {})
+    if verification_reports:
+        st.subheader("Verificación por tabla")
+        for database, report in verification_reports.items():
+            summary = report.get("summary", {})
+            message = f"**{database}**: {summary.get('passed', 0)}/{summary.get('tables', 0)} tablas correctas"
+            if report.get("status") == "passed":
+                st.success(message)
+            else:
+                st.error(message)
+            table_data = [
+                {
+                    "Tabla": f"{table['schema']}.{table['table']}",
+                    "Método": table["method"],
+                    "Filas prod": table["source_rows"],
+                    "Filas dev": table["target_rows"],
+                    "Resultado": table["status"].upper(),
+                    "Detalle": "; ".join(table["issues"])
+                }
+                for table in report.get("tables", [])
+            ]
+            st.dataframe(pd.DataFrame(table_data), use_container_width=True)
+
+    if polling and is_run_finished(workflow_status):
+        # Ejecución terminada: se vuelve a definir el fragmento sin temporizador
+        st.session_state["monitor_finished"] = monitor_key
         st.rerun()
+    elif auto_refresh and not polling:
+        st.caption("La ejecución ha terminado; el refresco automático se ha detenido. Pulse «Refrescar estado» para reanudarlo.")
 
 # Verificar credenciales
 if not function_key and api_base_url.startswith("https://"):
     st.warning("⚠️ Se requiere la API Key para obtener información de los workflows. Configúrela en la página principal.")
 else:
-    # Obtener estado del workflow
-    with st.spinner("Obteniendo información de estado..."):
-        workflow_status = get_workflow_status(api_base_url, function_key, run_id if run_id else None)
-    
-    if workflow_status:
-        if "message" in workflow_status and workflow_status["message"] == "No workflow runs found":
-            st.info("No hay ejecuciones de workflow disponibles.")
-        else:
-            # Mostrar información del workflow
-            st.subheader(f"Workflow: {workflow_status['name']}")
-            
-            # Estado general con el formato adecuado
-            status_class = "job-in-progress" if workflow_status["status"] == "in_progress" else (
-                "job-success" if workflow_status["conclusion"] == "success" else "job-failure"
-            )
-            
-            status_text = workflow_status["status"].replace("_", " ").upper()
-            conclusion_text = workflow_status["conclusion"].replace("_", " ").upper() if workflow_status["conclusion"] else ""
-            status_display = f"{status_text} - {conclusion_text}" if conclusion_text else status_text
-            
-            st.markdown(f"""
-            <div class="monitoring-card">
-                <h3 class="{status_class}">{status_display}</h3>
-                <p>ID: {workflow_status['id']}</p>
-                <p>Iniciado: {workflow_status['created_at']}</p>
-                <p>Última actualización: {workflow_status['updated_at']}</p>
-                {f"<p>Duración: {workflow_status['duration']['formatted']}</p>" if 'duration' in workflow_status else ""}
-                <a href="{workflow_status['html_url']}" target="_blank">Ver en GitHub</a>
-            </div>
-            """, unsafe_allow_html=True)
-            
-            # Mostrar detalles de los trabajos
-            if "jobs" in workflow_status and workflow_status["jobs"]:
-                st.subheader("Trabajos")
-                
-                for job in workflow_status["jobs"]:
-                    with st.expander(f"{job['name']} - {job['status'].replace('_', ' ').upper()}", expanded=True):
-                        st.markdown(f"""
-                        **Estado**: {format_job_status(job['status'], job['conclusion'])}  
-                        **Iniciado**: {job['started_at'] or 'No iniciado'}  
-                        **Completado**: {job['completed_at'] or 'No completado'}  
-                        **Duración**: {job['duration'] or 'N/A'}
-                        """, unsafe_allow_html=True)
-                        
-                        # Mostrar los pasos como una tabla
-                        if "steps" in job and job["steps"]:
-                            step_data = []
-                            for step in job["steps"]: 
-                                step_data.append({ 
-                                    "Paso": step["name"], 
-                                    "Estado": step["status"].replace("_", " ").upper(), 
-                                    "Resultado": step["conclusion"].replace("_", " ").upper() if step["conclusion"] else "N/A", 
-                                    "Duración": step["duration"] or "N/A" 
-                                }) 
-                            
-                            st.dataframe(pd.DataFrame(step_data), use_container_width=True)
-
-                            # Crear gráfico de progresión de los pasos
-                            timeline_data = [
-                                {
-                                    'Paso': step['name'], 
-                                    'Inicio': pd.to_datetime(step['started_at']) if step['started_at'] else None,
-                                    'Fin': pd.to_datetime(step['completed_at']) if step['completed_at'] else None
-                                } 
-                                for step in job["steps"] if step['started_at']
-                            ]
-                            
-                            if timeline_data:  # Verificar que hay datos para el gráfico
-                                fig = px.timeline(
-                                    pd.DataFrame(timeline_data),
-                                    x_start="Inicio", 
-                                    x_end="Fin", 
-                                    y="Paso",
-                                    color_discrete_sequence=["#3498DB"]
-                                )
-                                
-                                fig.update_layout(
-                                    title="Línea de Tiempo de Ejecución",
-                                    xaxis_title="",
-                                    yaxis_title="",
-                                    height=400
-                                )
-                                
-                                st.plotly_chart(fig, use_container_width=True)
-    else:
-        st.error("No se pudo obtener información de los workflows. Verifique la conexión con la API.")
+    show_run_status()
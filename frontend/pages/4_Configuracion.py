@@ -2,6 +2,8 @@ import streamlit as st
 import pandas as pd
 from datetime import datetime
 from utils.api import get_config
+from utils.auth import get_token_stats
+from utils.client import cache_size, get_stats, invalidate_cache, reset_stats
 
 # Título de la página
 st.title("⚙️ Configuración")
@@ -52,6 +54,7 @@ else:
             {"Endpoint": "/dumprestore/api/config", "Método": "GET", "Descripción": "Obtener configuración actual"},
             {"Endpoint": "/dumprestore/api/workflow/dump-restore", "Método": "POST", "Descripción": "Iniciar workflow de backup/restore"},
             {"Endpoint": "/dumprestore/api/workflow/status", "Método": "GET", "Descripción": "Obtener estado de workflows"},
+            {"Endpoint": "/dumprestore/api/backups", "Método": "GET", "Descripción": "Consultar el catálogo de backups"},
             {"Endpoint": "/major/...", "Método": "PATCH", "Descripción": "Major version upgrade de servidor PSSQL flexible server"}
         ]
         
@@ -71,6 +74,38 @@ Ejemplo de llamada a la API:
     else:
         st.error("No se pudo obtener la configuración. Verifique la conexión con la API y la Function Key.")
 
+# Panel de depuración del cliente HTTP (caché y latencia por endpoint)
+st.markdown("---")
+st.subheader("Cliente de la API")
+client_stats = get_stats()
+if client_stats:
+    st.dataframe(pd.DataFrame([{
+        "Endpoint": row["endpoint"],
+        "Peticiones": row["requests"],
+        "Aciertos caché": row["hits"],
+        "Revalidadas (304)": row["revalidated"],
+        "Red": row["misses"],
+        "Errores": row["errors"],
+        "Ratio de aciertos": f"{row['hit_ratio']:.0%}",
+        "Latencia media (ms)": row["avg_ms"] if row["avg_ms"] is not None else "-",
+        "Latencia p95 (ms)": row["p95_ms"] if row["p95_ms"] is not None else "-"
+    } for row in client_stats]), use_container_width=True, hide_index=True)
+else:
+    st.info("Todavía no se ha llamado a la API desde este proceso.")
+st.caption(f"Respuestas en caché: {cache_size()}")
+token_stats = get_token_stats()
+st.caption(f"Tokens de Azure AD: {token_stats['hits']} aciertos de caché, {token_stats['misses']} nuevos, "
+           f"{token_stats['refreshes']} renovaciones, {token_stats['errors']} errores")
+col1, col2 = st.columns(2)
+with col1:
+    if st.button("Vaciar caché"):
+        invalidate_cache()
+        st.rerun()
+with col2:
+    if st.button("Reiniciar estadísticas"):
+        reset_stats()
+        st.rerun()
+
 # Mostrar fecha/hora de la última actualización
 st.markdown("---")
 st.info(f"Última actualización: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
@@ -0,0 +1,170 @@
+import json
+import streamlit as st
+import pandas as pd
+import plotly.express as px
+from utils.api import create_schedule, delete_schedule, get_schedules, get_upcoming_schedules
+
+# Título de la página
+st.title("🗓️ Programación de Refrescos")
+
+# Recuperar configuración de la API de la sesión
+api_base_url = st.session_state.get("api_base_url", "")
+function_key = st.session_state.get("function_key", "")
+
+st.markdown("""
+Programe refrescos recurrentes en horario valle. Los refrescos que comparten servidor de producción
+se escalonan para no solaparse y, si se define una ventana de mantenimiento, solo arrancan dentro de ella.
+""")
+
+STATUS_LABELS = {"planned": "🕒 Planificado", "skipped": "⏭️ Omitido (no cabe en la ventana)"}
+
+if not function_key and api_base_url.startswith("https://"):
+    st.warning("⚠️ Se requiere la API Key para gestionar las programaciones. Configúrela en la página principal.")
+    st.stop()
+
+# Próximas ejecuciones
+st.subheader("Próximas ejecuciones")
+hours = st.slider("Horizonte (horas)", min_value=12, max_value=168, value=48, step=12)
+upcoming = get_upcoming_schedules(api_base_url, function_key, hours)
+if upcoming:
+    runs = upcoming["runs"]
+    if not runs:
+        st.info("No hay ejecuciones programadas en el horizonte seleccionado.")
+    else:
+        planned = [run for run in runs if run["status"] == "planned"]
+        if planned:
+            fig = px.timeline(
+                pd.DataFrame([{
+                    "Programación": run["name"],
+                    "Inicio": pd.to_datetime(run["start_at"]),
+                    "Fin": pd.to_datetime(run["end_at"]),
+                    "Servidor": run["pg_host_prod"]
+                } for run in planned]),
+                x_start="Inicio",
+                x_end="Fin",
+                y="Servidor",
+                color="Programación"
+            )
+            fig.update_layout(title="Ocupación prevista por servidor de producción (UTC)",
+                              xaxis_title="", yaxis_title="", height=350)
+            st.plotly_chart(fig, use_container_width=True)
+
+        st.dataframe(pd.DataFrame([{
+            "Programación": run["name"],
+            "Servidor": run["pg_host_prod"],
+            "Hora nominal (UTC)": run["nominal_at"],
+            "Inicio previsto (UTC)": run["start_at"] or "-",
+            "Retraso (min)": run["delay_minutes"] if run["delay_minutes"] is not None else "-",
+            "Estado": STATUS_LABELS.get(run["status"], run["status"])
+        } for run in runs]), use_container_width=True, hide_index=True)
+
+st.markdown("---")
+
+# Programaciones existentes
+st.subheader("Programaciones")
+schedules_data = get_schedules(api_base_url, function_key)
+if schedules_data:
+    if not schedules_data["schedules"]:
+        st.info("Todavía no hay programaciones.")
+    for schedule in schedules_data["schedules"]:
+        title = f"{'✅' if schedule['enabled'] else '⏸️'} {schedule['name']} — `{schedule['cron']}` ({schedule['timezone']})"
+        with st.expander(title):
+            col1, col2 = st.columns(2)
+            with col1:
+                st.markdown(f"**Servidor de producción**: {schedule['pg_host_prod']}")
+                st.markdown(f"**Duración prevista**: {schedule['expected_minutes']} min")
+                if schedule.get("window_start"):
+                    st.markdown(f"**Ventana**: {schedule['window_start']} durante {schedule['window_minutes']} min")
+            with col2:
+                next_runs = [run["start_at"] for run in schedule["next_runs"] if run["start_at"]]
+                st.markdown(f"**Próxima ejecución (UTC)**: {next_runs[0] if next_runs else '-'}")
+                last_run = schedule.get("last_run")
+                if last_run:
+                    st.markdown(f"**Última ejecución**: {last_run['start_at']} — {last_run['status']}"
+                                + (f" (`{last_run['run_id']}`)" if last_run.get("run_id") else ""))
+                    if last_run.get("error"):
+                        st.error(last_run["error"])
+            if not schedule["password_configured"]:
+                st.warning(f"⚠️ La app setting `{schedule['password_setting']}` no está configurada: las ejecuciones fallarán.")
+            st.json(schedule["refresh"], expanded=False)
+            if st.button("🗑️ Eliminar", key=f"delete_{schedule['id']}"):
+                if delete_schedule(api_base_url, function_key, schedule["id"]):
+                    st.success(f"Programación '{schedule['name']}' eliminada")
+                    st.rerun()
+
+st.markdown("---")
+
+# Nueva programación
+st.subheader("Nueva programación")
+with st.form("schedule_form"):
+    col1, col2 = st.columns(2)
+    with col1:
+        name = st.text_input("Nombre", placeholder="ventas-nocturno")
+        cron = st.text_input("Expresión cron", value="0 2 * * *",
+                             help="minuto hora día mes día-semana, o @daily/@weekly/@monthly.")
+        timezone = st.text_input("Zona horaria", value="Europe/Madrid")
+        expected_minutes = st.number_input("Duración prevista (min)", min_value=1, max_value=1440, value=60,
+                                           help="Se usa para escalonar los refrescos del mismo servidor de producción.")
+    with col2:
+        use_window = st.checkbox("Ventana de mantenimiento")
+        window_start = st.text_input("Inicio de la ventana (HH:MM)", value="01:00")
+        window_minutes = st.number_input("Duración de la ventana (min)", min_value=1, max_value=1440, value=300)
+        password_setting = st.text_input("App setting con la contraseña", placeholder="PG_PASSWORD_VENTAS",
+                                         help="La contraseña no se guarda: se lee de esta app setting al lanzar el refresco. "
+                                              "El nombre debe empezar por PG_PASSWORD_.")
+        enabled = st.checkbox("Activa", value=True)
+
+    st.markdown("**Refresco**")
+    col1, col2 = st.columns(2)
+    with col1:
+        pg_host_prod = st.text_input("Host de Producción", placeholder="prod-postgres")
+        pg_database = st.text_input("Bases de Datos", placeholder="mydb, otra_db")
+        resource_group = st.text_input("Grupo de Recursos", placeholder="rg-production")
+        storage_account = st.text_input("Cuenta de Almacenamiento", placeholder="mystorage")
+    with col2:
+        pg_host_dev = st.text_input("Host de Desarrollo", placeholder="dev-postgres")
+        pg_user = st.text_input("Usuario PostgreSQL", placeholder="postgres")
+        storage_container = st.text_input("Contenedor de Almacenamiento", placeholder="backups")
+        restore_profile = st.selectbox("Perfil de restauración", ["standard", "fast"])
+    extra_options = st.text_area("Opciones adicionales (JSON)", value="{}",
+                                 help="Cualquier otro campo de /api/workflow/dump-restore, p. ej. {\"selective\": true}.")
+
+    submitted = st.form_submit_button("Crear programación", type="primary")
+
+if submitted:
+    try:
+        extra = json.loads(extra_options or "{}")
+    except ValueError as e:
+        st.error(f"Las opciones adicionales no son JSON válido: {str(e)}")
+        st.stop()
+    databases = [db.strip() for db in pg_database.split(",") if db.strip()]
+    refresh = {
+        "pg_host_prod": pg_host_prod,
+        "pg_host_dev": pg_host_dev,
+        "pg_user": pg_user,
+        "resource_group": resource_group,
+        "storage_account": storage_account,
+        "storage_container": storage_container,
+        "restore_profile": restore_profile
+    }
+    if len(databases) == 1:
+        refresh["pg_database"] = databases[0]
+    elif databases:
+        refresh["pg_databases"] = databases
+    refresh.update(extra)
+    schedule_data = {
+        "name": name,
+        "cron": cron,
+        "timezone": timezone,
+        "window_start": window_start if use_window else None,
+        "window_minutes": int(window_minutes) if use_window else None,
+        "expected_minutes": int(expected_minutes),
+        "enabled": enabled,
+        "password_setting": password_setting,
+        "refresh": refresh
+    }
+    with st.spinner("Guardando programación..."):
+        result = create_schedule(api_base_url, function_key, schedule_data)
+    if result:
+        st.success(f"Programación '{result['name']}' creada")
+        st.rerun()
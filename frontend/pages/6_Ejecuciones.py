@@ -0,0 +1,117 @@
+import streamlit as st
+import pandas as pd
+from utils.api import fetch_run_statuses, get_workflow_status, list_runs
+from utils.client import invalidate_cache
+from utils.ui import format_job_status, format_seconds
+
+# Título de la página
+st.title("📋 Tablero de Ejecuciones")
+
+# Recuperar configuración de la API de la sesión
+api_base_url = st.session_state.get("api_base_url", "")
+function_key = st.session_state.get("function_key", "")
+
+st.markdown("""
+Ejecuciones activas y recientes (últimas 200) de GitHub Actions y del ejecutor local.
+Filtre por base de datos o servidor y despliegue una ejecución para ver sus trabajos.
+""")
+
+PAGE_SIZE = 25
+STATE_OPTIONS = {"Todas": None, "Activas": "active", "Terminadas": "completed"}
+
+if not function_key and api_base_url.startswith("https://"):
+    st.warning("⚠️ Se requiere la API Key para obtener las ejecuciones. Configúrela en la página principal.")
+    st.stop()
+
+col1, col2, col3, col4 = st.columns([2, 2, 1, 1])
+with col1:
+    database = st.text_input("Base de datos", placeholder="mydb").strip()
+with col2:
+    host = st.text_input("Servidor (producción o desarrollo)", placeholder="prod-postgres").strip()
+with col3:
+    state = st.selectbox("Estado", list(STATE_OPTIONS))
+with col4:
+    st.write("")
+    if st.button("Actualizar", use_container_width=True):
+        invalidate_cache("workflow/runs", "workflow/status")
+
+# Un cambio de filtros vuelve a la primera página
+filters = (database, host, state)
+if st.session_state.get("board_filters") != filters:
+    st.session_state["board_filters"] = filters
+    st.session_state["board_page"] = 1
+page = st.session_state.get("board_page", 1)
+
+runs_page = list_runs(api_base_url, function_key, page, PAGE_SIZE, database or None, host or None, STATE_OPTIONS[state])
+if not runs_page:
+    st.stop()
+
+st.caption(f"{runs_page['total']} ejecuciones · {runs_page['active']} activas · página {runs_page['page']} de {runs_page['pages']}")
+runs = runs_page["runs"]
+if not runs:
+    st.info("No hay ejecuciones que coincidan con los filtros.")
+    st.stop()
+
+# Estado detallado (progreso y resultado por base de datos) solo de las ejecuciones activas
+# de la página, consultadas en paralelo
+active_ids = [str(run["id"]) for run in runs if run["status"] != "completed"]
+with st.spinner("Consultando las ejecuciones activas..."):
+    statuses = fetch_run_statuses(api_base_url, function_key, active_ids)
+
+def describe_run(run):
+    """Fila del tablero con el progreso de las ejecuciones activas"""
+    status = statuses.get(str(run["id"])) or {}
+    progress = status.get("progress") or {}
+    databases = run["databases"] or (["*"] if run["all_databases"] else [])
+    return {
+        "ID": str(run["id"]),
+        "Ejecutor": run["executor"],
+        "Bases de datos": ", ".join(databases) or "N/A",
+        "Producción": run["source_host"] or "N/A",
+        "Desarrollo": run["target_host"] or "N/A",
+        "Estado": run["status"].replace("_", " ").upper(),
+        "Resultado": (run["conclusion"] or "").replace("_", " ").upper() or "-",
+        "Progreso": f"{progress['percent']}%" if progress.get("percent") is not None else "-",
+        "Iniciado": run["created_at"],
+        "Duración": format_seconds(run["duration_seconds"])
+    }
+
+st.dataframe(pd.DataFrame([describe_run(run) for run in runs]), use_container_width=True, hide_index=True)
+
+col1, col2, col3 = st.columns([1, 2, 1])
+with col1:
+    if st.button("◀ Anterior", disabled=page <= 1, use_container_width=True):
+        st.session_state["board_page"] = page - 1
+        st.rerun()
+with col3:
+    if st.button("Siguiente ▶", disabled=page >= runs_page["pages"], use_container_width=True):
+        st.session_state["board_page"] = page + 1
+        st.rerun()
+
+st.subheader("Detalle")
+for run in runs:
+    run_id = str(run["id"])
+    label = f"{run_id} · {run['title'] or run['name']} · {run['status'].replace('_', ' ').upper()}"
+    with st.expander(label):
+        if run.get("html_url"):
+            st.markdown(f"[Ver en GitHub]({run['html_url']})")
+        # Los trabajos solo se consultan al pedirlos: expandir no descarga nada
+        if st.toggle("Mostrar trabajos", key=f"board_jobs_{run_id}"):
+            # El estado de las activas es el resumen: los trabajos se piden en la vista completa
+            details = get_workflow_status(api_base_url, function_key, run_id)
+            if details:
+                for database, result in (details.get("databases") or {}).items():
+                    st.caption(f"**{database}**: {result['status'].upper()} · {result.get('stage') or 'N/A'}")
+                for job in details.get("jobs", []):
+                    st.markdown(f"**{job['name']}** — {format_job_status(job['status'], job['conclusion'])} · "
+                                f"{job['duration'] or 'N/A'}", unsafe_allow_html=True)
+                    if job.get("steps"):
+                        st.dataframe(pd.DataFrame([{
+                            "Paso": step["name"],
+                            "Estado": step["status"].replace("_", " ").upper(),
+                            "Resultado": step["conclusion"].replace("_", " ").upper() if step["conclusion"] else "N/A",
+                            "Duración": step["duration"] or "N/A"
+                        } for step in job["steps"]]), use_container_width=True, hide_index=True)
+        if st.button("Abrir en Monitoreo", key=f"board_open_{run_id}"):
+            st.session_state["last_run_id"] = run_id
+            st.switch_page("pages/3_Monitoreo.py")
@@ -6,7 +6,7 @@ import os
 # Agregar el directorio principal al path para importar los módulos
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from utils.ui import format_status_class, format_job_status
+from utils.ui import format_status_class, format_job_status, format_seconds, server_label
 
 def test_format_status_class():
     """Test the format_status_class function"""
@@ -21,3 +21,112 @@ def test_format_job_status():
     assert "job-failure" in format_job_status("completed", "failure")
     assert "job-in-progress" in format_job_status("in_progress", None)
     assert "N/A" in format_job_status("queued", None)
+
+def test_format_seconds():
+    """Durations are shown in the largest useful unit"""
+    assert format_seconds(None) == "N/A"
+    assert format_seconds(45) == "45 s"
+    assert format_seconds(720) == "12 min"
+    assert format_seconds(3900) == "1 h 05 min"
+
+def _response(status_code, content=b'{"status": "healthy"}', etag=None):
+    response = MagicMock(status_code=status_code, content=content)
+    response.headers = {"ETag": etag} if etag else {}
+    return response
+
+def test_client_cache_and_revalidation():
+    """Fresh responses come from the cache and stale ones are revalidated with their ETag"""
+    from utils import client
+    client.invalidate_cache()
+    client.reset_stats()
+    session = MagicMock()
+    session.get.side_effect = [_response(200, etag='"v1"'), _response(304)]
+    with patch.object(client, "get_session", return_value=session), patch.object(client.time, "monotonic") as clock:
+        clock.return_value = 100.0
+        assert client.get("health", "http://api/health", headers={"k": "1"}).json() == {"status": "healthy"}
+        assert client.get("health", "http://api/health", headers={"k": "1"}).source == "cache"
+        clock.return_value = 200.0
+        revalidated = client.get("health", "http://api/health", headers={"k": "1"})
+    assert revalidated.source == "revalidated" and revalidated.json() == {"status": "healthy"}
+    assert session.get.call_args.kwargs["headers"]["If-None-Match"] == '"v1"'
+    stats = client.get_stats()[0]
+    assert (stats["requests"], stats["hits"], stats["revalidated"], stats["misses"]) == (3, 1, 1, 1)
+
+def test_client_invalidation_and_credentials():
+    """Dispatches invalidate cached endpoints and different keys never share responses"""
+    from utils import client
+    client.invalidate_cache()
+    session = MagicMock()
+    session.get.return_value = _response(200)
+    session.request.return_value = _response(202)
+    with patch.object(client, "get_session", return_value=session):
+        client.get("workflow/status", "http://api/status", headers={"k": "1"})
+        client.get("workflow/status", "http://api/status", headers={"k": "2"})
+        assert session.get.call_count == 2
+        client.get("workflow/status", "http://api/status", headers={"k": "1"})
+        assert session.get.call_count == 2
+        client.send("POST", "workflow/dump-restore", "http://api/run", invalidate=("workflow/status",))
+        assert client.cache_size() == 0
+        client.get("workflow/status", "http://api/status", headers={"k": "1"})
+        assert session.get.call_count == 3
+
+def test_diff_jobs():
+    """Only jobs and steps that changed since the previous snapshot are reported"""
+    from utils.ui import diff_jobs, is_run_finished
+    step = {"name": "dump", "status": "in_progress", "conclusion": None, "completed_at": None}
+    jobs = [{"id": 1, "status": "in_progress", "conclusion": None, "steps": [step]},
+            {"id": 2, "status": "queued", "conclusion": None, "steps": []}]
+    snapshot, changed, steps = diff_jobs({}, jobs)
+    assert changed == {1, 2} and steps[1] == {"dump"}
+    assert diff_jobs(snapshot, jobs)[1] == set()
+
+    done = dict(step, status="completed", conclusion="success", completed_at="2026-01-01T00:00:00Z")
+    jobs[0] = dict(jobs[0], steps=[done, {"name": "restore", "status": "queued", "conclusion": None}])
+    _, changed, steps = diff_jobs(snapshot, jobs)
+    assert changed == {1} and steps[1] == {"dump", "restore"}
+
+    assert not is_run_finished({"status": "in_progress", "conclusion": None})
+    assert is_run_finished({"status": "completed", "conclusion": "failure"})
+
+class _FakeMsalApp:
+    calls = 0
+
+    def __init__(self, **kwargs):
+        pass
+
+    def acquire_token_for_client(self, scopes):
+        import time as _time
+        _FakeMsalApp.calls += 1
+        _time.sleep(0.05)
+        return {"access_token": f"token-{_FakeMsalApp.calls}", "expires_in": 3600}
+
+def test_token_cache_single_flight():
+    """Concurrent requests share one acquisition and later calls are served from the cache"""
+    import threading
+    from utils import auth
+    auth.clear_token_cache()
+    _FakeMsalApp.calls = 0
+    before = auth.get_token_stats()
+    with patch.object(auth.msal, "ConfidentialClientApplication", _FakeMsalApp):
+        tokens = []
+        threads = [threading.Thread(target=lambda: tokens.append(auth.acquire_token("t", "c", "s", "scope")))
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert tokens == ["token-1"] * 8
+        assert _FakeMsalApp.calls == 1
+        stats = auth.get_token_stats()
+        assert stats["misses"] - before["misses"] == 1 and stats["hits"] - before["hits"] == 7
+
+        # Cerca de la caducidad se renueva; otro scope tiene su propio token
+        with patch.object(auth.time, "time", return_value=auth.time.time() + 3600 - 60):
+            assert auth.acquire_token("t", "c", "s", "scope") == "token-2"
+        assert auth.acquire_token("t", "c", "s", "other") == "token-3"
+        assert auth.get_token_stats()["refreshes"] - before["refreshes"] == 1
+
+def test_server_label():
+    """Inventory servers are labelled with their resource group, version and state"""
+    server = {"name": "pg-ventas", "resource_group": "rg-prod", "version": "15", "state": "Ready", "sku_name": None}
+    assert server_label(server) == "pg-ventas (rg-prod) · PG 15 · Ready"
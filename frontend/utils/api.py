@@ -1,11 +1,13 @@
+from concurrent.futures import ThreadPoolExecutor
+
 import streamlit as st
-import requests
+from utils import client
 
 def get_health_status(api_base_url, function_key):
     """Obtiene el estado de salud de la API"""
     try:
         headers = {"Ocp-Apim-Subscription-Key": function_key}
-        response = requests.get(f"{api_base_url}/dumprestore/api%2Fhealth", headers=headers, timeout=10)
+        response = client.get("health", f"{api_base_url}/dumprestore/api%2Fhealth", headers=headers, timeout=10)
         if response.status_code == 200:
             return response.json()
         else:
@@ -15,19 +17,30 @@ def get_health_status(api_base_url, function_key):
         st.error(f"Error de conexión: {str(e)}")
         return None
 
-def get_workflow_status(api_base_url, function_key, run_id=None):
-    """Obtiene el estado actual del workflow"""
+def get_workflow_status(api_base_url, function_key, run_id=None, view="full", version=None, wait=0):
+    """
+    Obtiene el estado actual del workflow (view="summary": sin jobs ni pasos). Con version y
+    wait la API retiene la petición hasta que el estado cambia o pasan wait segundos
+    """
     try:
         headers = {"Ocp-Apim-Subscription-Key": function_key}
         params = {}
         if run_id:
             params["run_id"] = run_id
+        if view != "full":
+            params["view"] = view
+        if version and wait:
+            params["version"] = version
+            params["wait"] = wait
             
-        response = requests.get(
+        response = client.get(
+            "workflow/status",
             f"{api_base_url}/dumprestore/api%2Fworkflow%2Fstatus",
             headers=headers,
             params=params,
-            timeout=10
+            timeout=10 + wait,
+            # La espera ya devuelve el estado más reciente: no se sirve desde la caché
+            ttl=0 if version and wait else None
         )
         if response.status_code == 200:
             return response.json()
@@ -38,6 +51,54 @@ def get_workflow_status(api_base_url, function_key, run_id=None):
         st.error(f"Error de conexión: {str(e)}")
         return None
 
+def list_runs(api_base_url, function_key, page=1, per_page=25, database=None, host=None, state=None):
+    """Obtiene una página del historial de ejecuciones (activas y recientes) con filtros opcionales"""
+    try:
+        headers = {"Ocp-Apim-Subscription-Key": function_key}
+        params = {"page": page, "per_page": per_page}
+        params.update({k: v for k, v in {"database": database, "host": host, "state": state}.items() if v})
+        response = client.get(
+            "workflow/runs",
+            f"{api_base_url}/dumprestore/api%2Fworkflow%2Fruns",
+            headers=headers,
+            params=params,
+            timeout=30
+        )
+        if response.status_code == 200:
+            return response.json()
+        else:
+            st.error(f"Error al obtener las ejecuciones: {response.status_code} - {response.text}")
+            return None
+    except Exception as e:
+        st.error(f"Error de conexión: {str(e)}")
+        return None
+
+def fetch_run_statuses(api_base_url, function_key, run_ids, max_workers=6):
+    """
+    Obtiene el estado resumido (progreso y resultado por base de datos, sin jobs) de varias
+    ejecuciones en paralelo con un pool acotado. Se ejecuta fuera del hilo de Streamlit, así
+    que no muestra errores: devuelve {run_id: estado o None}
+    """
+    headers = {"Ocp-Apim-Subscription-Key": function_key}
+
+    def fetch(run_id):
+        try:
+            response = client.get(
+                "workflow/status",
+                f"{api_base_url}/dumprestore/api%2Fworkflow%2Fstatus",
+                headers=headers,
+                params={"run_id": run_id, "view": "summary"},
+                timeout=30
+            )
+            return response.json() if response.status_code == 200 else None
+        except Exception:
+            return None
+
+    if not run_ids:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(run_ids))) as pool:
+        return dict(zip(run_ids, pool.map(fetch, run_ids)))
+
 def execute_workflow(api_base_url, function_key, workflow_data):
     """Ejecuta un workflow de backup/restore"""
     try:
@@ -45,8 +106,10 @@ def execute_workflow(api_base_url, function_key, workflow_data):
             "Ocp-Apim-Subscription-Key": function_key,
             "Content-Type": "application/json"
         }
-        response = requests.post(
+        response = client.send(
+            "POST", "workflow/dump-restore",
             f"{api_base_url}/dumprestore/api%2Fworkflow%2Fdump-restore",
+            invalidate=("workflow/status", "workflow/runs"),
             headers=headers,
             json=workflow_data,
             timeout=30
@@ -60,11 +123,245 @@ def execute_workflow(api_base_url, function_key, workflow_data):
         st.error(f"Error de conexión: {str(e)}")
         return None
 
+def estimate_workflow(api_base_url, function_key, workflow_data):
+    """Estima la duración de cada fase de un refresco antes de lanzarlo"""
+    try:
+        headers = {
+            "Ocp-Apim-Subscription-Key": function_key,
+            "Content-Type": "application/json"
+        }
+        response = client.send(
+            "POST", "workflow/estimate",
+            f"{api_base_url}/dumprestore/api%2Fworkflow%2Festimate",
+            headers=headers,
+            json=workflow_data,
+            timeout=60
+        )
+        if response.status_code == 200:
+            return response.json()
+        else:
+            st.error(f"Error al estimar el refresco: {response.status_code} - {response.text}")
+            return None
+    except Exception as e:
+        st.error(f"Error de conexión: {str(e)}")
+        return None
+
+def reset_from_template(api_base_url, function_key, reset_data):
+    """Recrea una base de datos de desarrollo a partir de su plantilla"""
+    try:
+        headers = {
+            "Ocp-Apim-Subscription-Key": function_key,
+            "Content-Type": "application/json"
+        }
+        response = client.send(
+            "POST", "workflow/reset-from-template",
+            f"{api_base_url}/dumprestore/api%2Fworkflow%2Freset-from-template",
+            headers=headers,
+            json=reset_data,
+            timeout=300
+        )
+        if response.status_code == 200:
+            return response.json()
+        else:
+            st.error(f"Error al restablecer desde la plantilla: {response.status_code} - {response.text}")
+            return None
+    except Exception as e:
+        st.error(f"Error de conexión: {str(e)}")
+        return None
+
+def get_schedules(api_base_url, function_key):
+    """Obtiene las programaciones de refresco con sus próximas ejecuciones"""
+    try:
+        headers = {"Ocp-Apim-Subscription-Key": function_key}
+        response = client.get("schedules", f"{api_base_url}/dumprestore/api%2Fschedules", headers=headers, timeout=10)
+        if response.status_code == 200:
+            return response.json()
+        else:
+            st.error(f"Error al obtener las programaciones: {response.status_code} - {response.text}")
+            return None
+    except Exception as e:
+        st.error(f"Error de conexión: {str(e)}")
+        return None
+
+def get_upcoming_schedules(api_base_url, function_key, hours=48):
+    """Obtiene las próximas ejecuciones programadas, ya escalonadas por servidor"""
+    try:
+        headers = {"Ocp-Apim-Subscription-Key": function_key}
+        response = client.get(
+            "schedules/upcoming",
+            f"{api_base_url}/dumprestore/api%2Fschedules%2Fupcoming",
+            headers=headers,
+            params={"hours": hours},
+            timeout=10
+        )
+        if response.status_code == 200:
+            return response.json()
+        else:
+            st.error(f"Error al obtener las próximas ejecuciones: {response.status_code} - {response.text}")
+            return None
+    except Exception as e:
+        st.error(f"Error de conexión: {str(e)}")
+        return None
+
+def create_schedule(api_base_url, function_key, schedule_data):
+    """Crea una programación de refresco recurrente"""
+    try:
+        headers = {
+            "Ocp-Apim-Subscription-Key": function_key,
+            "Content-Type": "application/json"
+        }
+        response = client.send(
+            "POST", "schedules",
+            f"{api_base_url}/dumprestore/api%2Fschedules",
+            invalidate=("schedules", "schedules/upcoming"),
+            headers=headers,
+            json=schedule_data,
+            timeout=30
+        )
+        if response.status_code == 201:
+            return response.json()
+        else:
+            st.error(f"Error al crear la programación: {response.status_code} - {response.text}")
+            return None
+    except Exception as e:
+        st.error(f"Error de conexión: {str(e)}")
+        return None
+
+def delete_schedule(api_base_url, function_key, schedule_id):
+    """Elimina una programación de refresco"""
+    try:
+        headers = {"Ocp-Apim-Subscription-Key": function_key}
+        response = client.send(
+            "DELETE", "schedules",
+            f"{api_base_url}/dumprestore/api%2Fschedules%2F{schedule_id}",
+            invalidate=("schedules", "schedules/upcoming"),
+            headers=headers,
+            timeout=10
+        )
+        if response.status_code == 200:
+            return response.json()
+        else:
+            st.error(f"Error al eliminar la programación: {response.status_code} - {response.text}")
+            return None
+    except Exception as e:
+        st.error(f"Error de conexión: {str(e)}")
+        return None
+
+def start_upgrades(api_base_url, function_key, upgrade_data):
+    """Lanza un lote de actualizaciones de versión mayor orquestado por la API"""
+    try:
+        headers = {
+            "Ocp-Apim-Subscription-Key": function_key,
+            "Content-Type": "application/json"
+        }
+        response = client.send(
+            "POST", "upgrades",
+            f"{api_base_url}/dumprestore/api%2Fupgrades",
+            headers=headers,
+            json=upgrade_data,
+            timeout=30
+        )
+        if response.status_code == 202:
+            return response.json()
+        else:
+            st.error(f"Error al lanzar las actualizaciones: {response.status_code} - {response.text}")
+            return None
+    except Exception as e:
+        st.error(f"Error de conexión: {str(e)}")
+        return None
+
+def get_upgrade_batch(api_base_url, function_key, batch_id):
+    """Obtiene el progreso de cada servidor de un lote de actualizaciones"""
+    try:
+        headers = {"Ocp-Apim-Subscription-Key": function_key}
+        response = client.get(
+            "upgrades",
+            f"{api_base_url}/dumprestore/api%2Fupgrades%2F{batch_id}",
+            headers=headers,
+            timeout=10
+        )
+        if response.status_code == 200:
+            return response.json()
+        else:
+            st.error(f"Error al obtener el lote de actualizaciones: {response.status_code} - {response.text}")
+            return None
+    except Exception as e:
+        st.error(f"Error de conexión: {str(e)}")
+        return None
+
+def track_operation(api_base_url, function_key, operation_url, resource=None):
+    """Pide a la API que siga en segundo plano una operación asíncrona de ARM"""
+    try:
+        headers = {
+            "Ocp-Apim-Subscription-Key": function_key,
+            "Content-Type": "application/json"
+        }
+        response = client.send(
+            "POST", "operations",
+            f"{api_base_url}/dumprestore/api%2Foperations",
+            invalidate=("operations",),
+            headers=headers,
+            json={"url": operation_url, "kind": "major_upgrade", "resource": resource},
+            timeout=30
+        )
+        if response.status_code == 202:
+            return response.json()
+        else:
+            st.warning(f"La API no puede seguir la operación: {response.status_code} - {response.text}")
+            return None
+    except Exception as e:
+        st.error(f"Error de conexión: {str(e)}")
+        return None
+
+def list_operations(api_base_url, function_key, active=None):
+    """Obtiene las operaciones de ARM que sigue la API"""
+    try:
+        headers = {"Ocp-Apim-Subscription-Key": function_key}
+        params = {"active": str(active).lower()} if active is not None else None
+        response = client.get(
+            "operations",
+            f"{api_base_url}/dumprestore/api%2Foperations",
+            headers=headers,
+            params=params,
+            timeout=10
+        )
+        if response.status_code == 200:
+            return response.json()["operations"]
+        else:
+            st.error(f"Error al obtener las operaciones: {response.status_code} - {response.text}")
+            return None
+    except Exception as e:
+        st.error(f"Error de conexión: {str(e)}")
+        return None
+
+def get_servers(api_base_url, function_key, refresh=False):
+    """Obtiene el inventario de Flexible Servers de la API (refresh: reconstruirlo desde ARM)"""
+    try:
+        headers = {"Ocp-Apim-Subscription-Key": function_key}
+        if refresh:
+            client.invalidate_cache("servers")
+        response = client.get(
+            "servers",
+            f"{api_base_url}/dumprestore/api%2Fservers",
+            headers=headers,
+            params={"refresh": "true"} if refresh else None,
+            timeout=60
+        )
+        if response.status_code == 200:
+            return response.json()
+        else:
+            st.error(f"Error al obtener el inventario de servidores: {response.status_code} - {response.text}")
+            return None
+    except Exception as e:
+        st.error(f"Error de conexión: {str(e)}")
+        return None
+
 def get_config(api_base_url, function_key):
     """Obtiene la configuración actual de la API"""
     try:
         headers = {"Ocp-Apim-Subscription-Key": function_key}
-        response = requests.get(
+        response = client.get(
+            "config",
             f"{api_base_url}/dumprestore/api%2Fconfig",
             headers=headers,
             timeout=10
@@ -90,7 +387,8 @@ def get_server_info(subscription_id, resource_group, server_name, api_version, t
             "Content-Type": "application/json"
         }
         
-        response = requests.get(
+        response = client.send(
+            "GET", "arm/server",
             server_url,
             headers=headers,
             timeout=15
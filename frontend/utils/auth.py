@@ -1,22 +1,108 @@
+"""
+Tokens de Azure AD para las llamadas a ARM desde el frontend.
+
+La aplicación MSAL se crea una vez por proceso y credenciales, y los tokens se guardan por
+tenant, cliente y scope hasta poco antes de caducar. La obtención es single-flight: si varias
+ejecuciones de Streamlit piden a la vez un token caducado, solo una llama al endpoint de
+identidad y el resto espera su resultado. Dentro del margen de renovación se sigue sirviendo
+el token vigente mientras otra petición lo renueva.
+"""
+import hashlib
+import threading
+import time
+from typing import Any, Dict, Tuple
+
 import streamlit as st
 import msal
 
+# Segundos antes de la caducidad a partir de los que se renueva el token
+REFRESH_MARGIN = 300
+
+_lock = threading.Lock()
+_apps: Dict[Tuple[str, str, str], msal.ConfidentialClientApplication] = {}
+_tokens: Dict[Tuple[str, str, str], Dict[str, Any]] = {}
+_key_locks: Dict[Tuple[str, str, str], threading.Lock] = {}
+_stats = {"hits": 0, "misses": 0, "refreshes": 0, "errors": 0}
+
+
+def _count(name: str) -> None:
+    with _lock:
+        _stats[name] += 1
+
+
+def _get_app(tenant_id: str, client_id: str, client_secret: str) -> msal.ConfidentialClientApplication:
+    """Aplicación MSAL compartida por el proceso (el secreto solo entra en la clave como hash)."""
+    key = (tenant_id, client_id, hashlib.sha256((client_secret or "").encode()).hexdigest())
+    with _lock:
+        app = _apps.get(key)
+        if app is None:
+            app = msal.ConfidentialClientApplication(
+                client_id=client_id,
+                client_credential=client_secret,
+                authority=f"https://login.microsoftonline.com/{tenant_id}"
+            )
+            _apps[key] = app
+        return app
+
+
+def acquire_token(tenant_id: str, client_id: str, client_secret: str, scope: str) -> str:
+    """Token de client credentials para `scope`; lanza RuntimeError si Azure AD lo deniega."""
+    key = (tenant_id, client_id, scope)
+    with _lock:
+        cached = _tokens.get(key)
+        key_lock = _key_locks.setdefault(key, threading.Lock())
+    now = time.time()
+    if cached and now < cached["expires_at"] - REFRESH_MARGIN:
+        _count("hits")
+        return cached["token"]
+
+    # Token aún válido pero cerca de caducar: lo renueva solo quien consigue el lock
+    if cached and now < cached["expires_at"]:
+        if not key_lock.acquire(blocking=False):
+            _count("hits")
+            return cached["token"]
+    else:
+        key_lock.acquire()
+    try:
+        # Otra petición puede haberlo renovado mientras se esperaba el lock
+        with _lock:
+            cached = _tokens.get(key)
+        if cached and time.time() < cached["expires_at"] - REFRESH_MARGIN:
+            _count("hits")
+            return cached["token"]
+
+        result = _get_app(tenant_id, client_id, client_secret).acquire_token_for_client(scopes=[scope])
+        if "access_token" not in result:
+            _count("errors")
+            raise RuntimeError(result.get("error_description", "Unknown error"))
+        _count("refreshes" if cached else "misses")
+        with _lock:
+            _tokens[key] = {"token": result["access_token"], "expires_at": time.time() + int(result.get("expires_in", 3600))}
+        return result["access_token"]
+    finally:
+        key_lock.release()
+
+
+def get_token_stats() -> Dict[str, int]:
+    """Aciertos de la caché, tokens nuevos, renovaciones y errores desde el arranque."""
+    with _lock:
+        return dict(_stats)
+
+
+def clear_token_cache() -> None:
+    with _lock:
+        _tokens.clear()
+        _apps.clear()
+
+
 def get_azure_token(secrets):
     """Obtener token de autenticación de Azure AD"""
     try:
-        app = msal.ConfidentialClientApplication(
-            client_id=secrets.get("client_id"),
-            client_credential=secrets.get("client_secret"),
-            authority=f"https://login.microsoftonline.com/{secrets.get('tenant_id')}"
-        )
-        
-        result = app.acquire_token_for_client(scopes=[secrets.get("scope")])
-        
-        if "access_token" in result:
-            return result["access_token"]
-        else:
-            st.error(f"Error getting token: {result.get('error_description', 'Unknown error')}")
-            return None
+        return acquire_token(secrets.get("tenant_id"), secrets.get("client_id"),
+                             secrets.get("client_secret"), secrets.get("scope"))
+    except RuntimeError as e:
+        st.error(f"Error getting token: {str(e)}")
+        return None
     except Exception as e:
         st.error(f"Authentication error: {str(e)}")
         return None
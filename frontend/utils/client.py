@@ -0,0 +1,208 @@
+"""
+Cliente HTTP compartido por las páginas de Streamlit.
+
+Streamlit vuelve a ejecutar la página completa en cada interacción, así que sin caché cada
+clic repite las llamadas a la API a través de APIM. Este módulo mantiene:
+
+- Una única sesión de requests por proceso, con su pool de conexiones (keep-alive y TLS
+  reutilizados entre páginas y usuarios).
+- Una caché de respuestas GET con TTL por endpoint. La clave incluye las cabeceras de
+  autenticación, de modo que usuarios con distinta clave no comparten respuestas.
+- Peticiones condicionales: una respuesta caducada con ETag se revalida con If-None-Match y
+  un 304 la renueva sin volver a descargarla.
+- Invalidación explícita por endpoint tras lanzar operaciones (POST/DELETE).
+- Estadísticas por endpoint (aciertos, revalidaciones, errores y latencia) para el panel de
+  depuración de la página de Configuración.
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Segundos que una respuesta se sirve sin consultar la API (0: siempre se revalida)
+DEFAULT_TTL = {
+    "health": 15,
+    "config": 300,
+    "workflow/status": 5,
+    "workflow/runs": 10,
+    "schedules": 30,
+    "schedules/upcoming": 30,
+    "operations": 10,
+    "servers": 120
+}
+# Latencias de red recientes que se conservan por endpoint
+LATENCY_WINDOW = 100
+CACHE_SIZE = 256
+
+_lock = threading.Lock()
+_session: Optional[requests.Session] = None
+_cache: Dict[Tuple[str, ...], Dict[str, Any]] = {}
+_stats: Dict[str, Dict[str, Any]] = {}
+
+
+class CachedResponse:
+    """Respuesta con la interfaz mínima de requests.Response que usan las funciones de utils.api."""
+
+    def __init__(self, status_code: int, content: bytes, headers: Dict[str, str], source: str):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers
+        self.source = source  # network, cache o revalidated
+
+    @property
+    def text(self) -> str:
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self) -> Any:
+        return json.loads(self.content)
+
+
+def get_session() -> requests.Session:
+    """Sesión compartida por el proceso; los GET se reintentan ante errores transitorios de la pasarela."""
+    global _session
+    with _lock:
+        if _session is None:
+            retry = Retry(total=2, backoff_factor=0.3, status_forcelist=(502, 503, 504),
+                          allowed_methods=frozenset(["GET"]), raise_on_status=False)
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retry)
+            session = requests.Session()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+        return _session
+
+
+def _endpoint_stats(endpoint: str) -> Dict[str, Any]:
+    return _stats.setdefault(endpoint, {
+        "requests": 0, "hits": 0, "revalidated": 0, "misses": 0, "errors": 0,
+        "latencies": deque(maxlen=LATENCY_WINDOW)
+    })
+
+
+def _record(endpoint: str, outcome: str, latency: Optional[float] = None) -> None:
+    with _lock:
+        stats = _endpoint_stats(endpoint)
+        stats["requests"] += 1
+        stats[outcome] += 1
+        if latency is not None:
+            stats["latencies"].append(latency)
+
+
+def _cache_key(endpoint: str, url: str, headers: Optional[Dict[str, str]],
+               params: Optional[Dict[str, Any]]) -> Tuple[str, ...]:
+    # Las credenciales forman parte de la clave, pero solo se guarda su hash
+    credentials = hashlib.sha256(json.dumps(sorted((headers or {}).items())).encode()).hexdigest()
+    query = json.dumps(sorted((k, str(v)) for k, v in (params or {}).items()))
+    return (endpoint, url, query, credentials)
+
+
+def get(endpoint: str, url: str, headers: Optional[Dict[str, str]] = None,
+        params: Optional[Dict[str, Any]] = None, timeout: float = 10,
+        ttl: Optional[float] = None) -> CachedResponse:
+    """
+    GET con caché. `endpoint` identifica la ruta para el TTL, la invalidación y las
+    estadísticas. Solo se cachean respuestas 200; los errores de red se propagan.
+    """
+    ttl = DEFAULT_TTL.get(endpoint, 0) if ttl is None else ttl
+    key = _cache_key(endpoint, url, headers, params)
+    with _lock:
+        entry = _cache.get(key)
+    now = time.monotonic()
+    if entry is not None and now - entry["stored_at"] < ttl:
+        _record(endpoint, "hits")
+        return CachedResponse(200, entry["content"], entry["headers"], "cache")
+
+    request_headers = dict(headers or {})
+    if entry is not None and entry["headers"].get("ETag"):
+        request_headers["If-None-Match"] = entry["headers"]["ETag"]
+    started = time.monotonic()
+    try:
+        response = get_session().get(url, headers=request_headers, params=params, timeout=timeout)
+    except requests.RequestException:
+        _record(endpoint, "errors", time.monotonic() - started)
+        raise
+    latency = time.monotonic() - started
+
+    if response.status_code == 304 and entry is not None:
+        with _lock:
+            entry["stored_at"] = time.monotonic()
+        _record(endpoint, "revalidated", latency)
+        return CachedResponse(200, entry["content"], entry["headers"], "revalidated")
+
+    result = CachedResponse(response.status_code, response.content, dict(response.headers), "network")
+    if response.status_code == 200 and (ttl > 0 or response.headers.get("ETag")):
+        with _lock:
+            _cache[key] = {"content": response.content, "headers": dict(response.headers), "stored_at": time.monotonic()}
+            while len(_cache) > CACHE_SIZE:
+                # Los diccionarios conservan el orden de inserción: se descarta la entrada más antigua
+                _cache.pop(next(iter(_cache)))
+    _record(endpoint, "misses" if response.status_code < 400 else "errors", latency)
+    return result
+
+
+def send(method: str, endpoint: str, url: str, invalidate: Iterable[str] = (), **kwargs) -> requests.Response:
+    """
+    Petición sin caché (POST, PUT, DELETE o llamadas a ARM) por la sesión compartida. Si tiene
+    éxito, se descartan las respuestas cacheadas de los endpoints de `invalidate`.
+    """
+    started = time.monotonic()
+    try:
+        response = get_session().request(method, url, **kwargs)
+    except requests.RequestException:
+        _record(endpoint, "errors", time.monotonic() - started)
+        raise
+    _record(endpoint, "misses" if response.status_code < 400 else "errors", time.monotonic() - started)
+    if response.status_code < 400 and invalidate:
+        invalidate_cache(*invalidate)
+    return response
+
+
+def invalidate_cache(*endpoints: str) -> int:
+    """Descarta las respuestas cacheadas de los endpoints indicados (todas si no se indica ninguno)."""
+    with _lock:
+        keys = [key for key in _cache if not endpoints or key[0] in endpoints]
+        for key in keys:
+            del _cache[key]
+    return len(keys)
+
+
+def _percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def get_stats() -> List[Dict[str, Any]]:
+    """Estadísticas por endpoint: peticiones, aciertos de caché y latencia de red (ms)."""
+    with _lock:
+        rows = []
+        for endpoint, stats in sorted(_stats.items()):
+            latencies = list(stats["latencies"])
+            served = stats["hits"] + stats["revalidated"]
+            rows.append({
+                "endpoint": endpoint,
+                "requests": stats["requests"],
+                "hits": stats["hits"],
+                "revalidated": stats["revalidated"],
+                "misses": stats["misses"],
+                "errors": stats["errors"],
+                "hit_ratio": round(served / stats["requests"], 2) if stats["requests"] else 0.0,
+                "avg_ms": round(sum(latencies) / len(latencies) * 1000) if latencies else None,
+                "p95_ms": round(_percentile(latencies, 0.95) * 1000) if latencies else None
+            })
+        return rows
+
+
+def cache_size() -> int:
+    with _lock:
+        return len(_cache)
+
+
+def reset_stats() -> None:
+    with _lock:
+        _stats.clear()
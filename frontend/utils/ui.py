@@ -115,3 +115,45 @@ def format_job_status(status, conclusion):
         return f'<span class="job-in-progress">⟳ IN PROGRESS</span>'
     else:
         return f"{status.upper()} - {conclusion or 'N/A'}"
+
+def format_seconds(seconds):
+    """Formatea una duración en segundos como texto legible (45 s, 12 min, 1 h 05 min)"""
+    if seconds is None:
+        return "N/A"
+    seconds = int(seconds)
+    if seconds < 60:
+        return f"{seconds} s"
+    minutes = round(seconds / 60)
+    if minutes < 60:
+        return f"{minutes} min"
+    return f"{minutes // 60} h {minutes % 60:02d} min"
+
+def is_run_finished(workflow_status):
+    """Indica si una ejecución ha alcanzado un estado terminal (ya no cambiará)"""
+    return bool(workflow_status) and workflow_status.get("status") == "completed" and workflow_status.get("conclusion") is not None
+
+def diff_jobs(previous, jobs):
+    """
+    Compara los trabajos con la instantánea anterior ({id: firma}). Devuelve la nueva
+    instantánea, los trabajos que han cambiado y los pasos que han cambiado por trabajo
+    """
+    snapshot, changed_jobs, changed_steps = {}, set(), {}
+    for job in jobs:
+        steps = tuple(
+            (step["name"], step["status"], step["conclusion"], step.get("completed_at"))
+            for step in job.get("steps") or []
+        )
+        signature = (job["status"], job["conclusion"], job.get("completed_at"), steps)
+        snapshot[job["id"]] = signature
+        old = previous.get(job["id"])
+        if old == signature:
+            continue
+        changed_jobs.add(job["id"])
+        old_steps = {step[0]: step for step in old[3]} if old else {}
+        changed_steps[job["id"]] = {step[0] for step in steps if old_steps.get(step[0]) != step}
+    return snapshot, changed_jobs, changed_steps
+
+def server_label(server):
+    """Etiqueta de un servidor del inventario para desplegables y selecciones múltiples"""
+    details = [f"PG {server['version']}" if server.get("version") else None, server.get("state"), server.get("sku_name")]
+    return f"{server['name']} ({server['resource_group']}) · " + " · ".join(filter(None, details))
@@ -4,10 +4,16 @@
 # 
 # Este script realiza un backup de una base de datos PostgreSQL y lo sube a Azure Storage.
 # Incluye mecanismo de reintento para la carga a Azure Storage.
+# Junto a cada backup se publica un manifiesto (<backup>.manifest.json) con tamaño, SHA-256,
+# tablas con estimación de filas, tiempos, códec y versión de origen, y se registra una
+# entrada en el índice de catálogo del contenedor (ver catalog.sh).
+# Además se toma una instantánea de verificación por tabla (<backup>.verification.json)
+# sobre el mismo snapshot que usa pg_dump, que restore.sh compara tras restaurar.
 #
 # Requisitos:
-#   - pg_dump instalado
+#   - pg_dump y psql instalados
 #   - Azure CLI instalado y configurado
+#   - jq instalado
 #   - Variables de entorno configuradas:
 #     - PG_HOST_PROD: Hostname del servidor PostgreSQL de producción
 #     - PG_USER: Usuario de PostgreSQL
@@ -15,12 +21,45 @@
 #     - PG_DATABASE: Nombre de la base de datos a respaldar
 #     - AZURE_STORAGE_ACCOUNT: Nombre de la cuenta de almacenamiento
 #     - AZURE_STORAGE_CONTAINER: Nombre del contenedor
+#   - Variables opcionales:
+#     - VERIFY_ENABLED: true (por defecto) o false para no tomar la instantánea de verificación
+#     - VERIFY_JOBS: Conexiones concurrentes para la instantánea (por defecto 4)
+#     - VERIFY_EXACT_THRESHOLD_MB: Tamaño máximo de tabla con conteo exacto (por defecto 512)
+#     - VERIFY_CHECKSUM_ROWS: Filas por tabla incluidas en el checksum de muestra (por defecto 0, desactivado)
+#     - WORK_DIR: Directorio de ficheros temporales (por defecto /tmp); refresh.sh usa uno por base de datos
+#     - CHUNKED_BACKUPS: true para volcar sin compresión y subir el dump al almacén de chunks
+#       deduplicado (api/chunkstore.py) en lugar de como un blob completo; el manifiesto incluye
+#       las estadísticas de deduplicación y se publica el informe 'chunks' de la ejecución
+#     - CHUNK_JOBS: Subidas de chunks concurrentes (por defecto 8)
 
 set -e
 
+SCRIPT_DIR=$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)
+source "${SCRIPT_DIR}/catalog.sh"
+source "${SCRIPT_DIR}/report.sh"
+
 # Variables
+WORK_DIR="${WORK_DIR:-/tmp}"
 TIMESTAMP=$(date +"%Y%m%d_%H%M%S")
 BACKUP_FILE="${PG_DATABASE}_${TIMESTAMP}.dump"
+MANIFEST_FILE=$(manifest_name ${BACKUP_FILE})
+VERIFICATION_FILE="${BACKUP_FILE%.dump}.verification.json"
+VERIFY_ENABLED="${VERIFY_ENABLED:-true}"
+VERIFY_JOBS="${VERIFY_JOBS:-4}"
+VERIFY_EXACT_THRESHOLD_MB="${VERIFY_EXACT_THRESHOLD_MB:-512}"
+VERIFY_CHECKSUM_ROWS="${VERIFY_CHECKSUM_ROWS:-0}"
+CHUNKED_BACKUPS="${CHUNKED_BACKUPS:-false}"
+CHUNK_JOBS="${CHUNK_JOBS:-8}"
+if [ "$CHUNKED_BACKUPS" = "true" ]; then
+    # Sin compresión: un dump comprimido cambia por completo a partir del primer byte distinto
+    # y no se podría deduplicar; los chunks se comprimen uno a uno al subirse
+    BACKUP_CODEC="custom/none"
+    COMPRESS_ARGS="-Z 0"
+else
+    # pg_dump -F c comprime con zlib al nivel por defecto
+    BACKUP_CODEC="custom/gzip"
+    COMPRESS_ARGS=""
+fi
 
 echo "Starting backup of ${PG_DATABASE} from ${PG_HOST_PROD}..."
 
@@ -34,29 +73,118 @@ for var in "${required_vars[@]}"; do
     fi
 done
 
+PG_HOST_PROD_FQDN="${PG_HOST_PROD}.postgres.database.azure.com"
+
+# Collect source metadata for the manifest (server version, database size, tables)
+echo "Collecting source metadata from ${PG_HOST_PROD_FQDN}..."
+SOURCE_VERSION=$(PGPASSWORD=$PG_PASSWORD psql -h ${PG_HOST_PROD_FQDN} -U $PG_USER -d $PG_DATABASE -At -c "SHOW server_version;")
+DATABASE_SIZE=$(PGPASSWORD=$PG_PASSWORD psql -h ${PG_HOST_PROD_FQDN} -U $PG_USER -d $PG_DATABASE -At -c "SELECT pg_database_size(current_database());")
+TABLES_JSON=$(PGPASSWORD=$PG_PASSWORD psql -h ${PG_HOST_PROD_FQDN} -U $PG_USER -d $PG_DATABASE -At -c "
+    SELECT coalesce(json_agg(json_build_object(
+               'schema', n.nspname,
+               'table', c.relname,
+               'row_estimate', greatest(c.reltuples, 0)::bigint,
+               'size_bytes', pg_total_relation_size(c.oid)
+           ) ORDER BY n.nspname, c.relname), '[]')
+    FROM pg_class c
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE c.relkind IN ('r', 'p')
+      AND n.nspname NOT IN ('pg_catalog', 'information_schema')
+      AND n.nspname NOT LIKE 'pg_toast%';")
+
+# Take the per-table verification snapshot on the same MVCC snapshot pg_dump will use.
+# verification.py exports the snapshot, measures the tables and keeps the exporting
+# transaction open until the release file exists.
+SNAPSHOT_ARGS=""
+if [ "$VERIFY_ENABLED" = "true" ]; then
+    echo "Taking verification snapshot of ${PG_DATABASE} with ${VERIFY_JOBS} connections..."
+    rm -f ${WORK_DIR}/pg_snapshot_id ${WORK_DIR}/pg_snapshot_release ${WORK_DIR}/verification_snapshot.json
+    trap 'touch ${WORK_DIR}/pg_snapshot_release' EXIT
+    PGPASSWORD=$PG_PASSWORD python3 "${SCRIPT_DIR}/../api/verification.py" snapshot \
+        --host ${PG_HOST_PROD_FQDN} \
+        --dbname ${PG_DATABASE} \
+        --user ${PG_USER} \
+        --jobs ${VERIFY_JOBS} \
+        --exact-threshold-mb ${VERIFY_EXACT_THRESHOLD_MB} \
+        --checksum-rows ${VERIFY_CHECKSUM_ROWS} \
+        --output ${WORK_DIR}/verification_snapshot.json \
+        --snapshot-id-file ${WORK_DIR}/pg_snapshot_id \
+        --release-file ${WORK_DIR}/pg_snapshot_release &
+    VERIFY_PID=$!
+
+    for i in $(seq 1 60); do
+        [ -s ${WORK_DIR}/pg_snapshot_id ] && break
+        kill -0 $VERIFY_PID 2>/dev/null || break
+        sleep 1
+    done
+
+    if [ -s ${WORK_DIR}/pg_snapshot_id ]; then
+        SNAPSHOT_ARGS="--snapshot=$(cat ${WORK_DIR}/pg_snapshot_id)"
+        echo "pg_dump will use exported snapshot $(cat ${WORK_DIR}/pg_snapshot_id)"
+    else
+        echo "Warning: Could not export a snapshot; pg_dump will take its own"
+    fi
+fi
+
 # Create backup using pg_dump
+DUMP_STARTED_AT=$(date -u +"%Y-%m-%dT%H:%M:%SZ")
+DUMP_START=$(date +%s)
 echo "Executing pg_dump with user $PG_USER on database $PG_DATABASE from server ${PG_HOST_PROD}.postgres.database.azure.com..."
-PGPASSWORD=$PG_PASSWORD pg_dump -h ${PG_HOST_PROD}.postgres.database.azure.com -U $PG_USER -d $PG_DATABASE -F c -b -v -f /tmp/db_backup.dump
+echo "$TABLES_JSON" > ${WORK_DIR}/backup_tables.json
+progress_start dump 1 2 \
+    --tables-file ${WORK_DIR}/backup_tables.json \
+    --database-size "$DATABASE_SIZE" \
+    --output-file ${WORK_DIR}/db_backup.dump
+DUMP_EXIT=0
+PGPASSWORD=$PG_PASSWORD pg_dump -h ${PG_HOST_PROD_FQDN} -U $PG_USER -d $PG_DATABASE -F c -b -v $COMPRESS_ARGS $SNAPSHOT_ARGS -f ${WORK_DIR}/db_backup.dump 2>&3 || DUMP_EXIT=$?
+progress_end $DUMP_EXIT
 
-if [ $? -ne 0 ]; then
-    echo "Error: pg_dump failed with exit code $?"
+if [ $DUMP_EXIT -ne 0 ]; then
+    echo "Error: pg_dump failed with exit code $DUMP_EXIT"
     exit 1
 fi
 
-echo "Backup completed successfully."
+DUMP_SECONDS=$(( $(date +%s) - DUMP_START ))
+BACKUP_SIZE=$(stat -c %s ${WORK_DIR}/db_backup.dump)
+BACKUP_SHA256=$(sha256sum ${WORK_DIR}/db_backup.dump | cut -d ' ' -f 1)
+
+if [ "$VERIFY_ENABLED" = "true" ]; then
+    touch ${WORK_DIR}/pg_snapshot_release
+    if ! wait $VERIFY_PID || [ ! -s ${WORK_DIR}/verification_snapshot.json ]; then
+        echo "Warning: Verification snapshot failed; the restore will not be verified against the source"
+        VERIFICATION_FILE=""
+    fi
+else
+    VERIFICATION_FILE=""
+fi
+
+echo "Backup completed successfully (${BACKUP_SIZE} bytes in ${DUMP_SECONDS}s, sha256 ${BACKUP_SHA256})."
 
 # Upload to Azure Storage with retry mechanism
+UPLOAD_START=$(date +%s)
 echo "Uploading backup to Azure Storage account ${AZURE_STORAGE_ACCOUNT} in container ${AZURE_STORAGE_CONTAINER}..."
 MAX_RETRIES=5
+echo "null" > ${WORK_DIR}/chunk_stats.json
 for i in $(seq 1 $MAX_RETRIES); do
     echo "Upload attempt $i of $MAX_RETRIES..."
     
-    az storage blob upload \
-        --account-name ${AZURE_STORAGE_ACCOUNT} \
-        --container-name ${AZURE_STORAGE_CONTAINER} \
-        --name ${BACKUP_FILE} \
-        --file /tmp/db_backup.dump \
-        --auth-mode login && upload_success=true && break
+    if [ "$CHUNKED_BACKUPS" = "true" ]; then
+        # Only chunks missing from the store are transferred; a retry skips the ones already uploaded
+        python3 "${SCRIPT_DIR}/../api/chunkstore.py" put \
+            --account ${AZURE_STORAGE_ACCOUNT} \
+            --container ${AZURE_STORAGE_CONTAINER} \
+            --name ${BACKUP_FILE} \
+            --file ${WORK_DIR}/db_backup.dump \
+            --jobs ${CHUNK_JOBS} \
+            --output ${WORK_DIR}/chunk_stats.json && upload_success=true && break
+    else
+        az storage blob upload \
+            --account-name ${AZURE_STORAGE_ACCOUNT} \
+            --container-name ${AZURE_STORAGE_CONTAINER} \
+            --name ${BACKUP_FILE} \
+            --file ${WORK_DIR}/db_backup.dump \
+            --auth-mode login && upload_success=true && break
+    fi
     
     upload_success=false
     echo "Upload attempt failed, retrying in 15 seconds..."
@@ -68,13 +196,100 @@ if [ "$upload_success" != "true" ]; then
     exit 1
 fi
 
+UPLOAD_SECONDS=$(( $(date +%s) - UPLOAD_START ))
 echo "Backup uploaded successfully to ${AZURE_STORAGE_ACCOUNT}/${AZURE_STORAGE_CONTAINER}/${BACKUP_FILE}"
+if [ "$CHUNKED_BACKUPS" = "true" ]; then
+    echo "Chunk store: $(jq -r '"\(.new_chunks)/\(.chunks) new chunks, \(.bytes_uploaded) of \(.bytes_total) bytes transferred (dedup ratio \(.dedup_ratio // "n/a"))"' ${WORK_DIR}/chunk_stats.json)"
+    jq --arg backup "$BACKUP_FILE" '{backup: $backup} + .' ${WORK_DIR}/chunk_stats.json > ${WORK_DIR}/chunks_report.json
+    publish_run_report chunks ${WORK_DIR}/chunks_report.json
+fi
+
+if [ -n "$VERIFICATION_FILE" ]; then
+    echo "Uploading verification snapshot ${VERIFICATION_FILE}..."
+    az storage blob upload \
+        --account-name ${AZURE_STORAGE_ACCOUNT} \
+        --container-name ${AZURE_STORAGE_CONTAINER} \
+        --name ${VERIFICATION_FILE} \
+        --file ${WORK_DIR}/verification_snapshot.json \
+        --content-type application/json \
+        --overwrite \
+        --auth-mode login
+fi
+
+# Write and upload the backup manifest
+echo "Writing backup manifest ${MANIFEST_FILE}..."
+jq -n \
+    --arg name "$BACKUP_FILE" \
+    --arg database "$PG_DATABASE" \
+    --arg source_host "$PG_HOST_PROD" \
+    --arg pg_version "$SOURCE_VERSION" \
+    --arg codec "$BACKUP_CODEC" \
+    --arg sha256 "$BACKUP_SHA256" \
+    --arg created_at "$DUMP_STARTED_AT" \
+    --arg completed_at "$(date -u +"%Y-%m-%dT%H:%M:%SZ")" \
+    --arg run_id "${GITHUB_RUN_ID:-}" \
+    --arg verification_snapshot "$VERIFICATION_FILE" \
+    --argjson size_bytes "$BACKUP_SIZE" \
+    --argjson database_size_bytes "$DATABASE_SIZE" \
+    --argjson dump_seconds "$DUMP_SECONDS" \
+    --argjson upload_seconds "$UPLOAD_SECONDS" \
+    --argjson tables "$TABLES_JSON" \
+    --slurpfile chunk_stats ${WORK_DIR}/chunk_stats.json \
+    '{
+        version: 1,
+        name: $name,
+        database: $database,
+        source_host: $source_host,
+        pg_version: $pg_version,
+        codec: $codec,
+        format: "custom",
+        size_bytes: $size_bytes,
+        sha256: $sha256,
+        database_size_bytes: $database_size_bytes,
+        created_at: $created_at,
+        completed_at: $completed_at,
+        run_id: $run_id,
+        verification_snapshot: (if $verification_snapshot == "" then null else $verification_snapshot end),
+        timings: {dump_seconds: $dump_seconds, upload_seconds: $upload_seconds},
+        tables: $tables
+    } + (if $chunk_stats[0] == null then {} else {
+        storage: "chunks",
+        chunk_manifest: $chunk_stats[0].chunk_manifest,
+        dedup: ($chunk_stats[0] | del(.chunk_manifest))
+    } end)' > ${WORK_DIR}/backup_manifest.json
+
+az storage blob upload \
+    --account-name ${AZURE_STORAGE_ACCOUNT} \
+    --container-name ${AZURE_STORAGE_CONTAINER} \
+    --name ${MANIFEST_FILE} \
+    --file ${WORK_DIR}/backup_manifest.json \
+    --content-type application/json \
+    --overwrite \
+    --auth-mode login
+
+# Register the backup in the container catalog index
+echo "Registering ${BACKUP_FILE} in catalog ${CATALOG_BLOB}..."
+jq --arg manifest "$MANIFEST_FILE" '{
+        name, database, source_host, pg_version, codec, size_bytes, sha256,
+        database_size_bytes, created_at, run_id,
+        manifest: $manifest,
+        storage: (.storage // "blob"),
+        dump_seconds: .timings.dump_seconds,
+        table_count: (.tables | length),
+        status: "valid"
+    }' ${WORK_DIR}/backup_manifest.json > ${WORK_DIR}/catalog_entry.json
+
+if ! catalog_add_entry ${WORK_DIR}/catalog_entry.json; then
+    # El backup y su manifiesto ya están subidos; el catálogo se puede reconstruir a partir de ellos
+    echo "Warning: Failed to update catalog ${CATALOG_BLOB} after $CATALOG_MAX_RETRIES attempts"
+fi
 
 # Store the backup filename for the restore step
 echo "BACKUP_FILE=${BACKUP_FILE}" >> $GITHUB_ENV
+echo "BACKUP_CREATED=true" >> $GITHUB_ENV
 
 # Cleanup temporary files
 echo "Cleaning up temporary files..."
-rm -f /tmp/db_backup.dump
+rm -f ${WORK_DIR}/db_backup.dump ${WORK_DIR}/backup_manifest.json ${WORK_DIR}/catalog_entry.json ${WORK_DIR}/verification_snapshot.json ${WORK_DIR}/pg_snapshot_id ${WORK_DIR}/backup_tables.json ${WORK_DIR}/chunk_stats.json ${WORK_DIR}/chunks_report.json
 
 echo "Backup process completed"
\ No newline at end of file
@@ -0,0 +1,84 @@
+#!/bin/bash
+#
+# Funciones auxiliares para documentos JSON en Azure Storage
+#
+# Este fichero se carga con `source` desde el resto de scripts. Permite modificar un blob
+# JSON compartido entre ejecuciones concurrentes (catálogo de backups, reglas de firewall
+# compartidas...) sin perder actualizaciones.
+#
+# Requisitos:
+#   - Azure CLI instalado y configurado
+#   - jq instalado
+#   - Variables de entorno configuradas:
+#     - AZURE_STORAGE_ACCOUNT: Nombre de la cuenta de almacenamiento
+#     - AZURE_STORAGE_CONTAINER: Nombre del contenedor
+
+BLOB_UPDATE_MAX_RETRIES="${BLOB_UPDATE_MAX_RETRIES:-5}"
+
+# Aplica un filtro jq sobre un blob JSON con control de concurrencia optimista.
+# El blob se descarga junto con su ETag y solo se sobrescribe si nadie lo ha modificado
+# entretanto; en caso de conflicto se vuelve a intentar con la versión nueva. Si el blob
+# no existe se parte del documento inicial indicado.
+#
+# Uso: json_blob_update <blob> <json_inicial> <fichero_resultado|""> <filtro_jq> [argumentos adicionales para jq]
+json_blob_update() {
+    local blob=$1
+    local initial=$2
+    local result_file=$3
+    local filter=$4
+    shift 4
+    local workdir
+    workdir=$(mktemp -d)
+
+    for attempt in $(seq 1 $BLOB_UPDATE_MAX_RETRIES); do
+        local etag
+        etag=$(az storage blob show \
+            --account-name ${AZURE_STORAGE_ACCOUNT} \
+            --container-name ${AZURE_STORAGE_CONTAINER} \
+            --name "$blob" \
+            --query properties.etag -o tsv \
+            --auth-mode login 2>/dev/null || true)
+
+        local condition
+        if [ -n "$etag" ]; then
+            if ! az storage blob download \
+                --account-name ${AZURE_STORAGE_ACCOUNT} \
+                --container-name ${AZURE_STORAGE_CONTAINER} \
+                --name "$blob" \
+                --file "$workdir/current.json" \
+                --if-match "$etag" \
+                --auth-mode login >/dev/null; then
+                echo "Blob $blob changed while downloading, retrying..."
+                sleep $attempt
+                continue
+            fi
+            condition=(--if-match "$etag")
+        else
+            echo "$initial" > "$workdir/current.json"
+            condition=(--if-none-match "*")
+        fi
+
+        jq --arg now "$(date -u +"%Y-%m-%dT%H:%M:%SZ")" "$@" "$filter" \
+            "$workdir/current.json" > "$workdir/new.json"
+
+        if az storage blob upload \
+            --account-name ${AZURE_STORAGE_ACCOUNT} \
+            --container-name ${AZURE_STORAGE_CONTAINER} \
+            --name "$blob" \
+            --file "$workdir/new.json" \
+            --content-type application/json \
+            --overwrite \
+            "${condition[@]}" \
+            --auth-mode login >/dev/null; then
+            [ -n "$result_file" ] && cp "$workdir/new.json" "$result_file"
+            rm -rf "$workdir"
+            return 0
+        fi
+
+        echo "Update conflict on $blob (attempt $attempt of $BLOB_UPDATE_MAX_RETRIES), retrying..."
+        sleep $attempt
+    done
+
+    rm -rf "$workdir"
+    return 1
+}
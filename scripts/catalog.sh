@@ -0,0 +1,47 @@
+#!/bin/bash
+#
+# Funciones auxiliares del catálogo de backups
+#
+# Este fichero se carga con `source` desde los scripts de backup/restore. Mantiene un
+# índice compacto por contenedor (catalog/index.json) con una entrada por backup, de
+# modo que localizar el último backup válido requiere una única lectura en lugar de
+# listar todo el contenedor.
+#
+# Requisitos:
+#   - Azure CLI instalado y configurado
+#   - jq instalado
+#   - Variables de entorno configuradas:
+#     - AZURE_STORAGE_ACCOUNT: Nombre de la cuenta de almacenamiento
+#     - AZURE_STORAGE_CONTAINER: Nombre del contenedor
+
+CATALOG_BLOB="${CATALOG_BLOB:-catalog/index.json}"
+CATALOG_MAX_ENTRIES="${CATALOG_MAX_ENTRIES:-500}"
+CATALOG_MAX_RETRIES="${CATALOG_MAX_RETRIES:-5}"
+
+source "$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)/blob.sh"
+
+# Devuelve el nombre del manifiesto asociado a un fichero de backup
+manifest_name() {
+    echo "${1%.dump}.manifest.json"
+}
+
+# Aplica un filtro jq sobre el índice del catálogo (ver json_blob_update en blob.sh).
+# El filtro puede usar $now; el catálogo se recorta a CATALOG_MAX_ENTRIES entradas.
+#
+# Uso: catalog_update <filtro_jq> [argumentos adicionales para jq]
+catalog_update() {
+    local filter=$1
+    shift
+    BLOB_UPDATE_MAX_RETRIES=$CATALOG_MAX_RETRIES json_blob_update \
+        "${CATALOG_BLOB}" '{"version": 1, "backups": []}' "" \
+        "$filter | .updated_at = \$now | .backups = .backups[:\$max]" \
+        --argjson max "$CATALOG_MAX_ENTRIES" "$@"
+}
+
+# Añade (o reemplaza) la entrada de un backup al principio del catálogo
+#
+# Uso: catalog_add_entry <fichero_json_con_la_entrada>
+catalog_add_entry() {
+    catalog_update '.backups = ([$entry[0]] + [.backups[] | select(.name != $entry[0].name)])' \
+        --slurpfile entry "$1"
+}
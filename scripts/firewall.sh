@@ -0,0 +1,220 @@
+#!/bin/bash
+#
+# Gestión de reglas de firewall para los servidores PostgreSQL
+#
+# Este script abre y cierra el acceso de la IP del runner a los servidores de producción
+# y desarrollo. Cada ejecución usa un nombre de regla propio (gha-<run_id>-<intento>) en
+# lugar de una regla fija compartida, de modo que varios refrescos contra el mismo servidor
+# pueden ejecutarse en paralelo sin pisarse.
+#
+# Cuando varias ejecuciones salen por la misma IP comparten una única regla. Los titulares de
+# cada regla se registran en un blob (firewall/<servidor>/<ip>.json) que se actualiza con
+# control de concurrencia por ETag (ver blob.sh); la regla solo se elimina cuando la suelta
+# su último titular. Los titulares más antiguos que FIREWALL_HOLDER_TTL se consideran
+# abandonados (por ejecuciones canceladas sin limpieza) y se descartan.
+#
+# En lugar de esperar un tiempo fijo a que la regla se propague, "open" sondea los
+# servidores (pg_isready + SELECT 1) hasta que aceptan conexiones o vence el plazo.
+#
+# Uso:
+#   firewall.sh open    # Crea o reutiliza las reglas y espera a que los servidores respondan
+#   firewall.sh close   # Libera las reglas de esta ejecución
+#
+# Requisitos:
+#   - pg_isready y psql instalados
+#   - Azure CLI instalado y configurado
+#   - jq instalado
+#   - Variables de entorno configuradas:
+#     - RESOURCE_GROUP: Grupo de recursos de los servidores
+#     - PG_HOST_PROD: Hostname del servidor PostgreSQL de producción
+#     - PG_HOST_DEV: Hostname del servidor PostgreSQL de desarrollo
+#     - PG_USER: Usuario de PostgreSQL
+#     - PG_PASSWORD: Contraseña del usuario
+#     - AZURE_STORAGE_ACCOUNT: Nombre de la cuenta de almacenamiento
+#     - AZURE_STORAGE_CONTAINER: Nombre del contenedor
+#   - Variables opcionales:
+#     - RUN_KEY: Identificador de la ejecución (por defecto <GITHUB_RUN_ID>-<GITHUB_RUN_ATTEMPT>).
+#       Fuera de GitHub Actions es obligatorio y debe ser el mismo en "open" y "close"
+#     - RUNNER_IP: IP pública del runner (por defecto se consulta a api.ipify.org)
+#     - FIREWALL_READY_TIMEOUT: Segundos máximos de espera a que los servidores respondan (por defecto 180)
+#     - FIREWALL_PROBE_INTERVAL: Segundos entre sondeos (por defecto 3)
+#     - FIREWALL_HOLDER_TTL: Segundos tras los que un titular se considera abandonado (por defecto 21600)
+
+set -e
+
+SCRIPT_DIR=$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)
+source "${SCRIPT_DIR}/blob.sh"
+
+FIREWALL_READY_TIMEOUT="${FIREWALL_READY_TIMEOUT:-180}"
+FIREWALL_PROBE_INTERVAL="${FIREWALL_PROBE_INTERVAL:-3}"
+FIREWALL_HOLDER_TTL="${FIREWALL_HOLDER_TTL:-21600}"
+FIREWALL_ARM_RETRIES="${FIREWALL_ARM_RETRIES:-4}"
+# "open" y "close" son procesos distintos: la clave debe ser estable entre ambos para que
+# "close" encuentre el titular registrado por "open"
+if [ -z "$RUN_KEY" ] && [ -n "$GITHUB_RUN_ID" ]; then
+    RUN_KEY="${GITHUB_RUN_ID}-${GITHUB_RUN_ATTEMPT:-1}"
+fi
+if [ -z "$RUN_KEY" ]; then
+    echo "Error: Set RUN_KEY (or GITHUB_RUN_ID) to the same value for 'open' and 'close'"
+    exit 1
+fi
+if ! [[ "$RUN_KEY" =~ ^[A-Za-z0-9_-]+$ ]]; then
+    echo "Error: RUN_KEY may only contain letters, digits, '-' and '_'"
+    exit 1
+fi
+RULE_NAME="gha-${RUN_KEY}"
+
+# Verificar variables de entorno requeridas
+required_vars=("RESOURCE_GROUP" "PG_HOST_PROD" "PG_HOST_DEV" "PG_USER" "PG_PASSWORD" "AZURE_STORAGE_ACCOUNT" "AZURE_STORAGE_CONTAINER")
+for var in "${required_vars[@]}"; do
+    if [ -z "${!var}" ]; then
+        echo "Error: Required environment variable $var is not set"
+        exit 1
+    fi
+done
+
+# Producción y desarrollo pueden ser el mismo servidor
+SERVERS=$(printf "%s\n%s\n" "$PG_HOST_PROD" "$PG_HOST_DEV" | sort -u)
+
+# Ejecuta una llamada a ARM con reintentos y espera creciente
+arm_retry() {
+    for attempt in $(seq 1 $FIREWALL_ARM_RETRIES); do
+        if "$@"; then
+            return 0
+        fi
+        echo "Azure call failed (attempt $attempt of $FIREWALL_ARM_RETRIES), retrying..."
+        sleep $((attempt * 5))
+    done
+    return 1
+}
+
+holders_blob() {
+    echo "firewall/$1/${RUNNER_IP}.json"
+}
+
+# Descarta los titulares cuya última renovación supera el TTL
+PRUNE_FILTER='.holders = [.holders[] | select((($now | fromdateiso8601) - (.at | fromdateiso8601)) < $ttl)]'
+
+open_rule() {
+    local server=$1
+    local state
+    state=$(mktemp)
+
+    # Registrarse como titular; si nadie tiene regla para esta IP, la regla pasa a ser la nuestra
+    json_blob_update "$(holders_blob $server)" "{\"ip\": \"${RUNNER_IP}\", \"rule\": null, \"holders\": []}" "$state" \
+        "${PRUNE_FILTER} | .holders = [.holders[] | select(.run != \$run)] + [{run: \$run, at: \$now}] | .rule = (.rule // \$rule)" \
+        --arg run "$RUN_KEY" --arg rule "$RULE_NAME" --argjson ttl "$FIREWALL_HOLDER_TTL" >&2
+
+    local rule
+    rule=$(jq -r '.rule' "$state")
+    rm -f "$state"
+
+    if [ "$rule" != "$RULE_NAME" ]; then
+        echo "Sharing firewall rule $rule on $server for ${RUNNER_IP}"
+    else
+        echo "Creating firewall rule $rule on $server for ${RUNNER_IP}"
+    fi
+    # La creación es idempotente: también garantiza que una regla compartida sigue existiendo
+    arm_retry az postgres flexible-server firewall-rule create \
+        --resource-group $RESOURCE_GROUP \
+        --name $server \
+        --rule-name "$rule" \
+        --start-ip-address $RUNNER_IP \
+        --end-ip-address $RUNNER_IP \
+        --output none
+}
+
+close_rule() {
+    local server=$1
+    local state
+    state=$(mktemp)
+
+    # Soltar la regla; el último titular la reclama para borrarla dejando .rule a null, de modo
+    # que una ejecución que llegue después cree una regla nueva en lugar de reutilizar esta
+    json_blob_update "$(holders_blob $server)" "{\"ip\": \"${RUNNER_IP}\", \"rule\": null, \"holders\": []}" "$state" \
+        "${PRUNE_FILTER} | .holders = [.holders[] | select(.run != \$run)] | if (.holders | length) == 0 then .delete = .rule | .rule = null else .delete = null end" \
+        --arg run "$RUN_KEY" --argjson ttl "$FIREWALL_HOLDER_TTL" >&2
+
+    local rule
+    rule=$(jq -r '.delete // empty' "$state")
+    rm -f "$state"
+
+    if [ -z "$rule" ]; then
+        echo "Firewall rule on $server is still in use by other runs, keeping it"
+        return 0
+    fi
+
+    echo "Deleting firewall rule $rule on $server"
+    arm_retry az postgres flexible-server firewall-rule delete \
+        --resource-group $RESOURCE_GROUP \
+        --name $server \
+        --rule-name "$rule" \
+        --yes
+}
+
+# Espera a que un servidor acepte conexiones autenticadas. pg_isready solo comprueba que el
+# servidor responde; el firewall de Azure rechaza en la fase de autenticación, así que la
+# comprobación definitiva es un SELECT 1.
+wait_ready() {
+    local server=$1
+    local fqdn="${server}.postgres.database.azure.com"
+    local started=$SECONDS
+    local deadline=$((SECONDS + FIREWALL_READY_TIMEOUT))
+
+    while [ $SECONDS -lt $deadline ]; do
+        if pg_isready -h $fqdn -p 5432 -t 5 >/dev/null 2>&1 && \
+            PGPASSWORD=$PG_PASSWORD PGCONNECT_TIMEOUT=5 psql \
+                "host=$fqdn port=5432 dbname=postgres user=$PG_USER sslmode=require" \
+                -tAc "SELECT 1" >/dev/null 2>&1; then
+            echo "$server is reachable after $((SECONDS - started))s"
+            return 0
+        fi
+        sleep $FIREWALL_PROBE_INTERVAL
+    done
+
+    echo "Error: $server is not reachable after ${FIREWALL_READY_TIMEOUT}s"
+    return 1
+}
+
+case "$1" in
+    open)
+        if [ -z "$RUNNER_IP" ]; then
+            RUNNER_IP=$(curl -s https://api.ipify.org)
+        fi
+        if [ -n "$GITHUB_ENV" ]; then
+            echo "RUNNER_IP=$RUNNER_IP" >> $GITHUB_ENV
+        fi
+
+        for server in $SERVERS; do
+            open_rule $server
+        done
+
+        # Sondear los servidores en paralelo
+        pids=()
+        for server in $SERVERS; do
+            wait_ready $server &
+            pids+=($!)
+        done
+        failed=0
+        for pid in "${pids[@]}"; do
+            wait $pid || failed=1
+        done
+        exit $failed
+        ;;
+    close)
+        if [ -z "$RUNNER_IP" ]; then
+            echo "RUNNER_IP is not set, no firewall rules to release"
+            exit 0
+        fi
+
+        failed=0
+        for server in $SERVERS; do
+            close_rule $server || failed=1
+        done
+        exit $failed
+        ;;
+    *)
+        echo "Usage: $0 open|close"
+        exit 1
+        ;;
+esac
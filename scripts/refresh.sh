@@ -0,0 +1,264 @@
+#!/bin/bash
+#
+# PostgreSQL Multi-Database Refresh Script
+#
+# Este script refresca una o varias bases de datos de producción en desarrollo dentro de la
+# misma ejecución. Los roles (globals) se vuelcan una sola vez con pg_dumpall y se aplican en
+# desarrollo antes de restaurar; después cada base de datos sigue su propio pipeline
+# (backup.sh seguido de restore.sh) y hasta MAX_PARALLEL_DATABASES pipelines se ejecutan a la vez.
+#
+# Cada pipeline trabaja en su propio directorio temporal y publica un informe 'pipeline'
+# (runs/<GITHUB_RUN_ID>/pipeline/<base_de_datos>.json) con su resultado, que la API
+# devuelve por base de datos en el endpoint de estado.
+#
+# Requisitos:
+#   - pg_dumpall y psql instalados, además de los requisitos de backup.sh y restore.sh
+#   - Variables de entorno configuradas:
+#     - PG_HOST_PROD: Hostname del servidor PostgreSQL de producción
+#     - PG_HOST_DEV: Hostname del servidor PostgreSQL de desarrollo
+#     - PG_USER: Usuario de PostgreSQL
+#     - PG_PASSWORD: Contraseña del usuario
+#     - PG_DATABASE: Base de datos, lista separada por comas, o "*" para todas las bases de datos
+#       de producción que no son plantillas
+#     - AZURE_STORAGE_ACCOUNT: Nombre de la cuenta de almacenamiento
+#     - AZURE_STORAGE_CONTAINER: Nombre del contenedor
+#   - Variables opcionales:
+#     - BACKUPS_JSON: Backups a reutilizar por base de datos ({"base_de_datos": "backup.dump"});
+#       el resto de bases de datos hace un pg_dump nuevo
+#     - MAX_PARALLEL_DATABASES: Pipelines simultáneos (por defecto 2)
+#     - INCLUDE_GLOBALS: true (por defecto) o false para no copiar los roles
+#     - SUBSET_JSON: Modo subconjunto ({"roots": [...], "seed": 0}); en lugar de backup.sh y
+#       restore.sh se copia directamente un subconjunto referencialmente consistente con
+#       api/subset.py y se publica su informe 'subset'
+#     - SELECTIVE_THRESHOLD: Modo selectivo; solo se vuelven a copiar las tablas cuyos cambios
+#       desde el último refresco superan esta fracción de sus filas (api/selective.py). Las
+#       estadísticas se guardan en stats/<PG_HOST_PROD>/<base_de_datos>.json y, sin ellas o si el
+#       esquema ha cambiado, se hace el refresco completo
+#     - RESTORE_JOBS: Flujos COPY en paralelo de los modos subconjunto y selectivo (por defecto 4)
+
+set -e
+
+SCRIPT_DIR=$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)
+source "${SCRIPT_DIR}/report.sh"
+
+BACKUPS_JSON="${BACKUPS_JSON:-{\}}"
+MAX_PARALLEL_DATABASES="${MAX_PARALLEL_DATABASES:-2}"
+INCLUDE_GLOBALS="${INCLUDE_GLOBALS:-true}"
+WORK_ROOT=$(mktemp -d /tmp/refresh.XXXXXX)
+
+# Verificar variables de entorno requeridas
+required_vars=("PG_HOST_PROD" "PG_HOST_DEV" "PG_USER" "PG_PASSWORD" "PG_DATABASE" "AZURE_STORAGE_ACCOUNT" "AZURE_STORAGE_CONTAINER")
+for var in "${required_vars[@]}"; do
+    if [ -z "${!var}" ]; then
+        echo "Error: Required environment variable $var is not set"
+        echo "Make sure all required parameters are provided in the GitHub workflow inputs"
+        exit 1
+    fi
+done
+
+PG_HOST_PROD_FQDN="${PG_HOST_PROD}.postgres.database.azure.com"
+PG_HOST_DEV_FQDN="${PG_HOST_DEV}.postgres.database.azure.com"
+
+# Resolve the database list; "*" means every user database of the production server.
+# Largest databases first, so the longest pipelines start as early as possible.
+if [ "$PG_DATABASE" = "*" ]; then
+    DATABASES=$(PGPASSWORD=$PG_PASSWORD psql -h ${PG_HOST_PROD_FQDN} -U $PG_USER -d postgres -At -c "
+        SELECT datname FROM pg_database
+        WHERE NOT datistemplate AND datallowconn
+          AND datname NOT IN ('postgres', 'azure_maintenance', 'azure_sys')
+        ORDER BY pg_database_size(oid) DESC;")
+else
+    DATABASES=$(tr ',' '\n' <<< "$PG_DATABASE" | sed '/^$/d')
+fi
+
+if [ -z "$DATABASES" ]; then
+    echo "Error: No databases to refresh on ${PG_HOST_PROD}"
+    exit 1
+fi
+DATABASE_COUNT=$(wc -l <<< "$DATABASES")
+echo "Refreshing ${DATABASE_COUNT} database(s) from ${PG_HOST_PROD} to ${PG_HOST_DEV}: $(echo $DATABASES)"
+
+# Roles are cluster-wide: dump them once instead of once per database
+if [ "$INCLUDE_GLOBALS" = "true" ]; then
+    echo "Copying roles from ${PG_HOST_PROD} to ${PG_HOST_DEV}..."
+    if PGPASSWORD=$PG_PASSWORD pg_dumpall -h ${PG_HOST_PROD_FQDN} -U $PG_USER -l postgres \
+        --globals-only --no-role-passwords --no-tablespaces -f ${WORK_ROOT}/globals.sql; then
+        # Existing roles and Azure-reserved roles fail individually; the rest are still created
+        if ! PGPASSWORD=$PG_PASSWORD psql -h ${PG_HOST_DEV_FQDN} -U $PG_USER -d postgres -q \
+            -f ${WORK_ROOT}/globals.sql > ${WORK_ROOT}/globals.log 2>&1; then
+            echo "Warning: Failed to apply roles on ${PG_HOST_DEV}"
+        fi
+        echo "Roles applied ($(grep -c 'ERROR' ${WORK_ROOT}/globals.log || true) statements skipped, e.g. roles that already exist)."
+    else
+        echo "Warning: pg_dumpall --globals-only failed; restores will use the roles already present on ${PG_HOST_DEV}"
+    fi
+fi
+
+# Upload the table statistics of a database for the next selective refresh
+upload_stats() {
+    az storage blob upload \
+        --account-name ${AZURE_STORAGE_ACCOUNT} \
+        --container-name ${AZURE_STORAGE_CONTAINER} \
+        --name "stats/${PG_HOST_PROD}/$1.json" \
+        --file "$2" \
+        --content-type application/json \
+        --overwrite \
+        --auth-mode login >/dev/null \
+        || echo "Warning: Failed to upload table statistics of $1; the next selective refresh will be a full refresh"
+}
+
+# Dump, transfer and restore one database. Runs in a subshell with its own work directory;
+# backup.sh reports the new backup name through a per-database GITHUB_ENV file.
+run_pipeline() {
+    local database=$1
+    local work_dir="${WORK_ROOT}/${database}"
+    local started_at
+    started_at=$(date -u +"%Y-%m-%dT%H:%M:%SZ")
+    local start=$(date +%s)
+    local status="succeeded"
+    local failed_stage=""
+    local selective_done=false
+    local backup_file
+    backup_file=$(jq -r --arg database "$database" '.[$database] // empty' <<< "$BACKUPS_JSON")
+
+    mkdir -p "$work_dir"
+    : > "${work_dir}/env"
+    export PG_DATABASE=$database WORK_DIR=$work_dir GITHUB_ENV="${work_dir}/env"
+    export BACKUP_CREATED=false
+
+    if [ -n "$SELECTIVE_THRESHOLD" ]; then
+        # Re-copy only the tables that changed; exit code 3 asks for a full refresh
+        az storage blob download \
+            --account-name ${AZURE_STORAGE_ACCOUNT} \
+            --container-name ${AZURE_STORAGE_CONTAINER} \
+            --name "stats/${PG_HOST_PROD}/${database}.json" \
+            --file "${work_dir}/previous_stats.json" \
+            --auth-mode login >/dev/null 2>&1 || rm -f "${work_dir}/previous_stats.json"
+        # Until this run uploads new statistics the next one must be a full refresh: if the
+        # selective copy fails after emptying tables, the old counters would not show it
+        if [ -f "${work_dir}/previous_stats.json" ]; then
+            az storage blob delete \
+                --account-name ${AZURE_STORAGE_ACCOUNT} \
+                --container-name ${AZURE_STORAGE_CONTAINER} \
+                --name "stats/${PG_HOST_PROD}/${database}.json" \
+                --auth-mode login >/dev/null 2>&1 \
+                || echo "Warning: Failed to invalidate the table statistics of ${database}"
+        fi
+        local selective_code=0
+        PGPASSWORD=$PG_PASSWORD python3 "${SCRIPT_DIR}/../api/selective.py" run \
+            --source-host ${PG_HOST_PROD_FQDN} --target-host ${PG_HOST_DEV_FQDN} \
+            --source-name ${PG_HOST_PROD} --target-name ${PG_HOST_DEV} --user $PG_USER --database "$database" \
+            --previous "${work_dir}/previous_stats.json" --threshold "$SELECTIVE_THRESHOLD" --jobs "${RESTORE_JOBS:-4}" \
+            --stats-output "${work_dir}/stats.json" --output "${work_dir}/selective.json" || selective_code=$?
+        [ -s "${work_dir}/selective.json" ] && publish_run_report selective "${work_dir}/selective.json"
+        if [ $selective_code -eq 0 ]; then
+            selective_done=true
+        elif [ $selective_code -ne 3 ]; then
+            status="failed"
+            failed_stage="selective"
+        fi
+    fi
+
+    if [ "$status" = "failed" ] || [ "$selective_done" = "true" ]; then
+        :
+    elif [ -n "$SUBSET_JSON" ]; then
+        echo "Copying a referentially closed subset of ${database}..."
+        if PGPASSWORD=$PG_PASSWORD python3 "${SCRIPT_DIR}/../api/subset.py" \
+            --source-host ${PG_HOST_PROD_FQDN} --target-host ${PG_HOST_DEV_FQDN} --user $PG_USER \
+            --database "$database" --spec "$SUBSET_JSON" --jobs "${RESTORE_JOBS:-4}" \
+            --work-dir "$work_dir" --output "${work_dir}/subset.json"; then
+            publish_run_report subset "${work_dir}/subset.json"
+        else
+            status="failed"
+            failed_stage="subset"
+        fi
+    elif [ -z "$backup_file" ]; then
+        if "${SCRIPT_DIR}/backup.sh"; then
+            backup_file=$(grep '^BACKUP_FILE=' "${work_dir}/env" | tail -1 | cut -d '=' -f 2-)
+            BACKUP_CREATED=true
+        else
+            status="failed"
+            failed_stage="backup"
+        fi
+    else
+        echo "Reusing backup ${backup_file} for ${database}"
+    fi
+
+    if [ "$status" = "succeeded" ] && [ -z "$SUBSET_JSON" ] && [ "$selective_done" = "false" ] \
+        && ! BACKUP_FILE=$backup_file "${SCRIPT_DIR}/restore.sh"; then
+        status="failed"
+        failed_stage="restore"
+    fi
+
+    # Statistics for the next selective refresh: production counters were taken before the
+    # dump, dev counters are taken now that the restore has finished
+    if [ "$status" = "succeeded" ] && [ -s "${work_dir}/stats.json" ]; then
+        if [ "$selective_done" = "true" ] || PGPASSWORD=$PG_PASSWORD python3 "${SCRIPT_DIR}/../api/selective.py" record-target \
+            --target-host ${PG_HOST_DEV_FQDN} --user $PG_USER --database "$database" --stats "${work_dir}/stats.json"; then
+            upload_stats "$database" "${work_dir}/stats.json"
+        fi
+    fi
+
+    jq -n \
+        --arg database "$database" \
+        --arg status "$status" \
+        --arg failed_stage "$failed_stage" \
+        --arg backup "$backup_file" \
+        --arg started_at "$started_at" \
+        --arg completed_at "$(date -u +"%Y-%m-%dT%H:%M:%SZ")" \
+        --argjson backup_created "$BACKUP_CREATED" \
+        --argjson total_seconds "$(( $(date +%s) - start ))" \
+        '{database: $database, status: $status,
+          failed_stage: (if $failed_stage == "" then null else $failed_stage end),
+          backup: (if $backup == "" then null else $backup end), backup_created: $backup_created,
+          started_at: $started_at, completed_at: $completed_at, total_seconds: $total_seconds}' \
+        > "${work_dir}/pipeline.json"
+    publish_run_report pipeline "${work_dir}/pipeline.json"
+    rm -rf "${work_dir}/env"
+}
+
+# Run the pipelines with at most MAX_PARALLEL_DATABASES in flight. With several databases
+# every output line is prefixed with the database name so the interleaved log stays readable.
+for database in $DATABASES; do
+    while [ $(jobs -rp | wc -l) -ge $MAX_PARALLEL_DATABASES ]; do
+        wait -n || true
+    done
+    echo "Starting pipeline for ${database}..."
+    if [ "$DATABASE_COUNT" -eq 1 ]; then
+        ( run_pipeline "$database" ) &
+    else
+        ( run_pipeline "$database" 2>&1 | sed -u "s/^/[${database}] /" ) &
+    fi
+done
+wait
+
+# Per-database summary
+FAILED=0
+if [ -n "$GITHUB_STEP_SUMMARY" ]; then
+    {
+        echo "### Refresh ${PG_HOST_PROD} → ${PG_HOST_DEV}"
+        echo ""
+        echo "| Base de datos | Resultado | Backup | Segundos |"
+        echo "| --- | --- | --- | ---: |"
+    } >> "$GITHUB_STEP_SUMMARY"
+fi
+for database in $DATABASES; do
+    result="${WORK_ROOT}/${database}/pipeline.json"
+    if [ -s "$result" ]; then
+        line=$(jq -r '[.database, (.status + (if .failed_stage then " (" + .failed_stage + ")" else "" end)), (.backup // "-"), .total_seconds] | join(" | ")' "$result")
+        jq -e '.status == "succeeded"' "$result" >/dev/null || FAILED=$((FAILED + 1))
+    else
+        line="${database} | failed | - | -"
+        FAILED=$((FAILED + 1))
+    fi
+    echo "$line"
+    [ -n "$GITHUB_STEP_SUMMARY" ] && echo "| $line |" >> "$GITHUB_STEP_SUMMARY"
+done
+
+rm -rf "$WORK_ROOT"
+
+if [ $FAILED -gt 0 ]; then
+    echo "Error: ${FAILED} of ${DATABASE_COUNT} database(s) failed to refresh"
+    exit 1
+fi
+echo "All ${DATABASE_COUNT} database(s) refreshed successfully."
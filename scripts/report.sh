@@ -0,0 +1,118 @@
+#!/bin/bash
+#
+# Funciones auxiliares para medir fases y publicar informes de ejecución
+#
+# Este fichero se carga con `source` desde los scripts de backup/restore. Los informes
+# se publican en runs/<GITHUB_RUN_ID>/<tipo>/<PG_DATABASE>.json dentro del contenedor
+# de backups, que es donde la API los lee para el endpoint de estado.
+#
+# Requisitos:
+#   - Azure CLI instalado y configurado
+#   - jq instalado
+#   - python3 (seguimiento de progreso con api/progress.py)
+
+REPORT_SCRIPT_DIR=$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)
+PROGRESS_ENABLED="${PROGRESS_ENABLED:-true}"
+PROGRESS_INTERVAL="${PROGRESS_INTERVAL:-15}"
+PROGRESS_PID=""
+
+PHASE_NAMES=()
+PHASE_DURATIONS=()
+PHASE_STARTED_AT=0
+
+# Marca el inicio de una fase
+phase_start() {
+    PHASE_STARTED_AT=$(date +%s)
+}
+
+# Registra la duración de la fase en curso
+#
+# Uso: phase_end <nombre_fase>
+phase_end() {
+    local seconds=$(( $(date +%s) - PHASE_STARTED_AT ))
+    PHASE_NAMES+=("$1")
+    PHASE_DURATIONS+=("$seconds")
+    echo "Phase $1 completed in ${seconds}s"
+}
+
+# Imprime las duraciones registradas como objeto JSON {fase: segundos}
+phases_json() {
+    local json="{}"
+    for i in "${!PHASE_NAMES[@]}"; do
+        json=$(jq -c --arg name "${PHASE_NAMES[$i]}" --argjson seconds "${PHASE_DURATIONS[$i]}" \
+            '. + {($name): $seconds}' <<< "$json")
+    done
+    echo "$json"
+}
+
+# Escribe una tabla Markdown con las fases en el resumen del job de GitHub Actions
+#
+# Uso: phases_step_summary <título>
+phases_step_summary() {
+    [ -n "$GITHUB_STEP_SUMMARY" ] || return 0
+    {
+        echo "### $1"
+        echo ""
+        echo "| Fase | Segundos |"
+        echo "| --- | ---: |"
+        for i in "${!PHASE_NAMES[@]}"; do
+            echo "| ${PHASE_NAMES[$i]} | ${PHASE_DURATIONS[$i]} |"
+        done
+        echo ""
+    } >> "$GITHUB_STEP_SUMMARY"
+}
+
+# Publica un informe de ejecución para que la API pueda devolverlo en el estado del run.
+# Fuera de GitHub Actions (sin GITHUB_RUN_ID) no se publica nada.
+#
+# Uso: publish_run_report <tipo> <fichero_json>
+publish_run_report() {
+    [ -n "$GITHUB_RUN_ID" ] || return 0
+    az storage blob upload \
+        --account-name ${AZURE_STORAGE_ACCOUNT} \
+        --container-name ${AZURE_STORAGE_CONTAINER} \
+        --name "runs/${GITHUB_RUN_ID}/$1/${PG_DATABASE}.json" \
+        --file "$2" \
+        --content-type application/json \
+        --overwrite \
+        --auth-mode login >/dev/null \
+        || echo "Warning: Failed to publish $1 report for run ${GITHUB_RUN_ID}"
+}
+
+# Arranca el seguimiento de progreso de una etapa. La salida verbose de pg_dump/pg_restore
+# debe redirigirse al descriptor 3 (2>&3); api/progress.py la reenvía al log y publica el
+# progreso en runs/<GITHUB_RUN_ID>/progress/<PG_DATABASE>.json. Fuera de GitHub Actions el
+# descriptor 3 apunta a stderr y no se publica nada.
+#
+# Uso: progress_start <dump|restore> <índice_etapa> <total_etapas> [argumentos para progress.py]
+progress_start() {
+    if [ -n "$GITHUB_RUN_ID" ] && [ "$PROGRESS_ENABLED" = "true" ]; then
+        exec 3> >(python3 "${REPORT_SCRIPT_DIR}/../api/progress.py" "$1" \
+            --database "${PG_DATABASE}" \
+            --stage-index "$2" \
+            --stage-count "$3" \
+            --account "${AZURE_STORAGE_ACCOUNT}" \
+            --container "${AZURE_STORAGE_CONTAINER}" \
+            --blob "runs/${GITHUB_RUN_ID}/progress/${PG_DATABASE}.json" \
+            --interval "${PROGRESS_INTERVAL}" \
+            "${@:4}")
+        PROGRESS_PID=$!
+    else
+        exec 3>&2
+        PROGRESS_PID=""
+    fi
+}
+
+# Cierra el seguimiento de progreso registrando el código de salida de la etapa
+#
+# Uso: progress_end <código_salida>
+progress_end() {
+    if [ -n "$PROGRESS_PID" ]; then
+        echo "__EXIT__ $1" >&3
+        exec 3>&-
+        wait $PROGRESS_PID 2>/dev/null || true
+        PROGRESS_PID=""
+    else
+        exec 3>&-
+    fi
+}
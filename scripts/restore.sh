@@ -3,10 +3,30 @@
 # PostgreSQL Database Restore Script
 # 
 # Este script descarga un backup de Azure Storage y lo restaura en un servidor PostgreSQL.
+# Si el backup tiene manifiesto, se comprueba su SHA-256 antes de restaurar; un backup
+# corrupto se marca como inválido en el catálogo para que no vuelva a reutilizarse.
+#
+# Perfiles de restauración (RESTORE_PROFILE):
+#   - standard: pg_restore en un único paso (comportamiento original)
+#   - fast: restaura pre-data y datos primero, construye índices y restricciones después
+#     con paralelismo -j, aplica ajustes de sesión para carga masiva y termina con un
+#     ANALYZE paralelo por tabla (vacuumdb --analyze-only)
+# Las duraciones de cada fase se publican como informe de la ejecución (ver report.sh).
+# Si el backup tiene instantánea de verificación, se comparan las tablas restauradas con
+# producción (api/verification.py) y el informe se publica para el endpoint de estado.
+#
+# Con RESTORE_TARGET=template el backup se restaura en la plantilla <base_de_datos>__tpl, que se
+# sella con sus metadatos de frescura (api/templates.py), y la base de datos de trabajo se crea
+# como copia de la plantilla. Los resets posteriores solo repiten esa copia.
+#
+# Los backups subidos al almacén de chunks (CHUNKED_BACKUPS en backup.sh) se reconstruyen a
+# partir de su manifiesto <backup>.chunks.json con api/chunkstore.py; el resto se descarga
+# como un blob completo.
 #
 # Requisitos:
 #   - pg_restore y psql instalados
 #   - Azure CLI instalado y configurado
+#   - jq instalado
 #   - Variables de entorno configuradas:
 #     - PG_HOST_DEV: Hostname del servidor PostgreSQL de destino
 #     - PG_USER: Usuario de PostgreSQL
@@ -15,9 +35,34 @@
 #     - AZURE_STORAGE_ACCOUNT: Nombre de la cuenta de almacenamiento
 #     - AZURE_STORAGE_CONTAINER: Nombre del contenedor
 #     - BACKUP_FILE: Nombre del archivo de backup a descargar
+#   - Variables opcionales:
+#     - RESTORE_PROFILE: standard (por defecto) o fast
+#     - RESTORE_JOBS: Paralelismo del perfil fast (por defecto 4)
+#     - RESTORE_MAINTENANCE_WORK_MEM: maintenance_work_mem de las sesiones de carga (por defecto 1GB)
+#     - RESTORE_WORK_MEM: work_mem de las sesiones de carga (por defecto 64MB)
+#     - VERIFY_ENABLED: true (por defecto) o false para omitir la verificación por tabla
+#     - VERIFY_JOBS: Conexiones concurrentes de la verificación (por defecto 4)
+#     - RESTORE_TARGET: database (por defecto) o template
+#     - WORK_DIR: Directorio de ficheros temporales (por defecto /tmp); refresh.sh usa uno por base de datos
 
 set -e
 
+SCRIPT_DIR=$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)
+source "${SCRIPT_DIR}/catalog.sh"
+source "${SCRIPT_DIR}/report.sh"
+
+WORK_DIR="${WORK_DIR:-/tmp}"
+RESTORE_PROFILE="${RESTORE_PROFILE:-standard}"
+RESTORE_JOBS="${RESTORE_JOBS:-4}"
+RESTORE_MAINTENANCE_WORK_MEM="${RESTORE_MAINTENANCE_WORK_MEM:-1GB}"
+RESTORE_WORK_MEM="${RESTORE_WORK_MEM:-64MB}"
+VERIFY_ENABLED="${VERIFY_ENABLED:-true}"
+VERIFY_JOBS="${VERIFY_JOBS:-4}"
+VERIFICATION_STATUS="skipped"
+RESTORE_TARGET="${RESTORE_TARGET:-database}"
+RESTORE_STARTED_AT=$(date -u +"%Y-%m-%dT%H:%M:%SZ")
+RESTORE_START=$(date +%s)
+
 echo "Starting restore of ${PG_DATABASE} to ${PG_HOST_DEV}..."
 
 # Verificar variables de entorno requeridas
@@ -30,18 +75,38 @@ for var in "${required_vars[@]}"; do
     fi
 done
 
+LOCAL_BACKUP="${WORK_DIR}/${BACKUP_FILE}"
+if [ "$RESTORE_TARGET" = "template" ]; then
+    TARGET_DATABASE="${PG_DATABASE}__tpl"
+    echo "Restoring into template database ${TARGET_DATABASE}"
+else
+    TARGET_DATABASE="${PG_DATABASE}"
+fi
+
 # Download from Azure Storage
+phase_start
 echo "Downloading backup ${BACKUP_FILE} from Azure Storage account ${AZURE_STORAGE_ACCOUNT} in container ${AZURE_STORAGE_CONTAINER}..."
 MAX_RETRIES=3
 for i in $(seq 1 $MAX_RETRIES); do
     echo "Download attempt $i of $MAX_RETRIES..."
     
-    az storage blob download \
-      --account-name ${AZURE_STORAGE_ACCOUNT} \
-      --container-name ${AZURE_STORAGE_CONTAINER} \
+    # Chunked backups are reassembled from the chunk store; exit code 4 means a regular blob
+    chunk_code=0
+    python3 "${SCRIPT_DIR}/../api/chunkstore.py" get \
+      --account ${AZURE_STORAGE_ACCOUNT} \
+      --container ${AZURE_STORAGE_CONTAINER} \
       --name ${BACKUP_FILE} \
-      --file ${BACKUP_FILE} \
-      --auth-mode login && download_success=true && break
+      --file ${LOCAL_BACKUP} || chunk_code=$?
+    if [ $chunk_code -eq 0 ]; then
+      download_success=true && break
+    elif [ $chunk_code -eq 4 ]; then
+      az storage blob download \
+        --account-name ${AZURE_STORAGE_ACCOUNT} \
+        --container-name ${AZURE_STORAGE_CONTAINER} \
+        --name ${BACKUP_FILE} \
+        --file ${LOCAL_BACKUP} \
+        --auth-mode login && download_success=true && break
+    fi
     
     download_success=false
     echo "Download attempt failed, retrying in 10 seconds..."
@@ -54,40 +119,209 @@ if [ "$download_success" != "true" ]; then
 fi
 
 echo "Backup downloaded successfully."
+phase_end download
+
+# Verify the backup checksum against its manifest (backups without manifest are restored as-is)
+phase_start
+MANIFEST_FILE=$(manifest_name ${BACKUP_FILE})
+if az storage blob download \
+    --account-name ${AZURE_STORAGE_ACCOUNT} \
+    --container-name ${AZURE_STORAGE_CONTAINER} \
+    --name ${MANIFEST_FILE} \
+    --file ${WORK_DIR}/restore_manifest.json \
+    --auth-mode login >/dev/null 2>&1; then
+    expected_sha256=$(jq -r '.sha256' ${WORK_DIR}/restore_manifest.json)
+    actual_sha256=$(sha256sum ${LOCAL_BACKUP} | cut -d ' ' -f 1)
+    if [ "$expected_sha256" != "$actual_sha256" ]; then
+        echo "Error: Checksum mismatch for ${BACKUP_FILE} (expected ${expected_sha256}, got ${actual_sha256})"
+        catalog_update '(.backups[] | select(.name == $name) | .status) = "invalid"' --arg name "${BACKUP_FILE}" \
+            || echo "Warning: Failed to mark ${BACKUP_FILE} as invalid in the catalog"
+        rm -f ${LOCAL_BACKUP} ${WORK_DIR}/restore_manifest.json
+        exit 1
+    fi
+    echo "Checksum verified against manifest ${MANIFEST_FILE}."
+else
+    echo "No manifest found for ${BACKUP_FILE}, skipping checksum verification."
+fi
+phase_end checksum
 
 # Drop and recreate database
+phase_start
 echo "Connecting to ${PG_HOST_DEV}.postgres.database.azure.com with user ${PG_USER}..."
-echo "Dropping existing database ${PG_DATABASE} if it exists..."
-if ! PGPASSWORD=${PG_PASSWORD} psql -h ${PG_HOST_DEV}.postgres.database.azure.com -U ${PG_USER} postgres -c "DROP DATABASE IF EXISTS ${PG_DATABASE} WITH (FORCE);" ; then
-    echo "Error: Failed to drop database ${PG_DATABASE}"
+echo "Dropping existing database ${TARGET_DATABASE} if it exists..."
+if ! PGPASSWORD=${PG_PASSWORD} psql -h ${PG_HOST_DEV}.postgres.database.azure.com -U ${PG_USER} postgres -c "DROP DATABASE IF EXISTS ${TARGET_DATABASE} WITH (FORCE);" ; then
+    echo "Error: Failed to drop database ${TARGET_DATABASE}"
     exit 1
 fi
 
 echo "Creating fresh database..."
-if ! PGPASSWORD=${PG_PASSWORD} psql -h ${PG_HOST_DEV}.postgres.database.azure.com -U ${PG_USER} postgres -c "CREATE DATABASE ${PG_DATABASE};" ; then
-    echo "Error: Failed to create database ${PG_DATABASE}"
+if ! PGPASSWORD=${PG_PASSWORD} psql -h ${PG_HOST_DEV}.postgres.database.azure.com -U ${PG_USER} postgres -c "CREATE DATABASE ${TARGET_DATABASE};" ; then
+    echo "Error: Failed to create database ${TARGET_DATABASE}"
     exit 1
 fi
 
-# Restore using pg_restore
-echo "Restoring database ${PG_DATABASE} from backup file ${BACKUP_FILE}..."
-if ! PGPASSWORD=${PG_PASSWORD} pg_restore -h ${PG_HOST_DEV}.postgres.database.azure.com -U ${PG_USER} -d ${PG_DATABASE} -v ${BACKUP_FILE} ; then
-    echo "Warning: pg_restore completed with warnings or errors. Check the output above for details."
-    # No salimos con error porque pg_restore puede terminar con código distinto de 0 pero la base de datos
-    # aún así puede estar restaurada correctamente con algunas advertencias
+phase_end recreate
+
+PG_HOST_DEV_FQDN="${PG_HOST_DEV}.postgres.database.azure.com"
+
+# Progress: second stage when the backup was created in this run, only stage otherwise.
+# The manifest (if any) provides the per-table sizes used to compute percent complete.
+# The fast profile restores data with -j: tables finish independently (--parallel).
+PROGRESS_ARGS="--tables-file ${WORK_DIR}/restore_manifest.json"
+if [ "$RESTORE_PROFILE" = "fast" ]; then
+    PROGRESS_ARGS="${PROGRESS_ARGS} --parallel"
+fi
+if [ "${BACKUP_CREATED:-false}" = "true" ]; then
+    progress_start restore 2 2 ${PROGRESS_ARGS}
+else
+    progress_start restore 1 1 ${PROGRESS_ARGS}
+fi
+
+if [ "$RESTORE_PROFILE" = "fast" ]; then
+    # Session settings suited to bulk load, applied to every pg_restore/vacuumdb connection
+    export PGOPTIONS="-c maintenance_work_mem=${RESTORE_MAINTENANCE_WORK_MEM} -c work_mem=${RESTORE_WORK_MEM} -c synchronous_commit=off"
+    echo "Using fast restore profile with ${RESTORE_JOBS} jobs (PGOPTIONS: ${PGOPTIONS})"
+
+    # Schema without indexes and constraints, then table data in parallel
+    phase_start
+    echo "Restoring pre-data section of ${BACKUP_FILE}..."
+    if ! PGPASSWORD=${PG_PASSWORD} pg_restore -h ${PG_HOST_DEV_FQDN} -U ${PG_USER} -d ${TARGET_DATABASE} --section=pre-data -v ${LOCAL_BACKUP} 2>&3 ; then
+        echo "Warning: pg_restore pre-data completed with warnings or errors. Check the output above for details."
+    fi
+    phase_end pre_data
+
+    phase_start
+    echo "Restoring data section of ${BACKUP_FILE} with ${RESTORE_JOBS} jobs..."
+    if ! PGPASSWORD=${PG_PASSWORD} pg_restore -h ${PG_HOST_DEV_FQDN} -U ${PG_USER} -d ${TARGET_DATABASE} --section=data -j ${RESTORE_JOBS} -v ${LOCAL_BACKUP} 2>&3 ; then
+        echo "Warning: pg_restore data completed with warnings or errors. Check the output above for details."
+    fi
+    phase_end data
+
+    # Indexes, constraints and triggers are built once the data is loaded
+    phase_start
+    echo "Restoring post-data section (indexes and constraints) with ${RESTORE_JOBS} jobs..."
+    if ! PGPASSWORD=${PG_PASSWORD} pg_restore -h ${PG_HOST_DEV_FQDN} -U ${PG_USER} -d ${TARGET_DATABASE} --section=post-data -j ${RESTORE_JOBS} -v ${LOCAL_BACKUP} 2>&3 ; then
+        echo "Warning: pg_restore post-data completed with warnings or errors. Check the output above for details."
+    fi
+    phase_end post_data
+
+    # Planner statistics so the first queries on dev don't run blind
+    phase_start
+    echo "Analyzing restored tables with ${RESTORE_JOBS} jobs..."
+    if ! PGPASSWORD=${PG_PASSWORD} vacuumdb -h ${PG_HOST_DEV_FQDN} -U ${PG_USER} -d ${TARGET_DATABASE} --analyze-only --jobs ${RESTORE_JOBS} ; then
+        echo "Warning: ANALYZE failed on ${TARGET_DATABASE}. Planner statistics may be missing."
+    fi
+    phase_end analyze
+
+    unset PGOPTIONS
+    progress_end 0
+else
+    # Restore using pg_restore
+    phase_start
+    echo "Restoring database ${TARGET_DATABASE} from backup file ${BACKUP_FILE}..."
+    if ! PGPASSWORD=${PG_PASSWORD} pg_restore -h ${PG_HOST_DEV_FQDN} -U ${PG_USER} -d ${TARGET_DATABASE} -v ${LOCAL_BACKUP} 2>&3 ; then
+        echo "Warning: pg_restore completed with warnings or errors. Check the output above for details."
+        # No salimos con error porque pg_restore puede terminar con código distinto de 0 pero la base de datos
+        # aún así puede estar restaurada correctamente con algunas advertencias
+    fi
+    phase_end restore
+    progress_end 0
 fi
 
 # Verificar que la base de datos contiene datos
+phase_start
 echo "Verifying restored database..."
-tables_count=$(PGPASSWORD=${PG_PASSWORD} psql -h ${PG_HOST_DEV}.postgres.database.azure.com -U ${PG_USER} -d ${PG_DATABASE} -t -c "SELECT count(*) FROM information_schema.tables WHERE table_schema NOT IN ('pg_catalog', 'information_schema');")
+tables_count=$(PGPASSWORD=${PG_PASSWORD} psql -h ${PG_HOST_DEV_FQDN} -U ${PG_USER} -d ${TARGET_DATABASE} -t -c "SELECT count(*) FROM information_schema.tables WHERE table_schema NOT IN ('pg_catalog', 'information_schema');")
 if [ -z "$tables_count" ] || [ "$tables_count" -eq "0" ]; then
     echo "Warning: The restored database appears to be empty. Verify that the backup was valid."
 else
     echo "Database verified: $tables_count tables found."
 fi
+phase_end verify
+
+# Compare every table against the snapshot taken on production at dump time
+VERIFICATION_FILE="${BACKUP_FILE%.dump}.verification.json"
+if [ "$VERIFY_ENABLED" = "true" ] && az storage blob download \
+    --account-name ${AZURE_STORAGE_ACCOUNT} \
+    --container-name ${AZURE_STORAGE_CONTAINER} \
+    --name ${VERIFICATION_FILE} \
+    --file ${WORK_DIR}/verification_snapshot.json \
+    --auth-mode login >/dev/null 2>&1; then
+    phase_start
+    echo "Verifying restored tables against ${VERIFICATION_FILE} with ${VERIFY_JOBS} connections..."
+    if PGPASSWORD=${PG_PASSWORD} python3 "${SCRIPT_DIR}/../api/verification.py" verify \
+        --snapshot ${WORK_DIR}/verification_snapshot.json \
+        --host ${PG_HOST_DEV_FQDN} \
+        --dbname ${TARGET_DATABASE} \
+        --user ${PG_USER} \
+        --jobs ${VERIFY_JOBS} \
+        --output ${WORK_DIR}/verification_report.json; then
+        VERIFICATION_STATUS="passed"
+    elif [ -s ${WORK_DIR}/verification_report.json ]; then
+        VERIFICATION_STATUS="failed"
+    else
+        echo "Warning: Table verification could not be completed"
+        VERIFICATION_STATUS="error"
+    fi
+    [ -s ${WORK_DIR}/verification_report.json ] && publish_run_report verification ${WORK_DIR}/verification_report.json
+    phase_end verify_tables
+else
+    echo "No verification snapshot for ${BACKUP_FILE}, skipping table verification."
+fi
+
+# Seal the template and create the working database as a file-level copy of it.
+# A template that failed verification is left unsealed so it is never cloned.
+if [ "$RESTORE_TARGET" = "template" ] && [ "$VERIFICATION_STATUS" != "failed" ]; then
+    phase_start
+    echo "Sealing template ${TARGET_DATABASE} and cloning ${PG_DATABASE} from it..."
+    BACKUP_CREATED_AT=$(jq -r '.created_at // empty' ${WORK_DIR}/restore_manifest.json 2>/dev/null || true)
+    if ! PGPASSWORD=${PG_PASSWORD} python3 "${SCRIPT_DIR}/../api/templates.py" seal \
+        --host ${PG_HOST_DEV_FQDN} \
+        --user ${PG_USER} \
+        --database ${PG_DATABASE} \
+        --backup ${BACKUP_FILE} \
+        --source-host "${PG_HOST_PROD:-}" \
+        --backup-created-at "${BACKUP_CREATED_AT}" \
+        --run-id "${GITHUB_RUN_ID:-}" || \
+       ! PGPASSWORD=${PG_PASSWORD} python3 "${SCRIPT_DIR}/../api/templates.py" clone \
+        --host ${PG_HOST_DEV_FQDN} \
+        --user ${PG_USER} \
+        --database ${PG_DATABASE}; then
+        echo "Error: Failed to create ${PG_DATABASE} from template ${TARGET_DATABASE}"
+        exit 1
+    fi
+    phase_end template_clone
+fi
+
+# Publish per-phase timings
+jq -n \
+    --arg database "$PG_DATABASE" \
+    --arg target_host "$PG_HOST_DEV" \
+    --arg backup "$BACKUP_FILE" \
+    --arg profile "$RESTORE_PROFILE" \
+    --arg restore_target "$RESTORE_TARGET" \
+    --arg verification "$VERIFICATION_STATUS" \
+    --arg started_at "$RESTORE_STARTED_AT" \
+    --arg completed_at "$(date -u +"%Y-%m-%dT%H:%M:%SZ")" \
+    --argjson jobs "$RESTORE_JOBS" \
+    --argjson tables "$(echo $tables_count | tr -d ' ' | grep -E '^[0-9]+$' || echo null)" \
+    --argjson total_seconds "$(( $(date +%s) - RESTORE_START ))" \
+    --argjson phases "$(phases_json)" \
+    '{database: $database, target_host: $target_host, backup: $backup, profile: $profile, restore_target: $restore_target,
+      jobs: (if $profile == "fast" then $jobs else 1 end), tables: $tables, verification: $verification,
+      started_at: $started_at, completed_at: $completed_at,
+      total_seconds: $total_seconds, phases: $phases}' > ${WORK_DIR}/restore_report.json
+cat ${WORK_DIR}/restore_report.json
+phases_step_summary "Restore ${PG_DATABASE} (${RESTORE_PROFILE})"
+publish_run_report restore ${WORK_DIR}/restore_report.json
 
 # Limpiar archivos
 echo "Cleaning up temporary files..."
-rm -f ${BACKUP_FILE}
+rm -f ${LOCAL_BACKUP} ${WORK_DIR}/restore_manifest.json ${WORK_DIR}/restore_report.json ${WORK_DIR}/verification_snapshot.json ${WORK_DIR}/verification_report.json
+
+if [ "$VERIFICATION_STATUS" = "failed" ]; then
+    echo "Error: Restored database ${PG_DATABASE} does not match the source. See the verification report above."
+    exit 1
+fi
 
 echo "Restore completed successfully."
\ No newline at end of file